@@ -0,0 +1,127 @@
+"""Instantanes materialises de /get_affluence.
+
+Le calcul complet (app._compute_affluence) relit le parametrage N, tous les
+parametrages de l'evenement pour trouver N-1, l'historique de frequentation
+et des portes, regroupe par jour et interpole les courbes de remplissage de
+chaque edition de reference. Chaque cockpit ouvert le redemandait toutes les
+2 minutes alors que le resultat ne depend que de la base :
+
+  - il ne change que quand la billetterie d'un parametrage est mise a jour
+    (tickets.lastUpdate, signale par /webhook/parametrage-updated) ou quand
+    un historique de frequentation / portes est importe (scan_import) ;
+  - un poll lit donc un seul document de `affluence_snapshots` ; au plus une
+    fois par REVALIDATE_S, il relit aussi tickets.lastUpdate (projection) pour
+    rattraper une mise a jour arrivee sans webhook ;
+  - `invalidate` marque les instantanes a refaire ; le suivant est recalcule
+    une seule fois par processus meme si plusieurs cockpits arrivent ensemble.
+
+Les courbes de remplissage d'une edition passee ne bougent plus : elles sont
+gardees dans `affluence_reference_curves`, par (event, year), tant que son
+tickets.lastUpdate et sa date de course de reference restent les memes.
+
+Module helpers pur (pas de Flask), `db` toujours passe en argument ; le
+calcul lui-meme est fourni par l'appelant.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS = "affluence_snapshots"
+CURVES = "affluence_reference_curves"
+
+REVALIDATE_S = 600
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _key(event, year):
+    return "%s|%s" % (event, year)
+
+
+def _lock_for(key):
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+        return lock
+
+
+def current_last_update(db, event, year):
+    doc = db["parametrages"].find_one({"event": event, "year": year},
+                                      {"_id": 0, "tickets.lastUpdate": 1})
+    return ((doc or {}).get("tickets") or {}).get("lastUpdate")
+
+
+def _servable(db, doc, event, year, now):
+    if not doc or doc.get("dirty"):
+        return False
+    if now - doc.get("checked_at", 0) < REVALIDATE_S:
+        return True
+    if current_last_update(db, event, year) != doc.get("last_update"):
+        return False
+    db[SNAPSHOTS].update_one({"_id": doc["_id"]}, {"$set": {"checked_at": now}})
+    return True
+
+
+def get(db, event, year, compute, now=None):
+    """Payload de /get_affluence pour (event, year) ; `compute(event, year)`
+    n'est appele que si l'instantane manque ou est perime."""
+    now = time.time() if now is None else now
+    key = _key(event, year)
+    doc = db[SNAPSHOTS].find_one({"_id": key})
+    if _servable(db, doc, event, year, now):
+        return doc["payload"]
+    with _lock_for(key):
+        # Un autre thread a pu le refaire pendant l'attente du verrou.
+        doc = db[SNAPSHOTS].find_one({"_id": key})
+        if _servable(db, doc, event, year, now):
+            return doc["payload"]
+        return _rebuild(db, event, year, compute, now)
+
+
+def rebuild(db, event, year, compute, now=None):
+    """Recalcule et enregistre l'instantane de (event, year)."""
+    with _lock_for(_key(event, year)):
+        return _rebuild(db, event, year, compute, time.time() if now is None else now)
+
+
+def _rebuild(db, event, year, compute, now):
+    t0 = time.perf_counter()
+    payload = compute(event, year)
+    key = _key(event, year)
+    db[SNAPSHOTS].replace_one({"_id": key}, {
+        "_id": key, "event": event, "year": year, "payload": payload,
+        "last_update": payload.get("last_update"),
+        "built_at": now, "checked_at": now, "dirty": False,
+    }, upsert=True)
+    logger.info("affluence %s reconstruite en %.0f ms", key, (time.perf_counter() - t0) * 1000)
+    return payload
+
+
+def invalidate(db, event=None):
+    """Marque a refaire les instantanes d'un evenement (toutes annees : N+1
+    compare a N), ou tous si event est None (import d'historique, dont les
+    noms d'evenements sont parfois des codes courts)."""
+    query = {} if event is None else {"event": event}
+    db[SNAPSHOTS].update_many(query, {"$set": {"dirty": True}})
+
+
+def reference_curves(db, event, year, version, race_ref, build):
+    """Courbes de remplissage precalculees d'une edition passee ; `build()`
+    les calcule si elles manquent ou si la billetterie ou la date de course
+    de reference de cette edition ont change."""
+    key = _key(event, year)
+    race_iso = race_ref.isoformat() if race_ref else None
+    doc = db[CURVES].find_one({"_id": key})
+    if doc and doc.get("version") == version and doc.get("race_ref") == race_iso:
+        return doc["curves"]
+    curves = build()
+    db[CURVES].replace_one({"_id": key}, {
+        "_id": key, "event": event, "year": year, "version": version,
+        "race_ref": race_iso, "curves": curves, "built_at": time.time(),
+    }, upsert=True)
+    return curves
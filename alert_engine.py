@@ -7,18 +7,22 @@ Charge les definitions d'alertes depuis MongoDB, evalue chaque handler,
 et ecrit les alertes declenchees dans cockpit_active_alerts.
 
 Usage:
-    python alert_engine.py
+    python alert_engine.py                 # un cycle puis sortie
+    python alert_engine.py --sim-time "2026-06-14 13:35"
+    python alert_engine.py --daemon        # process resident (cf. run_daemon)
 """
 
 import os
 import sys
 import math
+import time
 import logging
 from datetime import datetime, timezone, timedelta
 
 from pymongo import MongoClient
 from bson.objectid import ObjectId
 
+from geo_index import neighbours_within
 from whatsapp import WhatsAppService
 
 # ---------------------------------------------------------------------------
@@ -408,23 +412,23 @@ def detect_traffic_cluster(definition, context):
     if len(located) < 2:
         return None
 
-    # Clustering simple : pour chaque alerte, trouver ses voisins
+    # Clustering simple : pour chaque alerte, trouver ses voisins. La grille
+    # de geo_index ecarte les paires trop eloignees sans calculer leur
+    # distance ; les voisins rendus sont ceux de la double boucle, dans le
+    # meme ordre, donc meme best_cluster et meme score.
     best_cluster = None
     best_score = 0
 
+    points = [(a["location"]["y"], a["location"]["x"]) for a in located]
+    weights = [alert_weight(a.get("type")) for a in located]
+    voisins = neighbours_within(points, radius_m, distance=haversine)
+
     for i, center in enumerate(located):
         cluster = [center]
-        score = alert_weight(center.get("type"))
-        for j, other in enumerate(located):
-            if i == j:
-                continue
-            dist = haversine(
-                center["location"]["y"], center["location"]["x"],
-                other["location"]["y"], other["location"]["x"]
-            )
-            if dist <= radius_m:
-                cluster.append(other)
-                score += alert_weight(other.get("type"))
+        score = weights[i]
+        for j in voisins[i]:
+            cluster.append(located[j])
+            score += weights[j]
         if score > best_score and len(cluster) >= 2:
             best_score = score
             best_cluster = cluster
@@ -1057,18 +1061,9 @@ def upsert_active_alert(db, alert_doc):
 # Cycle principal
 # ---------------------------------------------------------------------------
 
-def run_cycle(sim_time=None):
-    db = get_db()
-    defs = load_enabled_definitions(db)
-    if not defs:
-        log.info("Aucune definition d'alerte active")
-        return
-
-    context = build_context(db, sim_time=sim_time)
-    log.info("Cycle: %d definitions, event=%s, year=%s",
-             len(defs), context.get("event", "?"), context.get("year", "?"))
-
-    alerts_created = 0
+def _evaluate(db, defs, context):
+    """Evalue les definitions fournies et ecrit les alertes declenchees.
+    Retourne la liste (alert_doc, definition) a notifier sur WhatsApp."""
     wa_batch = []  # (alert_doc, definition) pour notification WhatsApp
     for d in defs:
         handler = HANDLERS.get(d.get("detection_type"))
@@ -1082,24 +1077,28 @@ def run_cycle(sim_time=None):
             if isinstance(result, list):
                 for r in result:
                     upsert_active_alert(db, r)
-                    alerts_created += 1
                     wa_batch.append((r, d))
             else:
                 upsert_active_alert(db, result)
-                alerts_created += 1
                 wa_batch.append((result, d))
         except Exception as e:
             log.error("Erreur handler '%s' (slug=%s): %s",
                       d.get("detection_type"), d.get("slug"), e, exc_info=True)
+    return wa_batch
 
+
+def _notify(db, wa_batch):
     # Notification WhatsApp en batch (agregation anti-ban)
-    if wa_batch:
-        try:
-            wa_service = WhatsAppService(db)
-            wa_service.notify_batch(wa_batch)
-        except Exception as e:
-            log.warning("Erreur notification WhatsApp: %s", e)
+    if not wa_batch:
+        return
+    try:
+        wa_service = WhatsAppService(db)
+        wa_service.notify_batch(wa_batch)
+    except Exception as e:
+        log.warning("Erreur notification WhatsApp: %s", e)
 
+
+def _purge_engine_state(db):
     # Nettoyage des etats de transition anciens (> 2 jours)
     cutoff = datetime.now(timezone.utc) - timedelta(days=2)
     try:
@@ -1107,8 +1106,208 @@ def run_cycle(sim_time=None):
     except Exception:
         pass
 
-    if alerts_created:
-        log.info("  -> %d alerte(s) creee(s)", alerts_created)
+
+def run_cycle(sim_time=None):
+    db = get_db()
+    defs = load_enabled_definitions(db)
+    if not defs:
+        log.info("Aucune definition d'alerte active")
+        return
+
+    context = build_context(db, sim_time=sim_time)
+    log.info("Cycle: %d definitions, event=%s, year=%s",
+             len(defs), context.get("event", "?"), context.get("year", "?"))
+
+    wa_batch = _evaluate(db, defs, context)
+    _notify(db, wa_batch)
+    _purge_engine_state(db)
+
+    if wa_batch:
+        log.info("  -> %d alerte(s) creee(s)", len(wa_batch))
+
+# ---------------------------------------------------------------------------
+# Mode daemon
+# ---------------------------------------------------------------------------
+#
+# Un seul process resident remplace les deux taches planifiees a 30 s : un
+# client Mongo poole pour toute la session, definitions et contexte gardes en
+# memoire, et chaque type de detection evalue a sa propre cadence. Les
+# handlers s'executent en sequence dans le meme thread : un appel Waze ou
+# WhatsApp lent retarde le tick suivant au lieu de lancer un second cycle en
+# parallele.
+#
+# Invalidation : app.py incremente un compteur dans VERSIONS_COLLECTION a
+# chaque ecriture de definition (cle "definitions") et a chaque webhook
+# parametrage (cle "context"). Le daemon relit ces compteurs a chaque tick
+# (une requete sur quelques documents) et ne recharge que ce qui a bouge.
+# Le contexte est en plus reconstruit au changement de jour Paris et au plus
+# tard toutes les CONTEXT_MAX_AGE_S, parametrages pouvant etre ecrit par
+# groundmaster sans passer par le webhook.
+
+VERSIONS_COLLECTION = "cockpit_alert_engine_versions"
+
+DAEMON_TICK_S = 5
+DEFAULT_INTERVAL_S = 30
+CONTEXT_MAX_AGE_S = 600
+PURGE_INTERVAL_S = 3600
+
+# Cadence d'evaluation par detection_type (secondes). Un type absent tourne
+# a DEFAULT_INTERVAL_S, la cadence historique des taches planifiees. Une
+# definition peut surcharger la sienne via params.interval_s.
+HANDLER_INTERVALS_S = {
+    "schedule_proximity": 30,
+    "schedule_transition": 30,
+    "traffic_cluster": 60,
+    "meteo_threshold": 300,
+    "checkpoint_reassign": 30,
+    "checkpoint_error_burst": 10,
+    "meteo_rain_onset": 300,
+    "pcorg_urgency": 15,
+}
+
+
+def handler_interval(definition):
+    """Cadence d'evaluation d'une definition, en secondes."""
+    params = definition.get("params") or {}
+    try:
+        override = int(params.get("interval_s") or 0)
+    except (TypeError, ValueError):
+        override = 0
+    if override > 0:
+        return max(override, DAEMON_TICK_S)
+    return HANDLER_INTERVALS_S.get(definition.get("detection_type"),
+                                   DEFAULT_INTERVAL_S)
+
+
+def read_versions(db):
+    """Compteurs d'invalidation {cle: version}. Vide si la collection n'existe
+    pas encore : le premier tick charge alors tout."""
+    try:
+        return {d["_id"]: d.get("version", 0)
+                for d in db[VERSIONS_COLLECTION].find({})}
+    except Exception as e:
+        log.warning("Lecture des versions impossible: %s", e)
+        return None
+
+
+def _paris_day(now):
+    try:
+        from zoneinfo import ZoneInfo
+        return now.astimezone(ZoneInfo("Europe/Paris")).strftime("%Y-%m-%d")
+    except Exception:
+        return now.strftime("%Y-%m-%d")
+
+
+class EngineCache:
+    """Definitions et contexte gardes entre deux ticks du daemon."""
+
+    def __init__(self):
+        self.defs = None
+        self.defs_version = None
+        self.context = None
+        self.context_version = None
+        self.context_day = None
+        self.context_built_at = 0.0
+
+    def refresh(self, db, now, monotonic_now):
+        """Recharge ce qui a ete invalide et rend (defs, context). Le contexte
+        rendu est une copie portant `now` : les handlers ne lisent que cette
+        cle de facon dynamique, le reste est stable sur la journee."""
+        versions = read_versions(db)
+        if versions is None:
+            # Lecture ratee : on garde les caches plutot que de recharger
+            # a chaque tick tant que Mongo tousse.
+            versions = {"definitions": self.defs_version,
+                        "context": self.context_version}
+
+        defs_version = versions.get("definitions", 0)
+        if self.defs is None or defs_version != self.defs_version:
+            self.defs = load_enabled_definitions(db)
+            self.defs_version = defs_version
+            log.info("Definitions rechargees: %d actives (version %s)",
+                     len(self.defs), defs_version)
+
+        context_version = versions.get("context", 0)
+        day = _paris_day(now)
+        if (self.context is None
+                or context_version != self.context_version
+                or day != self.context_day
+                or monotonic_now - self.context_built_at >= CONTEXT_MAX_AGE_S):
+            self.context = build_context(db, sim_time=now)
+            self.context_version = context_version
+            self.context_day = day
+            self.context_built_at = monotonic_now
+
+        context = dict(self.context)
+        context["now"] = now
+        return self.defs, context
+
+
+class HandlerSchedule:
+    """Prochaine echeance de chaque definition, en temps monotone."""
+
+    def __init__(self):
+        self._next_due = {}
+
+    @staticmethod
+    def _key(definition):
+        return definition.get("slug") or str(definition.get("_id"))
+
+    def due(self, defs, monotonic_now):
+        """Definitions a evaluer maintenant ; leur echeance est avancee d'un
+        intervalle. Une definition nouvellement vue est due immediatement."""
+        out = []
+        seen = set()
+        for d in defs:
+            key = self._key(d)
+            seen.add(key)
+            if self._next_due.get(key, 0.0) <= monotonic_now:
+                self._next_due[key] = monotonic_now + handler_interval(d)
+                out.append(d)
+        # Oublier les definitions desactivees ou supprimees : reactivees,
+        # elles repartiront immediatement.
+        for key in list(self._next_due):
+            if key not in seen:
+                del self._next_due[key]
+        return out
+
+    def next_wakeup(self, monotonic_now, tick_s=DAEMON_TICK_S):
+        """Delai avant la prochaine echeance, borne par tick_s (qui cadence
+        aussi la detection des invalidations)."""
+        if not self._next_due:
+            return tick_s
+        delay = min(self._next_due.values()) - monotonic_now
+        return max(0.0, min(delay, tick_s))
+
+
+def run_daemon(tick_s=DAEMON_TICK_S):
+    """Boucle resident : evalue chaque definition a sa cadence jusqu'a
+    interruption (Ctrl+C / arret de la tache)."""
+    db = get_db()
+    cache = EngineCache()
+    schedule = HandlerSchedule()
+    last_purge = 0.0
+    log.info("=== alert_engine daemon (tick %ds) ===", tick_s)
+    while True:
+        mono = time.monotonic()
+        try:
+            defs, context = cache.refresh(db, datetime.now(timezone.utc), mono)
+            due = schedule.due(defs, mono)
+            if due:
+                wa_batch = _evaluate(db, due, context)
+                _notify(db, wa_batch)
+                if wa_batch:
+                    log.info("  -> %d alerte(s) creee(s) (%s)", len(wa_batch),
+                             ", ".join(sorted({d.get("detection_type", "?")
+                                               for _, d in wa_batch})))
+            if mono - last_purge >= PURGE_INTERVAL_S:
+                _purge_engine_state(db)
+                last_purge = mono
+        except Exception as e:
+            # Une panne Mongo ne doit pas tuer le daemon : on retente au tick
+            # suivant, le client pymongo se reconnecte tout seul.
+            log.error("Erreur tick daemon: %s", e, exc_info=True)
+        time.sleep(schedule.next_wakeup(time.monotonic(), tick_s))
 
 
 def main():
@@ -1116,7 +1315,13 @@ def main():
     parser = argparse.ArgumentParser(description="Moteur de detection d'alertes TITAN Cockpit")
     parser.add_argument("--sim-time", type=str, default=None,
                         help="Simuler une heure (ex: '2026-06-14 13:35'). Utilise le fuseau Europe/Paris.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Mode resident : un seul process, cadence par type de detection.")
+    parser.add_argument("--tick", type=int, default=DAEMON_TICK_S,
+                        help="Pas de la boucle daemon en secondes (defaut %d)." % DAEMON_TICK_S)
     args = parser.parse_args()
+    if args.daemon and args.sim_time:
+        parser.error("--daemon et --sim-time sont incompatibles")
 
     sim_time = None
     if args.sim_time:
@@ -1132,7 +1337,12 @@ def main():
 
     log.info("=== Demarrage alert_engine ===")
     try:
-        run_cycle(sim_time=sim_time)
+        if args.daemon:
+            run_daemon(tick_s=max(1, args.tick))
+        else:
+            run_cycle(sim_time=sim_time)
+    except KeyboardInterrupt:
+        log.info("Arret demande")
     except Exception as e:
         log.error("Erreur fatale: %s", e, exc_info=True)
         sys.exit(0)
@@ -2,19 +2,26 @@
 import os
 import re
 import json
+import bisect
 import threading
+import time
 import logging
 import hashlib
 import numpy as np
 import pandas as pd
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from dateutil import tz
 from flask import Blueprint, jsonify, request, render_template
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
 from bson import json_util
 import html
 import unicodedata
 
+import live_push
+
 analyse_ops_bp = Blueprint("analyse_ops", __name__)
 logger = logging.getLogger(__name__)
 
@@ -42,17 +49,19 @@ def _ensure_db():
     _col_cache = _db["analyse_ops_cache"]
     _col_cache.create_index([("event", 1), ("year", 1), ("module", 1)], unique=True)
     _col_cache.create_index("computed_at", expireAfterSeconds=30 * 24 * 3600)
+    # Lecture du delta par le recalcul incremental
+    _col_pcorg.create_index([("event", 1), ("year", 1), ("synced_at", 1)])
+    _col_pcorg.create_index([("event", 1), ("year", 1), ("modified_at", 1)])
 
 # ---------------------------------------------------------------------------
 # Compute state (in-memory, per-process)
 # ---------------------------------------------------------------------------
-_compute_state = {
-    "status": "idle",        # idle | computing | done | error
-    "progress": 0,           # 0-100
-    "event": None,
-    "year": None,
-    "error": None,
-}
+# Un etat par (event, year) : deux evenements peuvent se calculer en meme
+# temps, seul un second calcul du meme couple est refuse.
+_compute_states = {}
+_last_compute_key = None
+_IDLE_STATE = {"status": "idle", "progress": 0, "event": None, "year": None,
+               "error": None, "timings": {}}
 _compute_lock = threading.Lock()
 
 # ---------------------------------------------------------------------------
@@ -84,10 +93,17 @@ def _human_td_minutes(m):
     r = int(round(m - 60 * h))
     return f"{h}h{r:02d}"
 
+# Les noms d'operateurs et libelles de services distincts se comptent en
+# centaines pour des dizaines de milliers de fiches : memoises.
+_re_operator_suffix = re.compile(r"\s*\[.*\]\s*$")
+_re_x3b_escaped = re.compile(r"(?:&amp;)?\\x3B", re.IGNORECASE)
+_re_x3b_word = re.compile(r"(?:&amp;)?\bx3B\b", re.IGNORECASE)
+
+@lru_cache(maxsize=4096)
 def clean_operator_name(x):
     if not x:
         return "Inconnu"
-    s = re.sub(r"\s*\[.*\]\s*$", "", str(x)).strip()
+    s = _re_operator_suffix.sub("", str(x)).strip()
     if not s:
         return "Inconnu"
     parts = s.split()
@@ -97,19 +113,26 @@ def clean_operator_name(x):
     nom = " ".join(parts[:-1]).upper()
     return f"{nom} {prenom}"
 
-def normalize_services(s):
+@lru_cache(maxsize=4096)
+def _normalize_services(s):
     if not s:
-        return []
+        return ()
     s = str(s)
     s = html.unescape(s)
-    s = re.sub(r"(?:&amp;)?\\x3B", ";", s, flags=re.IGNORECASE)
-    s = re.sub(r"(?:&amp;)?\bx3B\b", ";", s, flags=re.IGNORECASE)
+    s = _re_x3b_escaped.sub(";", s)
+    s = _re_x3b_word.sub(";", s)
     s = s.replace("\x3B", ";")
     s = (s.replace("\\", ";").replace("/", ";").replace("|", ";").replace(",", ";"))
     parts = [p.strip(" .\t\r\n") for p in s.split(";") if p and p.strip(" .\t\r\n")]
     parts = [" ".join(p.split()) for p in parts]
-    return parts
+    return tuple(parts)
 
+def normalize_services(s):
+    # Liste neuve a chaque appel : le cache garde un tuple, qu'un appelant
+    # ne peut pas modifier par megarde.
+    return list(_normalize_services(s))
+
+@lru_cache(maxsize=4096)
 def clean_service_label(lbl):
     if not lbl:
         return "Inconnu"
@@ -230,36 +253,105 @@ def _flatten_doc(doc):
     }
 
 # ---------------------------------------------------------------------------
-# Source hash for cache invalidation
+# Version des sources pour l'invalidation du cache
 # ---------------------------------------------------------------------------
-def _source_hash(event, year):
+# Un document par (event, year) dans analyse_ops_sources, dont `version` est
+# incremente par la sync PCOrg et par chaque ecriture de fiche (app.py,
+# field.py). Les GET de modules comparent la version du cache a celle-ci,
+# gardee en memoire SOURCE_VERSION_TTL secondes : une page qui charge ses 21
+# modules ne fait plus qu'une lecture Mongo au lieu de 42 (count + find_one
+# trie par module avec l'ancienne empreinte).
+COL_SOURCES = "analyse_ops_sources"
+SOURCE_VERSION_TTL = float(os.getenv("ANALYSE_OPS_VERSION_TTL", "5"))
+
+_versions = {}  # _source_id -> (version, time.monotonic() de lecture)
+_versions_lock = threading.Lock()
+
+
+def _source_id(event, year):
+    # year arrive en int (sync, GET) ou en str (formulaires) : meme cle.
+    return f"{event}|{year}"
+
+
+def bump_source_version(db, event, year):
+    """Signale que les fiches de (event, year) ont change.
+
+    A appeler APRES l'ecriture : un calcul qui lit la version entre les deux
+    verrait sinon l'ancienne donnee sous la nouvelle version.
+    """
+    if not event or year is None:
+        return None
+    doc = db[COL_SOURCES].find_one_and_update(
+        {"_id": _source_id(event, year)},
+        {"$inc": {"version": 1},
+         "$set": {"event": event, "year": year, "updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    version = (doc or {}).get("version")
+    with _versions_lock:
+        _versions[_source_id(event, year)] = (version, time.monotonic())
+    live_push.notify("pcorg")
+    return version
+
+
+def read_source_version(db, event, year):
+    """Version courante des fiches de (event, year), lue sans cache (topic
+    live_push "pcorg" : une lecture d'un petit document par periode)."""
+    doc = db[COL_SOURCES].find_one({"_id": _source_id(event, year)}, {"version": 1})
+    return (doc or {}).get("version", 0)
+
+
+def bump_fiche_source(db, fiche_id):
+    """bump_source_version pour une fiche connue par son _id seulement."""
+    fiche = db["pcorg"].find_one({"_id": fiche_id}, {"event": 1, "year": 1})
+    if not fiche:
+        return None
+    return bump_source_version(db, fiche.get("event"), fiche.get("year"))
+
+
+def _source_version(event, year, fresh=False):
+    key = _source_id(event, year)
+    now = time.monotonic()
+    if not fresh:
+        with _versions_lock:
+            hit = _versions.get(key)
+        if hit and now - hit[1] < SOURCE_VERSION_TTL:
+            return hit[0]
     _ensure_db()
-    count = _col_pcorg.count_documents({"event": event, "year": year})
-    last = _col_pcorg.find_one({"event": event, "year": year}, sort=[("ts", -1)], projection={"ts": 1})
-    last_ts = str(last["ts"]) if last and last.get("ts") else "none"
-    return f"{count}_{last_ts}"
+    doc = _db[COL_SOURCES].find_one({"_id": key})
+    version = (doc or {}).get("version", 0)
+    with _versions_lock:
+        _versions[key] = (version, now)
+    return version
 
 # ---------------------------------------------------------------------------
 # Cache helpers
 # ---------------------------------------------------------------------------
 def _cache_get(event, year, module):
-    _ensure_db()
-    doc = _col_cache.find_one({"event": event, "year": year, "module": module})
-    if not doc:
-        return None
-    current_hash = _source_hash(event, year)
-    if doc.get("source_hash") != current_hash:
-        return None
-    return doc.get("data")
+    return _cache_get_many(event, year, [module]).get(module)
 
-def _cache_set(event, year, module, data):
+def _cache_get_many(event, year, modules):
+    """Modules a jour pour (event, year) : une lecture du cache, une
+    comparaison de version en memoire. Les modules perimes sont absents."""
+    _ensure_db()
+    version = _source_version(event, year)
+    fresh = {}
+    for doc in _col_cache.find({"event": event, "year": year, "module": {"$in": list(modules)}}):
+        if doc.get("source_version") == version:
+            fresh[doc["module"]] = doc.get("data")
+    return fresh
+
+def _cache_set(event, year, module, data, source_version=None):
     _ensure_db()
+    if source_version is None:
+        source_version = _source_version(event, year, fresh=True)
     _col_cache.update_one(
         {"event": event, "year": year, "module": module},
         {"$set": {
             "data": data,
             "computed_at": datetime.now(timezone.utc),
-            "source_hash": _source_hash(event, year),
+            "source_version": source_version,
         }},
         upsert=True,
     )
@@ -481,7 +573,7 @@ def timeline_data():
 # ---------------------------------------------------------------------------
 @analyse_ops_bp.route("/api/analyse-ops/compute", methods=["POST"])
 def compute():
-    global _compute_state
+    global _last_compute_key
     data = request.get_json(silent=True) or {}
     event = data.get("event") or request.args.get("event")
     year = data.get("year") or request.args.get("year")
@@ -492,17 +584,38 @@ def compute():
         year = int(year)
     except (ValueError, TypeError):
         pass
+    full = bool(data.get("full")) or request.args.get("full") in ("1", "true")
+    key = (event, year)
     with _compute_lock:
-        if _compute_state["status"] == "computing":
+        current = _compute_states.get(key)
+        if current and current["status"] == "computing":
             return jsonify({"error": "Compute already in progress"}), 409
-        _compute_state = {"status": "computing", "progress": 0, "event": event, "year": year, "error": None}
-    t = threading.Thread(target=_run_compute, args=(event, year), daemon=True)
+        _compute_states[key] = {
+            "status": "computing", "progress": 0, "event": event, "year": year,
+            "error": None, "started_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": None, "timings": {},
+        }
+        _last_compute_key = key
+    t = threading.Thread(target=_run_compute, args=(event, year, full), daemon=True)
     t.start()
     return jsonify({"status": "computing", "event": event, "year": year})
 
 @analyse_ops_bp.route("/api/analyse-ops/status")
 def compute_status():
-    return jsonify(_compute_state)
+    event = request.args.get("event")
+    year = request.args.get("year")
+    if event and year:
+        try:
+            year = int(year)
+        except (ValueError, TypeError):
+            pass
+        key = (event, year)
+    else:
+        key = _last_compute_key
+    state = _compute_states.get(key)
+    if state is None:
+        return jsonify(dict(_IDLE_STATE, event=event, year=year))
+    return jsonify(state)
 
 # ---------------------------------------------------------------------------
 # Module GET endpoints (serve from cache)
@@ -515,16 +628,22 @@ _MODULES = [
     "anpr-cross", "network", "quality",
 ]
 
+def _event_year_args():
+    event = request.args.get("event")
+    year = request.args.get("year")
+    if not event or not year:
+        return None, None
+    try:
+        year = int(year)
+    except (ValueError, TypeError):
+        pass
+    return event, year
+
 def _make_module_route(module_name):
     def handler():
-        event = request.args.get("event")
-        year = request.args.get("year")
-        if not event or not year:
+        event, year = _event_year_args()
+        if not event:
             return jsonify({"error": "event and year required"}), 400
-        try:
-            year = int(year)
-        except (ValueError, TypeError):
-            pass
         cached = _cache_get(event, year, module_name)
         if cached is not None:
             return jsonify({"status": "ok", "data": cached})
@@ -539,910 +658,1385 @@ for _mod in _MODULES:
         view_func=_make_module_route(_mod),
     )
 
+@analyse_ops_bp.route("/api/analyse-ops/modules")
+def get_modules():
+    """Tous les modules a jour en une reponse (chargement de la page).
+
+    ?modules=kpis,temporal restreint la liste ; les modules absents ou
+    perimes sont listes dans `stale`.
+    """
+    event, year = _event_year_args()
+    if not event:
+        return jsonify({"error": "event and year required"}), 400
+    wanted = [m for m in (request.args.get("modules") or "").split(",") if m] or _MODULES
+    unknown = [m for m in wanted if m not in _MODULES]
+    if unknown:
+        return jsonify({"error": "modules inconnus : " + ", ".join(unknown)}), 400
+    fresh = _cache_get_many(event, year, wanted)
+    return jsonify({
+        "status": "ok" if fresh else "stale",
+        "data": fresh,
+        "stale": [m for m in wanted if m not in fresh],
+    })
+
 # ---------------------------------------------------------------------------
-# Compute engine (background thread)
+# Compute engine : graphe de taches
 # ---------------------------------------------------------------------------
-def _run_compute(event, year):
-    global _compute_state
+# Chaque module est une tache qui declare ses entrees : les resultats d'autres
+# taches (modules ou intermediaires comme "frame"). Une tache part des que ses
+# entrees sont pretes, si bien que les croisements qui attendent Mongo
+# (meteo, affluence, Waze, calendriers, ANPR, annee N-1) tournent en meme
+# temps que les modules pandas au lieu de les attendre l'un apres l'autre.
+#
+# kind="io"  : touche Mongo -> pool de threads.
+# kind="cpu" : pandas pur, entrees picklables -> pool de processus si
+#              ANALYSE_OPS_PROCESSES > 0, pool de threads sinon. Les entrees
+#              sont alors copiees vers le processus : ne vaut que pour les
+#              gros jeux (SAISON), d'ou le defaut a 0.
+COMPUTE_THREADS = int(os.getenv("ANALYSE_OPS_THREADS", "8"))
+COMPUTE_PROCESSES = int(os.getenv("ANALYSE_OPS_PROCESSES", "0"))
+
+_thread_pool = None
+_process_pool = None
+_pools_lock = threading.Lock()
+
+
+def _pools():
+    global _thread_pool, _process_pool
+    with _pools_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=COMPUTE_THREADS,
+                                              thread_name_prefix="analyse-ops")
+        if _process_pool is None and COMPUTE_PROCESSES > 0:
+            _process_pool = ProcessPoolExecutor(max_workers=COMPUTE_PROCESSES)
+    return _thread_pool, _process_pool
+
+
+class _Task:
+    __slots__ = ("name", "fn", "inputs", "kind", "module")
+
+    def __init__(self, name, fn, inputs=(), kind="cpu", module=True):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.kind = kind
+        self.module = module    # False = intermediaire, pas mis en cache
+
+
+class _NoDocuments(Exception):
+    pass
+
+
+def _timed(fn, job, inputs):
+    # Niveau module : doit etre picklable pour le pool de processus.
+    t0 = time.perf_counter()
+    value = fn(job, inputs)
+    return value, time.perf_counter() - t0
+
+
+def _run_tasks(job, tasks, on_done, given=None):
+    """Execute le graphe `tasks` ; on_done(task, value, seconds) est appele
+    dans le thread appelant a chaque tache terminee. `given` fournit des
+    resultats deja connus : les taches du meme nom ne sont pas lancees. La
+    premiere exception d'une tache interrompt le calcul et remonte."""
+    threads, procs = _pools()
+    known = {t.name for t in tasks} | set(given or ())
+    for t in tasks:
+        missing = [i for i in t.inputs if i not in known]
+        if missing:
+            raise ValueError(f"tache {t.name}: entrees inconnues {missing}")
+
+    results = dict(given or {})
+    pending = [t for t in tasks if t.name not in results]
+    running = {}
     try:
-        _ensure_db()
-        total_modules = 21
-        completed = 0
+        while pending or running:
+            ready = [t for t in pending if all(i in results for i in t.inputs)]
+            for t in ready:
+                pending.remove(t)
+                pool = procs if (t.kind == "cpu" and procs is not None) else threads
+                fut = pool.submit(_timed, t.fn, job, {i: results[i] for i in t.inputs})
+                running[fut] = t
+            if not running:
+                raise ValueError("dependances circulaires : "
+                                 + ", ".join(t.name for t in pending))
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                t = running.pop(fut)
+                value, seconds = fut.result()
+                results[t.name] = value
+                on_done(t, value, seconds)
+    finally:
+        for fut in running:
+            fut.cancel()
+    return results
 
-        def _progress():
-            nonlocal completed
-            completed += 1
-            _compute_state["progress"] = int(100 * completed / total_modules)
-
-        # =====================================================================
-        # 1) Load all pcorg documents for this event/year
-        # =====================================================================
-        docs = list(_col_pcorg.find({"event": event, "year": year}))
-        if not docs:
-            _compute_state = {"status": "error", "progress": 0, "event": event, "year": year,
-                              "error": f"Aucun document pour {event} {year}"}
-            return
-
-        df = pd.DataFrame([_flatten_doc(d) for d in docs])
-
-        # Clean operators
-        df["operator_create"] = df["operator_create"].apply(clean_operator_name)
-        df["operator_close"] = df["operator_close"].apply(clean_operator_name)
-
-        # Normalize carroyes
-        df["carroye"] = df["carroye"].astype(str).str.upper().str.replace(" ", "", regex=False).replace("NONE", np.nan)
-
-        # Parse timestamps
-        df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True)
-        df["close_ts"] = pd.to_datetime(df["close_ts"], errors="coerce", utc=True)
-        df["delay_min"] = pd.to_numeric(df["delay_min"], errors="coerce")
-
-        # Temporal derivatives
-        dft = df.dropna(subset=["ts"]).copy()
-        ts_paris = dft["ts"].dt.tz_convert("Europe/Paris")
-        dft["date"] = ts_paris.dt.date
-        dft["hour"] = ts_paris.dt.hour
-        try:
-            dft["dow_name"] = ts_paris.dt.day_name(locale="fr_FR")
-        except Exception:
-            dft["dow_name"] = ts_paris.dt.day_name()
-
-        # Services
-        df["services_list"] = df["services_contactes_raw"].apply(normalize_services)
-
-        N = len(df)
-        N_closed = int(pd.notna(df["delay_min"]).sum())
-
-        # =====================================================================
-        # 2) KPIs
-        # =====================================================================
-        same_op = df["operator_create"].fillna("Inconnu") == df["operator_close"].fillna("Inconnu")
-        fast_close = df["delay_min"].le(30)
-        fcr_mask = same_op & fast_close
-        fcr_count = int(fcr_mask.sum())
-
-        median_delay = float(np.nanmedian(df["delay_min"])) if N_closed else None
-        p90_delay = float(np.nanpercentile(df["delay_min"].dropna(), 90)) if N_closed else None
-
-        def sla_share(thr):
-            if N_closed == 0:
-                return 0.0
-            s = df["delay_min"].dropna()
-            return _pct(int((s <= thr).sum()), int(len(s)))
-
-        tel_share = _pct(int(df["flag_tel"].sum()), N)
-        radio_share = _pct(int(df["flag_radio"].sum()), N)
-
-        # Quality score
-        quality_fields = ["sous_classification", "appelant", "carroye", "services_contactes_raw"]
-        filled_counts = {f: int(df[f].notna().sum()) for f in quality_fields if f in df.columns}
-        n_perfect = int(df[quality_fields].notna().all(axis=1).sum()) if all(f in df.columns for f in quality_fields) else 0
-
-        # Date range
-        date_min = str(dft["date"].min()) if not dft.empty else None
-        date_max = str(dft["date"].max()) if not dft.empty else None
-
-        kpis_data = {
-            "total": N,
-            "total_closed": N_closed,
-            "fcr_count": fcr_count,
-            "fcr_rate": _pct(fcr_count, N),
-            "median_delay_min": round(median_delay, 1) if median_delay else None,
-            "p90_delay_min": round(p90_delay, 1) if p90_delay else None,
-            "sla10": sla_share(10),
-            "sla30": sla_share(30),
-            "sla60": sla_share(60),
-            "tel_share": tel_share,
-            "radio_share": radio_share,
-            "quality_fields": filled_counts,
-            "n_perfect": n_perfect,
-            "pct_perfect": _pct(n_perfect, N),
-            "date_range": {"start": date_min, "end": date_max},
-        }
-        _cache_set(event, year, "kpis", kpis_data)
-        _progress()
-
-        # =====================================================================
-        # 2b) Quality (detailed)
-        # =====================================================================
-        quality_data = {
-            "total": N,
-            "n_perfect": n_perfect,
-            "pct_perfect": _pct(n_perfect, N),
-            "fields": {},
-            "by_operator": [],
-            "by_day": [],
-            "worst_fields_by_operator": [],
-        }
-        # Per-field fill rate
-        field_labels = {
-            "sous_classification": "Sous-classification",
-            "appelant": "Appelant",
-            "carroye": "Carroye",
-            "services_contactes_raw": "Service contacte",
-        }
+
+# ---------------------------------------------------------------------------
+# Taches : chargement et intermediaires
+# ---------------------------------------------------------------------------
+_QUALITY_FIELDS = ["sous_classification", "appelant", "carroye", "services_contactes_raw"]
+
+
+def _sla_share(df, n_closed, thr):
+    if n_closed == 0:
+        return 0.0
+    s = df["delay_min"].dropna()
+    return _pct(int((s <= thr).sum()), int(len(s)))
+
+
+def _t_docs(job, inp):
+    _ensure_db()
+    docs = list(_col_pcorg.find({"event": job["event"], "year": job["year"]}))
+    if not docs:
+        raise _NoDocuments(f"Aucun document pour {job['event']} {job['year']}")
+    return docs
+
+
+_DOW_NAMES = np.array(["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"], dtype=object)
+
+
+def _frame(docs):
+    df = pd.DataFrame([_flatten_doc(d) for d in docs])
+
+    # Clean operators
+    df["operator_create"] = df["operator_create"].map(clean_operator_name)
+    df["operator_close"] = df["operator_close"].map(clean_operator_name)
+
+    # Normalize carroyes
+    df["carroye"] = df["carroye"].astype(str).str.upper().str.replace(" ", "", regex=False).replace("NONE", np.nan)
+
+    # Parse timestamps
+    df["ts"] = pd.to_datetime(df["ts"], errors="coerce", utc=True)
+    df["close_ts"] = pd.to_datetime(df["close_ts"], errors="coerce", utc=True)
+    df["delay_min"] = pd.to_numeric(df["delay_min"], errors="coerce")
+
+    # Services
+    df["services_list"] = df["services_contactes_raw"].map(normalize_services)
+    return df
+
+
+def _temporal_frame(df):
+    # Temporal derivatives
+    dft = df.dropna(subset=["ts"]).copy()
+    ts_paris = dft["ts"].dt.tz_convert("Europe/Paris")
+    dft["date"] = ts_paris.dt.date
+    dft["hour"] = ts_paris.dt.hour
+    # Table fixe plutot que day_name(locale="fr_FR") : sans la locale, le
+    # repli anglais ne correspondait a aucun jour de la heatmap.
+    dft["dow_name"] = _DOW_NAMES[ts_paris.dt.dayofweek.to_numpy()]
+    return dft
+
+
+def _t_frame(job, inp):
+    df = _frame(inp["docs"])
+    return {"df": df, "dft": _temporal_frame(df)}
+
+
+def _t_grid(job, inp):
+    _ensure_db()
+    grid_docs = list(_col_grid_ref.find({}, {"_id": 0, "grid_ref": 1, "latitude": 1, "longitude": 1}))
+    grid_df = pd.DataFrame(grid_docs) if grid_docs else pd.DataFrame(columns=["grid_ref", "latitude", "longitude"])
+    if not grid_df.empty:
+        grid_df["grid_ref"] = grid_df["grid_ref"].astype(str).str.upper().str.replace(" ", "", regex=False)
+    return grid_df
+
+
+def _interv_frame(docs):
+    intervs = []
+    for d in docs:
+        cc = d.get("content_category") or {}
+        xml_s = (d.get("xml_struct") or {})
+        for i in range(1, 6):
+            val = cc.get(f"intervenant{i}") or xml_s.get(f"intervenant{i}")
+            if val and str(val).strip():
+                intervs.append({"fiche_id": d.get("_id"), "niveau": f"Niveau {i}", "intervenant": str(val).strip()})
+    return pd.DataFrame(intervs) if intervs else pd.DataFrame(columns=["fiche_id", "niveau", "intervenant"])
+
+
+def _t_interv_frame(job, inp):
+    return _interv_frame(inp["docs"])
+
+
+# ---------------------------------------------------------------------------
+# Taches : modules
+# ---------------------------------------------------------------------------
+def _m_kpis(job, inp):
+    df, dft = inp["frame"]["df"], inp["frame"]["dft"]
+    N = len(df)
+    N_closed = int(pd.notna(df["delay_min"]).sum())
+
+    same_op = df["operator_create"].fillna("Inconnu") == df["operator_close"].fillna("Inconnu")
+    fast_close = df["delay_min"].le(30)
+    fcr_mask = same_op & fast_close
+    fcr_count = int(fcr_mask.sum())
+
+    median_delay = float(np.nanmedian(df["delay_min"])) if N_closed else None
+    p90_delay = float(np.nanpercentile(df["delay_min"].dropna(), 90)) if N_closed else None
+
+    tel_share = _pct(int(df["flag_tel"].sum()), N)
+    radio_share = _pct(int(df["flag_radio"].sum()), N)
+
+    # Quality score
+    quality_fields = _QUALITY_FIELDS
+    filled_counts = {f: int(df[f].notna().sum()) for f in quality_fields if f in df.columns}
+    n_perfect = int(df[quality_fields].notna().all(axis=1).sum()) if all(f in df.columns for f in quality_fields) else 0
+
+    # Date range
+    date_min = str(dft["date"].min()) if not dft.empty else None
+    date_max = str(dft["date"].max()) if not dft.empty else None
+
+    return {
+        "total": N,
+        "total_closed": N_closed,
+        "fcr_count": fcr_count,
+        "fcr_rate": _pct(fcr_count, N),
+        "median_delay_min": round(median_delay, 1) if median_delay else None,
+        "p90_delay_min": round(p90_delay, 1) if p90_delay else None,
+        "sla10": _sla_share(df, N_closed, 10),
+        "sla30": _sla_share(df, N_closed, 30),
+        "sla60": _sla_share(df, N_closed, 60),
+        "tel_share": tel_share,
+        "radio_share": radio_share,
+        "quality_fields": filled_counts,
+        "n_perfect": n_perfect,
+        "pct_perfect": _pct(n_perfect, N),
+        "date_range": {"start": date_min, "end": date_max},
+    }
+
+
+def _m_quality(job, inp):
+    df, dft = inp["frame"]["df"], inp["frame"]["dft"]
+    N = len(df)
+    n_perfect = inp["kpis"]["n_perfect"]
+    quality_fields = _QUALITY_FIELDS
+    quality_data = {
+        "total": N,
+        "n_perfect": n_perfect,
+        "pct_perfect": _pct(n_perfect, N),
+        "fields": {},
+        "by_operator": [],
+        "by_day": [],
+        "worst_fields_by_operator": [],
+    }
+    # Per-field fill rate
+    field_labels = {
+        "sous_classification": "Sous-classification",
+        "appelant": "Appelant",
+        "carroye": "Carroye",
+        "services_contactes_raw": "Service contacte",
+    }
+    for f in quality_fields:
+        if f in df.columns:
+            filled = int(df[f].notna().sum())
+            quality_data["fields"][field_labels.get(f, f)] = {
+                "filled": filled,
+                "missing": N - filled,
+                "pct": _pct(filled, N),
+            }
+
+    # Quality per operator (top 20 creators)
+    op_top_names = df["operator_create"].value_counts().head(20).index.tolist()
+    op_quality = []
+    for op in op_top_names:
+        op_df = df[df["operator_create"] == op]
+        op_n = len(op_df)
+        if op_n == 0:
+            continue
+        op_perfect = int(op_df[quality_fields].notna().all(axis=1).sum()) if all(f in op_df.columns for f in quality_fields) else 0
+        field_pcts = {}
         for f in quality_fields:
-            if f in df.columns:
-                filled = int(df[f].notna().sum())
-                quality_data["fields"][field_labels.get(f, f)] = {
-                    "filled": filled,
-                    "missing": N - filled,
-                    "pct": _pct(filled, N),
-                }
+            if f in op_df.columns:
+                field_pcts[field_labels.get(f, f)] = _pct(int(op_df[f].notna().sum()), op_n)
+        op_quality.append({
+            "operator": op,
+            "total": op_n,
+            "perfect": op_perfect,
+            "pct_perfect": _pct(op_perfect, op_n),
+            "fields": field_pcts,
+        })
+    quality_data["by_operator"] = sorted(op_quality, key=lambda x: x["pct_perfect"])
+
+    # Quality progression by day
+    if not dft.empty:
+        day_quality = []
+        for day, group in dft.groupby("date"):
+            day_n = len(group)
+            day_ids = group.index
+            day_df = df.loc[day_ids]
+            day_perfect = int(day_df[quality_fields].notna().all(axis=1).sum()) if all(f in day_df.columns for f in quality_fields) else 0
+            day_quality.append({
+                "date": str(day),
+                "total": day_n,
+                "pct_perfect": _pct(day_perfect, day_n),
+            })
+        quality_data["by_day"] = day_quality
+    return quality_data
+
+
+def _m_temporal(job, inp):
+    df, dft = inp["frame"]["df"], inp["frame"]["dft"]
+    if dft.empty:
+        return _temporal_data(None, None, df, dft)
+    by_hour = dft.groupby(["date", "hour"]).size().reset_index(name="count")
+    hm = dft.groupby(["dow_name", "hour"]).size().reset_index(name="n")
+    return _temporal_data(by_hour, hm, df, dft)
+
+
+def _temporal_data(by_hour, hm, df, dft):
+    # by_hour (date, hour, count) et hm (dow_name, hour, n) : comptages deja
+    # faits, soit par groupby, soit par les agregats incrementaux.
+    hourly = []
+    heatmap_data = {"days": [], "hours": list(range(24)), "values": []}
+    backlog = []
+
+    if not dft.empty:
+        by_hour["dt"] = pd.to_datetime(by_hour["date"]) + pd.to_timedelta(by_hour["hour"], unit="h")
+        hourly = [{"dt": str(dt), "count": int(n)} for dt, n in zip(by_hour["dt"], by_hour["count"])]
+
+        # Heatmap day x hour
+        days_order = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
+        hm["dow_name"] = hm["dow_name"].str.lower()
+        hm["dow_name"] = pd.Categorical(hm["dow_name"], categories=days_order, ordered=True)
+        pivot = hm.pivot(index="dow_name", columns="hour", values="n").fillna(0)
+        heatmap_data = {
+            "days": pivot.index.tolist(),
+            "hours": list(range(24)),
+            "values": pivot.values.tolist(),
+        }
+
+        # Backlog
+        events_open = dft[["ts"]].copy()
+        events_open["delta"] = 1
+        events_open = events_open.rename(columns={"ts": "t"})
+        events_close = df[pd.notna(df["close_ts"])][["close_ts"]].copy()
+        events_close["delta"] = -1
+        events_close = events_close.rename(columns={"close_ts": "t"})
+        flow = pd.concat([events_open[["t", "delta"]], events_close[["t", "delta"]]], ignore_index=True)
+        flow = flow.sort_values("t")
+        flow["backlog"] = flow["delta"].cumsum()
+        # Downsample to max 500 points
+        step = max(1, len(flow) // 500)
+        flow_sampled = flow.iloc[::step]
+        backlog = [{"t": str(t), "backlog": int(b)} for t, b in zip(flow_sampled["t"], flow_sampled["backlog"])]
+
+        # Peak detection (z-score > 2)
+        hour_counts = by_hour["count"]
+        mean_c = hour_counts.mean()
+        std_c = hour_counts.std()
+        peaks = []
+        if std_c > 0:
+            for dt, n in zip(by_hour["dt"], by_hour["count"]):
+                z = (n - mean_c) / std_c
+                if z > 2:
+                    peaks.append({"dt": str(dt), "count": int(n), "zscore": round(z, 2)})
+
+    return {"hourly": hourly, "heatmap": heatmap_data, "backlog": backlog, "peaks": peaks if not dft.empty else []}
+
+
+def _m_geographic(job, inp):
+    df = inp["frame"]["df"]
+    grid_df = inp["grid"]
+    # Areas
+    area_counts = df["area_desc"].value_counts().head(15)
+    areas = [{"area_desc": str(k), "n": int(v)} for k, v in area_counts.items()]
+
+    # Carroyes with GPS
+    car_series = df["carroye"].dropna()
+    car_counts = car_series.value_counts()
+
+    car_points = []
+    if not car_counts.empty and not grid_df.empty:
+        car_df = car_counts.reset_index()
+        car_df.columns = ["carroye", "n"]
+        # Descriptions
+        desc_df = (
+            df.loc[pd.notna(df["carroye"]) & pd.notna(df["text"]), ["carroye", "text"]]
+            .groupby("carroye")["text"].apply(list).reset_index(name="descs")
+        )
+        desc_df["descs"] = desc_df["descs"].apply(lambda L: [str(t)[:240] for t in L[:10]])
+        car_map = car_df.merge(grid_df, left_on="carroye", right_on="grid_ref", how="left")
+        car_map = car_map.merge(desc_df, on="carroye", how="left")
+        car_map = car_map.dropna(subset=["latitude", "longitude"])
+        car_points = [{
+            "ref": str(r["carroye"]),
+            "n": int(r["n"]),
+            "lat": float(r["latitude"]),
+            "lon": float(r["longitude"]),
+            "descs": r["descs"] if isinstance(r["descs"], list) else [],
+        } for r in car_map.to_dict("records")]
+
+    # GPS points (real coordinates from gps field)
+    gps_df = df.dropna(subset=["lat", "lon"])[["_id", "lat", "lon", "text", "category", "severity", "ts", "sous_classification"]].copy()
+    gps_points = [{
+        "id": str(r["_id"]),
+        "lat": float(r["lat"]),
+        "lon": float(r["lon"]),
+        "text": str(r["text"])[:200] if r["text"] else "",
+        "category": str(r["category"]) if r["category"] else "",
+        "severity": int(r["severity"]) if pd.notna(r["severity"]) else 0,
+        "ts": str(r["ts"]) if pd.notna(r["ts"]) else "",
+        "sous_class": str(r["sous_classification"]) if r["sous_classification"] else "",
+    } for r in gps_df.to_dict("records")]
+
+    # Hotspots (risk score)
+    hotspots = []
+    df_hot = pd.DataFrame({"carroye": df["carroye"], "delay_min": df["delay_min"]})
+    df_hot = df_hot.dropna(subset=["carroye"])
+    if not df_hot.empty:
+        agg_hot = df_hot.groupby("carroye").agg(
+            volume=("carroye", "count"),
+            p90_delay=("delay_min", lambda s: float(np.nanpercentile(s.dropna(), 90)) if s.dropna().any() else 0),
+        ).reset_index()
+        if len(agg_hot) > 1:
+            agg_hot["score"] = round(100 * (_norm_col(agg_hot["volume"]) + _norm_col(agg_hot["p90_delay"].fillna(0))) / 2.0, 1)
+        else:
+            agg_hot["score"] = 50.0
+        top_hot = agg_hot.sort_values("score", ascending=False).head(20)
+        # Merge with coords
+        if not grid_df.empty:
+            top_hot = top_hot.merge(grid_df, left_on="carroye", right_on="grid_ref", how="left")
+            top_hot = top_hot.dropna(subset=["latitude", "longitude"])
+            hotspots = [{
+                "ref": str(r["carroye"]), "score": float(r["score"]),
+                "volume": int(r["volume"]), "p90": round(float(r["p90_delay"]), 1),
+                "lat": float(r["latitude"]), "lon": float(r["longitude"]),
+            } for r in top_hot.to_dict("records")]
+
+    return {
+        "areas": areas,
+        "car_points": car_points,
+        "gps_points": gps_points,
+        "hotspots": hotspots,
+        "gps_count": len(gps_points),
+    }
+
+
+def _m_performance(job, inp):
+    df = inp["frame"]["df"]
+    kpis = inp["kpis"]
+    delay_hist = []
+    if kpis["total_closed"]:
+        delays = df["delay_min"].dropna()
+        bins = [0, 10, 30, 60, 120, 240, 480, float("inf")]
+        labels = ["0-10", "10-30", "30-60", "1-2h", "2-4h", "4-8h", "8h+"]
+        cuts = pd.cut(delays, bins=bins, labels=labels, right=True)
+        delay_hist = [{"range": str(k), "count": int(v)} for k, v in cuts.value_counts().sort_index().items()]
+
+    return {
+        "fcr": {"fcr": kpis["fcr_count"], "non_fcr": max(0, kpis["total"] - kpis["fcr_count"])},
+        "sla": {"sla10": kpis["sla10"], "sla30": kpis["sla30"], "sla60": kpis["sla60"]},
+        "delay_distribution": delay_hist,
+        "median_delay": kpis["median_delay_min"],
+        "p90_delay": kpis["p90_delay_min"],
+    }
 
-        # Quality per operator (top 20 creators)
-        op_top_names = df["operator_create"].value_counts().head(20).index.tolist()
-        op_quality = []
-        for op in op_top_names:
-            op_df = df[df["operator_create"] == op]
-            op_n = len(op_df)
-            if op_n == 0:
-                continue
-            op_perfect = int(op_df[quality_fields].notna().all(axis=1).sum()) if all(f in op_df.columns for f in quality_fields) else 0
-            field_pcts = {}
-            for f in quality_fields:
-                if f in op_df.columns:
-                    field_pcts[field_labels.get(f, f)] = _pct(int(op_df[f].notna().sum()), op_n)
-            op_quality.append({
-                "operator": op,
-                "total": op_n,
-                "perfect": op_perfect,
-                "pct_perfect": _pct(op_perfect, op_n),
-                "fields": field_pcts,
+
+def _m_categories(job, inp):
+    df = inp["frame"]["df"]
+    N = len(df)
+    source_series = df["source"].dropna().astype(str)
+    pco_sources = source_series[source_series.str.startswith("PCO")]
+    source_top = pco_sources.value_counts().head(15)
+    sources = [{"label": str(k), "n": int(v)} for k, v in source_top.items()]
+
+    sc_series = df["sous_classification"].dropna().astype(str)
+    sc_series = sc_series[sc_series.str.strip() != ""]
+    sc_series = sc_series[sc_series != "Inconnu"]
+    sc_counts = sc_series.value_counts().sort_values(ascending=True)
+    sous_class = [{"label": str(k), "n": int(v)} for k, v in sc_counts.items()]
+
+    # Channels
+    channels = {}
+    channels["Telephone"] = int(df["flag_tel"].sum())
+    channels["Radio"] = int(df["flag_radio"].sum())
+    channels["Autre"] = N - channels["Telephone"] - channels["Radio"]
+
+    return {"sources": sources, "sous_classifications": sous_class, "channels": channels}
+
+
+def _m_operators(job, inp):
+    df = inp["frame"]["df"]
+    op_create = df["operator_create"].value_counts().head(20)
+    op_create_list = [{"label": str(k), "n": int(v)} for k, v in op_create.items()]
+
+    # Delays by operator (top 15 creators)
+    top_ops = op_create.head(15).index.tolist()
+    op_delays = []
+    for op in top_ops:
+        subset = df[df["operator_create"] == op]["delay_min"].dropna()
+        if len(subset):
+            op_delays.append({
+                "label": op,
+                "median": round(float(subset.median()), 1),
+                "p90": round(float(np.percentile(subset, 90)), 1),
+                "n": int(len(subset)),
             })
-        quality_data["by_operator"] = sorted(op_quality, key=lambda x: x["pct_perfect"])
 
-        # Quality progression by day
+    return {"creators": op_create_list, "delays_by_op": op_delays}
+
+
+def _m_services(job, inp):
+    df = inp["frame"]["df"]
+    svc_exploded = df[["services_list", "delay_min"]].copy()
+    svc_exploded["services_list_filled"] = [L if L else ["Inconnu"] for L in svc_exploded["services_list"]]
+    svc_df = svc_exploded.explode("services_list_filled").rename(columns={"services_list_filled": "service"})
+    svc_df["service"] = svc_df["service"].map(clean_service_label)
+    svc_known = svc_df[svc_df["service"] != "Inconnu"]
+
+    svc_split = svc_known["service"].value_counts().head(15)
+    svc_split_list = [{"label": str(k), "n": int(v)} for k, v in svc_split.items()]
+
+    svc_closed = svc_df[pd.notna(svc_df["delay_min"])].copy()
+    svc_p90 = []
+    if not svc_closed.empty:
+        svc_agg = svc_closed.groupby("service")["delay_min"].agg(
+            n="count", mediane="median", moyenne="mean",
+            p90=lambda s: float(np.percentile(s.dropna(), 90)) if s.dropna().any() else 0,
+        ).reset_index().sort_values("p90", ascending=True)
+        svc_p90 = [{
+            "label": str(r["service"]), "n": int(r["n"]),
+            "median": round(float(r["mediane"]), 1),
+            "mean": round(float(r["moyenne"]), 1),
+            "p90": round(float(r["p90"]), 1),
+        } for r in svc_agg.to_dict("records")]
+
+    return {"split": svc_split_list, "p90": svc_p90}
+
+
+def _m_intervenants(job, inp):
+    df_interv = inp["interv_frame"]
+    interv_top = []
+    interv_levels = []
+    avg_per_fiche = 0
+    if not df_interv.empty:
+        avg_per_fiche = round(df_interv.groupby("fiche_id").size().mean(), 2)
+        top_g = df_interv["intervenant"].value_counts().head(20).reset_index()
+        top_g.columns = ["intervenant", "n"]
+        interv_top = [{"label": str(r["intervenant"]), "n": int(r["n"])} for r in top_g.to_dict("records")]
+        # By level
+        repart = df_interv.groupby(["intervenant", "niveau"]).size().reset_index(name="n")
+        repart_top = repart[repart["intervenant"].isin(top_g["intervenant"])]
+        for r in repart_top.to_dict("records"):
+            interv_levels.append({"intervenant": str(r["intervenant"]), "niveau": str(r["niveau"]), "n": int(r["n"])})
+
+    return {"top": interv_top, "levels": interv_levels, "avg_per_fiche": avg_per_fiche}
+
+
+def _m_text(job, inp):
+    df = inp["frame"]["df"]
+    op_name_tokens = set()
+    for coln in ["operator_create", "operator_close"]:
+        if coln in df.columns:
+            for name in df[coln].dropna().unique():
+                op_name_tokens.update(_tokenize_basic(str(name)))
+
+    text_sources = []
+    for col in ["text_full", "text", "comment_text"]:
+        if col in df.columns:
+            text_sources += [_clean_text_blob(t) for t in df[col].dropna().tolist()]
+
+    raw_tokens = _tokenize_basic(" ".join(text_sources))
+    tokens = [t for t in raw_tokens if t not in STOPWORDS_FR and t not in op_name_tokens]
+
+    wordcloud_words = []
+    if tokens:
+        freq = pd.Series(tokens).value_counts().head(120)
+        wordcloud_words = [{"t": str(w), "n": int(c)} for w, c in freq.items()]
+
+    # Treemap: sous-classifications (meme comptage que le module categories)
+    treemap = [dict(sc) for sc in inp["categories"]["sous_classifications"]]
+
+    return {"wordcloud": wordcloud_words, "treemap": treemap}
+
+
+def _m_appelants(job, inp):
+    df = inp["frame"]["df"]
+    # Build reverse alias map
+    alias_map = {}
+    for canonical, variants in APPELANT_ALIASES.items():
+        for v in variants:
+            alias_map[v.upper().strip()] = canonical
+        alias_map[canonical.upper().strip()] = canonical
+
+    appelant_series = df["appelant"].dropna().astype(str).str.upper().str.strip()
+    appelant_norm = appelant_series.map(lambda x: alias_map.get(x, x))
+    app_counts = appelant_norm.value_counts().head(20)
+    appelants = [{"label": str(k), "n": int(v)} for k, v in app_counts.items()]
+    return {"top": appelants}
+
+
+def _safe_float(v):
+    if v is None:
+        return None
+    try:
+        f = float(v)
+        if np.isnan(f) or np.isinf(f):
+            return None
+        return round(f, 2)
+    except (ValueError, TypeError):
+        return None
+
+
+def _m_meteo_cross(job, inp):
+    _ensure_db()
+    dft = inp["frame"]["dft"]
+    meteo_cross = {"days": [], "pearson_temp": None, "pearson_rain": None}
+    try:
         if not dft.empty:
-            day_quality = []
-            for day, group in dft.groupby("date"):
-                day_n = len(group)
-                day_ids = group.index
-                day_df = df.loc[day_ids]
-                day_perfect = int(day_df[quality_fields].notna().all(axis=1).sum()) if all(f in day_df.columns for f in quality_fields) else 0
-                day_quality.append({
-                    "date": str(day),
-                    "total": day_n,
-                    "pct_perfect": _pct(day_perfect, day_n),
+            dates = sorted(dft["date"].unique())
+            inc_by_day = dft.groupby("date").size().to_dict()
+            meteo_days = []
+            for d in dates:
+                date_str = str(d)
+                # Date in donnees_meteo can be ISODate, string "YYYY-MM-DD" or "YYYY-MM-DDT00:00:00.000Z"
+                meteo_doc = _db["donnees_meteo"].find_one({"Date": datetime(d.year, d.month, d.day)})
+                if not meteo_doc:
+                    meteo_doc = _db["donnees_meteo"].find_one({"Date": date_str})
+                if not meteo_doc:
+                    meteo_doc = _db["donnees_meteo"].find_one({"Date": date_str + "T00:00:00.000Z"})
+                tmax = tmin = rain = None
+                if meteo_doc:
+                    # Use get with sentinel to handle 0 values correctly (0 is valid, not missing)
+                    _miss = object()
+                    # Keys in MongoDB have accents: Température, Précipitations
+                    tmax = meteo_doc.get("Temp\u00e9rature max (\u00b0C)", _miss)
+                    if tmax is _miss:
+                        tmax = meteo_doc.get("Temperature max (\u00b0C)", _miss)
+                    if tmax is _miss:
+                        tmax = meteo_doc.get("Temperature max (C)")
+                    tmin = meteo_doc.get("Temp\u00e9rature min (\u00b0C)", _miss)
+                    if tmin is _miss:
+                        tmin = meteo_doc.get("Temperature min (\u00b0C)", _miss)
+                    if tmin is _miss:
+                        tmin = meteo_doc.get("Temperature min (C)")
+                    rain = meteo_doc.get("Pr\u00e9cipitations (mm)", _miss)
+                    if rain is _miss:
+                        rain = meteo_doc.get("Precipitations (mm)")
+                meteo_days.append({
+                    "date": date_str,
+                    "incidents": int(inc_by_day.get(d, 0)),
+                    "tmax": _safe_float(tmax),
+                    "tmin": _safe_float(tmin),
+                    "rain": _safe_float(rain),
                 })
-            quality_data["by_day"] = day_quality
+            meteo_cross["days"] = meteo_days
+            # Pearson
+            inc_vals = [m["incidents"] for m in meteo_days if m["tmax"] is not None]
+            temp_vals = [m["tmax"] for m in meteo_days if m["tmax"] is not None]
+            rain_vals = [m["rain"] for m in meteo_days if m["rain"] is not None]
+            inc_rain = [m["incidents"] for m in meteo_days if m["rain"] is not None]
+            if len(inc_vals) >= 3 and len(temp_vals) >= 3:
+                r = float(np.corrcoef(inc_vals[:len(temp_vals)], temp_vals)[0, 1])
+                if not np.isnan(r):
+                    meteo_cross["pearson_temp"] = round(r, 3)
+            if len(inc_rain) >= 3 and len(rain_vals) >= 3:
+                r = float(np.corrcoef(inc_rain[:len(rain_vals)], rain_vals)[0, 1])
+                if not np.isnan(r):
+                    meteo_cross["pearson_rain"] = round(r, 3)
+    except Exception as e:
+        logger.warning(f"Meteo cross failed: {e}")
+    return meteo_cross
+
 
-        _cache_set(event, year, "quality", quality_data)
-        _progress()
+def _m_affluence_cross(job, inp):
+    _ensure_db()
+    event, year = job["event"], job["year"]
+    affluence_cross = {"hourly": []}
+    try:
+        evt_doc = _db["evenement"].find_one({"nom": event})
+        if evt_doc and evt_doc.get("skidata"):
+            skidata_id = evt_doc["skidata"]
+            # year can be int or str in data_access, try both
+            access_docs = list(_db["data_access"].find(
+                {"counter_id": skidata_id, "year": {"$in": [year, str(year), int(year) if isinstance(year, str) and year.isdigit() else year]}},
+                sort=[("timestamp", 1)],
+            ).limit(2000))
+            if not access_docs:
+                # Fallback: search by requested_event (no spaces, no "H ")
+                slug = event.replace(" ", "").upper()
+                access_docs = list(_db["data_access"].find(
+                    {"requested_event": slug, "year": {"$in": [year, str(year), int(year) if isinstance(year, str) and year.isdigit() else year]}},
+                    sort=[("timestamp", 1)],
+                ).limit(2000))
+            if access_docs:
+                for adoc in access_docs:
+                    ts_a = adoc.get("timestamp")
+                    if ts_a:
+                        current_val = adoc.get("current", 0)
+                        try:
+                            current_val = int(current_val)
+                        except (ValueError, TypeError):
+                            current_val = 0
+                        affluence_cross["hourly"].append({
+                            "dt": str(ts_a),
+                            "presents": current_val,
+                        })
+    except Exception as e:
+        logger.warning(f"Affluence cross failed: {e}")
+    return affluence_cross
 
-        # =====================================================================
-        # 3) Temporal
-        # =====================================================================
-        hourly = []
-        heatmap_data = {"days": [], "hours": list(range(24)), "values": []}
-        backlog = []
 
+def _m_waze_cross(job, inp):
+    _ensure_db()
+    dft = inp["frame"]["dft"]
+    waze_cross = {"alerts": []}
+    try:
         if not dft.empty:
-            by_hour = dft.groupby(["date", "hour"]).size().reset_index(name="count")
-            by_hour["dt"] = pd.to_datetime(by_hour["date"]) + pd.to_timedelta(by_hour["hour"], unit="h")
-            hourly = [{"dt": str(r["dt"]), "count": int(r["count"])} for _, r in by_hour.iterrows()]
-
-            # Heatmap day x hour
-            hm = dft.groupby(["dow_name", "hour"]).size().reset_index(name="n")
-            days_order = ["lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]
-            hm["dow_name"] = hm["dow_name"].str.lower()
-            hm["dow_name"] = pd.Categorical(hm["dow_name"], categories=days_order, ordered=True)
-            pivot = hm.pivot(index="dow_name", columns="hour", values="n").fillna(0)
-            heatmap_data = {
-                "days": pivot.index.tolist(),
-                "hours": list(range(24)),
-                "values": pivot.values.tolist(),
-            }
+            date_min = dft["ts"].min()
+            date_max = dft["ts"].max()
+            waze_alerts = list(_db["waze_feed_events"].find({
+                "observed_at": {"$gte": date_min, "$lte": date_max},
+                "entity_type": "alert",
+            }).limit(500))
+            for wa in waze_alerts:
+                geo = wa.get("geometry") or {}
+                coords = geo.get("coordinates", [])
+                if len(coords) >= 2:
+                    waze_cross["alerts"].append({
+                        "lat": float(coords[1]),
+                        "lon": float(coords[0]),
+                        "type": (wa.get("kind") or {}).get("type", ""),
+                        "subtype": (wa.get("kind") or {}).get("subtype", ""),
+                        "dt": str(wa.get("observed_at", "")),
+                        "street": (wa.get("road") or {}).get("street", ""),
+                    })
+    except Exception as e:
+        logger.warning(f"Waze cross failed: {e}")
+    return waze_cross
 
-            # Backlog
-            events_open = dft[["ts"]].copy()
-            events_open["delta"] = 1
-            events_open = events_open.rename(columns={"ts": "t"})
-            events_close = df[pd.notna(df["close_ts"])][["close_ts"]].copy()
-            events_close["delta"] = -1
-            events_close = events_close.rename(columns={"close_ts": "t"})
-            flow = pd.concat([events_open[["t", "delta"]], events_close[["t", "delta"]]], ignore_index=True)
-            flow = flow.sort_values("t")
-            flow["backlog"] = flow["delta"].cumsum()
-            # Downsample to max 500 points
-            step = max(1, len(flow) // 500)
-            flow_sampled = flow.iloc[::step]
-            backlog = [{"t": str(r["t"]), "backlog": int(r["backlog"])} for _, r in flow_sampled.iterrows()]
-
-            # Peak detection (z-score > 2)
-            hour_counts = by_hour["count"]
-            mean_c = hour_counts.mean()
-            std_c = hour_counts.std()
-            peaks = []
-            if std_c > 0:
-                for _, r in by_hour.iterrows():
-                    z = (r["count"] - mean_c) / std_c
-                    if z > 2:
-                        peaks.append({"dt": str(r["dt"]), "count": int(r["count"]), "zscore": round(z, 2)})
-
-        temporal_data = {"hourly": hourly, "heatmap": heatmap_data, "backlog": backlog, "peaks": peaks if not dft.empty else []}
-        _cache_set(event, year, "temporal", temporal_data)
-        _progress()
-
-        # =====================================================================
-        # 4) Geographic
-        # =====================================================================
-        # Areas
-        area_counts = df["area_desc"].value_counts().head(15)
-        areas = [{"area_desc": str(k), "n": int(v)} for k, v in area_counts.items()]
-
-        # Carroyes with GPS
-        car_series = df["carroye"].dropna()
-        car_counts = car_series.value_counts()
-        grid_docs = list(_col_grid_ref.find({}, {"_id": 0, "grid_ref": 1, "latitude": 1, "longitude": 1}))
-        grid_df = pd.DataFrame(grid_docs) if grid_docs else pd.DataFrame(columns=["grid_ref", "latitude", "longitude"])
-        if not grid_df.empty:
-            grid_df["grid_ref"] = grid_df["grid_ref"].astype(str).str.upper().str.replace(" ", "", regex=False)
-
-        car_points = []
-        if not car_counts.empty and not grid_df.empty:
-            car_df = car_counts.reset_index()
-            car_df.columns = ["carroye", "n"]
-            # Descriptions
-            desc_df = (
-                df.loc[pd.notna(df["carroye"]) & pd.notna(df["text"]), ["carroye", "text"]]
-                .groupby("carroye")["text"].apply(list).reset_index(name="descs")
-            )
-            desc_df["descs"] = desc_df["descs"].apply(lambda L: [str(t)[:240] for t in L[:10]])
-            car_map = car_df.merge(grid_df, left_on="carroye", right_on="grid_ref", how="left")
-            car_map = car_map.merge(desc_df, on="carroye", how="left")
-            car_map = car_map.dropna(subset=["latitude", "longitude"])
-            car_points = [{
-                "ref": str(r["carroye"]),
-                "n": int(r["n"]),
-                "lat": float(r["latitude"]),
-                "lon": float(r["longitude"]),
-                "descs": r["descs"] if isinstance(r["descs"], list) else [],
-            } for _, r in car_map.iterrows()]
-
-        # GPS points (real coordinates from gps field)
-        gps_df = df.dropna(subset=["lat", "lon"])[["_id", "lat", "lon", "text", "category", "severity", "ts", "sous_classification"]].copy()
-        gps_points = [{
+
+def _m_convergence(job, inp):
+    df = inp["frame"]["df"]
+    car_points = inp["geographic"]["car_points"]
+    convergence_data = {"gps_incidents": []}
+    gps_for_cluster = df.dropna(subset=["lat", "lon"])[["_id", "lat", "lon", "ts", "category", "severity", "sous_classification", "area_desc"]].copy()
+    if not gps_for_cluster.empty:
+        convergence_data["gps_incidents"] = [{
             "id": str(r["_id"]),
             "lat": float(r["lat"]),
             "lon": float(r["lon"]),
-            "text": str(r["text"])[:200] if r["text"] else "",
+            "ts": str(r["ts"]) if pd.notna(r["ts"]) else "",
             "category": str(r["category"]) if r["category"] else "",
             "severity": int(r["severity"]) if pd.notna(r["severity"]) else 0,
-            "ts": str(r["ts"]) if pd.notna(r["ts"]) else "",
             "sous_class": str(r["sous_classification"]) if r["sous_classification"] else "",
-        } for _, r in gps_df.iterrows()]
-
-        # Hotspots (risk score)
-        hotspots = []
-        df_hot = pd.DataFrame({"carroye": df["carroye"], "delay_min": df["delay_min"]})
-        df_hot = df_hot.dropna(subset=["carroye"])
-        if not df_hot.empty:
-            def _norm_col(s):
-                s = s.astype(float)
-                if s.max() == s.min():
-                    return pd.Series([0.0] * len(s), index=s.index)
-                return (s - s.min()) / (s.max() - s.min())
-            agg_hot = df_hot.groupby("carroye").agg(
-                volume=("carroye", "count"),
-                p90_delay=("delay_min", lambda s: float(np.nanpercentile(s.dropna(), 90)) if s.dropna().any() else 0),
-            ).reset_index()
-            if len(agg_hot) > 1:
-                agg_hot["score"] = round(100 * (_norm_col(agg_hot["volume"]) + _norm_col(agg_hot["p90_delay"].fillna(0))) / 2.0, 1)
-            else:
-                agg_hot["score"] = 50.0
-            top_hot = agg_hot.sort_values("score", ascending=False).head(20)
-            # Merge with coords
-            if not grid_df.empty:
-                top_hot = top_hot.merge(grid_df, left_on="carroye", right_on="grid_ref", how="left")
-                top_hot = top_hot.dropna(subset=["latitude", "longitude"])
-                hotspots = [{
-                    "ref": str(r["carroye"]), "score": float(r["score"]),
-                    "volume": int(r["volume"]), "p90": round(float(r["p90_delay"]), 1),
-                    "lat": float(r["latitude"]), "lon": float(r["longitude"]),
-                } for _, r in top_hot.iterrows()]
-
-        geo_data = {
-            "areas": areas,
-            "car_points": car_points,
-            "gps_points": gps_points,
-            "hotspots": hotspots,
-            "gps_count": len(gps_points),
+            "area": str(r["area_desc"]) if r["area_desc"] else "",
+        } for r in gps_for_cluster.to_dict("records")]
+    # Also add carrroye-based points for events without GPS
+    if len(convergence_data["gps_incidents"]) < 50 and car_points:
+        for cp in car_points:
+            convergence_data["gps_incidents"].append({
+                "id": f"car_{cp['ref']}",
+                "lat": cp["lat"],
+                "lon": cp["lon"],
+                "ts": "",
+                "category": "",
+                "severity": 0,
+                "sous_class": "",
+                "area": cp["ref"],
+                "is_carroye": True,
+                "n": cp["n"],
+            })
+    return convergence_data
+
+
+def _m_comparative(job, inp):
+    _ensure_db()
+    event, year = job["event"], job["year"]
+    df = inp["frame"]["df"]
+    kpis = inp["kpis"]
+    comparative = {"years": [], "kpis_by_year": {}}
+    try:
+        other_year = year - 1 if isinstance(year, int) else None
+        if other_year:
+            other_count = _col_pcorg.count_documents({"event": event, "year": other_year})
+            if other_count > 0:
+                other_docs = list(_col_pcorg.find({"event": event, "year": other_year}))
+                odf = pd.DataFrame([_flatten_doc(d) for d in other_docs])
+                odf["delay_min"] = pd.to_numeric(odf["delay_min"], errors="coerce")
+                on_closed = int(pd.notna(odf["delay_min"]).sum())
+                comparative["years"] = [other_year, year]
+                comparative["kpis_by_year"][str(other_year)] = {
+                    "total": len(odf),
+                    "median_delay": round(float(np.nanmedian(odf["delay_min"])), 1) if on_closed else None,
+                    "sla30": _pct(int((odf["delay_min"].dropna() <= 30).sum()), on_closed) if on_closed else 0,
+                }
+                comparative["kpis_by_year"][str(year)] = {
+                    "total": kpis["total"],
+                    "median_delay": kpis["median_delay_min"],
+                    "sla30": kpis["sla30"],
+                }
+                # Category evolution
+                cat_curr = df["source"].value_counts().head(10).to_dict()
+                cat_prev = odf["source"].value_counts().head(10).to_dict()
+                all_cats = sorted(set(list(cat_curr.keys()) + list(cat_prev.keys())))[:15]
+                comparative["category_evolution"] = {
+                    c: {str(other_year): int(cat_prev.get(c, 0)), str(year): int(cat_curr.get(c, 0))}
+                    for c in all_cats
+                }
+    except Exception as e:
+        logger.warning(f"Comparative failed: {e}")
+    return comparative
+
+
+def _m_escalation(job, inp):
+    df = inp["frame"]["df"]
+    df_interv = inp["interv_frame"]
+    escalation = {"flows": [], "levels_count": {}}
+    if not df_interv.empty:
+        # Count fiches with each level
+        for i in range(1, 6):
+            lvl_name = f"Niveau {i}"
+            escalation["levels_count"][lvl_name] = int((df_interv["niveau"] == lvl_name).sum())
+        # Build sankey flows: category -> sous_class -> service
+        cat_to_sous = df.dropna(subset=["source", "sous_classification"]).groupby(["source", "sous_classification"]).size().reset_index(name="n")
+        for r in cat_to_sous.head(30).to_dict("records"):
+            escalation["flows"].append({"from": str(r["source"]), "to": str(r["sous_classification"]), "flow": int(r["n"])})
+        sous_to_svc = df.dropna(subset=["sous_classification"]).copy()
+        sous_to_svc["svc"] = [L[0] if L else None for L in sous_to_svc["services_list"]]
+        sous_to_svc = sous_to_svc.dropna(subset=["svc"])
+        svc_flows = sous_to_svc.groupby(["sous_classification", "svc"]).size().reset_index(name="n")
+        for r in svc_flows.head(30).to_dict("records"):
+            escalation["flows"].append({"from": str(r["sous_classification"]), "to": str(r["svc"]), "flow": int(r["n"])})
+    return escalation
+
+
+def _m_zones_vulnerability(job, inp):
+    df = inp["frame"]["df"]
+    zones_vuln = {"zones": []}
+    area_df = df.dropna(subset=["area_desc"]).copy()
+    if not area_df.empty:
+        agg = area_df.groupby("area_desc").agg(
+            volume=("area_desc", "count"),
+            sev_mean=("severity", lambda s: float(s.dropna().mean()) if s.dropna().any() else 0),
+            p90_delay=("delay_min", lambda s: float(np.nanpercentile(s.dropna(), 90)) if s.dropna().any() else 0),
+        ).reset_index()
+        if len(agg) > 1:
+            agg["score"] = round(100 * (
+                _norm_col(agg["volume"]) * 0.4 +
+                _norm_col(agg["sev_mean"].fillna(0)) * 0.3 +
+                _norm_col(agg["p90_delay"].fillna(0)) * 0.3
+            ), 1)
+        else:
+            agg["score"] = 50.0
+        top_zones = agg.sort_values("score", ascending=False).head(15)
+        zones_vuln["zones"] = [{
+            "zone": str(r["area_desc"]),
+            "score": float(r["score"]),
+            "volume": int(r["volume"]),
+            "sev_mean": round(float(r["sev_mean"]), 2),
+            "p90_delay": round(float(r["p90_delay"]), 1),
+        } for r in top_zones.to_dict("records")]
+    return zones_vuln
+
+
+def _m_effectifs_cross(job, inp):
+    _ensure_db()
+    event, year = job["event"], job["year"]
+    effectifs_cross = {"zones": [], "alerts": [], "available": False}
+    try:
+        # Try different slug patterns
+        slug_map = {
+            "24H AUTOS": "24hautos", "24H MOTOS": "24hmotos", "24H CAMIONS": "24hcamions",
+            "GPF": "gpf", "GP EXPLORER": "gpexplorer", "LE MANS CLASSIC": "lemansclassic",
+            "SUPERBIKE": "superbike", "CONGRES SDIS": "congressdis",
+        }
+        slug = slug_map.get(event, event.lower().replace(" ", ""))
+        cal_name = f"calendrier_{year}_{slug}"
+        cal_col = _db[cal_name]
+        cal_count = cal_col.count_documents({})
+        if cal_count > 0:
+            effectifs_cross["available"] = True
+            cal_docs = list(cal_col.find({}))
+            # Aggregate by zone and half-hour slot
+            zone_slots = {}
+            for cdoc in cal_docs:
+                zone = cdoc.get("zone") or "Inconnu"
+                stype = cdoc.get("accueil_surete", "S")
+                for dp in (cdoc.get("donnees_presences") or []):
+                    date = dp.get("date", "")
+                    for ph in (dp.get("plages_horaires") or []):
+                        nb = ph.get("nombre_personnes", 0)
+                        if nb > 0:
+                            key = (zone, date, ph.get("heure_debut", ""))
+                            if key not in zone_slots:
+                                zone_slots[key] = {"agents_secu": 0, "agents_accueil": 0}
+                            if stype == "S":
+                                zone_slots[key]["agents_secu"] += nb
+                            else:
+                                zone_slots[key]["agents_accueil"] += nb
+
+            zone_results = []
+            for (zone, date, heure), agents in zone_slots.items():
+                total_agents = agents["agents_secu"] + agents["agents_accueil"]
+                if total_agents > 0:
+                    zone_results.append({
+                        "zone": zone, "date": date, "heure": heure,
+                        "agents_secu": agents["agents_secu"],
+                        "agents_accueil": agents["agents_accueil"],
+                        "total_agents": total_agents,
+                    })
+            effectifs_cross["zones"] = zone_results[:500]
+    except Exception as e:
+        logger.warning(f"Effectifs cross failed: {e}")
+    return effectifs_cross
+
+
+def _m_anpr_cross(job, inp):
+    _ensure_db()
+    df = inp["frame"]["df"]
+    anpr_cross = {"available": False, "matches": []}
+    try:
+        plates_in_pcorg = set()
+        for pl_list in df["extracted_plates"].dropna():
+            if isinstance(pl_list, list):
+                plates_in_pcorg.update(pl_list)
+        if plates_in_pcorg and _db["hik_anpr"].count_documents({}) > 0:
+            anpr_cross["available"] = True
+            matched = list(_db["hik_anpr"].find(
+                {"license_plate": {"$in": list(plates_in_pcorg)}},
+                {"license_plate": 1, "event_dt": 1, "camera_path": 1, "_id": 0},
+            ).limit(200))
+            anpr_cross["matches"] = [{
+                "plate": m.get("license_plate", ""),
+                "dt": str(m.get("event_dt", "")),
+                "camera": m.get("camera_path", ""),
+            } for m in matched]
+    except Exception as e:
+        logger.warning(f"ANPR cross failed: {e}")
+    return anpr_cross
+
+
+def _m_network(job, inp):
+    df = inp["frame"]["df"]
+    network = {"nodes": [], "links": []}
+    try:
+        node_map = {}
+        link_map = {}
+
+        def _add_node(name, ntype):
+            if name and name != "Inconnu" and name not in node_map:
+                node_map[name] = {"id": name, "type": ntype, "weight": 0}
+
+        def _add_link(src, tgt, w=1):
+            if src and tgt and src != "Inconnu" and tgt != "Inconnu" and src != tgt:
+                key = (src, tgt) if src < tgt else (tgt, src)
+                link_map[key] = link_map.get(key, 0) + w
+
+        # Top operators (creators)
+        top_op_names = df["operator_create"].value_counts().head(12).index.tolist()
+        for op in top_op_names:
+            _add_node(op, "operator")
+
+        # Top zones
+        top_zone_names = df["area_desc"].value_counts().head(12).index.tolist()
+        for z in top_zone_names:
+            _add_node(z.split("/")[-1].strip() if "/" in z else z, "zone")
+
+        # Top services (les 10 premiers du classement du module services)
+        top_svc_names = [s["label"] for s in inp["services"]["split"][:10]]
+        for s in top_svc_names:
+            _add_node(s, "service")
+
+        top_ops, top_zones, top_svcs = set(top_op_names), set(top_zone_names), set(top_svc_names)
+
+        # Build links: operator -> zone
+        for op, zone in zip(df["operator_create"], df["area_desc"]):
+            if op in top_ops and zone in top_zones:
+                zone_short = zone.split("/")[-1].strip() if "/" in zone else zone
+                _add_link(op, zone_short)
+                if op in node_map:
+                    node_map[op]["weight"] += 1
+
+        # Build links: zone -> service
+        for zone, svcs in zip(df["area_desc"], df["services_list"]):
+            if zone in top_zones and svcs:
+                zone_short = zone.split("/")[-1].strip() if "/" in zone else zone
+                for svc in svcs:
+                    svc = clean_service_label(svc)
+                    if svc in top_svcs:
+                        _add_link(zone_short, svc)
+
+        network["nodes"] = list(node_map.values())
+        network["links"] = [{"source": k[0], "target": k[1], "value": v}
+                            for k, v in sorted(link_map.items(), key=lambda x: -x[1])[:80]]
+    except Exception as e:
+        logger.warning(f"Network graph failed: {e}")
+    return network
+
+
+# Ordre = ordre de soumission a entrees pretes egales : les croisements Mongo
+# d'abord, pour que leur attente recouvre le travail pandas.
+_TASKS = [
+    _Task("docs", _t_docs, kind="io", module=False),
+    _Task("grid", _t_grid, kind="io", module=False),
+    _Task("affluence-cross", _m_affluence_cross, kind="io"),
+    _Task("effectifs-cross", _m_effectifs_cross, kind="io"),
+    _Task("frame", _t_frame, ["docs"], module=False),
+    _Task("interv_frame", _t_interv_frame, ["docs"], module=False),
+    _Task("meteo-cross", _m_meteo_cross, ["frame"], kind="io"),
+    _Task("waze-cross", _m_waze_cross, ["frame"], kind="io"),
+    _Task("anpr-cross", _m_anpr_cross, ["frame"], kind="io"),
+    _Task("kpis", _m_kpis, ["frame"]),
+    _Task("comparative", _m_comparative, ["frame", "kpis"], kind="io"),
+    _Task("quality", _m_quality, ["frame", "kpis"]),
+    _Task("temporal", _m_temporal, ["frame"]),
+    _Task("geographic", _m_geographic, ["frame", "grid"]),
+    _Task("performance", _m_performance, ["frame", "kpis"]),
+    _Task("categories", _m_categories, ["frame"]),
+    _Task("operators", _m_operators, ["frame"]),
+    _Task("services", _m_services, ["frame"]),
+    _Task("intervenants", _m_intervenants, ["interv_frame"]),
+    _Task("text", _m_text, ["frame", "categories"]),
+    _Task("appelants", _m_appelants, ["frame"]),
+    _Task("convergence", _m_convergence, ["frame", "geographic"]),
+    _Task("escalation", _m_escalation, ["frame", "interv_frame"]),
+    _Task("zones-vulnerability", _m_zones_vulnerability, ["frame"]),
+    _Task("network", _m_network, ["frame", "services"]),
+]
+_TASKS_BY_NAME = {t.name: t for t in _TASKS}
+
+
+# ---------------------------------------------------------------------------
+# Recalcul incremental
+# ---------------------------------------------------------------------------
+# Apres un calcul, le frame nettoye est garde en memoire (par processus, comme
+# _compute_states). Le calcul suivant ne relit que les fiches modifiees depuis
+# (synced_at pose par sync_pcorg_sql a chaque DateWrite, modified_at pose par
+# les ecritures de l'application), retire l'ancienne version de chaque fiche
+# des agregats additifs, ajoute la nouvelle, et rend kpis / categories /
+# operators / services / temporal sans repasser sur tout le jeu. Les autres
+# modules sont recalcules sur le frame fusionne, sans relire Mongo.
+#
+# Recouvrement de INCR_OVERLAP sur le curseur : synced_at est pose avant
+# l'ecriture du lot et les horloges des deux ecrivains peuvent deriver. Une
+# fiche relue deux fois est simplement remplacee par elle-meme.
+INCR_OVERLAP = timedelta(minutes=5)
+INCR_MAX_RETAINED = 4
+_INCR_MODULES = ("kpis", "categories", "operators", "services", "temporal")
+
+_retained = {}
+
+
+class _FullRebuild(Exception):
+    pass
+
+
+def _absent(v):
+    return v is None or v is pd.NaT or (isinstance(v, float) and v != v)
+
+
+def _bump(counter, key, sign):
+    counter[key] += sign
+    if counter[key] <= 0:
+        del counter[key]
+
+
+def _sorted_bump(values, v, sign):
+    if sign > 0:
+        bisect.insort(values, v)
+    else:
+        del values[bisect.bisect_left(values, v)]
+
+
+def _ranked(counter, n=None):
+    # Equivalent de value_counts() : effectif decroissant, ordre d'insertion
+    # a egalite.
+    items = sorted(counter.items(), key=lambda kv: -kv[1])
+    return items if n is None else items[:n]
+
+
+class _Aggregates:
+    """Sommes des modules additifs ; apply(row, sign) ajoute (+1) ou retire
+    (-1) la contribution d'une fiche du frame."""
+
+    def __init__(self):
+        self.n = 0
+        self.delays = []                # delay_min tries, sans NaN
+        self.fcr = 0
+        self.tel = 0
+        self.radio = 0
+        self.filled = Counter()         # champ qualite -> fiches renseignees
+        self.perfect = 0
+        self.dates = Counter()          # date Paris -> fiches
+        self.hours = Counter()          # (date, heure) -> fiches
+        self.dow_hours = Counter()      # (jour, heure) -> fiches
+        self.sources = Counter()        # sources PCO*
+        self.sous_class = Counter()
+        self.creators = Counter()
+        self.op_delays = defaultdict(list)
+        self.svc_counts = Counter()     # hors "Inconnu"
+        self.svc_delays = defaultdict(list)
+
+    @classmethod
+    def from_frame(cls, df, dft):
+        agg = cls()
+        agg.update(df, dft, 1)
+        return agg
+
+    def update(self, df, dft, sign):
+        temporal = dict(zip(dft.index, zip(dft["date"], dft["hour"], dft["dow_name"])))
+        for idx, row in zip(df.index, df.to_dict("records")):
+            self.apply(row, temporal.get(idx), sign)
+
+    def apply(self, row, temporal, sign):
+        self.n += sign
+        delay = row["delay_min"]
+        closed = not _absent(delay)
+        if closed:
+            _sorted_bump(self.delays, delay, sign)
+        op = row["operator_create"]
+        if closed and op == row["operator_close"] and delay <= 30:
+            self.fcr += sign
+        self.tel += sign * int(bool(row["flag_tel"]))
+        self.radio += sign * int(bool(row["flag_radio"]))
+        present = [f for f in _QUALITY_FIELDS if not _absent(row[f])]
+        for f in present:
+            self.filled[f] += sign
+        if len(present) == len(_QUALITY_FIELDS):
+            self.perfect += sign
+
+        if temporal is not None:
+            date, hour, dow = temporal
+            _bump(self.dates, date, sign)
+            _bump(self.hours, (date, hour), sign)
+            _bump(self.dow_hours, (dow, hour), sign)
+
+        source = row["source"]
+        if not _absent(source) and str(source).startswith("PCO"):
+            _bump(self.sources, str(source), sign)
+        sc = row["sous_classification"]
+        if not _absent(sc):
+            sc = str(sc)
+            if sc.strip() != "" and sc != "Inconnu":
+                _bump(self.sous_class, sc, sign)
+
+        _bump(self.creators, op, sign)
+        if closed:
+            _sorted_bump(self.op_delays[op], delay, sign)
+
+        for svc in (row["services_list"] or ["Inconnu"]):
+            svc = clean_service_label(svc)
+            if svc != "Inconnu":
+                _bump(self.svc_counts, svc, sign)
+            if closed:
+                _sorted_bump(self.svc_delays[svc], delay, sign)
+
+    def _sla(self, thr):
+        if not self.delays:
+            return 0.0
+        return _pct(bisect.bisect_right(self.delays, thr), len(self.delays))
+
+    def kpis(self):
+        n_closed = len(self.delays)
+        median_delay = float(np.median(self.delays)) if n_closed else None
+        p90_delay = float(np.percentile(self.delays, 90)) if n_closed else None
+        return {
+            "total": self.n,
+            "total_closed": n_closed,
+            "fcr_count": self.fcr,
+            "fcr_rate": _pct(self.fcr, self.n),
+            "median_delay_min": round(median_delay, 1) if median_delay else None,
+            "p90_delay_min": round(p90_delay, 1) if p90_delay else None,
+            "sla10": self._sla(10),
+            "sla30": self._sla(30),
+            "sla60": self._sla(60),
+            "tel_share": _pct(self.tel, self.n),
+            "radio_share": _pct(self.radio, self.n),
+            "quality_fields": {f: self.filled[f] for f in _QUALITY_FIELDS},
+            "n_perfect": self.perfect,
+            "pct_perfect": _pct(self.perfect, self.n),
+            "date_range": {
+                "start": str(min(self.dates)) if self.dates else None,
+                "end": str(max(self.dates)) if self.dates else None,
+            },
         }
-        _cache_set(event, year, "geographic", geo_data)
-        _progress()
-
-        # =====================================================================
-        # 5) Performance
-        # =====================================================================
-        delay_hist = []
-        if N_closed:
-            delays = df["delay_min"].dropna()
-            bins = [0, 10, 30, 60, 120, 240, 480, float("inf")]
-            labels = ["0-10", "10-30", "30-60", "1-2h", "2-4h", "4-8h", "8h+"]
-            cuts = pd.cut(delays, bins=bins, labels=labels, right=True)
-            delay_hist = [{"range": str(k), "count": int(v)} for k, v in cuts.value_counts().sort_index().items()]
-
-        perf_data = {
-            "fcr": {"fcr": fcr_count, "non_fcr": max(0, N - fcr_count)},
-            "sla": {"sla10": sla_share(10), "sla30": sla_share(30), "sla60": sla_share(60)},
-            "delay_distribution": delay_hist,
-            "median_delay": round(median_delay, 1) if median_delay else None,
-            "p90_delay": round(p90_delay, 1) if p90_delay else None,
+
+    def categories(self):
+        return {
+            "sources": [{"label": k, "n": v} for k, v in _ranked(self.sources, 15)],
+            "sous_classifications": [{"label": k, "n": v}
+                                     for k, v in sorted(self.sous_class.items(), key=lambda kv: kv[1])],
+            "channels": {"Telephone": self.tel, "Radio": self.radio,
+                         "Autre": self.n - self.tel - self.radio},
         }
-        _cache_set(event, year, "performance", perf_data)
-        _progress()
-
-        # =====================================================================
-        # 6) Categories
-        # =====================================================================
-        source_series = df["source"].dropna().astype(str)
-        pco_sources = source_series[source_series.str.startswith("PCO")]
-        source_top = pco_sources.value_counts().head(15)
-        sources = [{"label": str(k), "n": int(v)} for k, v in source_top.items()]
-
-        sc_series = df["sous_classification"].dropna().astype(str)
-        sc_series = sc_series[sc_series.str.strip() != ""]
-        sc_series = sc_series[sc_series != "Inconnu"]
-        sc_counts = sc_series.value_counts().sort_values(ascending=True)
-        sous_class = [{"label": str(k), "n": int(v)} for k, v in sc_counts.items()]
-
-        # Channels
-        channels = {}
-        channels["Telephone"] = int(df["flag_tel"].sum())
-        channels["Radio"] = int(df["flag_radio"].sum())
-        channels["Autre"] = N - channels["Telephone"] - channels["Radio"]
-
-        cat_data = {"sources": sources, "sous_classifications": sous_class, "channels": channels}
-        _cache_set(event, year, "categories", cat_data)
-        _progress()
-
-        # =====================================================================
-        # 7) Operators
-        # =====================================================================
-        op_create = df["operator_create"].value_counts().head(20)
-        op_create_list = [{"label": str(k), "n": int(v)} for k, v in op_create.items()]
-
-        # Delays by operator (top 15 creators)
-        top_ops = op_create.head(15).index.tolist()
-        op_delays = []
-        for op in top_ops:
-            subset = df[df["operator_create"] == op]["delay_min"].dropna()
-            if len(subset):
-                op_delays.append({
+
+    def operators(self):
+        creators = _ranked(self.creators, 20)
+        delays = []
+        for op, _ in creators[:15]:
+            values = self.op_delays.get(op)
+            if values:
+                delays.append({
                     "label": op,
-                    "median": round(float(subset.median()), 1),
-                    "p90": round(float(np.percentile(subset, 90)), 1),
-                    "n": int(len(subset)),
+                    "median": round(float(np.median(values)), 1),
+                    "p90": round(float(np.percentile(values, 90)), 1),
+                    "n": len(values),
                 })
-
-        ops_data = {"creators": op_create_list, "delays_by_op": op_delays}
-        _cache_set(event, year, "operators", ops_data)
-        _progress()
-
-        # =====================================================================
-        # 8) Services
-        # =====================================================================
-        svc_exploded = df[["services_list", "delay_min"]].copy()
-        svc_exploded["services_list_filled"] = svc_exploded["services_list"].apply(lambda L: L if L else ["Inconnu"])
-        svc_df = svc_exploded.explode("services_list_filled").rename(columns={"services_list_filled": "service"})
-        svc_df["service"] = svc_df["service"].apply(clean_service_label)
-        svc_known = svc_df[svc_df["service"] != "Inconnu"]
-
-        svc_split = svc_known["service"].value_counts().head(15)
-        svc_split_list = [{"label": str(k), "n": int(v)} for k, v in svc_split.items()]
-
-        svc_closed = svc_df[pd.notna(svc_df["delay_min"])].copy()
-        svc_p90 = []
-        if not svc_closed.empty:
-            svc_agg = svc_closed.groupby("service")["delay_min"].agg(
-                n="count", mediane="median", moyenne="mean",
-                p90=lambda s: float(np.percentile(s.dropna(), 90)) if s.dropna().any() else 0,
-            ).reset_index().sort_values("p90", ascending=True)
-            svc_p90 = [{
-                "label": str(r["service"]), "n": int(r["n"]),
-                "median": round(float(r["mediane"]), 1),
-                "mean": round(float(r["moyenne"]), 1),
-                "p90": round(float(r["p90"]), 1),
-            } for _, r in svc_agg.iterrows()]
-
-        svc_data = {"split": svc_split_list, "p90": svc_p90}
-        _cache_set(event, year, "services", svc_data)
-        _progress()
-
-        # =====================================================================
-        # 9) Intervenants
-        # =====================================================================
-        intervs = []
-        for d in docs:
-            cc = d.get("content_category") or {}
-            xml_s = (d.get("xml_struct") or {})
-            for i in range(1, 6):
-                val = cc.get(f"intervenant{i}") or xml_s.get(f"intervenant{i}")
-                if val and str(val).strip():
-                    intervs.append({"fiche_id": d.get("_id"), "niveau": f"Niveau {i}", "intervenant": str(val).strip()})
-        df_interv = pd.DataFrame(intervs) if intervs else pd.DataFrame(columns=["fiche_id", "niveau", "intervenant"])
-
-        interv_top = []
-        interv_levels = []
-        avg_per_fiche = 0
-        if not df_interv.empty:
-            avg_per_fiche = round(df_interv.groupby("fiche_id").size().mean(), 2)
-            top_g = df_interv["intervenant"].value_counts().head(20).reset_index()
-            top_g.columns = ["intervenant", "n"]
-            interv_top = [{"label": str(r["intervenant"]), "n": int(r["n"])} for _, r in top_g.iterrows()]
-            # By level
-            repart = df_interv.groupby(["intervenant", "niveau"]).size().reset_index(name="n")
-            repart_top = repart[repart["intervenant"].isin(top_g["intervenant"])]
-            for _, r in repart_top.iterrows():
-                interv_levels.append({"intervenant": str(r["intervenant"]), "niveau": str(r["niveau"]), "n": int(r["n"])})
-
-        interv_data = {"top": interv_top, "levels": interv_levels, "avg_per_fiche": avg_per_fiche}
-        _cache_set(event, year, "intervenants", interv_data)
-        _progress()
-
-        # =====================================================================
-        # 10) Text / Wordcloud
-        # =====================================================================
-        op_name_tokens = set()
-        for coln in ["operator_create", "operator_close"]:
-            if coln in df.columns:
-                for name in df[coln].dropna().unique():
-                    op_name_tokens.update(_tokenize_basic(str(name)))
-
-        text_sources = []
-        for col in ["text_full", "text", "comment_text"]:
-            if col in df.columns:
-                text_sources += [_clean_text_blob(t) for t in df[col].dropna().tolist()]
-
-        raw_tokens = _tokenize_basic(" ".join(text_sources))
-        tokens = [t for t in raw_tokens if t not in STOPWORDS_FR and t not in op_name_tokens]
-
-        wordcloud_words = []
-        if tokens:
-            freq = pd.Series(tokens).value_counts().head(120)
-            wordcloud_words = [{"t": str(w), "n": int(c)} for w, c in freq.items()]
-
-        # Treemap: sous-classifications
-        treemap = []
-        if not sc_counts.empty:
-            for k, v in sc_counts.items():
-                treemap.append({"label": str(k), "n": int(v)})
-
-        text_data = {"wordcloud": wordcloud_words, "treemap": treemap}
-        _cache_set(event, year, "text", text_data)
-        _progress()
-
-        # =====================================================================
-        # 11) Appelants
-        # =====================================================================
-        # Build reverse alias map
-        alias_map = {}
-        for canonical, variants in APPELANT_ALIASES.items():
-            for v in variants:
-                alias_map[v.upper().strip()] = canonical
-            alias_map[canonical.upper().strip()] = canonical
-
-        appelant_series = df["appelant"].dropna().astype(str).str.upper().str.strip()
-        appelant_norm = appelant_series.map(lambda x: alias_map.get(x, x))
-        app_counts = appelant_norm.value_counts().head(20)
-        appelants = [{"label": str(k), "n": int(v)} for k, v in app_counts.items()]
-
-        _cache_set(event, year, "appelants", {"top": appelants})
-        _progress()
-
-        # =====================================================================
-        # 12) Meteo cross
-        # =====================================================================
-        meteo_cross = {"days": [], "pearson_temp": None, "pearson_rain": None}
-        try:
-            if not dft.empty:
-                dates = sorted(dft["date"].unique())
-                inc_by_day = dft.groupby("date").size().to_dict()
-                meteo_days = []
-                for d in dates:
-                    date_str = str(d)
-                    # Date in donnees_meteo can be ISODate, string "YYYY-MM-DD" or "YYYY-MM-DDT00:00:00.000Z"
-                    meteo_doc = _db["donnees_meteo"].find_one({"Date": datetime(d.year, d.month, d.day)})
-                    if not meteo_doc:
-                        meteo_doc = _db["donnees_meteo"].find_one({"Date": date_str})
-                    if not meteo_doc:
-                        meteo_doc = _db["donnees_meteo"].find_one({"Date": date_str + "T00:00:00.000Z"})
-                    tmax = tmin = rain = None
-                    if meteo_doc:
-                        # Use get with sentinel to handle 0 values correctly (0 is valid, not missing)
-                        _miss = object()
-                        # Keys in MongoDB have accents: Température, Précipitations
-                        tmax = meteo_doc.get("Temp\u00e9rature max (\u00b0C)", _miss)
-                        if tmax is _miss:
-                            tmax = meteo_doc.get("Temperature max (\u00b0C)", _miss)
-                        if tmax is _miss:
-                            tmax = meteo_doc.get("Temperature max (C)")
-                        tmin = meteo_doc.get("Temp\u00e9rature min (\u00b0C)", _miss)
-                        if tmin is _miss:
-                            tmin = meteo_doc.get("Temperature min (\u00b0C)", _miss)
-                        if tmin is _miss:
-                            tmin = meteo_doc.get("Temperature min (C)")
-                        rain = meteo_doc.get("Pr\u00e9cipitations (mm)", _miss)
-                        if rain is _miss:
-                            rain = meteo_doc.get("Precipitations (mm)")
-                    def _safe_float(v):
-                        if v is None:
-                            return None
-                        try:
-                            f = float(v)
-                            if np.isnan(f) or np.isinf(f):
-                                return None
-                            return round(f, 2)
-                        except (ValueError, TypeError):
-                            return None
-                    meteo_days.append({
-                        "date": date_str,
-                        "incidents": int(inc_by_day.get(d, 0)),
-                        "tmax": _safe_float(tmax),
-                        "tmin": _safe_float(tmin),
-                        "rain": _safe_float(rain),
-                    })
-                meteo_cross["days"] = meteo_days
-                # Pearson
-                inc_vals = [m["incidents"] for m in meteo_days if m["tmax"] is not None]
-                temp_vals = [m["tmax"] for m in meteo_days if m["tmax"] is not None]
-                rain_vals = [m["rain"] for m in meteo_days if m["rain"] is not None]
-                inc_rain = [m["incidents"] for m in meteo_days if m["rain"] is not None]
-                if len(inc_vals) >= 3 and len(temp_vals) >= 3:
-                    r = float(np.corrcoef(inc_vals[:len(temp_vals)], temp_vals)[0, 1])
-                    if not np.isnan(r):
-                        meteo_cross["pearson_temp"] = round(r, 3)
-                if len(inc_rain) >= 3 and len(rain_vals) >= 3:
-                    r = float(np.corrcoef(inc_rain[:len(rain_vals)], rain_vals)[0, 1])
-                    if not np.isnan(r):
-                        meteo_cross["pearson_rain"] = round(r, 3)
-        except Exception as e:
-            logger.warning(f"Meteo cross failed: {e}")
-        _cache_set(event, year, "meteo-cross", meteo_cross)
-        _progress()
-
-        # =====================================================================
-        # 13) Affluence cross
-        # =====================================================================
-        affluence_cross = {"hourly": []}
-        try:
-            evt_doc = _db["evenement"].find_one({"nom": event})
-            if evt_doc and evt_doc.get("skidata"):
-                skidata_id = evt_doc["skidata"]
-                # year can be int or str in data_access, try both
-                access_docs = list(_db["data_access"].find(
-                    {"counter_id": skidata_id, "year": {"$in": [year, str(year), int(year) if isinstance(year, str) and year.isdigit() else year]}},
-                    sort=[("timestamp", 1)],
-                ).limit(2000))
-                if not access_docs:
-                    # Fallback: search by requested_event (no spaces, no "H ")
-                    slug = event.replace(" ", "").upper()
-                    access_docs = list(_db["data_access"].find(
-                        {"requested_event": slug, "year": {"$in": [year, str(year), int(year) if isinstance(year, str) and year.isdigit() else year]}},
-                        sort=[("timestamp", 1)],
-                    ).limit(2000))
-                if access_docs:
-                    for adoc in access_docs:
-                        ts_a = adoc.get("timestamp")
-                        if ts_a:
-                            current_val = adoc.get("current", 0)
-                            try:
-                                current_val = int(current_val)
-                            except (ValueError, TypeError):
-                                current_val = 0
-                            affluence_cross["hourly"].append({
-                                "dt": str(ts_a),
-                                "presents": current_val,
-                            })
-        except Exception as e:
-            logger.warning(f"Affluence cross failed: {e}")
-        _cache_set(event, year, "affluence-cross", affluence_cross)
-        _progress()
-
-        # =====================================================================
-        # 14) Waze cross
-        # =====================================================================
-        waze_cross = {"alerts": []}
-        try:
-            if not dft.empty:
-                date_min = dft["ts"].min()
-                date_max = dft["ts"].max()
-                waze_alerts = list(_db["waze_feed_events"].find({
-                    "observed_at": {"$gte": date_min, "$lte": date_max},
-                    "entity_type": "alert",
-                }).limit(500))
-                for wa in waze_alerts:
-                    geo = wa.get("geometry") or {}
-                    coords = geo.get("coordinates", [])
-                    if len(coords) >= 2:
-                        waze_cross["alerts"].append({
-                            "lat": float(coords[1]),
-                            "lon": float(coords[0]),
-                            "type": (wa.get("kind") or {}).get("type", ""),
-                            "subtype": (wa.get("kind") or {}).get("subtype", ""),
-                            "dt": str(wa.get("observed_at", "")),
-                            "street": (wa.get("road") or {}).get("street", ""),
-                        })
-        except Exception as e:
-            logger.warning(f"Waze cross failed: {e}")
-        _cache_set(event, year, "waze-cross", waze_cross)
-        _progress()
-
-        # =====================================================================
-        # 15) Convergence (data for client-side jDBSCAN)
-        # =====================================================================
-        convergence_data = {"gps_incidents": []}
-        gps_for_cluster = df.dropna(subset=["lat", "lon"])[["_id", "lat", "lon", "ts", "category", "severity", "sous_classification", "area_desc"]].copy()
-        if not gps_for_cluster.empty:
-            convergence_data["gps_incidents"] = [{
-                "id": str(r["_id"]),
-                "lat": float(r["lat"]),
-                "lon": float(r["lon"]),
-                "ts": str(r["ts"]) if pd.notna(r["ts"]) else "",
-                "category": str(r["category"]) if r["category"] else "",
-                "severity": int(r["severity"]) if pd.notna(r["severity"]) else 0,
-                "sous_class": str(r["sous_classification"]) if r["sous_classification"] else "",
-                "area": str(r["area_desc"]) if r["area_desc"] else "",
-            } for _, r in gps_for_cluster.iterrows()]
-        # Also add carrroye-based points for events without GPS
-        if len(convergence_data["gps_incidents"]) < 50 and car_points:
-            for cp in car_points:
-                convergence_data["gps_incidents"].append({
-                    "id": f"car_{cp['ref']}",
-                    "lat": cp["lat"],
-                    "lon": cp["lon"],
-                    "ts": "",
-                    "category": "",
-                    "severity": 0,
-                    "sous_class": "",
-                    "area": cp["ref"],
-                    "is_carroye": True,
-                    "n": cp["n"],
+        return {"creators": [{"label": k, "n": v} for k, v in creators], "delays_by_op": delays}
+
+    def services(self):
+        p90 = []
+        for svc in sorted(self.svc_delays):
+            values = self.svc_delays[svc]
+            if values:
+                p90.append({
+                    "label": str(svc), "n": len(values),
+                    "median": round(float(np.median(values)), 1),
+                    "mean": round(float(np.mean(values)), 1),
+                    "p90": round(float(np.percentile(values, 90)), 1),
                 })
-        _cache_set(event, year, "convergence", convergence_data)
-        _progress()
+        p90.sort(key=lambda r: r["p90"])
+        return {"split": [{"label": k, "n": v} for k, v in _ranked(self.svc_counts, 15)], "p90": p90}
+
+    def temporal(self, df, dft):
+        if dft.empty:
+            return _temporal_data(None, None, df, dft)
+        by_hour = pd.DataFrame([(d, h, n) for (d, h), n in sorted(self.hours.items())],
+                               columns=["date", "hour", "count"])
+        hm = pd.DataFrame([(d, h, n) for (d, h), n in sorted(self.dow_hours.items())],
+                          columns=["dow_name", "hour", "n"])
+        return _temporal_data(by_hour, hm, df, dft)
+
+
+class _Retained:
+    __slots__ = ("df", "dft", "interv", "cursor", "aggregates")
+
+    def __init__(self, df, dft, interv, cursor):
+        self.df = df
+        self.dft = dft
+        self.interv = interv
+        self.cursor = cursor
+        self.aggregates = None      # construit au premier recalcul incremental
+
+
+def _retain(key, retained):
+    _retained.pop(key, None)
+    _retained[key] = retained
+    while len(_retained) > INCR_MAX_RETAINED:
+        _retained.pop(next(iter(_retained)))
+
+
+def _merge_delta(event, year, retained):
+    """Relit les fiches modifiees depuis le dernier calcul et les fusionne
+    dans `retained` (frame, intervenants, agregats). Leve _FullRebuild si le
+    delta ne suffit pas a expliquer le nouvel etat (suppression, fiche
+    deplacee vers un autre evenement, ecriture sans marqueur)."""
+    since = retained.cursor - INCR_OVERLAP
+    docs = list(_col_pcorg.find({"event": event, "year": year, "$or": [
+        {"synced_at": {"$gte": since}},
+        {"modified_at": {"$gte": since}},
+    ]}))
+    total = _col_pcorg.count_documents({"event": event, "year": year})
+    df = retained.df
+    if not docs:
+        if total != len(df):
+            raise _FullRebuild(f"{total} fiches en base, {len(df)} en memoire")
+        if retained.aggregates is None:
+            retained.aggregates = _Aggregates.from_frame(df, retained.dft)
+        return 0
+
+    delta = _frame(docs)
+    delta_t = _temporal_frame(delta)
+    changed = df["_id"].isin(set(delta["_id"]))
+    if len(df) - int(changed.sum()) + len(delta) != total:
+        raise _FullRebuild(f"{total} fiches en base apres fusion du delta")
+
+    if retained.aggregates is None:
+        retained.aggregates = _Aggregates.from_frame(df, retained.dft)
+    agg = retained.aggregates
+    agg.update(df[changed], retained.dft[retained.dft.index.isin(df.index[changed])], -1)
+    agg.update(delta, delta_t, 1)
+
+    # Une fiche modifiee garde sa place, les nouvelles vont a la fin : meme
+    # ordre qu'une relecture complete, donc memes departages a egalite.
+    position = dict(zip(df["_id"], df.index))
+    order = list(df.index[~changed]) + [position.get(i, len(df) + k) for k, i in enumerate(delta["_id"])]
+    merged = pd.concat([df[~changed], delta], ignore_index=True)
+    merged = merged.iloc[np.argsort(order, kind="stable")].reset_index(drop=True)
+    retained.df = merged
+    retained.dft = _temporal_frame(merged)
+
+    interv = retained.interv
+    interv = pd.concat([interv[~interv["fiche_id"].isin(set(delta["_id"]))], _interv_frame(docs)],
+                       ignore_index=True)
+    rank = dict(zip(merged["_id"], merged.index))
+    interv = interv.iloc[np.argsort(interv["fiche_id"].map(rank).to_numpy(), kind="stable")]
+    retained.interv = interv.reset_index(drop=True)
+    return len(docs)
+
+
+def _run_compute(event, year, full=False):
+    key = (event, year)
+    state = _compute_states.setdefault(key, {
+        "status": "computing", "progress": 0, "event": event, "year": year,
+        "error": None, "timings": {},
+    })
+    t0 = time.perf_counter()
+    try:
+        _ensure_db()
+        # Une seule version pour tout le calcul, relue dans Mongo AVANT la
+        # lecture des fiches : une ecriture arrivee entre-temps la fera monter
+        # et rendra bien le cache perime. Idem pour le curseur du prochain
+        # incremental.
+        source_version = _source_version(event, year, fresh=True)
+        cursor = datetime.now(timezone.utc)
+        job = {"event": event, "year": year}
+        n_modules = sum(1 for t in _TASKS if t.module)
+        completed = 0
 
-        # =====================================================================
-        # 16) Comparative
-        # =====================================================================
-        comparative = {"years": [], "kpis_by_year": {}}
-        try:
-            other_year = year - 1 if isinstance(year, int) else None
-            if other_year:
-                other_count = _col_pcorg.count_documents({"event": event, "year": other_year})
-                if other_count > 0:
-                    other_docs = list(_col_pcorg.find({"event": event, "year": other_year}))
-                    odf = pd.DataFrame([_flatten_doc(d) for d in other_docs])
-                    odf["delay_min"] = pd.to_numeric(odf["delay_min"], errors="coerce")
-                    on_closed = int(pd.notna(odf["delay_min"]).sum())
-                    comparative["years"] = [other_year, year]
-                    comparative["kpis_by_year"][str(other_year)] = {
-                        "total": len(odf),
-                        "median_delay": round(float(np.nanmedian(odf["delay_min"])), 1) if on_closed else None,
-                        "sla30": _pct(int((odf["delay_min"].dropna() <= 30).sum()), on_closed) if on_closed else 0,
-                    }
-                    comparative["kpis_by_year"][str(year)] = {
-                        "total": N,
-                        "median_delay": round(median_delay, 1) if median_delay else None,
-                        "sla30": sla_share(30),
-                    }
-                    # Category evolution
-                    cat_curr = df["source"].value_counts().head(10).to_dict()
-                    cat_prev = odf["source"].value_counts().head(10).to_dict()
-                    all_cats = sorted(set(list(cat_curr.keys()) + list(cat_prev.keys())))[:15]
-                    comparative["category_evolution"] = {
-                        c: {str(other_year): int(cat_prev.get(c, 0)), str(year): int(cat_curr.get(c, 0))}
-                        for c in all_cats
-                    }
-        except Exception as e:
-            logger.warning(f"Comparative failed: {e}")
-        _cache_set(event, year, "comparative", comparative)
-        _progress()
-
-        # =====================================================================
-        # 17) Escalation (Sankey flows)
-        # =====================================================================
-        escalation = {"flows": [], "levels_count": {}}
-        if not df_interv.empty:
-            # Count fiches with each level
-            for i in range(1, 6):
-                lvl_name = f"Niveau {i}"
-                escalation["levels_count"][lvl_name] = int((df_interv["niveau"] == lvl_name).sum())
-            # Build sankey flows: category -> sous_class -> service
-            cat_to_sous = df.dropna(subset=["source", "sous_classification"]).groupby(["source", "sous_classification"]).size().reset_index(name="n")
-            for _, r in cat_to_sous.head(30).iterrows():
-                escalation["flows"].append({"from": str(r["source"]), "to": str(r["sous_classification"]), "flow": int(r["n"])})
-            sous_to_svc = df.dropna(subset=["sous_classification"]).copy()
-            sous_to_svc["svc"] = sous_to_svc["services_list"].apply(lambda L: L[0] if L else None)
-            sous_to_svc = sous_to_svc.dropna(subset=["svc"])
-            svc_flows = sous_to_svc.groupby(["sous_classification", "svc"]).size().reset_index(name="n")
-            for _, r in svc_flows.head(30).iterrows():
-                escalation["flows"].append({"from": str(r["sous_classification"]), "to": str(r["svc"]), "flow": int(r["n"])})
-
-        _cache_set(event, year, "escalation", escalation)
-        _progress()
-
-        # =====================================================================
-        # 18) Zones vulnerability
-        # =====================================================================
-        zones_vuln = {"zones": []}
-        area_df = df.dropna(subset=["area_desc"]).copy()
-        if not area_df.empty:
-            agg = area_df.groupby("area_desc").agg(
-                volume=("area_desc", "count"),
-                sev_mean=("severity", lambda s: float(s.dropna().mean()) if s.dropna().any() else 0),
-                p90_delay=("delay_min", lambda s: float(np.nanpercentile(s.dropna(), 90)) if s.dropna().any() else 0),
-            ).reset_index()
-            if len(agg) > 1:
-                agg["score"] = round(100 * (
-                    _norm_col(agg["volume"]) * 0.4 +
-                    _norm_col(agg["sev_mean"].fillna(0)) * 0.3 +
-                    _norm_col(agg["p90_delay"].fillna(0)) * 0.3
-                ), 1)
+        def _done(task, value, seconds):
+            nonlocal completed
+            state["timings"][task.name] = round(seconds * 1000)
+            if task.module:
+                _cache_set(event, year, task.name, value, source_version)
+                completed += 1
+                state["progress"] = int(100 * completed / n_modules)
+
+        retained = None if full else _retained.get(key)
+        given = {}
+        if retained is not None:
+            t_delta = time.perf_counter()
+            try:
+                state["changed"] = _merge_delta(event, year, retained)
+            except _FullRebuild as e:
+                logger.info(f"Analyse ops {event}/{year}: recalcul complet ({e})")
+                _retained.pop(key, None)
+                retained = None
             else:
-                agg["score"] = 50.0
-            top_zones = agg.sort_values("score", ascending=False).head(15)
-            zones_vuln["zones"] = [{
-                "zone": str(r["area_desc"]),
-                "score": float(r["score"]),
-                "volume": int(r["volume"]),
-                "sev_mean": round(float(r["sev_mean"]), 2),
-                "p90_delay": round(float(r["p90_delay"]), 1),
-            } for _, r in top_zones.iterrows()]
-
-        _cache_set(event, year, "zones-vulnerability", zones_vuln)
-        _progress()
-
-        # =====================================================================
-        # 19) Effectifs cross
-        # =====================================================================
-        effectifs_cross = {"zones": [], "alerts": [], "available": False}
-        try:
-            event_slug = event.lower().replace(" ", "").replace("24h", "24h")
-            # Try different slug patterns
-            slug_map = {
-                "24H AUTOS": "24hautos", "24H MOTOS": "24hmotos", "24H CAMIONS": "24hcamions",
-                "GPF": "gpf", "GP EXPLORER": "gpexplorer", "LE MANS CLASSIC": "lemansclassic",
-                "SUPERBIKE": "superbike", "CONGRES SDIS": "congressdis",
-            }
-            slug = slug_map.get(event, event.lower().replace(" ", ""))
-            cal_name = f"calendrier_{year}_{slug}"
-            cal_col = _db[cal_name]
-            cal_count = cal_col.count_documents({})
-            if cal_count > 0:
-                effectifs_cross["available"] = True
-                cal_docs = list(cal_col.find({}))
-                # Aggregate by zone and half-hour slot
-                zone_slots = {}
-                for cdoc in cal_docs:
-                    zone = cdoc.get("zone") or "Inconnu"
-                    stype = cdoc.get("accueil_surete", "S")
-                    for dp in (cdoc.get("donnees_presences") or []):
-                        date = dp.get("date", "")
-                        for ph in (dp.get("plages_horaires") or []):
-                            nb = ph.get("nombre_personnes", 0)
-                            if nb > 0:
-                                key = (zone, date, ph.get("heure_debut", ""))
-                                if key not in zone_slots:
-                                    zone_slots[key] = {"agents_secu": 0, "agents_accueil": 0}
-                                if stype == "S":
-                                    zone_slots[key]["agents_secu"] += nb
-                                else:
-                                    zone_slots[key]["agents_accueil"] += nb
-
-                # Cross with incidents
-                zone_mapping = {}
-                for z in set(k[0] for k in zone_slots):
-                    zu = z.upper()
-                    zone_mapping[zu] = zu
-
-                zone_results = []
-                for (zone, date, heure), agents in zone_slots.items():
-                    total_agents = agents["agents_secu"] + agents["agents_accueil"]
-                    if total_agents > 0:
-                        zone_results.append({
-                            "zone": zone, "date": date, "heure": heure,
-                            "agents_secu": agents["agents_secu"],
-                            "agents_accueil": agents["agents_accueil"],
-                            "total_agents": total_agents,
-                        })
-                effectifs_cross["zones"] = zone_results[:500]
-        except Exception as e:
-            logger.warning(f"Effectifs cross failed: {e}")
-        _cache_set(event, year, "effectifs-cross", effectifs_cross)
-        _progress()
-
-        # =====================================================================
-        # ANPR cross (conditional)
-        # =====================================================================
-        anpr_cross = {"available": False, "matches": []}
-        try:
-            plates_in_pcorg = set()
-            for pl_list in df["extracted_plates"].dropna():
-                if isinstance(pl_list, list):
-                    plates_in_pcorg.update(pl_list)
-            if plates_in_pcorg and _db["hik_anpr"].count_documents({}) > 0:
-                anpr_cross["available"] = True
-                matched = list(_db["hik_anpr"].find(
-                    {"license_plate": {"$in": list(plates_in_pcorg)}},
-                    {"license_plate": 1, "event_dt": 1, "camera_path": 1, "_id": 0},
-                ).limit(200))
-                anpr_cross["matches"] = [{
-                    "plate": m.get("license_plate", ""),
-                    "dt": str(m.get("event_dt", "")),
-                    "camera": m.get("camera_path", ""),
-                } for m in matched]
-        except Exception as e:
-            logger.warning(f"ANPR cross failed: {e}")
-        _cache_set(event, year, "anpr-cross", anpr_cross)
-        _progress()
-
-        # =====================================================================
-        # 20) Network graph (operator-zone-service relationships)
-        # =====================================================================
-        network = {"nodes": [], "links": []}
-        try:
-            node_map = {}
-            link_map = {}
-
-            def _add_node(name, ntype):
-                if name and name != "Inconnu" and name not in node_map:
-                    node_map[name] = {"id": name, "type": ntype, "weight": 0}
-
-            def _add_link(src, tgt, w=1):
-                if src and tgt and src != "Inconnu" and tgt != "Inconnu" and src != tgt:
-                    key = (src, tgt) if src < tgt else (tgt, src)
-                    link_map[key] = link_map.get(key, 0) + w
-
-            # Top operators (creators)
-            top_op_names = df["operator_create"].value_counts().head(12).index.tolist()
-            for op in top_op_names:
-                _add_node(op, "operator")
-
-            # Top zones
-            top_zone_names = df["area_desc"].value_counts().head(12).index.tolist()
-            for z in top_zone_names:
-                _add_node(z.split("/")[-1].strip() if "/" in z else z, "zone")
-
-            # Top services
-            top_svc_names = svc_known["service"].value_counts().head(10).index.tolist() if not svc_known.empty else []
-            for s in top_svc_names:
-                _add_node(s, "service")
-
-            # Build links: operator -> zone
-            for _, row in df.iterrows():
-                op = row.get("operator_create")
-                zone = row.get("area_desc")
-                if op in top_op_names and zone in top_zone_names:
-                    zone_short = zone.split("/")[-1].strip() if "/" in zone else zone
-                    _add_link(op, zone_short)
-                    if op in node_map:
-                        node_map[op]["weight"] += 1
-
-            # Build links: zone -> service
-            for _, row in df.iterrows():
-                zone = row.get("area_desc")
-                svcs = row.get("services_list") or []
-                if zone in top_zone_names and svcs:
-                    zone_short = zone.split("/")[-1].strip() if "/" in zone else zone
-                    for svc in svcs:
-                        svc = clean_service_label(svc)
-                        if svc in top_svc_names:
-                            _add_link(zone_short, svc)
-
-            network["nodes"] = list(node_map.values())
-            network["links"] = [{"source": k[0], "target": k[1], "value": v}
-                                for k, v in sorted(link_map.items(), key=lambda x: -x[1])[:80]]
-        except Exception as e:
-            logger.warning(f"Network graph failed: {e}")
-        _cache_set(event, year, "network", network)
-
-        _compute_state = {"status": "done", "progress": 100, "event": event, "year": year, "error": None}
-
+                state["timings"]["delta"] = round((time.perf_counter() - t_delta) * 1000)
+                given = {
+                    "docs": None,
+                    "frame": {"df": retained.df, "dft": retained.dft},
+                    "interv_frame": retained.interv,
+                }
+                agg = retained.aggregates
+                for name in _INCR_MODULES:
+                    t_mod = time.perf_counter()
+                    if name == "temporal":
+                        value = agg.temporal(retained.df, retained.dft)
+                    else:
+                        value = getattr(agg, name)()
+                    given[name] = value
+                    _done(_TASKS_BY_NAME[name], value, time.perf_counter() - t_mod)
+        state["mode"] = "incremental" if retained is not None else "full"
+
+        results = _run_tasks(job, _TASKS, _done, given)
+        if retained is None:
+            retained = _Retained(results["frame"]["df"], results["frame"]["dft"],
+                                 results["interv_frame"], cursor)
+        retained.cursor = cursor
+        _retain(key, retained)
+        state.update({"status": "done", "progress": 100})
+    except _NoDocuments as e:
+        _retained.pop(key, None)
+        state.update({"status": "error", "progress": 0, "error": str(e)})
     except Exception as e:
+        _retained.pop(key, None)
         logger.exception(f"Compute failed for {event}/{year}")
-        _compute_state = {"status": "error", "progress": 0, "event": event, "year": year, "error": str(e)}
+        state.update({"status": "error", "progress": 0, "error": str(e)})
+    finally:
+        state["duration_ms"] = round((time.perf_counter() - t0) * 1000)
 
 
 def _norm_col(s):
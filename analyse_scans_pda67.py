@@ -63,23 +63,19 @@ def collecter_transactions(sock, heures, max_tx, filtre_cp):
             print(f"  Page {page}: pas de reponse.")
             break
 
-        not_complete, txs, max_txid = parse_transactions(resp)
+        # full=True : le resume et le JSON lisent le document complet
+        not_complete, txs, max_txid = parse_transactions(resp, full=True)
         nb = len(txs)
 
         # Filtrer par checkpoint si demande
         if filtre_cp:
-            filtrees = []
-            for tx in txs:
-                cp = tx.get("checkpoint")
-                if cp:
-                    cp_name = cp.get("Name") or cp.get("name") or ""
-                    if filtre_cp.lower() in cp_name.lower():
-                        filtrees.append(tx)
+            filtrees = [tx.full for tx in txs
+                        if filtre_cp.lower() in (tx.checkpoint_name or "").lower()]
             print(f"  Page {page:03d}: {nb} transactions, {len(filtrees)} matchent '{filtre_cp}' | NotComplete={int(not_complete)}")
             toutes.extend(filtrees)
         else:
             print(f"  Page {page:03d}: {nb} transactions | NotComplete={int(not_complete)}")
-            toutes.extend(txs)
+            toutes.extend(tx.full for tx in txs)
 
         if len(toutes) >= max_tx:
             print(f"  Atteint {len(toutes)} transactions, arret.")
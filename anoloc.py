@@ -25,6 +25,8 @@ import requests
 import string
 import unicodedata
 
+import gps_history
+
 anoloc_bp = Blueprint("anoloc", __name__)
 
 ANOLOC_API_BASE_DEFAULT = "https://app.lemans.anoloc.io/api/v3"
@@ -264,8 +266,15 @@ def anoloc_live():
     if not config or not config.get("enabled"):
         return jsonify({"groups": {}, "enabled": False})
 
-    visible_groups = _get_user_visible_groups(config)
+    groups = build_live_groups(db, config, _get_user_visible_groups(config),
+                               request.args.get("event"), request.args.get("year"))
+    return jsonify({"groups": groups, "enabled": True})
 
+
+def build_live_groups(db, config, visible_groups, event, year):
+    """Groupes de balises (et tablettes Field) de /anoloc/live, sans Flask :
+    partage avec le topic live_push "anoloc", qui les construit une fois pour
+    tous les ecrans (visible_groups=None) et filtre par abonne ensuite."""
     # Lire anoloc_latest (positions connues)
     latest_docs = {doc["_id"]: doc for doc in db["anoloc_latest"].find()}
 
@@ -294,6 +303,7 @@ def anoloc_live():
             continue
 
         groups[out_key] = {
+            "group_id": grp_id,
             "label": grp_cfg.get("label", grp_id),
             "icon": grp_cfg.get("icon", "location_on"),
             "color": grp_cfg.get("color", "#6366f1"),
@@ -355,8 +365,6 @@ def anoloc_live():
                 })
 
     # Fusion des tablettes Field filtrees par event/year (rendering mixte)
-    event = request.args.get("event")
-    year = request.args.get("year")
     tablets_by_group = _get_field_tablets_by_group(db, event, year)
     for gid, tablets in tablets_by_group.items():
         if gid not in groups:
@@ -364,13 +372,29 @@ def anoloc_live():
         for t in tablets:
             groups[gid]["devices"].append(_tablet_to_device(t))
 
-    return jsonify({"groups": groups, "enabled": True})
+    return groups
+
+
+def _parse_iso_utc(value):
+    """Date ISO 8601 (avec ou sans Z) en datetime UTC conscient, ou None."""
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
 
 
 @anoloc_bp.route("/anoloc/trail")
 def anoloc_trail():
-    """Retourne l'historique des positions d'un device (balise ou tablette).
-    Params: device_id (requis), minutes (defaut 60, max 1440 = 24h)."""
+    """Retourne la trace simplifiee d'un device (balise ou tablette).
+    Params: device_id (requis), minutes (defaut 60, max 1440 = 24h), ou
+    from/to (ISO 8601, rejeu d'une fenetre passee de 24h au plus) ;
+    max_points (defaut 400, max 5000) et zoom (niveau de la carte : la
+    tolerance de simplification vaut alors un pixel)."""
     device_id = request.args.get("device_id", "").strip()
     if not device_id:
         return jsonify({"ok": False, "error": "missing_device_id"}), 400
@@ -380,30 +404,43 @@ def anoloc_trail():
     except (TypeError, ValueError):
         minutes = 60
     minutes = max(5, min(minutes, 1440))
+    try:
+        max_points = int(request.args.get("max_points", gps_history.DEFAULT_MAX_POINTS))
+    except (TypeError, ValueError):
+        max_points = gps_history.DEFAULT_MAX_POINTS
+    try:
+        zoom = request.args.get("zoom")
+        zoom = max(0, min(float(zoom), 24)) if zoom not in (None, "") else None
+    except (TypeError, ValueError):
+        zoom = None
+
+    until = _parse_iso_utc(request.args.get("to"))
+    since = _parse_iso_utc(request.args.get("from"))
+    if since is not None:
+        # Rejeu : sans `to` valide, la fenetre dure `minutes` ; jamais plus de 24h.
+        if until is None or until <= since:
+            until = since + timedelta(minutes=minutes)
+        until = min(until, since + timedelta(hours=24))
+        minutes = int((until - since).total_seconds() // 60)
+    else:
+        until = None
+        since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
 
     db = _get_mongo_db()
-    since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-
-    cursor = db["anoloc_positions"].find(
-        {"device_id": device_id, "collected_at": {"$gte": since}},
-        {"lat": 1, "lng": 1, "speed": 1, "collected_at": 1, "_id": 0},
-    ).sort("collected_at", 1)
-
+    raw, raw_count = gps_history.trail(db, device_id, since, until,
+                                      max_points=max_points, zoom=zoom)
     points = []
-    for doc in cursor:
-        lat = doc.get("lat")
-        lng = doc.get("lng")
-        if lat is None or lng is None:
-            continue
+    for doc in raw:
         ts = doc.get("collected_at")
         points.append({
-            "lat": lat,
-            "lng": lng,
+            "lat": doc["lat"],
+            "lng": doc["lng"],
             "speed": doc.get("speed", 0),
             "ts": ts.isoformat() if isinstance(ts, datetime) else str(ts or ""),
         })
 
-    return jsonify({"ok": True, "device_id": device_id, "minutes": minutes, "points": points})
+    return jsonify({"ok": True, "device_id": device_id, "minutes": minutes,
+                    "points": points, "raw_count": raw_count})
 
 
 @anoloc_bp.route("/anoloc/vehicles-by-category")
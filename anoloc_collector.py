@@ -2,8 +2,17 @@
 """
 anoloc_collector.py - Collecteur autonome de positions GPS Anoloc.
 
-Lance par tache planifiee Windows toutes les minutes.
-Fait 2 collectes espacees de 30 secondes puis s'arrete.
+Deux modes :
+  - tache planifiee Windows toutes les minutes : 2 collectes espacees de
+    30 secondes puis arret ;
+  - resident (--daemon) : une collecte toutes les 30 secondes sans fin, avec
+    une session HTTP et un token Anoloc gardes d'un cycle a l'autre, et la
+    config relue toutes les CONFIG_REFRESH_S.
+
+Chaque cycle ecrit en deux allers-retours Mongo (un insert_many dans
+anoloc_positions, un bulk_write non ordonne dans anoloc_latest) et saute les
+balises qui n'ont ni bouge ni change d'etat depuis leur derniere ecriture.
+Sa latence (appel /live, ecriture) est consignee dans anoloc_logs.
 
 Prerequis:
   - Document anoloc_config {_id: "global", enabled: true, ...} dans MongoDB
@@ -11,6 +20,7 @@ Prerequis:
 
 Usage:
     python anoloc_collector.py
+    python anoloc_collector.py --daemon
 """
 
 import os
@@ -34,7 +44,9 @@ def now_local():
     return datetime.now(TZ_LOCAL)
 
 import requests
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
+
+import gps_history
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -46,9 +58,20 @@ DB_NAME = "titan" if _TITAN_ENV in {"prod", "production"} else "titan_dev"
 ANOLOC_API_BASE_DEFAULT = "https://app.lemans.anoloc.io/api/v3"
 USER_AGENT = "COCKPIT-TITAN/1.0"
 
-COLLECT_INTERVAL = 30       # secondes entre les 2 collectes
+COLLECT_INTERVAL = 30       # secondes entre 2 collectes
 DEVICES_CACHE_TTL = 300     # cache devices local 5 min
-NB_CYCLES = 2               # nombre de collectes par execution
+NB_CYCLES = 2               # nombre de collectes par execution (mode tache planifiee)
+CONFIG_REFRESH_S = 60       # relecture config + live-control (mode resident)
+# Une balise inchangee est tout de meme reecrite au bout de ce delai : sa
+# trace garde un point toutes les 5 min, et collected_at / sent_at /
+# batterie ne vieillissent pas plus que ca dans anoloc_latest.
+LATEST_REFRESH_S = 300
+
+DAEMON_MODE = "--daemon" in sys.argv
+
+# Token Anoloc garde entre deux lancements de la tache planifiee : sans lui,
+# chaque minute commence par un /login.
+SESSION_DOC_ID = "collector-session"
 
 logging.basicConfig(
     level=logging.INFO,
@@ -65,8 +88,6 @@ def _handle_signal(signum, frame):
     log.info("Signal %s recu, arret en cours...", signum)
     _stop = True
 
-signal.signal(signal.SIGINT, _handle_signal)
-signal.signal(signal.SIGTERM, _handle_signal)
 
 # ---------------------------------------------------------------------------
 # MongoDB
@@ -84,10 +105,8 @@ def get_db():
 
 
 def ensure_indexes(db):
-    db["anoloc_positions"].create_index(
-        [("device_id", 1), ("collected_at", -1)]
-    )
-    db["anoloc_positions"].create_index("collected_at")
+    # Historique en time-series avec retention (index device/instant inclus)
+    gps_history.ensure_collection(db)
     db["anoloc_logs"].create_index("ts", expireAfterSeconds=7 * 24 * 3600)  # TTL 7 jours
 
 
@@ -140,15 +159,25 @@ def set_collecting_status(db, running, error=None):
 _token = None
 _devices_cache = None
 _devices_cache_ts = 0
+_http = None
 api_base = ANOLOC_API_BASE_DEFAULT
 
 
+def http_session():
+    """Session HTTP partagee : la connexion TLS a Anoloc est reutilisee d'un
+    appel et d'un cycle a l'autre au lieu d'etre renegociee a chaque GET."""
+    global _http
+    if _http is None:
+        _http = requests.Session()
+        _http.headers["User-Agent"] = USER_AGENT
+    return _http
+
+
 def anoloc_login(login, password):
     """Authentification Anoloc, retourne le Bearer token."""
-    resp = requests.post(
+    resp = http_session().post(
         f"{api_base}/login",
         json={"login": login, "password": password, "remember_me": True},
-        headers={"User-Agent": USER_AGENT},
         timeout=15,
     )
     resp.raise_for_status()
@@ -158,18 +187,46 @@ def anoloc_login(login, password):
 
 def anoloc_get(endpoint, token):
     """GET generique vers l'API Anoloc."""
-    resp = requests.get(
+    resp = http_session().get(
         f"{api_base}{endpoint}",
-        headers={
-            "Authorization": f"Bearer {token}",
-            "User-Agent": USER_AGENT,
-        },
+        headers={"Authorization": f"Bearer {token}"},
         timeout=15,
     )
     resp.raise_for_status()
     return resp.json()
 
 
+def load_cached_token(db, login):
+    """Token du lancement precedent, s'il a ete obtenu pour ce login."""
+    doc = db["anoloc_config"].find_one({"_id": SESSION_DOC_ID}) or {}
+    if doc.get("login") == login and doc.get("api_base") == api_base:
+        return doc.get("token")
+    return None
+
+
+def save_token(db, login, token):
+    db["anoloc_config"].update_one(
+        {"_id": SESSION_DOC_ID},
+        {"$set": {"login": login, "api_base": api_base, "token": token,
+                  "obtained_at": now_local()}},
+        upsert=True,
+    )
+
+
+def authenticate(db, login, password, force=False):
+    """Token valide : celui en cache, sinon un /login (memorise en base).
+
+    `force` apres un 401 : le token en cache a expire ou a ete revoque.
+    """
+    if not force:
+        token = load_cached_token(db, login)
+        if token:
+            return token
+    token = anoloc_login(login, password)
+    save_token(db, login, token)
+    return token
+
+
 def get_devices(token):
     """Retourne les devices Anoloc avec cache local."""
     global _devices_cache, _devices_cache_ts
@@ -242,12 +299,75 @@ def db_log(db, level, message, details=None):
         pass
 
 
-def collect_once(token, device_group_map, devices_info, db, logging_enabled=False):
-    """Une iteration de collecte: GET /live, insert positions, upsert latest."""
+def _as_aware(dt):
+    """pymongo (client non tz_aware) relit des datetimes naifs en UTC."""
+    if isinstance(dt, datetime) and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _signature(doc):
+    """Ce qui fait qu'une balise a << bouge ou change d'etat >>.
+
+    last_real_at en fait partie : l'affichage en ligne / GPS de anoloc.py se
+    deduit de son age. Une balise immobile qui envoie encore de vraies frames
+    doit donc etre reecrite, sinon elle passerait hors ligne a tort au bout de
+    30 minutes.
+    """
+    return (doc.get("lat"), doc.get("lng"), doc.get("status"),
+            _as_aware(doc.get("last_real_at")), doc.get("beacon_group"))
+
+
+def load_seen(db):
+    """Signatures connues, relues une fois depuis anoloc_latest : meme une
+    tache planifiee qui ne vit qu'une minute saute ce qui n'a pas change."""
+    seen = {}
+    for doc in db["anoloc_latest"].find({}, {"lat": 1, "lng": 1, "status": 1,
+                                             "last_real_at": 1, "beacon_group": 1,
+                                             "collected_at": 1}):
+        seen[doc["_id"]] = (_signature(doc), _as_aware(doc.get("collected_at")))
+    return seen
+
+
+def _is_unchanged(seen, device_id, doc, now):
+    connu = seen.get(device_id)
+    if connu is None:
+        return False
+    signature, written_at = connu
+    if signature != _signature(doc) or written_at is None:
+        return False
+    return (now - written_at).total_seconds() < LATEST_REFRESH_S
+
+
+def write_cycle(db, positions, latest_ops):
+    """Un insert_many et un bulk_write non ordonne : deux allers-retours
+    Mongo par cycle, quel que soit le nombre de balises. Non ordonnes, une
+    ecriture en echec n'empeche pas les autres."""
+    if positions:
+        db["anoloc_positions"].insert_many(positions, ordered=False)
+    if latest_ops:
+        db["anoloc_latest"].bulk_write(latest_ops, ordered=False)
+
+
+def collect_once(token, device_group_map, devices_info, db, logging_enabled=False, seen=None):
+    """Une iteration de collecte: GET /live, insert positions, upsert latest.
+
+    `seen` ({device_id: (signature, ecrit_le)}) est tenu a jour ici : une
+    balise dont la signature n'a pas change depuis moins de LATEST_REFRESH_S
+    n'est pas reecrite. Rend les compteurs et latences du cycle.
+    """
+    if seen is None:
+        seen = {}
+    t0 = time.perf_counter()
     now = now_local()
     live_data = get_live(token)
+    t_fetch = time.perf_counter()
 
     inserted = 0
+    skipped = 0
+    positions = []
+    latest_ops = []
+    written = {}
     device_details = []
 
     for device_id, frame in live_data.items():
@@ -335,22 +455,22 @@ def collect_once(token, device_group_map, devices_info, db, logging_enabled=Fals
             "collected_at": now,
         }
 
-        # Historique complet
-        db["anoloc_positions"].insert_one(doc.copy())
-
-        # Derniere position (upsert)
-        latest = dict(doc)
-        latest["imei"] = dev_info.get("imei", "")
-        latest["icon"] = grp.get("icon", "location_on")
-        latest["color"] = grp.get("color", "#6366f1")
-        latest["group_label"] = grp.get("label", "")
-
-        db["anoloc_latest"].replace_one(
-            {"_id": device_id},
-            {**latest, "_id": device_id},
-            upsert=True,
-        )
-        inserted += 1
+        unchanged = _is_unchanged(seen, device_id, doc, now)
+        if unchanged:
+            skipped += 1
+        else:
+            # Historique complet
+            positions.append(doc.copy())
+
+            # Derniere position (upsert)
+            latest = dict(doc)
+            latest["imei"] = dev_info.get("imei", "")
+            latest["icon"] = grp.get("icon", "location_on")
+            latest["color"] = grp.get("color", "#6366f1")
+            latest["group_label"] = grp.get("label", "")
+            latest_ops.append(ReplaceOne({"_id": device_id}, {**latest, "_id": device_id}, upsert=True))
+            written[device_id] = (_signature(doc), now)
+            inserted += 1
 
         # Determiner le vrai statut
         anoloc_status = frame.get("status", "offline")
@@ -377,49 +497,67 @@ def collect_once(token, device_group_map, devices_info, db, logging_enabled=Fals
                 "gps": "OK" if has_gps else "NON",
                 "speed": frame.get("speed", 0) if has_gps else "-",
                 "battery": battery_pct,
-                "collected": True,
+                "collected": not unchanged,
                 "online": really_online,
                 "last_real": fmt_local(last_real) if last_real else "-",
                 "sent_at": fmt_local(sent_at) if sent_at else "-",
             })
 
-    # Log du cycle
+    write_cycle(db, positions, latest_ops)
+    # Seulement une fois l'ecriture passee : une balise perdue sur une
+    # erreur Mongo sera reecrite au cycle suivant.
+    seen.update(written)
+    t_write = time.perf_counter()
+
+    stats = {
+        "positions": inserted,
+        "skipped": skipped,
+        "fetch_ms": round((t_fetch - t0) * 1000),
+        "write_ms": round((t_write - t_fetch) * 1000),
+        "total_ms": round((t_write - t0) * 1000),
+    }
+
+    # Log du cycle : la latence toujours, le detail par balise si le logging
+    # detaille est active.
+    message = (f"Cycle: {inserted} positions, {skipped} inchangees, "
+               f"API {stats['fetch_ms']} ms, Mongo {stats['write_ms']} ms")
+    details = {"cycle": stats}
     if logging_enabled:
         online = len([d for d in device_details if d.get("online")])
         offline = len([d for d in device_details if not d.get("online")])
         gps_ok = len([d for d in device_details if d.get("gps") == "OK"])
-        db_log(db, "info",
-               f"Collecte: {online} en ligne, {offline} hors ligne, {gps_ok} avec GPS, {inserted} positions",
-               {"devices": device_details})
+        message = (f"Collecte: {online} en ligne, {offline} hors ligne, {gps_ok} avec GPS, "
+                   f"{inserted} positions, {skipped} inchangees, "
+                   f"API {stats['fetch_ms']} ms, Mongo {stats['write_ms']} ms")
+        details["devices"] = device_details
+    db_log(db, "info", message, details)
 
-    return inserted
+    return stats
 
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def main():
-    global _token, api_base
+def load_settings(db):
+    """Lit live-control et la config globale.
 
-    db = get_db()
-    ensure_indexes(db)
+    Rend (settings, None) ou (None, raison) ; une raison `None` dans le
+    second cas signifie que la collecte est simplement desactivee.
+    """
+    global api_base
 
-    # --- Verifier le live-control ---
     if not is_collecting_enabled(db):
         log.info("Collecte desactivee (live-control.collecting = false)")
-        sys.exit(0)
+        return None, None
 
-    # --- Lire la config ---
     config = db["anoloc_config"].find_one({"_id": "global"})
     if not config:
         log.warning("Pas de configuration Anoloc trouvee (anoloc_config.global)")
-        set_collecting_status(db, False, error="Config absente")
-        sys.exit(0)
+        return None, "Config absente"
 
     if not config.get("enabled", False):
         log.info("Collecteur Anoloc desactive dans la config globale")
-        set_collecting_status(db, False, error="Config desactivee")
-        sys.exit(0)
+        return None, "Config desactivee"
 
     # URL de base
     api_base = config.get("api_base", "").rstrip("/") or ANOLOC_API_BASE_DEFAULT
@@ -428,25 +566,75 @@ def main():
     password = config.get("password", "")
     if not login or not password:
         log.error("Credentials Anoloc manquants dans la config")
-        set_collecting_status(db, False, error="Credentials manquants")
-        sys.exit(0)
+        return None, "Credentials manquants"
 
     # Construire le mapping device -> groupe
     device_group_map = build_device_to_group_map(config)
     if not device_group_map:
         log.warning("Aucun device configure dans les beacon_groups actifs")
-        set_collecting_status(db, False, error="Aucun device configure")
+        return None, "Aucun device configure"
+
+    nb_groups = len([g for g in config.get("beacon_groups", []) if g.get("enabled", True)])
+    return {
+        "login": login,
+        "password": password,
+        "device_group_map": device_group_map,
+        "nb_groups": nb_groups,
+        "logging": is_logging_enabled(db),
+    }, None
+
+
+def run_cycle(db, settings, seen):
+    """Une collecte, avec re-authentification sur 401.
+
+    Rend les stats du cycle, ou None si le cycle a echoue (deja logue).
+    """
+    global _token
+    try:
+        devices_info = get_devices(_token)
+        return collect_once(_token, settings["device_group_map"], devices_info, db,
+                            logging_enabled=settings["logging"], seen=seen)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 401:
+            log.warning("Token expire, re-authentification...")
+            try:
+                _token = authenticate(db, settings["login"], settings["password"], force=True)
+                log.info("Re-authentification reussie")
+            except Exception as e2:
+                log.error("Re-auth echouee: %s", e2)
+                set_collecting_status(db, False, error=f"Re-auth echouee: {e2}")
+                raise
+        else:
+            log.error("Erreur API Anoloc: %s", e)
+    except Exception as e:
+        log.error("Erreur collecte: %s", e)
+    return None
+
+
+def _sleep_until(deadline):
+    while not _stop and time.monotonic() < deadline:
+        time.sleep(min(1, max(0, deadline - time.monotonic())))
+
+
+def main():
+    global _token
+
+    db = get_db()
+    ensure_indexes(db)
+
+    # --- Verifier le live-control et lire la config ---
+    settings, error = load_settings(db)
+    if settings is None:
+        if error:
+            set_collecting_status(db, False, error=error)
         sys.exit(0)
 
-    log.info(
-        "Demarrage: %d devices dans %d groupes actifs",
-        len(device_group_map),
-        len([g for g in config.get("beacon_groups", []) if g.get("enabled", True)]),
-    )
+    log.info("Demarrage: %d devices dans %d groupes actifs",
+             len(settings["device_group_map"]), settings["nb_groups"])
 
-    # Authentification
+    # Authentification (token du lancement precedent si possible)
     try:
-        _token = anoloc_login(login, password)
+        _token = authenticate(db, settings["login"], settings["password"])
         log.info("Authentification Anoloc reussie")
     except Exception as e:
         log.error("Echec authentification Anoloc: %s", e)
@@ -455,39 +643,26 @@ def main():
 
     # Signaler le demarrage
     set_collecting_status(db, True)
-    _logging = is_logging_enabled(db)
-    if _logging:
-        db_log(db, "info", f"Demarrage collecteur: {len(device_group_map)} devices, {len([g for g in config.get('beacon_groups', []) if g.get('enabled', True)])} groupes")
+    if settings["logging"]:
+        db_log(db, "info", f"Demarrage collecteur: {len(settings['device_group_map'])} devices, {settings['nb_groups']} groupes")
 
     # --- 2 collectes espacees de 30 secondes ---
+    seen = load_seen(db)
     for cycle in range(1, NB_CYCLES + 1):
         if _stop:
             break
 
         try:
-            devices_info = get_devices(_token)
-            count = collect_once(_token, device_group_map, devices_info, db, logging_enabled=_logging)
-            log.info("Cycle %d/%d: %d positions collectees", cycle, NB_CYCLES, count)
-        except requests.exceptions.HTTPError as e:
-            if e.response is not None and e.response.status_code == 401:
-                log.warning("Token expire, re-authentification...")
-                try:
-                    _token = anoloc_login(login, password)
-                    log.info("Re-authentification reussie")
-                except Exception as e2:
-                    log.error("Re-auth echouee: %s", e2)
-                    set_collecting_status(db, False, error=f"Re-auth echouee: {e2}")
-                    break
-            else:
-                log.error("Erreur API Anoloc: %s", e)
-        except Exception as e:
-            log.error("Erreur collecte: %s", e)
+            stats = run_cycle(db, settings, seen)
+        except Exception:
+            break
+        if stats is not None:
+            log.info("Cycle %d/%d: %d positions collectees, %d inchangees (%d ms)",
+                     cycle, NB_CYCLES, stats["positions"], stats["skipped"], stats["total_ms"])
 
         # Attendre 30s avant le prochain cycle (sauf apres le dernier)
         if cycle < NB_CYCLES and not _stop:
-            wait_end = time.time() + COLLECT_INTERVAL
-            while not _stop and time.time() < wait_end:
-                time.sleep(1)
+            _sleep_until(time.monotonic() + COLLECT_INTERVAL)
 
     # Mettre a jour le statut
     set_collecting_status(db, False)
@@ -497,5 +672,88 @@ def main():
         _client.close()
 
 
+def run_resident():
+    """Collecteur resident : une collecte toutes les COLLECT_INTERVAL.
+
+    Session HTTP, token, cache devices et signatures des balises survivent
+    d'un cycle a l'autre. La config est relue toutes les CONFIG_REFRESH_S :
+    une desactivation depuis l'admin met le collecteur en veille au lieu de
+    l'arreter, un changement de login force un nouveau token. Le rythme est
+    tenu sur l'horloge monotone : un cycle lent ne decale pas les suivants.
+    """
+    global _token
+
+    db = get_db()
+    ensure_indexes(db)
+    log.info("Collecteur resident: collecte toutes les %ds, config relue toutes les %ds",
+             COLLECT_INTERVAL, CONFIG_REFRESH_S)
+
+    settings = None
+    login_courant = None
+    seen = load_seen(db)
+    t_config = float("-inf")
+    prochain = time.monotonic()
+
+    try:
+        while not _stop:
+            maintenant = time.monotonic()
+            if settings is None or maintenant - t_config >= CONFIG_REFRESH_S:
+                t_config = maintenant
+                try:
+                    settings, error = load_settings(db)
+                except Exception as e:
+                    log.error("Lecture config impossible: %s", e)
+                    settings, error = None, None
+                if settings is None:
+                    if error:
+                        set_collecting_status(db, False, error=error)
+                    _sleep_until(maintenant + CONFIG_REFRESH_S)
+                    prochain = time.monotonic()
+                    continue
+                if settings["login"] != login_courant or _token is None:
+                    try:
+                        _token = authenticate(db, settings["login"], settings["password"])
+                        login_courant = settings["login"]
+                        log.info("Authentification Anoloc reussie")
+                    except Exception as e:
+                        log.error("Echec authentification Anoloc: %s", e)
+                        set_collecting_status(db, False, error=f"Auth echouee: {e}")
+                        settings = None
+                        _sleep_until(maintenant + CONFIG_REFRESH_S)
+                        prochain = time.monotonic()
+                        continue
+
+            try:
+                stats = run_cycle(db, settings, seen)
+            except Exception:
+                # Re-auth echouee : on retentera a la prochaine relecture.
+                settings = None
+                _token = None
+                stats = None
+            if stats is not None:
+                log.info("Cycle: %d positions, %d inchangees (API %d ms, Mongo %d ms)",
+                         stats["positions"], stats["skipped"], stats["fetch_ms"], stats["write_ms"])
+                try:
+                    set_collecting_status(db, True)
+                except Exception as e:
+                    log.error("Statut non ecrit: %s", e)
+
+            prochain = max(prochain + COLLECT_INTERVAL, time.monotonic())
+            _sleep_until(prochain)
+    finally:
+        try:
+            set_collecting_status(db, False)
+        except Exception:
+            pass
+        log.info("Collecteur resident arrete")
+        if _client:
+            _client.close()
+
+
 if __name__ == "__main__":
-    main()
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    if DAEMON_MODE:
+        run_resident()
+    else:
+        main()
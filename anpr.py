@@ -6,7 +6,12 @@ from datetime import datetime, timezone, timedelta
 from flask import Blueprint, jsonify, request, render_template, Response, send_file, abort
 from pymongo import MongoClient, DESCENDING, ASCENDING
 from bson.objectid import ObjectId
-import gridfs
+
+import anpr_rollup
+import image_service
+import onsite_counter
+import plate_crossref
+import plate_index
 
 anpr_bp = Blueprint("anpr", __name__)
 logger = logging.getLogger(__name__)
@@ -291,7 +296,6 @@ COLOR_HEX = {
 # ---------------------------------------------------------------------------
 _db = None
 _col_anpr = None
-_fs = None
 _col_camera_config = None
 _col_site_counter = None
 _col_vision_imm = None
@@ -300,7 +304,7 @@ _col_vision_cfg = None
 
 
 def _ensure_db():
-    global _db, _col_anpr, _fs, _col_camera_config, _col_site_counter
+    global _db, _col_anpr, _col_camera_config, _col_site_counter
     global _col_vision_imm, _col_vision_bl, _col_vision_cfg
     if _db is not None:
         return
@@ -311,7 +315,6 @@ def _ensure_db():
     dev_mode = os.getenv("TITAN_ENV", "dev") != "prod"
     _db = client["titan_dev" if dev_mode else "titan"]
     _col_anpr = _db["hik_anpr"]
-    _fs = gridfs.GridFS(_db, collection="hik_images")
     _col_camera_config = _db["anpr_camera_config"]
     _col_site_counter = _db["anpr_site_counter"]
     _col_vision_imm = _db["vision_immatriculations"]
@@ -323,6 +326,9 @@ def _ensure_db():
     _col_anpr.create_index([("license_plate", 1)])
     _col_anpr.create_index([("camera_path", 1), ("event_dt", DESCENDING)])
     _col_camera_config.create_index("camera_path", unique=True)
+    plate_index.ensure_indexes(_db)
+    plate_crossref.ensure_indexes(_db)
+    anpr_rollup.ensure_indexes(_db)
 
 
 def _brand(logo_id):
@@ -336,13 +342,7 @@ def _get_cam_configs():
 
 def _resolve_direction(raw_direction, camera_path, cam_configs):
     """Resolve raw forward/reverse into entry/exit using camera config."""
-    cfg = cam_configs.get(camera_path, {})
-    fwd_role = cfg.get("forward_role", "entry")  # default: forward = entry
-    if raw_direction == "forward":
-        return "entry" if fwd_role == "entry" else "exit"
-    elif raw_direction == "reverse":
-        return "exit" if fwd_role == "entry" else "entry"
-    return "unknown"
+    return onsite_counter.resolve_direction(raw_direction, camera_path, cam_configs)
 
 
 def _serialize(doc, cam_configs=None):
@@ -398,10 +398,14 @@ def anpr_search():
     cam_cfgs = _get_cam_configs()
     query = {}
 
-    # Plate search (partial match)
+    # Plate search (partial match, trigram index -- see plate_index)
     plate = request.args.get("plate", "").strip().upper()
-    if plate:
-        query["license_plate"] = {"$regex": plate, "$options": "i"}
+    plate_filter = plate_index.fragment_filter(plate)
+    if plate_filter is None:
+        plate = ""
+    else:
+        # $and : le filtre de direction plus bas pose deja son propre $or
+        query["$and"] = [plate_filter]
 
     # Exclude UNKNOWN plates unless explicitly searching
     if not plate:
@@ -504,17 +508,23 @@ def anpr_search():
     if has_anpr_filter and source_filter == "":
         source_filter = "anpr"
 
-    # For "cross" mode: find plates present in both ANPR and Vision
+    # For "cross" mode: plates present in both ANPR and Vision, read from
+    # the materialised cross-reference (see plate_crossref)
     cross_plates = None
     if source_filter == "cross":
-        # Get all distinct normalized ANPR plates
-        anpr_plates_raw = _col_anpr.distinct("license_plate", query)
-        anpr_norms = set(_normalize_plate(p) for p in anpr_plates_raw if p and p != "UNKNOWN")
-        # Get all Vision normalized plates
-        vision_norms = set(d["plaque_norm"] for d in _col_vision_imm.find({}, {"plaque_norm": 1}) if d.get("plaque_norm"))
-        # Intersection
-        cross_norms = anpr_norms & vision_norms
-        cross_plates = cross_norms
+        cross_plates = plate_crossref.cross_plates(
+            _db, since=(query.get("event_dt") or {}).get("$gte"),
+            until=(query.get("event_dt") or {}).get("$lte"))
+        # The cross-reference only narrows by date: keep the plates the ANPR
+        # filters (plate, camera, direction, colour...) actually match, so
+        # the Vision half honours them too. Only on a real filter -- the
+        # UNKNOWN guard alone is not one -- and scoped to the cross plates
+        # so the lookup stays on the plate_norm index.
+        if (plate or has_anpr_filter) and cross_plates:
+            dq = {k: v for k, v in query.items() if k != "license_plate"}
+            dq["$and"] = list(query.get("$and", [])) + [plate_index.exact_filter(cross_plates)]
+            seen = set(_col_anpr.distinct("plate_norm", dq))
+            cross_plates = [p for p in cross_plates if p in seen]
 
     # Pagination
     page = max(1, int(request.args.get("page", 1)))
@@ -526,10 +536,7 @@ def anpr_search():
     if source_filter not in ("vision",):
         if cross_plates is not None:
             # Only ANPR records matching cross plates
-            if cross_plates:
-                query["license_plate"] = {"$in": [re.compile(n, re.IGNORECASE) for n in cross_plates]}
-            else:
-                query["license_plate"] = {"$in": []}
+            query.setdefault("$and", []).append(plate_index.exact_filter(cross_plates))
         anpr_total = _col_anpr.count_documents(query)
         docs = list(_col_anpr.find(query).sort("event_dt", DESCENDING).limit(500))
         for d in docs:
@@ -543,12 +550,9 @@ def anpr_search():
     if source_filter not in ("anpr",):
         vq = {}
         if plate:
-            vq["plaque_norm"] = {"$regex": _normalize_plate(plate), "$options": "i"}
+            vq.update(plate_index.fragment_filter(plate, "plaque_norm", "plaque_grams", "plaque_norm"))
         if cross_plates is not None:
-            if cross_plates:
-                vq["plaque_norm"] = {"$in": list(cross_plates)}
-            else:
-                vq["plaque_norm"] = {"$in": []}
+            vq["plaque_norm"] = {"$in": cross_plates}
         # Apply date filter on Vision date field (ISO string)
         if date_from:
             vq.setdefault("date", {})
@@ -606,101 +610,39 @@ def anpr_search():
     })
 
 
+def _parse_range():
+    """from / to query params (ISO) as datetimes, None when absent or invalid."""
+    out = []
+    for name in ("from", "to"):
+        raw = request.args.get(name, "").strip()
+        try:
+            out.append(datetime.fromisoformat(raw) if raw else None)
+        except ValueError:
+            out.append(None)
+    return tuple(out)
+
+
 @anpr_bp.route("/api/anpr/stats")
 def anpr_stats():
     """Aggregate statistics for the dashboard."""
     _ensure_db()
 
-    # Base query (exclude unknowns for stats)
-    base_match = {"license_plate": {"$ne": "UNKNOWN"}}
+    since, until = _parse_range()
 
-    date_from = request.args.get("from", "").strip()
-    date_to = request.args.get("to", "").strip()
-    if date_from or date_to:
-        dt_filter = {}
-        if date_from:
-            try:
-                dt_filter["$gte"] = datetime.fromisoformat(date_from)
-            except ValueError:
-                pass
-        if date_to:
-            try:
-                dt_filter["$lte"] = datetime.fromisoformat(date_to)
-            except ValueError:
-                pass
-        if dt_filter:
-            base_match["event_dt"] = dt_filter
-
-    pipeline_total = [{"$match": base_match}, {"$count": "n"}]
-    total_res = list(_col_anpr.aggregate(pipeline_total))
-    total = total_res[0]["n"] if total_res else 0
-
-    pipeline_unique = [
-        {"$match": base_match},
-        {"$group": {"_id": "$license_plate"}},
-        {"$count": "n"},
-    ]
-    unique_res = list(_col_anpr.aggregate(pipeline_unique))
-    unique_plates = unique_res[0]["n"] if unique_res else 0
-
-    # By color
-    pipeline_color = [
-        {"$match": base_match},
-        {"$group": {"_id": "$vehicle_color", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-    ]
-    by_color = {d["_id"]: d["count"] for d in _col_anpr.aggregate(pipeline_color) if d["_id"]}
-
-    # By brand (top 15)
-    pipeline_brand = [
-        {"$match": base_match},
-        {"$group": {"_id": "$vehicle_logo", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-        {"$limit": 15},
-    ]
-    by_brand = [{"brand": _brand(d["_id"]), "count": d["count"]}
-                for d in _col_anpr.aggregate(pipeline_brand)]
-
-    # By type
-    pipeline_type = [
-        {"$match": base_match},
-        {"$group": {"_id": "$vehicle_type", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-    ]
-    by_type = [{"type": d["_id"], "label": VEHICLE_TYPE_LABELS.get(d["_id"], d["_id"]), "count": d["count"]}
-               for d in _col_anpr.aggregate(pipeline_type) if d["_id"]]
-
-    # By camera
-    pipeline_camera = [
-        {"$match": base_match},
-        {"$group": {"_id": "$camera_path", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}},
-    ]
-    by_camera = {d["_id"]: d["count"] for d in _col_anpr.aggregate(pipeline_camera) if d["_id"]}
-
-    # Hourly distribution
-    pipeline_hourly = [
-        {"$match": base_match},
-        {"$group": {"_id": {"$hour": "$event_dt"}, "count": {"$sum": 1}}},
-        {"$sort": {"_id": 1}},
-    ]
-    by_hour = {d["_id"]: d["count"] for d in _col_anpr.aggregate(pipeline_hourly)}
-
-    # Allowlist count
-    pipeline_allow = [
-        {"$match": {**base_match, "vehicle_list_name": "allowList"}},
-        {"$count": "n"},
-    ]
-    allow_res = list(_col_anpr.aggregate(pipeline_allow))
-    allowlist_count = allow_res[0]["n"] if allow_res else 0
-
-    # Avg confidence
-    pipeline_conf = [
-        {"$match": {**base_match, "confidence": {"$gt": 0}}},
-        {"$group": {"_id": None, "avg": {"$avg": "$confidence"}}},
-    ]
-    conf_res = list(_col_anpr.aggregate(pipeline_conf))
-    avg_confidence = round(conf_res[0]["avg"], 1) if conf_res else 0
+    # Hourly rollups + one $facet pass over the raw edges (see anpr_rollup)
+    rows, plates = anpr_rollup.collect(_db, since, until, with_plates=True)
+    stats = anpr_rollup.summarize(rows, plates)
+
+    total = stats["total"]
+    unique_plates = stats["unique_plates"]
+    allowlist_count = stats["allowlist_count"]
+    avg_confidence = stats["avg_confidence"]
+    by_color = {c: n for c, n in stats["by_color"] if c}
+    by_brand = [{"brand": _brand(logo), "count": n} for logo, n in stats["by_logo"][:15]]
+    by_type = [{"type": t, "label": VEHICLE_TYPE_LABELS.get(t, t), "count": n}
+               for t, n in stats["by_type"] if t]
+    by_camera = {c: n for c, n in stats["by_camera"] if c}
+    by_hour = stats["by_hour"]
 
     return jsonify({
         "total": total,
@@ -783,7 +725,7 @@ def anpr_plate_history(plate):
     records = []
 
     # ANPR detections
-    docs = list(_col_anpr.find({"license_plate": plate}).sort("event_dt", DESCENDING).limit(200))
+    docs = list(_col_anpr.find(plate_index.exact_filter([plate])).sort("event_dt", DESCENDING).limit(200))
     for d in docs:
         r = _serialize(d, cam_cfgs)
         r["source"] = "anpr"
@@ -819,39 +761,54 @@ def anpr_plate_history(plate):
     })
 
 
-HIK_IMAGE_DIR = "E:/TITAN/production/hik_images"
+HIK_IMAGE_DIR = image_service.IMAGES_ROOT
+
+
+def _send_image(full_path, width):
+    """Original ou miniature `width` (?w=), ETag fort et cache immutable :
+    un chemin d'image LAPI n'est jamais reecrit."""
+    etag = image_service.file_etag(full_path)
+    thumb = image_service.derivative(HIK_IMAGE_DIR, full_path, width) if width else None
+    if thumb and thumb != full_path:
+        etag = image_service.derivative_etag(full_path, width)
+        full_path = thumb
+    resp = send_file(full_path, mimetype="image/jpeg", etag=etag, conditional=True)
+    resp.headers["Cache-Control"] = image_service.cache_control(public=True)
+    return resp
 
 
 @anpr_bp.route("/api/anpr/image/<path:image_ref>")
 def anpr_image(image_ref):
-    """Sert une image : chemin disque (nouveau) ou ObjectId GridFS (ancien)."""
+    """Sert une image : chemin disque (nouveau) ou ObjectId GridFS (ancien).
+    ?w=160|480 sert une miniature."""
     _ensure_db()
+    width = image_service.parse_width(request.args.get("w"))
 
     # Nouveau format : chemin relatif sur disque
     if "/" in image_ref:
-        safe = os.path.normpath(image_ref)
-        if ".." in safe:
-            abort(400)
-        full_path = os.path.join(HIK_IMAGE_DIR, safe)
-        if not os.path.abspath(full_path).startswith(os.path.abspath(HIK_IMAGE_DIR)):
+        full_path = image_service.resolve(HIK_IMAGE_DIR, image_ref)
+        if full_path is None:
             abort(400)
         if os.path.isfile(full_path):
-            resp = send_file(full_path, mimetype="image/jpeg")
-            resp.headers["Cache-Control"] = "public, max-age=86400"
-            return resp
+            return _send_image(full_path, width)
 
-    # Ancien format : ObjectId GridFS
+    # Ancien format : ObjectId GridFS, deja migre sur disque ou lu par morceaux
     else:
         try:
             oid = ObjectId(image_ref)
-            grid_file = _fs.get(oid)
-            return Response(
-                grid_file.read(),
-                mimetype="image/jpeg",
-                headers={"Cache-Control": "public, max-age=86400"},
-            )
         except Exception:
-            pass
+            oid = None
+        if oid is not None:
+            migrated = os.path.join(HIK_IMAGE_DIR, image_service.migrated_relpath(oid))
+            if os.path.isfile(migrated):
+                return _send_image(migrated, width)
+            grid_file = image_service.gridfs_file(_db, oid)
+            if grid_file is not None:
+                resp = Response(image_service.gridfs_chunks(_db, oid), mimetype="image/jpeg")
+                resp.content_length = grid_file.get("length")
+                resp.set_etag("gridfs-%s" % oid)
+                resp.headers["Cache-Control"] = image_service.cache_control(public=True)
+                return resp.make_conditional(request)
 
     # Fallback : pixel transparent 1x1
     return Response(
@@ -907,6 +864,8 @@ def anpr_cameras_config():
         }},
         upsert=True,
     )
+    # forward_role may have changed: recount the on-site counter from history
+    onsite_counter.rebuild(_db)
     return jsonify({"ok": True})
 
 
@@ -915,126 +874,35 @@ def anpr_flow():
     """Entries vs exits over time (15-min buckets)."""
     _ensure_db()
 
-    base_match = {"license_plate": {"$ne": "UNKNOWN"}}
-    date_from = request.args.get("from", "").strip()
-    date_to = request.args.get("to", "").strip()
-    if date_from:
-        try:
-            base_match.setdefault("event_dt", {})["$gte"] = datetime.fromisoformat(date_from)
-        except ValueError:
-            pass
-    if date_to:
-        try:
-            base_match.setdefault("event_dt", {})["$lte"] = datetime.fromisoformat(date_to)
-        except ValueError:
-            pass
+    since, until = _parse_range()
 
-    # Get camera configs for entry/exit resolution
+    # Same rollups as the stats, direction resolved with the camera config
     configs = {c["camera_path"]: c for c in _col_camera_config.find()}
+    rows, _ = anpr_rollup.collect(_db, since, until)
+    entries, exits = anpr_rollup.flow(rows, configs)
 
-    # Build per-camera direction classification
-    entry_match = []
-    exit_match = []
-    for cam in _col_anpr.distinct("camera_path"):
-        cfg = configs.get(cam, {})
-        fwd_role = cfg.get("forward_role", "entry")
-        if fwd_role == "entry":
-            entry_match.append({"camera_path": cam, "direction": "forward"})
-            exit_match.append({"camera_path": cam, "direction": "reverse"})
-        else:
-            exit_match.append({"camera_path": cam, "direction": "forward"})
-            entry_match.append({"camera_path": cam, "direction": "reverse"})
-
-    def bucket_pipeline(dir_conditions):
-        if not dir_conditions:
-            return []
-        return list(_col_anpr.aggregate([
-            {"$match": {**base_match, "$or": dir_conditions}},
-            {"$group": {
-                "_id": {
-                    "$dateTrunc": {"date": "$event_dt", "unit": "minute", "binSize": 15}
-                },
-                "count": {"$sum": 1},
-            }},
-            {"$sort": {"_id": 1}},
-        ]))
-
-    entries = bucket_pipeline(entry_match)
-    exits = bucket_pipeline(exit_match)
-
-    return jsonify({
-        "entries": [{"t": d["_id"].isoformat(), "n": d["count"]} for d in entries],
-        "exits": [{"t": d["_id"].isoformat(), "n": d["count"]} for d in exits],
-    })
+    return jsonify({"entries": entries, "exits": exits})
 
 
 # ---------------------------------------------------------------------------
 # On-site vehicle counter (entries - exits since last reset)
 # ---------------------------------------------------------------------------
 
-def _count_direction(cam_configs, since, target_dir):
-    """Count detections resolved as 'entry' or 'exit' since a given datetime."""
-    match_conds = []
-    for cam_path, cfg in cam_configs.items():
-        fwd_role = cfg.get("forward_role", "entry")
-        if target_dir == "entry":
-            raw = "forward" if fwd_role == "entry" else "reverse"
-        else:
-            raw = "reverse" if fwd_role == "entry" else "forward"
-        match_conds.append({"camera_path": cam_path, "direction": raw})
-
-    # Also include cameras with no config (default forward=entry)
-    all_cams = _col_anpr.distinct("camera_path")
-    for cam in all_cams:
-        if cam not in cam_configs:
-            raw = "forward" if target_dir == "entry" else "reverse"
-            match_conds.append({"camera_path": cam, "direction": raw})
-
-    if not match_conds:
-        return 0
-
-    base = {"license_plate": {"$ne": "UNKNOWN"}, "event_dt": {"$gte": since}}
-    pipeline = [
-        {"$match": {**base, "$or": match_conds}},
-        {"$count": "n"},
-    ]
-    res = list(_col_anpr.aggregate(pipeline))
-    return res[0]["n"] if res else 0
-
-
 @anpr_bp.route("/api/anpr/onsite")
 def anpr_onsite():
-    """Vehicles currently on site = entries - exits since last reset."""
+    """Vehicles currently on site = entries - exits since last reset
+    (running counter maintained at ingest, see onsite_counter)."""
     _ensure_db()
-    cam_configs = _get_cam_configs()
-
-    # Get reset timestamp (or epoch if never reset)
-    doc = _col_site_counter.find_one({"_id": "reset"})
-    reset_at = doc["reset_at"] if doc else datetime(2000, 1, 1)
-
-    entries = _count_direction(cam_configs, reset_at, "entry")
-    exits = _count_direction(cam_configs, reset_at, "exit")
-    on_site = max(0, entries - exits)
-
-    return jsonify({
-        "on_site": on_site,
-        "entries": entries,
-        "exits": exits,
-        "reset_at": reset_at.isoformat() if isinstance(reset_at, datetime) else str(reset_at),
-    })
+    return jsonify(onsite_counter.payload(onsite_counter.get(_db)))
 
 
 @anpr_bp.route("/api/anpr/onsite/reset", methods=["POST"])
 def anpr_onsite_reset():
-    """Reset the on-site counter to 0 (stores current timestamp)."""
+    """Reset the on-site counter to 0; the closed period is kept as a snapshot."""
     _ensure_db()
     now = datetime.now(timezone.utc)
-    _col_site_counter.update_one(
-        {"_id": "reset"},
-        {"$set": {"reset_at": now}},
-        upsert=True,
-    )
-    return jsonify({"ok": True, "reset_at": now.isoformat()})
+    previous = onsite_counter.reset(_db, now)
+    return jsonify({"ok": True, "reset_at": now.isoformat(), "previous": previous})
 
 
 # ---------------------------------------------------------------------------
@@ -1115,16 +983,15 @@ def anpr_vision_batch():
     if not norm_map:
         return jsonify({})
 
-    # Single query for all norms
-    docs = _col_vision_imm.find({"plaque_norm": {"$in": list(norm_map.keys())}, **vf})
+    # Single _id lookup in the cross-reference for all norms
     results = {}
-    for doc in docs:
-        orig = norm_map.get(doc["plaque_norm"])
-        if orig:
-            results[orig] = {
-                "lieu": doc.get("lieu", ""),
-                "billets_count": len(doc.get("billets", [])),
-                "commentaire": doc.get("commentaire", ""),
+    for norm, doc in plate_crossref.lookup(_db, norm_map.keys()).items():
+        fiche = plate_crossref.vision_for_event(doc, vf["evenement"], vf["annee"])
+        if fiche:
+            results[norm_map[norm]] = {
+                "lieu": fiche.get("lieu", ""),
+                "billets_count": fiche.get("billets_count", 0),
+                "commentaire": fiche.get("commentaire", ""),
             }
 
     return jsonify(results)
@@ -1150,18 +1017,27 @@ def anpr_vision_search():
     if lieu:
         query["lieu"] = lieu
     search_plate = request.args.get("plate", "").strip().upper()
-    if search_plate:
-        query["plaque_norm"] = {"$regex": _normalize_plate(search_plate)}
+    plate_filter = plate_index.fragment_filter(search_plate, "plaque_norm", "plaque_grams", "plaque_norm")
+    if plate_filter:
+        query.update(plate_filter)
 
     docs = list(_col_vision_imm.find(query).sort("date", -1))
 
+    # Count ANPR detections for all plates in one aggregation (was one
+    # unindexed regex count per Vision doc)
+    norms = sorted({doc.get("plaque_norm") for doc in docs if doc.get("plaque_norm")})
+    anpr_counts = {}
+    if norms:
+        for row in _col_anpr.aggregate([
+            {"$match": plate_index.exact_filter(norms)},
+            {"$group": {"_id": {"$ifNull": ["$plate_norm", "$license_plate"]}, "count": {"$sum": 1}}},
+        ]):
+            key = _normalize_plate(row["_id"])
+            anpr_counts[key] = anpr_counts.get(key, 0) + row["count"]
+
     results = []
     for doc in docs:
-        norm = doc.get("plaque_norm", "")
-        # Count ANPR detections for this plate (using regex to match normalized)
-        anpr_count = _col_anpr.count_documents(
-            {"license_plate": {"$regex": norm, "$options": "i"}}
-        ) if norm else 0
+        anpr_count = anpr_counts.get(doc.get("plaque_norm", ""), 0)
 
         results.append({
             "plaque": doc.get("plaque", ""),
@@ -1203,8 +1079,10 @@ def anpr_vision_stats():
     by_lieu = {}
     by_lieu_all = {}
 
-    # Get all distinct ANPR normalized plates for fast lookup
-    anpr_norms = set(_normalize_plate(p) for p in _col_anpr.distinct("license_plate") if p and p != "UNKNOWN")
+    # ANPR-seen plates among these, from the cross-reference (was a distinct
+    # over every ANPR read)
+    anpr_norms = set(norm for norm, x in plate_crossref.lookup(
+        _db, [d.get("plaque_norm") for d in docs]).items() if x.get("has_anpr"))
 
     for doc in docs:
         norm = doc.get("plaque_norm", "")
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+anpr_ingest.py - Traitements a la suite de l'ingestion LAPI (hik_anpr).
+
+Les lectures sont ecrites dans hik_anpr hors de ce depot (ecoutehik2.py sur
+la VM PCA). Ce resident fait, toutes les CHECK_S, ce qui devrait suivre
+chaque insertion :
+
+  - plate_index.backfill : cles de recherche des plaques ;
+  - plate_crossref.record_anpr : croisement LAPI x Vision ;
+  - anpr_rollup.record : agregats horaires des tableaux de bord ;
+  - onsite_counter.record : compteur de vehicules sur site.
+
+Chaque consommateur lit les lectures arrivees depuis son propre repere (_id
+croissant, un seul ecrivain), garde dans anpr_ingest_state. Un lot est
+rejoue si le processus tombe entre l'ecriture et l'avancee du repere : les
+compteurs en $inc portent donc sur chaque document le dernier _id replie
+(voir `unfolded`, et counted_to pour onsite_counter), et la reprise
+n'incremente pas deux fois.
+
+Usage:
+    python anpr_ingest.py                       # un passage puis arret
+    python anpr_ingest.py --daemon              # resident, toutes les CHECK_S
+    python anpr_ingest.py --rebuild crossref    # reconstruit le croisement
+    python anpr_ingest.py --rebuild rollup      # reconstruit les agregats
+    python anpr_ingest.py --rebuild onsite      # recompte les vehicules sur site
+"""
+
+import argparse
+import logging
+import signal
+import time
+from datetime import datetime, timezone
+
+import anpr_rollup
+import onsite_counter
+import plate_crossref
+import plate_index
+
+log = logging.getLogger("anpr_ingest")
+
+COL_ANPR = "hik_anpr"
+COL_STATE = "anpr_ingest_state"
+
+# Repere du croisement tenu avant ce resident par plate_crossref.fold_anpr.
+LEGACY_STATE = "plate_crossref_state"
+
+BATCH = 1000
+CHECK_S = 30
+
+# Champs lus par l'ensemble des consommateurs (projection commune).
+READ_FIELDS = {
+    "license_plate": 1, "plate_norm": 1, "event_dt": 1, "camera_path": 1,
+    "direction": 1, "vehicle_color": 1, "vehicle_type": 1, "vehicle_logo": 1,
+    "confidence": 1, "vehicle_list_name": 1,
+}
+
+_stop = False
+
+
+def _handle_signal(signum, frame):
+    global _stop
+    _stop = True
+
+
+# ---------------------------------------------------------------------------
+# Reperes
+# ---------------------------------------------------------------------------
+
+def fold(db, name, record, batch=BATCH):
+    """Passe a `record(db, lectures)` les lectures hik_anpr arrivees depuis
+    le repere du consommateur `name`, par lots. Rend le nombre de lectures."""
+    state = db[COL_STATE].find_one({"_id": name}) or {}
+    last_id = state.get("last_id")
+    total = 0
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        docs = list(db[COL_ANPR].find(query, READ_FIELDS).sort("_id", 1).limit(batch))
+        if not docs:
+            break
+        record(db, docs)
+        last_id = docs[-1]["_id"]
+        mark(db, name, last_id)
+        total += len(docs)
+        if len(docs) < batch:
+            break
+    return total
+
+
+def unfolded(field, last_id):
+    """Filtre des documents ou le lot termine a `last_id` n'a pas encore ete
+    compte : `field` (dernier _id replie sur ce document) absent ou plus
+    ancien. A poser avec {"$set": {field: last_id}} dans le meme $inc."""
+    return {"$or": [{field: None}, {field: {"$lt": last_id}}]}
+
+
+def reset(db, name):
+    """Oublie le repere : le prochain fold reprend depuis la premiere lecture."""
+    db[COL_STATE].delete_many({"_id": name})
+
+
+def mark(db, name, last_id):
+    """Avance le repere a last_id (apres un lot, ou un recalcul qui a deja
+    compte jusque-la). Jamais de recul : un lot du resident encore en vol
+    pendant un recalcul lance par le web ne ramene pas le repere en arriere."""
+    db[COL_STATE].update_one({"_id": name},
+                             {"$max": {"last_id": last_id},
+                              "$set": {"updated_at": datetime.now(timezone.utc)}},
+                             upsert=True)
+
+
+def migrate_legacy_state(db):
+    """Reprend le repere de plate_crossref_state pour le consommateur
+    crossref, puis supprime l'ancienne collection. Sans cette reprise, le
+    premier passage replierait de nouveau tout l'historique dans le
+    croisement (anpr_count en $inc)."""
+    old = db[LEGACY_STATE].find_one({"_id": "anpr"})
+    if old is None:
+        return False
+    if db[COL_STATE].find_one({"_id": "crossref"}) is not None:
+        log.warning("%s et repere crossref presents : le croisement a pu etre replie "
+                    "deux fois, relancer --rebuild crossref", LEGACY_STATE)
+    elif old.get("last_id") is not None:
+        mark(db, "crossref", old["last_id"])
+    db.drop_collection(LEGACY_STATE)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Point d'entree
+# ---------------------------------------------------------------------------
+
+def run_once(db):
+    counts = plate_index.backfill(db)
+    counts["crossref"] = plate_crossref.fold_anpr(db)
+    counts["rollup"] = anpr_rollup.fold(db)
+    counts["onsite"] = onsite_counter.fold(db)
+    if any(counts.values()):
+        log.info("lectures traitees : %s", ", ".join(
+            "%s %d" % (k, n) for k, n in counts.items()))
+    return counts
+
+
+def run_resident(db):
+    log.info("Suivi d'ingestion LAPI resident : passage toutes les %ds", CHECK_S)
+    while not _stop:
+        try:
+            run_once(db)
+        except Exception as e:
+            log.error("Passage d'ingestion LAPI echoue: %s", e)
+        fin = time.monotonic() + CHECK_S
+        while not _stop and time.monotonic() < fin:
+            time.sleep(min(1.0, fin - time.monotonic()))
+
+
+def main():
+    from field import _get_mongo_db
+
+    parser = argparse.ArgumentParser(description="Traitements a la suite de l'ingestion LAPI")
+    parser.add_argument("--daemon", action="store_true", help="Mode resident")
+    parser.add_argument("--rebuild", choices=("crossref", "rollup", "onsite"),
+                        help="Reconstruit une vue depuis les collections sources")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    db = _get_mongo_db()
+    if migrate_legacy_state(db):
+        log.info("repere %s repris dans %s", LEGACY_STATE, COL_STATE)
+    plate_index.ensure_indexes(db)
+    plate_crossref.ensure_indexes(db)
+    anpr_rollup.ensure_indexes(db)
+    if args.rebuild == "crossref":
+        plate_crossref.rebuild(db)
+    elif args.rebuild == "rollup":
+        log.info("agregats reconstruits : %d lectures", anpr_rollup.rebuild(db))
+    elif args.rebuild == "onsite":
+        doc = onsite_counter.rebuild(db)
+        log.info("sur site recompte : %d entrees, %d sorties", doc["entries"], doc["exits"])
+    elif args.daemon:
+        run_resident(db)
+    else:
+        run_once(db)
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    main()
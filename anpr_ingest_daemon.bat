@@ -0,0 +1,8 @@
+@echo off
+setlocal
+chcp 65001 >nul
+set "PYTHONIOENCODING=utf-8"
+cd /d E:\TITAN\production\cockpit
+"E:\TITAN\production\titan_prod\Scripts\python.exe" -X utf8 "anpr_ingest.py" --daemon
+endlocal
+exit /b 0
@@ -0,0 +1,278 @@
+"""Agregats horaires des lectures LAPI pour /api/anpr/stats et /api/anpr/flow.
+
+anpr_stats passait neuf pipelines sur hik_anpr a chaque rafraichissement du
+tableau de bord (total, plaques uniques, couleur, marque, type, camera, heure,
+allowList, confiance), chacun repetant le meme $match ; anpr_flow en passait
+deux de plus. Les lectures sont maintenant repliees, au fil de l'ingestion
+(resident anpr_ingest), dans :
+
+  - anpr_hourly_rollups : un document par (heure, camera, sens brut, couleur,
+    type, logo, tranche de confiance) : count, allow, conf_sum / conf_n (pour
+    la moyenne des confiances > 0), q0..q3 (par quart d'heure, pour le flux) ;
+  - anpr_hourly_plates : {_id: heure, plates: [...]}, les plaques distinctes
+    de l'heure (les plaques uniques d'une plage ne s'additionnent pas).
+
+Une plage [since, until] se lit en trois morceaux : les heures pleines dans
+les agregats, les bouts d'heure aux bords et les lectures pas encore
+repliees (au-dela du repere anpr_ingest) en un seul pipeline $facet sur
+hik_anpr, borne par l'index event_dt ou _id. Tant que les agregats n'ont
+jamais ete construits, tout passe par ce pipeline.
+
+Les lectures UNKNOWN sont ecartees, comme le faisaient les deux routes.
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+import anpr_ingest
+import onsite_counter
+from plate_index import normalize_plate
+
+COL = "anpr_hourly_rollups"
+COL_PLATES = "anpr_hourly_plates"
+STATE = "rollup"
+
+# Tranches de confiance : (borne basse, libelle), de la plus haute a la plus basse.
+BANDS = ((90, "90+"), (80, "80-89"), (60, "60-79"), (1, "1-59"), (0, "0"))
+DIMS = ("camera_path", "direction", "vehicle_color", "vehicle_type", "vehicle_logo", "band")
+HOUR = timedelta(hours=1)
+
+
+def confidence_band(confidence):
+    try:
+        c = int(confidence or 0)
+    except (TypeError, ValueError):
+        c = 0
+    for low, label in BANDS:
+        if c >= low:
+            return label
+    return "0"
+
+
+def _naive_utc(dt):
+    if dt is not None and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _floor_hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def _ceil_hour(dt):
+    h = _floor_hour(dt)
+    return h if h == dt else h + HOUR
+
+
+def _row_id(hour, dims):
+    return "|".join([hour.isoformat()] + ["" if v is None else str(v) for v in dims])
+
+
+def _accumulate(rows, hour, q, dims, confidence, allow, n=1):
+    key = _row_id(hour, dims)
+    row = rows.get(key)
+    if row is None:
+        row = rows[key] = dict(zip(DIMS, dims), _id=key, hour=hour, count=0, allow=0,
+                               conf_sum=0, conf_n=0, q0=0, q1=0, q2=0, q3=0)
+    row["count"] += n
+    row["q%d" % q] += n
+    if allow:
+        row["allow"] += n
+    if (confidence or 0) > 0:
+        row["conf_sum"] += confidence * n
+        row["conf_n"] += n
+
+
+def _dims(r, confidence):
+    return (r.get("camera_path"), r.get("direction"), r.get("vehicle_color"),
+            r.get("vehicle_type"), r.get("vehicle_logo"), confidence_band(confidence))
+
+
+def ensure_indexes(db):
+    db[COL].create_index("hour")
+
+
+# ---------------------------------------------------------------------------
+# Ecriture
+# ---------------------------------------------------------------------------
+
+def record(db, reads):
+    """Replie des lectures hik_anpr dans les agregats horaires. Rejouer un
+    lot ne compte rien deux fois (folded_to, voir anpr_ingest.unfolded)."""
+    rows = {}
+    plates = {}
+    for r in reads:
+        norm = r.get("plate_norm") or normalize_plate(r.get("license_plate"))
+        dt = _naive_utc(r.get("event_dt"))
+        if not norm or norm == "UNKNOWN" or not isinstance(dt, datetime):
+            continue
+        hour = _floor_hour(dt)
+        conf = r.get("confidence") or 0
+        _accumulate(rows, hour, dt.minute // 15, _dims(r, conf), conf,
+                    r.get("vehicle_list_name") == "allowList")
+        plates.setdefault(hour, set()).add(norm)
+
+    last_id = reads[-1]["_id"] if reads else None
+    ops = []
+    for key, row in rows.items():
+        inc = {k: row[k] for k in ("count", "allow", "conf_sum", "conf_n", "q0", "q1", "q2", "q3")
+               if row[k]}
+        ops.append(UpdateOne({"_id": key}, {
+            "$set": {"hour": row["hour"], **{d: row[d] for d in DIMS}},
+        }, upsert=True))
+        ops.append(UpdateOne({"_id": key, **anpr_ingest.unfolded("folded_to", last_id)},
+                             {"$inc": inc, "$set": {"folded_to": last_id}}))
+    if ops:
+        db[COL].bulk_write(ops, ordered=True)
+    plate_ops = [UpdateOne({"_id": hour}, {"$addToSet": {"plates": {"$each": sorted(p)}}},
+                           upsert=True) for hour, p in plates.items()]
+    if plate_ops:
+        db[COL_PLATES].bulk_write(plate_ops, ordered=False)
+    return len(rows)
+
+
+def fold(db):
+    return anpr_ingest.fold(db, STATE, record)
+
+
+def rebuild(db):
+    db[COL].delete_many({})
+    db[COL_PLATES].delete_many({})
+    anpr_ingest.reset(db, STATE)
+    ensure_indexes(db)
+    return fold(db)
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+
+def plan(since, until):
+    """Decoupe [since, until] : (filtre des heures pleines sur `hour`, ou None
+    si aucune ; filtres event_dt des bouts d'heure a lire en brut)."""
+    h0 = _ceil_hour(since) if since is not None else None
+    h1 = _floor_hour(until) if until is not None else None
+    if h0 is not None and h1 is not None and h0 >= h1:
+        dt = {"$gte": since, "$lte": until}
+        return None, [dt]
+    hours, edges = {}, []
+    if h0 is not None:
+        hours["$gte"] = h0
+        if since < h0:
+            edges.append({"$gte": since, "$lt": h0})
+    if h1 is not None:
+        hours["$lt"] = h1
+        edges.append({"$gte": h1, "$lte": until})
+    return hours, edges
+
+
+def _raw(db, branches, with_plates):
+    """Un seul pipeline $facet sur les lectures brutes des `branches`."""
+    facet = {"rows": [{"$group": {
+        "_id": {
+            "hour": {"$dateTrunc": {"date": "$event_dt", "unit": "hour"}},
+            "q": {"$floor": {"$divide": [{"$minute": "$event_dt"}, 15]}},
+            "camera_path": "$camera_path", "direction": "$direction",
+            "vehicle_color": "$vehicle_color", "vehicle_type": "$vehicle_type",
+            "vehicle_logo": "$vehicle_logo", "confidence": "$confidence",
+            "allow": {"$eq": ["$vehicle_list_name", "allowList"]},
+        },
+        "count": {"$sum": 1},
+    }}]}
+    if with_plates:
+        facet["plates"] = [{"$group": {"_id": {"$ifNull": ["$plate_norm", "$license_plate"]}}}]
+    match = {"license_plate": {"$ne": "UNKNOWN"}, "$or": branches}
+    res = list(db[anpr_ingest.COL_ANPR].aggregate([{"$match": match}, {"$facet": facet}]))
+    res = res[0] if res else {}
+    rows = {}
+    for g in res.get("rows", []):
+        k = g["_id"]
+        conf = k.get("confidence") or 0
+        _accumulate(rows, k["hour"], int(k["q"]), _dims(k, conf), conf, k.get("allow"), g["count"])
+    plates = {normalize_plate(p["_id"]) for p in res.get("plates", []) if p.get("_id")}
+    return list(rows.values()), plates
+
+
+def collect(db, since=None, until=None, with_plates=False):
+    """(lignes d'agregat, plaques distinctes ou None) couvrant [since, until]."""
+    since, until = _naive_utc(since), _naive_utc(until)
+    state = db[anpr_ingest.COL_STATE].find_one({"_id": STATE})
+    if state is None:
+        dt = {}
+        if since is not None:
+            dt["$gte"] = since
+        if until is not None:
+            dt["$lte"] = until
+        rows, plates = _raw(db, [{"event_dt": dt} if dt else {}], with_plates)
+        return rows, (plates if with_plates else None)
+
+    hours, edges = plan(since, until)
+    rows, plates = [], set()
+    branches = [{"event_dt": e} for e in edges]
+    if hours is not None:
+        hour_q = {"hour": hours} if hours else {}
+        rows = list(db[COL].find(hour_q))
+        if with_plates:
+            for doc in db[COL_PLATES].find({"_id": hours} if hours else {}):
+                plates.update(doc.get("plates") or [])
+        # Lectures de ces heures arrivees apres le dernier repli
+        tail = {"_id": {"$gt": state.get("last_id")}}
+        if hours:
+            tail["event_dt"] = hours
+        branches.append(tail)
+    raw_rows, raw_plates = _raw(db, branches, with_plates)
+    rows.extend(raw_rows)
+    plates |= raw_plates
+    return rows, (plates if with_plates else None)
+
+
+def summarize(rows, plates=None):
+    """Compteurs du tableau de bord a partir de lignes d'agregat."""
+    total = allow = conf_sum = conf_n = 0
+    by = {d: {} for d in ("vehicle_color", "vehicle_logo", "vehicle_type", "camera_path")}
+    by_hour = {}
+    for row in rows:
+        n = row.get("count", 0)
+        total += n
+        allow += row.get("allow", 0)
+        conf_sum += row.get("conf_sum", 0)
+        conf_n += row.get("conf_n", 0)
+        for d, acc in by.items():
+            acc[row.get(d)] = acc.get(row.get(d), 0) + n
+        h = row["hour"].hour
+        by_hour[h] = by_hour.get(h, 0) + n
+
+    def ranked(acc):
+        return sorted(acc.items(), key=lambda kv: kv[1], reverse=True)
+
+    return {
+        "total": total,
+        "unique_plates": len(plates) if plates is not None else None,
+        "allowlist_count": allow,
+        "avg_confidence": round(conf_sum / conf_n, 1) if conf_n else 0,
+        "by_color": ranked(by["vehicle_color"]),
+        "by_logo": ranked(by["vehicle_logo"]),
+        "by_type": ranked(by["vehicle_type"]),
+        "by_camera": ranked(by["camera_path"]),
+        "by_hour": dict(sorted(by_hour.items())),
+    }
+
+
+def flow(rows, cam_configs):
+    """Entrees / sorties par quart d'heure ; le sens brut est resolu avec la
+    configuration courante des cameras (forward_role, entree par defaut)."""
+    entries, exits = {}, {}
+    for row in rows:
+        sens = onsite_counter.resolve_direction(row.get("direction"), row.get("camera_path"), cam_configs)
+        if sens not in ("entry", "exit"):
+            continue
+        acc = entries if sens == "entry" else exits
+        for q in range(4):
+            n = row.get("q%d" % q, 0)
+            if n:
+                t = row["hour"] + timedelta(minutes=15 * q)
+                acc[t] = acc.get(t, 0) + n
+    return ([{"t": t.isoformat(), "n": n} for t, n in sorted(entries.items())],
+            [{"t": t.isoformat(), "n": n} for t, n in sorted(exits.items())])
@@ -7,13 +7,15 @@ import hmac
 import logging
 import uuid
 import subprocess
+import threading
 import jwt
 from datetime import datetime, timedelta, timezone
 
 # Third-party imports
 from flask import (
     Flask, Blueprint, jsonify, render_template, send_from_directory, request,
-    redirect, url_for, flash, session, abort, make_response
+    redirect, url_for, flash, session, abort, make_response, Response,
+    stream_with_context
 )
 from flask_cors import CORS
 from flask_wtf.csrf import CSRFProtect, CSRFError
@@ -29,11 +31,11 @@ from waitress import serve
 # Local application imports
 from traffic import traffic_bp
 from merge import run_merge
-from analyse_ops import analyse_ops_bp
+from analyse_ops import analyse_ops_bp, bump_source_version, bump_fiche_source, read_source_version
 from scan_report import scan_report_bp
-from anoloc import anoloc_bp
+from anoloc import anoloc_bp, build_live_groups, _get_user_visible_groups
 from anpr import anpr_bp
-from field import field_bp
+from field import field_bp, unread_by_device
 from vision_admin import vision_admin_bp
 from crise_auth import crise_auth_bp
 from routing import routing_bp
@@ -42,6 +44,15 @@ from cameras import cameras_bp
 from meteo import meteo_bp
 import pcorg_summary
 import pcorg_summary_mail
+import affluence_snapshot
+import image_service
+import live_push
+import metrics
+import serving
+from serving import heavy
+import peak_rollup
+import plate_crossref
+import presence_ledger
 import pcorg_ai_memory
 import alfred
 from alfred import alfred_bp
@@ -110,6 +121,9 @@ if not DEV_MODE and not os.getenv('SNAPSHOT_PUBLIC_SECRET'):
 
 # Connexion à MongoDB
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+# Avant tout MongoClient du processus : le listener global de metrics.py ne
+# se branche que sur les clients crees apres lui (blueprints compris).
+metrics.install_listener()
 client = MongoClient(MONGO_URI)
 
 # Sélection dynamique de la base de données
@@ -118,6 +132,28 @@ db = client[db_name]
 
 CORS(app)  # Activer CORS pour toutes les routes
 
+
+# Mesures par route et par commande Mongo (metrics.py), lues sur /api/_metrics.
+# Hooks de l'app : ils couvrent aussi toutes les routes des blueprints, et
+# l'after_request enregistre en premier passe en dernier (duree complete).
+@app.before_request
+def _metrics_begin():
+    metrics.begin()
+
+
+@app.after_request
+def _metrics_end(response):
+    duree_ms, commandes = metrics.end()
+    if duree_ms is not None:
+        rule = request.url_rule.rule if request.url_rule is not None else "<sans route>"
+        metrics.registry.record(
+            "%s %s" % (request.method, rule), request.endpoint, response.status_code, duree_ms,
+            bytes_in=request.content_length or 0,
+            bytes_out=0 if response.is_streamed else (response.content_length or 0),
+            commands=commandes,
+        )
+    return response
+
 # Cache noms utilisateurs (email -> {firstname, lastname}), evite un find par requete
 _user_name_cache = {}
 
@@ -137,6 +173,20 @@ COL_ACTIVE_ALERTS.create_index("dedup_key", unique=True, sparse=True)
 COL_ACTIVE_ALERTS.create_index("definition_slug")
 COL_ANPR_WATCHLIST.create_index("plate", unique=True)
 
+
+def _bump_alert_engine_version(key):
+    """Invalide le cache du daemon alert_engine (cf. alert_engine.run_daemon) :
+    'definitions' apres une ecriture de definition, 'context' apres une mise
+    a jour de parametrage. Sans daemon en route, l'increment est inoffensif."""
+    try:
+        db['cockpit_alert_engine_versions'].update_one(
+            {"_id": key},
+            {"$inc": {"version": 1}, "$set": {"at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.warning(f"Bump version alert_engine ({key}) impossible: {e}")
+
 # Collections WhatsApp (WAHA)
 COL_WA_GROUPS = db['cockpit_wa_groups']
 COL_WA_CONTACTS = db['cockpit_wa_contacts']
@@ -327,8 +377,9 @@ _ALERT_SEEDS = [
         "priority": 0,
     },
 ]
+_seeded = 0
 for _seed in _ALERT_SEEDS:
-    COL_ALERT_DEFS.update_one(
+    _res = COL_ALERT_DEFS.update_one(
         {"slug": _seed["slug"]},
         {"$setOnInsert": {
             **_seed,
@@ -337,6 +388,10 @@ for _seed in _ALERT_SEEDS:
         }},
         upsert=True
     )
+    if _res.upserted_id is not None:
+        _seeded += 1
+if _seeded:
+    _bump_alert_engine_version("definitions")
 
 # Seed fake users en mode CODING pour tester la gestion des groupes
 if CODING:
@@ -2255,18 +2310,6 @@ def _ticketing_day_groups(param_doc, race_date):
     return groups
 
 
-def _group_fill_rates(param_doc, race_ref, target_days_before):
-    """{signature: part du final deja vendue a target_days_before} pour une
-    edition de reference."""
-    rates = {}
-    for sig, names in _ticketing_day_groups(param_doc, race_ref).items():
-        pts, final, _ = _fill_curve(param_doc, race_date_override=race_ref, product_names=names)
-        pct = _interpolate_pct(pts, final, target_days_before)
-        if pct and pct > 0:
-            rates[sig] = pct / 100
-    return rates
-
-
 def _reference_weights(n):
     """Poids geometriques decroissants : N-1 pese le double de N-2, etc.
 
@@ -2284,16 +2327,64 @@ def _reference_weights(n):
 @app.route('/get_affluence', methods=['GET'])
 @role_required("user")
 @block_required("widget-right-2")
+@heavy
 def get_affluence():
+    """Affluence billetterie d'un (event, year), servie depuis son instantane
+    materialise (affluence_snapshot.py) : une lecture de document par poll,
+    le calcul complet ne tourne qu'apres un webhook parametrage ou un import
+    d'historique."""
     event = request.args.get("event")
     year = request.args.get("year")
     if not event or not year:
         return jsonify({"error": "Missing event or year"}), 400
+    return jsonify(affluence_snapshot.get(db, event, year, _compute_affluence))
+
+
+def _reference_curves(param_doc, race_ref):
+    """Courbes de remplissage d'une edition passee, panier global et par groupe
+    de jours : figees avec l'edition, elles sont calculees une fois et gardees
+    dans affluence_reference_curves."""
+    points, final, _ = _fill_curve(param_doc, race_date_override=race_ref,
+                                   product_names=_ticketing_product_names(param_doc))
+    groups = []
+    for sig, names in _ticketing_day_groups(param_doc, race_ref).items():
+        g_points, g_final, _ = _fill_curve(param_doc, race_date_override=race_ref,
+                                           product_names=names)
+        groups.append({"sig": sig if sig == 'all' else list(sig),
+                       "points": [list(pt) for pt in g_points], "final": g_final})
+    return {"points": [list(pt) for pt in points], "final": final, "groups": groups}
+
+
+def _reference_fill_rates(event, param_doc, race_ref, target_days_before):
+    """(taux global, {signature: taux}) d'une edition de reference a
+    target_days_before, depuis ses courbes precalculees."""
+    version = (param_doc.get('tickets') or {}).get('lastUpdate')
+    curves = affluence_snapshot.reference_curves(
+        db, event, param_doc.get('year'), version, race_ref,
+        lambda: _reference_curves(param_doc, race_ref))
+    g_pct = _interpolate_pct(curves["points"], curves["final"], target_days_before)
+    rates = {}
+    for grp in curves["groups"]:
+        pct = _interpolate_pct(grp["points"], grp["final"], target_days_before)
+        if pct and pct > 0:
+            sig = grp["sig"] if grp["sig"] == 'all' else tuple(grp["sig"])
+            rates[sig] = pct / 100
+    return (g_pct / 100 if g_pct and g_pct > 0 else None), rates
 
+
+def _rebuild_affluence(event, year):
+    try:
+        affluence_snapshot.rebuild(db, event, year, _compute_affluence)
+    except Exception as e:
+        logger.warning("Reconstruction affluence %s %s echouee : %s", event, year, e)
+
+
+def _compute_affluence(event, year):
+    """Calcul complet de /get_affluence (dict serialisable, sans Flask)."""
     # Charger parametrages complet (data + tickets a la racine)
     doc = db['parametrages'].find_one({'event': event, 'year': year}, {'_id': 0})
     if not doc or 'data' not in doc:
-        return jsonify({"days": [], "total_ventes": None})
+        return {"days": [], "total_ventes": None}
 
     gh = doc['data'].get('globalHoraires', {})
     public_days = gh.get('dates', [])
@@ -2303,7 +2394,7 @@ def get_affluence():
     last_update = tickets.get('lastUpdate')
 
     if not public_days or not ticketing_config:
-        return jsonify({"days": [], "total_ventes": None, "last_update": last_update})
+        return {"days": [], "total_ventes": None, "last_update": last_update}
 
     # Parser la date de course courante
     race_date = _param_race_date(doc)
@@ -2431,11 +2522,9 @@ def get_affluence():
             if cy >= current_year_int:
                 continue
             race_ref = hist_race_by_year.get(cy) or _param_race_date(cand)
-            pts, final, _ = _fill_curve(cand, race_date_override=race_ref,
-                                        product_names=_ticketing_product_names(cand))
-            g_pct = _interpolate_pct(pts, final, days_before)
-            g_rate = g_pct / 100 if g_pct and g_pct > 0 else None
-            groups = _group_fill_rates(cand, race_ref, days_before)
+            if not race_ref:
+                continue
+            g_rate, groups = _reference_fill_rates(event, cand, race_ref, days_before)
             if g_rate or groups:
                 reference_rates.append({'year': cy, 'global': g_rate, 'groups': groups})
                 if len(reference_rates) >= MAX_REFERENCE_EDITIONS:
@@ -2738,7 +2827,7 @@ def get_affluence():
                 'projection': site_projection,
             })
 
-    return jsonify({
+    return {
         "days": result_days,
         "total_ventes": total_ventes,
         "total_delta": total_delta,
@@ -2754,12 +2843,13 @@ def get_affluence():
         "prev_reference_date": prev_reference_date,
         "days_before": days_before,
         "sites": sites
-    })
+    }
 
 
 @app.route('/get_affluence_hourly', methods=['GET'])
 @role_required("user")
 @block_required("widget-right-2")
+@heavy
 def get_affluence_hourly():
     """Courbe horaire des presents pour un jour donne :
     - n  : presents annee en cours (historique_controle{year=N} si dispo,
@@ -2909,6 +2999,7 @@ def get_affluence_hourly():
 @app.route('/get_affluence_curves', methods=['GET'])
 @role_required("user")
 @block_required("widget-right-2")
+@heavy
 def get_affluence_curves():
     """Courbes de remplissage (ventes cumulees) par 'jours avant course'
     pour N, N-1 et N-2. Sert au grand panneau Affluence pour visualiser
@@ -3891,6 +3982,7 @@ def create_alert_definition():
     }
     ins = COL_ALERT_DEFS.insert_one(doc)
     doc['_id'] = ins.inserted_id
+    _bump_alert_engine_version("definitions")
     return jsonify(_pub(doc)), 201
 
 @app.route('/api/alert-definitions/<did>', methods=['PUT'])
@@ -3939,6 +4031,7 @@ def update_alert_definition(did):
     )
     if not res:
         return jsonify({"error": "Definition introuvable"}), 404
+    _bump_alert_engine_version("definitions")
     return jsonify(_pub(res))
 
 @app.route('/api/alert-definitions/<did>', methods=['DELETE'])
@@ -3951,6 +4044,7 @@ def delete_alert_definition(did):
     r = COL_ALERT_DEFS.delete_one({"_id": oid})
     if r.deleted_count == 0:
         return jsonify({"error": "Definition introuvable"}), 404
+    _bump_alert_engine_version("definitions")
     return jsonify({"ok": True})
 
 # --- Alfred (agent IA WhatsApp) ---
@@ -4061,7 +4155,17 @@ def alfred_dm_remove(chat_id):
 @role_required("admin")
 def list_anpr_watchlist():
     docs = list(COL_ANPR_WATCHLIST.find().sort([('createdAt', -1)]))
-    return jsonify([_pub(d) for d in docs])
+    # Derniere lecture / Vision / blacklist : une lecture par _id du croisement
+    fiches = plate_crossref.lookup(db, [d.get('plate') for d in docs])
+    out = []
+    for d in docs:
+        p = _pub(d)
+        resume = plate_crossref.summary(fiches.get(plate_crossref.normalize_plate(d.get('plate'))))
+        if resume and isinstance(resume.get('last_seen'), datetime):
+            resume['last_seen'] = resume['last_seen'].replace(tzinfo=timezone.utc).isoformat()
+        p['crossref'] = resume
+        out.append(p)
+    return jsonify(out)
 
 @app.route('/api/anpr-watchlist', methods=['POST'])
 @role_required("admin")
@@ -4084,6 +4188,7 @@ def add_anpr_watchlist():
     }
     ins = COL_ANPR_WATCHLIST.insert_one(doc)
     doc['_id'] = ins.inserted_id
+    plate_crossref.set_watchlist(db, plate, doc['enabled'])
     return jsonify(_pub(doc)), 201
 
 @app.route('/api/anpr-watchlist/<wid>', methods=['PUT'])
@@ -4107,6 +4212,8 @@ def update_anpr_watchlist(wid):
     )
     if not res:
         return jsonify({"error": "Plaque introuvable"}), 404
+    if 'enabled' in patch:
+        plate_crossref.set_watchlist(db, res.get('plate'), res.get('enabled'))
     return jsonify(_pub(res))
 
 @app.route('/api/anpr-watchlist/<wid>', methods=['DELETE'])
@@ -4116,9 +4223,10 @@ def delete_anpr_watchlist(wid):
         oid = ObjectId(wid)
     except Exception:
         return jsonify({"error": "ID invalide"}), 400
-    r = COL_ANPR_WATCHLIST.delete_one({"_id": oid})
-    if r.deleted_count == 0:
+    doc = COL_ANPR_WATCHLIST.find_one_and_delete({"_id": oid})
+    if not doc:
         return jsonify({"error": "Plaque introuvable"}), 404
+    plate_crossref.set_watchlist(db, doc.get('plate'), False)
     return jsonify({"ok": True})
 
 # --- Alertes actives (polling par le client) ---
@@ -4155,11 +4263,16 @@ def _get_user_alert_slugs(payload):
 @role_required("user")
 def get_active_alerts():
     payload = getattr(request, 'user_payload', {})
-    allowed_slugs = _get_user_alert_slugs(payload)
+    return jsonify(_active_alerts_list(_get_user_alert_slugs(payload)))
+
+
+def _active_alerts_list(allowed_slugs, limit=50):
+    """Alertes actives serialisees, plus recentes d'abord. allowed_slugs=None :
+    toutes."""
     query = {"expiresAt": {"$gt": datetime.now(timezone.utc)}}
     if allowed_slugs is not None:
         query["definition_slug"] = {"$in": allowed_slugs}
-    docs = list(COL_ACTIVE_ALERTS.find(query).sort([('triggeredAt', -1)]).limit(50))
+    docs = list(COL_ACTIVE_ALERTS.find(query).sort([('triggeredAt', -1)]).limit(limit))
     result = []
     for d in docs:
         d['_id'] = str(d['_id'])
@@ -4173,14 +4286,34 @@ def get_active_alerts():
             elif isinstance(v, ObjectId):
                 d[k] = str(v)
         result.append(d)
-    return jsonify(result)
+    return result
 
 
 # ---------------------------------------------------------------------------
 # Camera Smart Events : catalogue, liste cameras, snapshot, console temps reel
 # ---------------------------------------------------------------------------
 
-HIK_IMAGES_ROOT = os.path.abspath(os.getenv("HIK_IMAGES_ROOT", r"E:\TITAN\production\hik_images"))
+HIK_IMAGES_ROOT = image_service.IMAGES_ROOT
+
+
+def _send_hik_snapshot(snap, cache_control):
+    """Sert un snapshot Hik (chemin absolu sous HIK_IMAGES_ROOT) ou sa
+    miniature ?w=160|480, avec un ETag fort (304 sur If-None-Match)."""
+    full_path = image_service.resolve(HIK_IMAGES_ROOT, snap)
+    if full_path is None:
+        return jsonify({"error": "Chemin hors zone autorisee"}), 403
+    if not os.path.isfile(full_path):
+        return jsonify({"error": "Fichier introuvable"}), 404
+    etag = image_service.file_etag(full_path)
+    width = image_service.parse_width(request.args.get("w"))
+    thumb = image_service.derivative(HIK_IMAGES_ROOT, full_path, width) if width else None
+    if thumb and thumb != full_path:
+        etag = image_service.derivative_etag(full_path, width)
+        full_path = thumb
+    from flask import send_file
+    resp = send_file(full_path, mimetype="image/jpeg", etag=etag, conditional=True)
+    resp.headers["Cache-Control"] = cache_control
+    return resp
 
 
 @app.route('/api/camera-event-types', methods=['GET'])
@@ -4267,20 +4400,8 @@ def get_hik_snapshot(alert_id):
     snap = (doc.get("actionData") or {}).get("snapshot_path") or ""
     if not snap:
         return jsonify({"error": "Pas de snapshot"}), 404
-    # Resolution + securisation du chemin
-    full_path = os.path.abspath(snap)
-    try:
-        common = os.path.commonpath([full_path, HIK_IMAGES_ROOT])
-    except ValueError:
-        return jsonify({"error": "Chemin invalide"}), 403
-    if common != HIK_IMAGES_ROOT:
-        return jsonify({"error": "Chemin hors zone autorisee"}), 403
-    if not os.path.isfile(full_path):
-        return jsonify({"error": "Fichier introuvable"}), 404
-    from flask import send_file
-    resp = send_file(full_path, mimetype="image/jpeg", max_age=300)
-    resp.headers["Cache-Control"] = "private, max-age=300"
-    return resp
+    # Un snapshot d'alerte n'est jamais reecrit : cache navigateur immutable
+    return _send_hik_snapshot(snap, image_service.cache_control(public=False))
 
 
 @app.route('/public/snapshot/<alert_id>', methods=['GET'])
@@ -4309,18 +4430,12 @@ def public_snapshot(alert_id):
     snap = (doc.get("actionData") or {}).get("snapshot_path") or ""
     if not snap:
         return jsonify({"error": "Pas de snapshot"}), 404
-    full_path = os.path.abspath(snap)
-    try:
-        common = os.path.commonpath([full_path, HIK_IMAGES_ROOT])
-    except ValueError:
-        return jsonify({"error": "Chemin invalide"}), 403
-    if common != HIK_IMAGES_ROOT:
-        return jsonify({"error": "Chemin hors zone autorisee"}), 403
-    if not os.path.isfile(full_path):
-        return jsonify({"error": "Fichier introuvable"}), 404
-    from flask import send_file
-    resp = send_file(full_path, mimetype="image/jpeg", max_age=3600)
-    resp.headers["Cache-Control"] = "public, max-age=3600"
+    # Cache public borne par l'expiration du lien : un cache partage ne doit
+    # pas continuer a servir l'image une fois la signature perimee.
+    remaining = int(exp) - int(datetime.now(timezone.utc).timestamp())
+    resp = _send_hik_snapshot(snap, image_service.cache_control(public=True, max_age=remaining))
+    if isinstance(resp, tuple):
+        return resp
     # X-Robots-Tag : ne pas indexer
     resp.headers["X-Robots-Tag"] = "noindex, nofollow"
     return resp
@@ -4343,6 +4458,11 @@ def hik_events_stream():
     except ValueError:
         since_s = 900
     since_s = max(60, min(86400, since_s))
+    return jsonify({"window_seconds": since_s, "rows": _hik_console_rows(since_s)})
+
+
+def _hik_console_rows(since_s):
+    """Lignes de la console Hik sur les `since_s` dernieres secondes."""
     since_dt = datetime.now(timezone.utc) - timedelta(seconds=since_s)
 
     col = db['hik_event_stream']
@@ -4389,7 +4509,7 @@ def hik_events_stream():
             "last_snapshot_path": row.get("last_snapshot_path") or "",
             "last_id": str(row.get("last_id")) if row.get("last_id") else "",
         })
-    return jsonify({"window_seconds": since_s, "rows": result})
+    return result
 
 
 @app.route('/api/hik-events-stream/snapshot/<stream_id>', methods=['GET'])
@@ -4408,19 +4528,7 @@ def hik_event_stream_snapshot(stream_id):
     snap = doc.get("snapshot_path") or ""
     if not snap:
         return jsonify({"error": "Pas de snapshot"}), 404
-    full_path = os.path.abspath(snap)
-    try:
-        common = os.path.commonpath([full_path, HIK_IMAGES_ROOT])
-    except ValueError:
-        return jsonify({"error": "Chemin invalide"}), 403
-    if common != HIK_IMAGES_ROOT:
-        return jsonify({"error": "Chemin hors zone autorisee"}), 403
-    if not os.path.isfile(full_path):
-        return jsonify({"error": "Fichier introuvable"}), 404
-    from flask import send_file
-    resp = send_file(full_path, mimetype="image/jpeg", max_age=300)
-    resp.headers["Cache-Control"] = "private, max-age=300"
-    return resp
+    return _send_hik_snapshot(snap, image_service.cache_control(public=False))
 
 ################################################################################
 # Webhook & Merge Config
@@ -4446,6 +4554,13 @@ def webhook_parametrage_updated():
     if not event or not year:
         return jsonify({"error": "event et year requis"}), 400
 
+    _bump_alert_engine_version("context")
+    # Billetterie potentiellement changee : instantanes d'affluence de
+    # l'evenement a refaire (N+1 se compare a N), celui de l'annee notifiee
+    # tout de suite, en fond, pour que le prochain poll reste une lecture.
+    affluence_snapshot.invalidate(db, event)
+    threading.Thread(target=_rebuild_affluence, args=(event, str(year)),
+                     name="affluence-rebuild", daemon=True).start()
     try:
         result = run_merge(db, event, str(year))
         return jsonify(result)
@@ -4637,6 +4752,7 @@ def run_merge_manual():
     if not event or not year:
         return jsonify({"error": "event et year requis"}), 400
 
+    _bump_alert_engine_version("context")
     try:
         result = run_merge(db, event, str(year))
         return jsonify(result)
@@ -4768,7 +4884,10 @@ def pcorg_live():
         year = int(year)
     except ValueError:
         return jsonify({"error": "year invalide"}), 400
+    return jsonify(_pcorg_live_payload(event, year))
+
 
+def _pcorg_live_payload(event, year):
     base = {"event": event, "year": year, "category": {"$regex": "^PCO"}}
     col = db["pcorg"]
 
@@ -4784,7 +4903,7 @@ def pcorg_live():
     ).sort("close_ts", -1).limit(PCORG_CLOSED_PAGE_SIZE))
     closed_total = col.count_documents(closed_query)
 
-    return jsonify({
+    return {
         "open": [_pcorg_serialise(d) for d in open_docs],
         "closed": [_pcorg_serialise(d) for d in closed_docs],
         "counts": {
@@ -4793,7 +4912,138 @@ def pcorg_live():
             "closed_total": closed_total,
         },
         "closed_page_size": PCORG_CLOSED_PAGE_SIZE,
-    })
+    }
+
+
+# ---------------------------------------------------------------------------
+# Mesures (metrics.py)
+# ---------------------------------------------------------------------------
+
+@app.route('/api/_metrics', methods=['GET'])
+@role_required("admin")
+def api_metrics():
+    """Latences par route (p50/p95/p99, histogramme), commandes Mongo et tailles
+    par requete, et les dernieres requetes lentes avec leurs commandes Mongo
+    les plus couteuses. ?sort=total_s (defaut), p95_ms, mongo_ms_per_request..."""
+    return jsonify(metrics.registry.snapshot(request.args.get("sort", "total_s")))
+
+
+@app.route('/api/_metrics/reset', methods=['POST'])
+@role_required("admin")
+def api_metrics_reset():
+    metrics.registry.reset()
+    return jsonify({"ok": True})
+
+
+# ---------------------------------------------------------------------------
+# Push live (SSE) : remplace le polling des ecrans live, voir live_push.py
+# ---------------------------------------------------------------------------
+
+push_hub = live_push.install(lambda: db)
+
+
+def _push_pcorg(db_, params):
+    payload = _pcorg_live_payload(params["event"], params["year"])
+    # Les compteurs par categorie de /api/pcorg/stats voyagent avec la liste :
+    # l'ecran n'a plus a les redemander a chaque tour.
+    meta = {"counts": payload["counts"], "closed_page_size": payload["closed_page_size"],
+            "stats": _pcorg_stats_payload(params["event"], params["year"])}
+    return payload["open"] + payload["closed"], meta
+
+
+def _push_anoloc(db_, params):
+    config = db_["anoloc_config"].find_one({"_id": "global"})
+    if not config or not config.get("enabled"):
+        return [], {"enabled": False}
+    groups = build_live_groups(db_, config, None, params.get("event"), params.get("year"))
+    return [dict(g, key=k) for k, g in groups.items()], {"enabled": True}
+
+
+def _push_field_unread(db_, params):
+    return [{"device_id": k, "count": n} for k, n in sorted(unread_by_device(db_).items())], None
+
+
+# Periodes : celles des anciens pollings, mais payees une fois par canal.
+# pcorg : la version d'analyse_ops (montee par chaque ecriture, ici ou dans
+# pcorg_sync) est relue toutes les 5 s ; la liste, seulement si elle bouge.
+push_hub.register("pcorg", _push_pcorg, key=lambda f: f["id"], interval_s=5,
+                  version=lambda db_, p: read_source_version(db_, p["event"], p["year"]),
+                  max_stale_s=60)
+# alerts : un canal par ensemble de slugs (partage par les utilisateurs qui
+# ont le meme) ; le filtre passe dans la requete, avant la limite, comme la
+# route /api/active-alerts.
+push_hub.register("alerts", lambda db_, p: (_active_alerts_list(
+                      list(p["slugs"]) if p["slugs"] is not None else None, limit=200), None),
+                  key=lambda a: a["_id"], interval_s=10)
+push_hub.register("hik", lambda db_, p: (_hik_console_rows(p["since"]), {"window_seconds": p["since"]}),
+                  key=lambda r: "%s|%s" % (r["camera_path"], r["event_type"]),
+                  interval_s=5, admin_only=True)
+push_hub.register("anoloc", _push_anoloc, key=lambda g: g["key"], interval_s=15)
+push_hub.register("field_unread", _push_field_unread, key=lambda r: r["device_id"],
+                  interval_s=8, admin_only=True)
+
+
+def _push_demande(name, payload):
+    """(params, filtre) d'un topic pour l'utilisateur courant, ou une erreur."""
+    if name == "pcorg":
+        try:
+            return {"event": request.args["event"], "year": int(request.args["year"])}, None, None
+        except (KeyError, ValueError):
+            return None, None, "event et year requis"
+    if name == "hik":
+        try:
+            since_s = int(request.args.get("since", "900"))
+        except ValueError:
+            since_s = 900
+        return {"since": max(60, min(86400, since_s))}, None, None
+    if name == "alerts":
+        slugs = _get_user_alert_slugs(payload)
+        return {"slugs": tuple(sorted(slugs)) if slugs is not None else None}, None, None
+    if name == "anoloc":
+        config = db["anoloc_config"].find_one({"_id": "global"}) or {}
+        visibles = _get_user_visible_groups(config)
+        params = {"event": request.args.get("event") or None, "year": request.args.get("year") or None}
+        if visibles is None:
+            return params, None, None
+        visibles = set(visibles)
+        return params, (lambda g: g.get("group_id") in visibles), None
+    return {}, None, None
+
+
+@app.route('/api/live/stream', methods=['GET'])
+@role_required("user")
+def live_stream():
+    """Flux SSE des topics demandes : ?topics=pcorg,alerts,hik,anoloc,field_unread
+    (+ event/year pour pcorg et anoloc, since pour hik).
+
+    Un evenement `snapshot` par topic a l'ouverture, puis des `delta`
+    {upsert, remove, order[, meta]}. 503 si tous les flux sont pris : le
+    client garde alors son polling.
+    """
+    payload = getattr(request, 'user_payload', {})
+    is_admin = payload.get("is_super_admin") or payload.get("app_role") == "admin"
+    demandes = []
+    for name in (request.args.get("topics") or "").split(","):
+        name = name.strip()
+        topic = push_hub.topic(name)
+        if topic is None:
+            continue
+        if topic.admin_only and not is_admin:
+            continue
+        params, accept, err = _push_demande(name, payload)
+        if err:
+            return jsonify({"error": err}), 400
+        demandes.append((name, params, accept))
+    if not demandes:
+        return jsonify({"error": "aucun topic"}), 400
+
+    sub = push_hub.subscribe(demandes)
+    if sub is None:
+        return jsonify({"error": "flux satures"}), 503
+    resp = Response(stream_with_context(sub.events()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
 
 
 @app.route('/api/pcorg/stats', methods=['GET'])
@@ -4807,7 +5057,10 @@ def pcorg_stats():
         year = int(year)
     except ValueError:
         return jsonify({"error": "year invalide"}), 400
+    return jsonify(_pcorg_stats_payload(event, year))
+
 
+def _pcorg_stats_payload(event, year):
     pipeline = [
         {"$match": {"event": event, "year": year, "category": {"$regex": "^PCO"}}},
         {"$group": {
@@ -4833,14 +5086,14 @@ def pcorg_stats():
             bucket["open"] = n
             total_open += n
 
-    return jsonify({
+    return {
         "counts": counts,
         "totals": {
             "open": total_open,
             "closed": total_closed,
             "all": total_open + total_closed,
         },
-    })
+    }
 
 
 @app.route('/api/pcorg/closed', methods=['GET'])
@@ -5239,6 +5492,7 @@ def pcorg_create():
         "extracted": {"phones": None, "plates": None},
         "tags": [],
         "synced_at": None,
+        "modified_at": datetime.now(timezone.utc),
         "sql_id": None,
         "guid": None,
         "server": "COCKPIT",
@@ -5246,6 +5500,7 @@ def pcorg_create():
     }
 
     db["pcorg"].insert_one(doc)
+    bump_source_version(db, event, year)
 
     # Engager la tablette terrain si patrouille correspond
     patr = content_cat.get("patrouille", "")
@@ -5363,6 +5618,7 @@ def pcorg_quick_create():
         "extracted": {"phones": None, "plates": None},
         "tags": [],
         "synced_at": None,
+        "modified_at": datetime.now(timezone.utc),
         "sql_id": None,
         "guid": None,
         "server": "COCKPIT",
@@ -5370,6 +5626,7 @@ def pcorg_quick_create():
     }
 
     db["pcorg"].insert_one(doc)
+    bump_source_version(db, event, year)
 
     # Engager la tablette terrain si patrouille correspond
     if patrouille:
@@ -5461,11 +5718,13 @@ def pcorg_update(doc_id):
     if not sets:
         return jsonify({"error": "rien a mettre a jour"}), 400
 
+    sets["modified_at"] = datetime.now(timezone.utc)
     update_ops = {"$set": sets}
     if ts_history_entry:
         update_ops["$push"] = {"comment_history": ts_history_entry}
 
     db["pcorg"].update_one({"_id": doc_id}, update_ops)
+    bump_source_version(db, doc.get("event"), doc.get("year"))
 
     # Si patrouille a ete modifie, engager la tablette terrain
     new_patr = (cc_update or {}).get("patrouille", "")
@@ -5512,11 +5771,12 @@ def pcorg_add_comment(doc_id):
     db["pcorg"].update_one(
         {"_id": doc_id},
         {
-            "$set": {"comment": new_comment},
+            "$set": {"comment": new_comment, "modified_at": datetime.now(timezone.utc)},
             "$push": {"comment_history": history_entry},
             "$inc": {"bounce_rev": 1},
         }
     )
+    bump_source_version(db, doc.get("event"), doc.get("year"))
     return jsonify({"ok": True, "entry": history_entry})
 
 
@@ -5612,11 +5872,12 @@ def pcorg_camera_capture():
         db["pcorg"].update_one(
             {"_id": fiche_id},
             {
-                "$set": {"comment": new_comment},
+                "$set": {"comment": new_comment, "modified_at": datetime.now(timezone.utc)},
                 "$push": {"comment_history": history_entry},
                 "$inc": {"bounce_rev": 1},
             }
         )
+        bump_fiche_source(db, fiche_id)
         result["entry"] = history_entry
 
     return jsonify(result)
@@ -5638,10 +5899,12 @@ def pcorg_update_gps(doc_id):
 
     result = db["pcorg"].update_one(
         {"_id": doc_id},
-        {"$set": {"gps": {"type": "Point", "coordinates": [lon, lat]}}}
+        {"$set": {"gps": {"type": "Point", "coordinates": [lon, lat]},
+                  "modified_at": datetime.now(timezone.utc)}}
     )
     if result.matched_count == 0:
         return jsonify({"error": "introuvable"}), 404
+    bump_fiche_source(db, doc_id)
     return jsonify({"ok": True})
 
 
@@ -5687,11 +5950,13 @@ def pcorg_set_urgency(doc_id):
     db["pcorg"].update_one(
         {"_id": doc_id},
         {
-            "$set": {"niveau_urgence": niveau, "comment": new_comment},
+            "$set": {"niveau_urgence": niveau, "comment": new_comment,
+                     "modified_at": datetime.now(timezone.utc)},
             "$push": {"comment_history": history_entry},
             "$inc": {"bounce_rev": 1},
         }
     )
+    bump_fiche_source(db, doc_id)
     return jsonify({"ok": True, "entry": history_entry})
 
 
@@ -5733,10 +5998,12 @@ def pcorg_close(doc_id):
                 "operator_close": operator_name,
                 "operator_id_close": user.get("email", ""),
                 "comment": new_comment,
+                "modified_at": datetime.now(timezone.utc),
             },
             "$push": {"comment_history": history_entry},
         }
     )
+    bump_source_version(db, doc.get("event"), doc.get("year"))
 
     # Auto-disengage: reset tablet to "patrouille" when cockpit closes fiche
     _disengage_field_device(doc, doc_id)
@@ -5822,10 +6089,12 @@ def field_device_release():
             db["pcorg"].update_one(
                 {"_id": fiche_id},
                 {
-                    "$set": {"comment": new_comment, "content_category.patrouille": ""},
+                    "$set": {"comment": new_comment, "content_category.patrouille": "",
+                             "modified_at": datetime.now(timezone.utc)},
                     "$push": {"comment_history": history_entry},
                 },
             )
+            bump_fiche_source(db, fiche_id)
 
     return jsonify({"ok": True, "device_name": device_name})
 
@@ -5834,9 +6103,12 @@ def field_device_release():
 @role_required("admin")
 def pcorg_delete(doc_id):
     """Supprime une fiche d'intervention (admin uniquement)."""
+    doc = db["pcorg"].find_one({"_id": doc_id}, {"event": 1, "year": 1})
     result = db["pcorg"].delete_one({"_id": doc_id})
     if result.deleted_count == 0:
         return jsonify({"error": "introuvable"}), 404
+    doc = doc or {}
+    bump_source_version(db, doc.get("event"), doc.get("year"))
     return jsonify({"ok": True})
 
 
@@ -6954,6 +7226,17 @@ def hsh_archive_and_purge():
         counts["titres_agg"] = len(docs)
         src_titres.delete_many({"evenement": evenement})
 
+    # 1c. Archiver le registre des presents (deltas + checkpoints), purger le solde
+    for nom, cle in ((presence_ledger.COL_DELTAS, "presence_deltas"),
+                     (presence_ledger.COL_CHECKPOINTS, "presence_checkpoints")):
+        docs = list(db[nom].find({"evenement": evenement}))
+        if docs:
+            dest = db[f"hsh_archive_{cle}_{archive_tag}"]
+            dest.insert_many(docs)
+            counts[cle] = len(docs)
+            db[nom].delete_many({"evenement": evenement})
+    db[presence_ledger.COL_SOLDES].delete_one({"_id": evenement})
+
     # 2. Archiver hsh_erreurs
     docs = list(COL_HSH_ERREURS.find({"evenement": evenement}))
     if docs:
@@ -6978,6 +7261,9 @@ def hsh_archive_and_purge():
     if docs:
         dest = db[f"hsh_archive_compteurs_{archive_tag}"]
         dest.insert_many(docs)
+        # Les pics par tranche ignorent la collection : l'archive les garde
+        # tels quels, on rattrape juste ce que le collecteur n'a pas replie.
+        counts["pics_15min"] = peak_rollup.replier(db, docs)
         counts["compteurs"] = len(docs)
         db.data_access.delete_many({
             "requested_event": evenement,
@@ -7425,6 +7711,7 @@ def hsh_get_counters():
 @app.route('/api/live-controle/dashboard', methods=['GET'])
 @role_required("user")
 @block_required("widget-counters")
+@heavy
 def hsh_get_dashboard():
     """Dashboard contexte pour le plein-ecran : series temporelles par zone,
     pics jour, comparaison N-1. Param optionnel ?date=YYYY-MM-DD pour choisir
@@ -7915,6 +8202,31 @@ def hsh_get_status():
     })
 
 
+@app.route('/api/live-controle/presents', methods=['GET'])
+@role_required("user")
+def hsh_presents():
+    """Presents par zone et categorie, lus dans le registre tenu par le
+    collecteur (presence_ledger) au lieu de rejouer handshake_forensic.
+
+    Query : evenement (defaut ___GLOBAL___), a et depuis en heure de Paris
+    "YYYY-MM-DD HH:MM" (defaut maintenant / debut de la journee), zone (nom
+    de l'Area, toutes si absent)."""
+    evenement = request.args.get("evenement")
+    if not evenement:
+        doc = db.data_access.find_one({"_id": HSH_GLOBAL_ID}) or {}
+        evenement = doc.get("evenement", "")
+    if not evenement:
+        return jsonify({"ok": False, "error": "Evenement requis"}), 400
+    try:
+        instant = presence_ledger.instant_hsh(request.args["a"]) if request.args.get("a") else None
+        depuis = presence_ledger.instant_hsh(request.args["depuis"]) if request.args.get("depuis") else None
+    except ValueError as exc:
+        return jsonify({"ok": False, "error": str(exc)}), 400
+    res = presence_ledger.presents(db, evenement, instant=instant, depuis=depuis,
+                                   zone=request.args.get("zone") or None)
+    return jsonify({"ok": True, **res})
+
+
 ################################################################################
 # WhatsApp (WAHA) - API admin
 ################################################################################
@@ -8431,5 +8743,7 @@ if __name__ == "__main__":
         logger.info(f"[DEV] Running TITAN Home in development mode on port {PORT}")
         app.run(debug=True, use_reloader=True, host="127.0.0.1", port=PORT)
     else:
-        logger.warning(f"[PROD] Running TITAN Home on port {PORT}")
-        serve(app, host="0.0.0.0", port=PORT)
+        logger.warning(f"[PROD] Running TITAN Home on port {PORT} ({serving.profile!r})")
+        for avert in serving.profile.check():
+            logger.warning("[PROD] Profil waitress : %s", avert)
+        serve(app, host="0.0.0.0", port=PORT, **serving.profile.waitress_kwargs())
@@ -1,56 +1,49 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-calcul_presents.py — Calcule les presents sur site a un instant donne
-en rejouant toutes les transactions depuis le debut de la journee.
+calcul_presents.py — Calcule les presents sur site a un instant donne.
 
-Utilise la collection handshake_forensic (ou une archive) pour
-comptabiliser entrees - sorties dans ENCEINTE GENERALE, ventile
-par categorie (personne, vehicule, enfant, accredite).
+Par defaut, lit le registre des presents tenu par le collecteur live
+(presence_ledger : checkpoint de 5 minutes + rejeu court), ventile par zone
+et par categorie (personne, vehicule, enfant, accredite).
 
-Usage:
-    python calcul_presents.py
+--rejouer garde l'ancien calcul : rejeu de toutes les transactions de
+handshake_forensic (ou d'une archive, ou d'un export JSON) depuis le debut
+de la periode, avec le detail par porte et par titre vehicule. Lent un jour
+de forte affluence, mais independant du registre : utile pour le verifier.
 
-Le script demande la date/heure en prompt (heure de Paris).
+Usage:
+    python calcul_presents.py                              # maintenant
+    python calcul_presents.py --a "2026-06-13 22:00"
+    python calcul_presents.py --a "2026-06-13 22:00" --depuis "2026-06-13 06:00"
+    python calcul_presents.py --zone ""                    # toutes les zones
+    python calcul_presents.py --rejouer --source hsh_archive_tx_24H_AUTOS_2026
+    python calcul_presents.py --json
+
+Les dates sont en heure de Paris (YYYY-MM-DD HH:MM).
 """
 
-import datetime
-import zoneinfo
+import argparse
+import json
 import os
-import sys
 
 from pymongo import MongoClient
 
+import presence_ledger
+from presence_ledger import categoriser_scan
+
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 _TITAN_ENV = os.getenv("TITAN_ENV", "dev").strip().lower()
 DB_NAME = "titan" if _TITAN_ENV in {"prod", "production"} else "titan_dev"
 
-TZ_PARIS = zoneinfo.ZoneInfo("Europe/Paris")
-
 mongo_client = MongoClient(MONGO_URI)
 db = mongo_client[DB_NAME]
 
+JSON_FORENSIC = os.path.join(os.path.dirname(__file__), "uploads", "titan.handshake_forensic.json")
+
 
 def charger_cache_titres():
-    cache = {}
-    for doc in db["access_barcodes_utids"].find({}, {"utid": 1, "title": 1}):
-        utid = doc.get("utid")
-        if utid:
-            cache[utid] = doc.get("title", "")
-    return cache
-
-
-def categoriser_scan(utid, cache_titres, upid=None):
-    if upid and upid.endswith("-ACCRED"):
-        return "accredite"
-    if utid and utid.startswith("EWC"):
-        return "accredite"
-    if utid and utid in cache_titres:
-        title = cache_titres[utid]
-        if "Bracelet Enfant" in title:
-            return "enfant"
-        return "vehicule"
-    return "personne"
+    return presence_ledger.charger_cache_titres(db)
 
 
 def lister_collections_forensic():
@@ -65,99 +58,56 @@ def lister_collections_forensic():
     return cols
 
 
-def main():
-    print("=" * 60)
-    print("  CALCUL DES PRESENTS SUR SITE")
-    print("=" * 60)
-    print()
-
-    # Source : collections MongoDB ou fichier JSON
-    json_source = None
-    cols = lister_collections_forensic()
-
-    # Chercher aussi un fichier JSON forensic
-    json_path = os.path.join(os.path.dirname(__file__), "uploads", "titan.handshake_forensic.json")
-    has_json = os.path.exists(json_path)
+def evenement_courant():
+    doc = db["data_access"].find_one({"_id": "___GLOBAL___"}) or {}
+    return doc.get("evenement", "")
 
-    sources = []
-    for name, count in cols:
-        sources.append(("mongo", name, count))
-    if has_json:
-        sources.append(("json", json_path, None))
 
-    if not sources:
-        print("Aucune source de transactions trouvee.")
-        return
+# ---------------------------------------------------------------------------
+# Registre (defaut)
+# ---------------------------------------------------------------------------
 
-    print("Sources disponibles :")
-    for i, (stype, name, count) in enumerate(sources, 1):
-        if stype == "mongo":
-            print(f"  {i}. [MongoDB] {name} ({count:,} documents)")
-        else:
-            print(f"  {i}. [Fichier] {os.path.basename(name)}")
-    print()
-
-    if len(sources) == 1:
-        selected = sources[0]
-        label = selected[1] if selected[0] == "mongo" else os.path.basename(selected[1])
-        print(f"Source selectionnee : {label}")
-    else:
-        choix = input("Numero de la source [1] : ").strip()
-        if not choix:
-            choix = "1"
-        try:
-            idx = int(choix) - 1
-            selected = sources[idx]
-        except (ValueError, IndexError):
-            print("Choix invalide.")
-            return
-
-    col = None
-    if selected[0] == "mongo":
-        col = db[selected[1]]
+def afficher_registre(res):
+    print(f"{'=' * 60}")
+    print(f"  PRESENTS AU {res['instant']} (Paris) — {res['evenement']}")
+    print(f"{'=' * 60}")
+    print(f"  Depuis : {res['depuis']}")
+    if res["methode"] == "solde":
+        print("  Source : solde courant du registre")
     else:
-        import json as jsonlib
-        print(f"Chargement de {os.path.basename(selected[1])}...")
-        with open(selected[1], "r", encoding="utf-8") as f:
-            json_source = jsonlib.load(f)
-        print(f"  {len(json_source):,} transactions chargees.")
-    print()
-
-    # Demander la date/heure de debut
-    now_paris = datetime.datetime.now(TZ_PARIS)
-    print("Depuis quelle date/heure compter les transactions ?")
-    print("Format : YYYY-MM-DD HH:MM (heure de Paris)")
-    print("Exemple : 2026-04-13 06:00")
-    print(f"Vide    = debut de la journee ({now_paris.strftime('%Y-%m-%d')} 00:00)")
+        print(f"  Source : checkpoint {res['checkpoint'] or '-'}"
+              f" + {res['rejeu']:,} transactions rejouees")
     print()
-    dt_input = input("Depuis : ").strip()
-
-    if not dt_input:
-        debut_paris = now_paris.replace(hour=0, minute=0, second=0, microsecond=0)
-    else:
-        try:
-            debut_paris = datetime.datetime.strptime(dt_input, "%Y-%m-%d %H:%M")
-            debut_paris = debut_paris.replace(tzinfo=TZ_PARIS)
-        except ValueError:
-            print("Format invalide. Utilisez YYYY-MM-DD HH:MM")
-            return
-
-    debut_str = debut_paris.strftime("%Y-%m-%d %H:%M:%S")
-    cible_str = now_paris.strftime("%Y-%m-%d %H:%M:%S")
+    if not res["zones"]:
+        print("  Aucune zone dans le registre pour cette periode.")
+        print()
+    for zone in sorted(res["zones"].values(), key=lambda z: -z["total"]):
+        p = zone["presents"]
+        print(f"  --- {zone['name'] or '?'} ---")
+        print(f"  Total compteur (comme Skidata)  : {zone['total']:>8,}")
+        print(f"    - Vehicules presents          : {p['vehicule']:>8,}")
+        print(f"  = Personnes sur site            : {zone['personnes']:>8,}")
+        print(f"      dont accredites             : {p['accredite']:>8,}")
+        print(f"      dont enfants                : {p['enfant']:>8,}")
+        print()
+        print(f"  {'Categorie':<14} {'Entrees':>8} {'Sorties':>8} {'Presents':>8}")
+        print(f"  {'-'*14} {'-'*8} {'-'*8} {'-'*8}")
+        for cat_label, cat_key in [("Personnes", "personne"), ("Vehicules", "vehicule"),
+                                    ("Enfants", "enfant"), ("Accredites", "accredite")]:
+            e = zone[f"entrees_{cat_key}"]
+            s = zone[f"sorties_{cat_key}"]
+            print(f"  {cat_label:<14} {e:>8,} {s:>8,} {e - s:>8,}")
+        print()
+    print(f"{'=' * 60}")
 
-    print()
-    print(f"Calcul des presents dans ENCEINTE GENERALE")
-    print(f"  Du    : {debut_str} (Paris)")
-    print(f"  Au    : {cible_str} (Paris) — maintenant")
-    print()
 
-    # Charger le cache des titres
-    cache_titres = charger_cache_titres()
-    print(f"Cache titres : {len(cache_titres)} UTID charges")
-    print()
+# ---------------------------------------------------------------------------
+# Rejeu complet (--rejouer)
+# ---------------------------------------------------------------------------
 
-    # Requeter les transactions OK (status=0) dans ENCEINTE GENERALE
-    # jusqu'a l'heure cible
+def rejouer(source_iter, cache_titres):
+    """Rejoue des transactions OK deja filtrees -> compteurs, par porte,
+    par titre vehicule."""
     total_tx = 0
     compteurs = {
         "entrees_personne": 0, "sorties_personne": 0,
@@ -168,29 +118,6 @@ def main():
     par_gate = {}
     par_titre_veh = {}
 
-    if col is not None:
-        # Source MongoDB
-        filtre = {
-            "status": "0",
-            "area.Name": "ENCEINTE GENERALE",
-            "date_paris": {"$gte": debut_str, "$lte": cible_str},
-        }
-        source_iter = col.find(filtre).sort("date_paris", 1)
-    else:
-        # Source JSON — filtrer en Python
-        def json_filter():
-            for tx in json_source:
-                if tx.get("status") != "0":
-                    continue
-                area = tx.get("area") or {}
-                if area.get("Name") != "ENCEINTE GENERALE":
-                    continue
-                dp = tx.get("date_paris", "")
-                if dp < debut_str or dp > cible_str:
-                    continue
-                yield tx
-        source_iter = json_filter()
-
     for tx in source_iter:
         total_tx += 1
         direction = tx.get("direction", "")
@@ -222,7 +149,10 @@ def main():
             elif direction == "Sortie":
                 par_titre_veh[titre]["sorties"] += 1
 
-    # Calculs
+    return total_tx, compteurs, par_gate, par_titre_veh
+
+
+def afficher_rejeu(cible_str, zone, total_tx, compteurs, par_gate, par_titre_veh):
     p_pers = compteurs["entrees_personne"] - compteurs["sorties_personne"]
     p_veh = compteurs["entrees_vehicule"] - compteurs["sorties_vehicule"]
     p_enf = compteurs["entrees_enfant"] - compteurs["sorties_enfant"]
@@ -230,13 +160,12 @@ def main():
     p_total_skidata = p_pers + p_veh + p_enf + p_acc
     p_personnes = p_pers + p_enf + p_acc  # humains = tout sauf vehicules
 
-    # Affichage
     print(f"{'=' * 60}")
     print(f"  RESULTATS AU {cible_str} (Paris)")
     print(f"{'=' * 60}")
     print(f"  Transactions OK analysees : {total_tx:,}")
     print()
-    print(f"  --- PRESENTS SUR SITE (ENCEINTE GENERALE) ---")
+    print(f"  --- PRESENTS SUR SITE ({zone}) ---")
     print()
     print(f"  Total compteur (comme Skidata)  : {p_total_skidata:>8,}")
     print(f"    - Vehicules presents          : {p_veh:>8,}")
@@ -276,6 +205,98 @@ def main():
     print(f"{'=' * 60}")
 
 
+def main_rejouer(args, debut_str, cible_str):
+    source = args.source
+    if source is None:
+        cols = lister_collections_forensic()
+        if cols:
+            source = cols[0][0] if len(cols) == 1 else "handshake_forensic"
+        elif os.path.exists(JSON_FORENSIC):
+            source = JSON_FORENSIC
+        else:
+            print("Aucune source de transactions trouvee.")
+            return
+
+    zone = args.zone
+    if source.endswith(".json"):
+        print(f"Chargement de {os.path.basename(source)}...")
+        with open(source, "r", encoding="utf-8") as f:
+            json_source = json.load(f)
+        print(f"  {len(json_source):,} transactions chargees.")
+
+        # Source JSON — filtrer en Python
+        def json_filter():
+            for tx in json_source:
+                if tx.get("status") != "0":
+                    continue
+                area = tx.get("area") or {}
+                if zone and area.get("Name") != zone:
+                    continue
+                dp = tx.get("date_paris", "")
+                if dp < debut_str or dp > cible_str:
+                    continue
+                yield tx
+        source_iter = json_filter()
+    else:
+        print(f"Source : {source}")
+        filtre = {
+            "status": "0",
+            "date_paris": {"$gte": debut_str, "$lte": cible_str},
+        }
+        if zone:
+            filtre["area.Name"] = zone
+        source_iter = db[source].find(filtre).sort("date_paris", 1)
+
+    cache_titres = charger_cache_titres()
+    print(f"Cache titres : {len(cache_titres)} UTID charges")
+    print()
+    afficher_rejeu(cible_str, zone or "toutes zones",
+                   *rejouer(source_iter, cache_titres))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Presents sur site a un instant donne")
+    parser.add_argument("--a", dest="instant", default=None,
+                        help="Instant vise, heure Paris YYYY-MM-DD HH:MM (defaut: maintenant)")
+    parser.add_argument("--depuis", default=None,
+                        help="Compter depuis, heure Paris (defaut: debut de la journee)")
+    parser.add_argument("--evenement", default=None,
+                        help="Evenement (defaut: celui de ___GLOBAL___)")
+    parser.add_argument("--zone", default=presence_ledger.ZONE_DEFAUT,
+                        help=f"Nom de l'Area HSH (defaut: {presence_ledger.ZONE_DEFAUT} ; \"\" = toutes)")
+    parser.add_argument("--json", action="store_true", help="Sortie JSON (registre)")
+    parser.add_argument("--rejouer", action="store_true",
+                        help="Ancien calcul : rejeu complet des transactions")
+    parser.add_argument("--source", default=None,
+                        help="Avec --rejouer : collection (handshake_forensic, hsh_archive_tx_*) ou fichier .json")
+    args = parser.parse_args()
+
+    try:
+        instant = presence_ledger.instant_hsh(args.instant) if args.instant \
+            else presence_ledger.maintenant_hsh().replace(microsecond=0)
+        depuis = presence_ledger.instant_hsh(args.depuis) if args.depuis \
+            else instant.replace(hour=0, minute=0, second=0)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    if args.rejouer:
+        main_rejouer(args, depuis.strftime("%Y-%m-%d %H:%M:%S"),
+                     instant.strftime("%Y-%m-%d %H:%M:%S"))
+        return
+
+    evenement = args.evenement or evenement_courant()
+    if not evenement:
+        print("Aucun evenement configure dans ___GLOBAL___ (utilisez --evenement).")
+        return
+
+    res = presence_ledger.presents(db, evenement, instant=instant, depuis=depuis,
+                                   zone=args.zone or None)
+    if args.json:
+        print(json.dumps(res, ensure_ascii=False, indent=2))
+    else:
+        afficher_registre(res)
+
+
 if __name__ == "__main__":
     try:
         main()
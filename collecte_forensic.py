@@ -66,7 +66,8 @@ def collecter_et_stocker(sock, from_utc, to_utc, issuer=None):
             print(f"  Page {page}: pas de reponse.")
             break
 
-        not_complete, txs, max_txid = parse_transactions(resp)
+        # full=True : handshake_forensic garde tous les attributs.
+        not_complete, txs, max_txid = parse_transactions(resp, full=True)
         nb = len(txs)
         total += nb
 
@@ -74,12 +75,11 @@ def collecter_et_stocker(sock, from_utc, to_utc, issuer=None):
         if txs:
             ops = []
             for tx in txs:
-                tx_id = tx.get("transaction_id")
-                if tx_id is None:
+                if tx.transaction_id is None:
                     continue
                 ops.append(UpdateOne(
-                    {"_id": tx_id},
-                    {"$set": tx},
+                    {"_id": tx.transaction_id},
+                    {"$set": tx.full},
                     upsert=True,
                 ))
             if ops:
@@ -118,19 +118,19 @@ def collecter_depuis_curseur(sock, last_tx_id, issuer=None):
             print(f"  Page {page}: pas de reponse.")
             break
 
-        not_complete, txs, max_txid = parse_transactions(resp)
+        # full=True : handshake_forensic garde tous les attributs.
+        not_complete, txs, max_txid = parse_transactions(resp, full=True)
         nb = len(txs)
         total += nb
 
         if txs:
             ops = []
             for tx in txs:
-                tx_id = tx.get("transaction_id")
-                if tx_id is None:
+                if tx.transaction_id is None:
                     continue
                 ops.append(UpdateOne(
-                    {"_id": tx_id},
-                    {"$set": tx},
+                    {"_id": tx.transaction_id},
+                    {"$set": tx.full},
                     upsert=True,
                 ))
             if ops:
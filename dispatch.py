@@ -0,0 +1,142 @@
+"""Suggestion de la patrouille disponible la plus proche d'une fiche.
+
+Deux etages :
+
+  1. classement a vol d'oiseau sur un index spatial en memoire des
+     positions field_devices (DeviceIndex : grille geo_index, recherche des
+     k plus proches anneau par anneau). L'index est reconstruit au plus une
+     fois par INDEX_TTL_S et par (event, year), en une seule requete : un
+     classement ne relit pas Mongo et reste en dessous de la milliseconde
+     pour quelques centaines de tablettes ;
+  2. affinage des k premiers au temps de trajet (routing.travel_times : un
+     seul appel matrice Valhalla pour les k, pas k appels /route), fait par
+     la route HTTP dans routing.py.
+
+Filtres : statut (par defaut "patrouille" seulement ; "intervention" sur
+demande), beacon_group, batterie minimale, position plus recente que
+POSITION_MAX_AGE.
+
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from geo_index import GeoGrid, haversine_m
+
+# Cote des cellules de l'index : de l'ordre de l'ecart entre deux patrouilles
+# sur le site, pour que les premiers anneaux suffisent en general.
+INDEX_CELL_M = 500
+INDEX_TTL_S = 5
+
+# Une position plus vieille ne dit plus ou est la tablette.
+POSITION_MAX_AGE = timedelta(minutes=10)
+
+DEFAULT_STATUSES = ("patrouille",)
+DEFAULT_K = 5
+
+_cache = {}  # (event, year) -> (built_ts, DeviceIndex)
+_cache_lock = threading.Lock()
+
+
+def _as_utc(dt):
+    if isinstance(dt, datetime) and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class DeviceIndex:
+    """Positions des tablettes d'un evenement, rangees dans une GeoGrid."""
+
+    def __init__(self, devices):
+        self.devices = []
+        points = []
+        for d in devices:
+            pos = d.get("last_position") or {}
+            try:
+                lat, lng = float(pos["lat"]), float(pos["lng"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.devices.append(d)
+            points.append((lat, lng))
+        self.points = points
+        self.grid = GeoGrid.for_points(points, INDEX_CELL_M)
+        for i, (lat, lng) in enumerate(points):
+            self.grid.add(i, lat, lng)
+
+    def nearest(self, lat, lng, k, accept=None):
+        """Les k tablettes acceptees les plus proches : [(distance_m, device)]
+        tries par distance croissante."""
+        trouves = []
+        dernier = self.grid.max_ring(lat, lng)
+        r = 0
+        while r <= dernier:
+            for i in self.grid.ring(lat, lng, r):
+                device = self.devices[i]
+                if accept is not None and not accept(device):
+                    continue
+                p = self.points[i]
+                trouves.append((haversine_m(lat, lng, p[0], p[1]), i))
+            if len(trouves) >= k:
+                trouves.sort()
+                # Tout ce qui reste est au-dela de r * cell_m.
+                if trouves[k - 1][0] <= r * self.grid.cell_m:
+                    break
+            r += 1
+        trouves.sort()
+        return [(d, self.devices[i]) for d, i in trouves[:k]]
+
+
+def device_index(db, event, year, now_ts=None):
+    """Index des tablettes non revoquees de (event, year), cache INDEX_TTL_S."""
+    now_ts = time.time() if now_ts is None else now_ts
+    key = (str(event), str(year))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit and now_ts - hit[0] < INDEX_TTL_S:
+            return hit[1]
+    devices = list(db["field_devices"].find(
+        {"event": event, "year": str(year), "revoked": {"$ne": True}},
+        {"name": 1, "status": 1, "beacon_group_id": 1, "last_position": 1,
+         "last_seen": 1, "active_fiche_id": 1},
+    ))
+    index = DeviceIndex(devices)
+    with _cache_lock:
+        _cache[key] = (now_ts, index)
+    return index
+
+
+def reset_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def make_filter(statuses=DEFAULT_STATUSES, beacon_group=None, min_battery=None,
+                now=None, exclude_ids=()):
+    now = now or datetime.now(timezone.utc)
+    statuses = set(statuses)
+    exclude_ids = {str(i) for i in exclude_ids}
+
+    def accept(device):
+        if (device.get("status") or "patrouille") not in statuses:
+            return False
+        if str(device.get("_id")) in exclude_ids:
+            return False
+        if beacon_group and device.get("beacon_group_id") != beacon_group:
+            return False
+        pos = device.get("last_position") or {}
+        ts = _as_utc(pos.get("ts"))
+        if not isinstance(ts, datetime) or now - ts > POSITION_MAX_AGE:
+            return False
+        if min_battery is not None:
+            battery = pos.get("battery")
+            if battery is None or battery < min_battery:
+                return False
+        return True
+    return accept
+
+
+def candidates(db, event, year, lat, lng, k=DEFAULT_K, **filtres):
+    """Les k tablettes disponibles les plus proches a vol d'oiseau."""
+    return device_index(db, event, year).nearest(lat, lng, k, make_filter(**filtres))
@@ -26,6 +26,11 @@ import re
 import uuid as _uuid
 from functools import wraps
 
+from analyse_ops import bump_source_version, bump_fiche_source
+import gps_history
+import live_push
+from serving import heavy
+
 try:
     from PIL import Image, ImageOps
     _PIL_AVAILABLE = True
@@ -523,18 +528,21 @@ def field_token_required(f):
                 return jsonify({"error": "event_ended"}), 401
             return redirect("/field/denied")
 
-        # Mettre a jour last_seen (best-effort)
-        try:
-            db["field_devices"].update_one(
-                {"_id": device["_id"]},
-                {"$set": {
-                    "last_seen": _now(),
-                    "last_ip": _client_ip(),
-                    "last_ua": (request.headers.get("User-Agent") or "")[:200],
-                }},
-            )
-        except Exception:
-            pass
+        # Mettre a jour last_seen (best-effort). Les routes qui ecrivent de
+        # toute facon sur la tablette (positions) fusionnent ce $set dans
+        # leur propre update_one : un aller-retour de moins par ping.
+        touch = {
+            "last_seen": _now(),
+            "last_ip": _client_ip(),
+            "last_ua": (request.headers.get("User-Agent") or "")[:200],
+        }
+        if getattr(f, "_field_merges_touch", False):
+            request.field_touch = touch
+        else:
+            try:
+                db["field_devices"].update_one({"_id": device["_id"]}, {"$set": touch})
+            except Exception:
+                pass
 
         request.device = device
         return f(*args, **kwargs)
@@ -947,118 +955,220 @@ def field_push_unsubscribe():
     return jsonify({"ok": True})
 
 
-@field_bp.route("/field/position", methods=["POST"])
-@field_token_required
-def field_position():
-    """Recevoir une position GPS de la tablette (ecrit dans field_devices.last_position)."""
-    data = request.get_json(silent=True) or {}
-    try:
-        lat = float(data.get("lat"))
-        lng = float(data.get("lng"))
-    except (TypeError, ValueError):
-        return jsonify({"ok": False, "error": "invalid_coords"}), 400
+# ---------------------------------------------------------------------------
+# Positions GPS
+# ---------------------------------------------------------------------------
 
-    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
-        return jsonify({"ok": False, "error": "out_of_range"}), 400
+# Historique des positions : ecrit en tache de fond, par lots (voir
+# gps_history.BufferedWriter). Le ping n'attend plus Mongo pour ca.
+_history_writer = gps_history.BufferedWriter(lambda: _get_mongo_db())
 
-    accuracy = data.get("accuracy")
-    try:
-        accuracy = float(accuracy) if accuracy is not None else None
-    except (TypeError, ValueError):
-        accuracy = None
+# Coordonnees et statut des fiches assignees, pour le test de proximite :
+# la meme fiche est relue a chaque ping de chaque tablette qui la suit.
+_FICHE_GPS_TTL_S = 30
+_fiche_gps_cache = {}  # fiche_id -> (checked_at_ts, (lat, lng) | None, status_code)
 
-    speed = data.get("speed")
-    try:
-        speed = float(speed) if speed is not None else None
-    except (TypeError, ValueError):
-        speed = None
+PROXIMITY_RADIUS_M = 10
+POSITIONS_BATCH_MAX = 500
+# Un point de backlog plus vieux que ca ne sert plus (ni trace, ni position).
+POSITIONS_BACKLOG_MAX_AGE = timedelta(hours=24)
+
+
+def _haversine_m(a_lat, a_lng, b_lat, b_lng):
+    from math import radians, sin, cos, asin, sqrt
+    dl = radians(b_lat - a_lat)
+    do = radians(b_lng - a_lng)
+    h = sin(dl / 2) ** 2 + cos(radians(a_lat)) * cos(radians(b_lat)) * sin(do / 2) ** 2
+    return 2 * 6371000 * asin(min(1, sqrt(h)))
+
+
+def _fiche_target(db, fiche_id):
+    """((lat, lng) ou None, status_code) d'une fiche, via le cache TTL."""
+    now_ts = _now().timestamp()
+    cached = _fiche_gps_cache.get(fiche_id)
+    if cached and now_ts - cached[0] < _FICHE_GPS_TTL_S:
+        return cached[1], cached[2]
+    fiche = db["pcorg"].find_one({"_id": fiche_id}, {"gps": 1, "status_code": 1}) or {}
+    fcoords = (fiche.get("gps") or {}).get("coordinates") or []
+    target = (fcoords[1], fcoords[0]) if len(fcoords) >= 2 else None
+    _fiche_gps_cache[fiche_id] = (now_ts, target, fiche.get("status_code"))
+    return target, fiche.get("status_code")
+
+
+def _forget_fiche_target(fiche_id):
+    _fiche_gps_cache.pop(fiche_id, None)
 
-    heading = data.get("heading")
+
+def _float_or_none(value):
     try:
-        heading = float(heading) if heading is not None else None
+        return float(value) if value is not None else None
     except (TypeError, ValueError):
-        heading = None
+        return None
 
-    battery = data.get("battery")
+
+def _parse_position(data, ts):
+    """Point recu de la tablette -> (pos_doc, None) ou (None, code_erreur)."""
     try:
-        battery = float(battery) if battery is not None else None
+        lat = float(data.get("lat"))
+        lng = float(data.get("lng"))
     except (TypeError, ValueError):
-        battery = None
+        return None, "invalid_coords"
+
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        return None, "out_of_range"
 
-    pos_doc = {
+    return {
         "lat": lat,
         "lng": lng,
-        "accuracy": accuracy,
-        "speed": speed,
-        "heading": heading,
-        "battery": battery,
-        "ts": _now(),
-    }
+        "accuracy": _float_or_none(data.get("accuracy")),
+        "speed": _float_or_none(data.get("speed")),
+        "heading": _float_or_none(data.get("heading")),
+        "battery": _float_or_none(data.get("battery")),
+        "ts": ts,
+    }, None
 
-    db = _get_mongo_db()
-    db["field_devices"].update_one(
-        {"_id": request.device["_id"]},
-        {"$set": {
-            "last_position": pos_doc,
-            "last_seen": _now(),
-        }},
-    )
 
-    # -- Historique des positions (meme collection que les balises anoloc)
+def _client_ts(value, now):
+    """Horodatage tablette (ms epoch) en datetime UTC, ou None s'il est
+    illisible ou hors de [now - POSITIONS_BACKLOG_MAX_AGE, now]."""
     try:
-        db["anoloc_positions"].insert_one({
-            "device_id": "field:" + str(request.device["_id"]),
-            "beacon_group": request.device.get("beacon_group_id", ""),
-            "label": request.device.get("name", "?"),
-            "lat": lat,
-            "lng": lng,
-            "speed": speed or 0,
-            "heading": heading or 0,
-            "status": "running",
-            "battery_pct": int(round(battery)) if battery is not None else None,
-            "gps_fix": 1,
-            "collected_at": _now(),
-        })
-    except Exception:
-        pass  # non-bloquant
-    # -- Auto-detection de proximite : si la tablette a une fiche assignee
-    #    avec GPS et qu'on est a <10m, passer le statut a "sur_place"
+        ts = datetime.fromtimestamp(float(value) / 1000, tz=timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if ts > now + timedelta(seconds=60) or now - ts > POSITIONS_BACKLOG_MAX_AGE:
+        return None
+    return min(ts, now)
+
+
+def _as_utc(dt):
+    if isinstance(dt, datetime) and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _record_positions(db, device, positions):
+    """Enregistre des points deja valides d'une tablette, tries par ts.
+
+    Un seul update_one sur field_devices (derniere position + last_seen du
+    decorateur), l'historique en file pour le writer, puis le test de
+    proximite sur le point le plus recent, a partir de la tablette deja
+    chargee par field_token_required.
+    """
+    dernier = positions[-1]
+    maj = dict(getattr(request, "field_touch", None) or {"last_seen": _now()})
+    connu = _as_utc(((device.get("last_position") or {}).get("ts")))
+    # Un backlog rejoue apres des pings live ne doit pas reculer la tablette.
+    plus_recent = connu is None or dernier["ts"] >= connu
+    if plus_recent:
+        maj["last_position"] = dernier
+    db["field_devices"].update_one({"_id": device["_id"]}, {"$set": maj})
+
+    device_id = "field:" + str(device["_id"])
+    _history_writer.add_many([{
+        "device_id": device_id,
+        "beacon_group": device.get("beacon_group_id", ""),
+        "label": device.get("name", "?"),
+        "lat": p["lat"],
+        "lng": p["lng"],
+        "speed": p["speed"] or 0,
+        "heading": p["heading"] or 0,
+        "status": "running",
+        "battery_pct": int(round(p["battery"])) if p["battery"] is not None else None,
+        "gps_fix": 1,
+        "collected_at": p["ts"],
+    } for p in positions])
+
+    if plus_recent:
+        _check_proximity(db, device, dernier)
+
+
+def _check_proximity(db, device, pos):
+    """Auto-detection de proximite : si la tablette a une fiche assignee
+    avec GPS et qu'on est a <10m, passer le statut a "sur_place"."""
     try:
-        device_fresh = db["field_devices"].find_one({"_id": request.device["_id"]})
-        cur_status = (device_fresh or {}).get("status") or "patrouille"
-        fiche_id = (device_fresh or {}).get("active_fiche_id")
-        if fiche_id and cur_status in ("intervention", "patrouille"):
-            fiche = db["pcorg"].find_one({"_id": fiche_id}, {"gps": 1, "status_code": 1})
-            if fiche and fiche.get("status_code") != 10:
-                fiche_gps = fiche.get("gps") or {}
-                fcoords = fiche_gps.get("coordinates") or []
-                if len(fcoords) >= 2:
-                    from math import radians, sin, cos, asin, sqrt
-                    def _hav(a_lat, a_lng, b_lat, b_lng):
-                        R = 6371000
-                        dl = radians(b_lat - a_lat)
-                        do = radians(b_lng - a_lng)
-                        s = sin(dl / 2) ** 2 + cos(radians(a_lat)) * cos(radians(b_lat)) * sin(do / 2) ** 2
-                        return 2 * R * asin(min(1, sqrt(s)))
-                    dist = _hav(lat, lng, fcoords[1], fcoords[0])
-                    if dist <= 10:
-                        db["field_devices"].update_one(
-                            {"_id": request.device["_id"], "status": {"$in": ["intervention", "patrouille"]}},
-                            {
-                                "$set": {"status": "sur_place", "status_since": _now()},
-                                "$push": {"status_history": {
-                                    "status": "sur_place", "ts": _now(),
-                                    "trigger": "auto_proximity",
-                                    "fiche_id": fiche_id,
-                                }},
-                            },
-                        )
+        cur_status = device.get("status") or "patrouille"
+        fiche_id = device.get("active_fiche_id")
+        if not fiche_id or cur_status not in ("intervention", "patrouille"):
+            return
+        target, status_code = _fiche_target(db, fiche_id)
+        if target is None or status_code == 10:
+            return
+        if _haversine_m(pos["lat"], pos["lng"], target[0], target[1]) > PROXIMITY_RADIUS_M:
+            return
+        # Le filtre sur le statut reste la garde : la tablette a pu changer
+        # de statut depuis son chargement en debut de requete.
+        db["field_devices"].update_one(
+            {"_id": device["_id"], "status": {"$in": ["intervention", "patrouille"]}},
+            {
+                "$set": {"status": "sur_place", "status_since": _now()},
+                "$push": {"status_history": {
+                    "status": "sur_place", "ts": _now(),
+                    "trigger": "auto_proximity",
+                    "fiche_id": fiche_id,
+                }},
+            },
+        )
     except Exception:
         pass  # non-bloquant
 
+
+def _merges_touch(f):
+    """Marque une route dont l'ecriture absorbe le last_seen du decorateur."""
+    f._field_merges_touch = True
+    return f
+
+
+@field_bp.route("/field/position", methods=["POST"])
+@field_token_required
+@_merges_touch
+def field_position():
+    """Recevoir une position GPS de la tablette (ecrit dans field_devices.last_position)."""
+    data = request.get_json(silent=True) or {}
+    pos, error = _parse_position(data, _now())
+    if error:
+        return jsonify({"ok": False, "error": error}), 400
+
+    _record_positions(_get_mongo_db(), request.device, [pos])
     return jsonify({"ok": True})
 
 
+@field_bp.route("/field/positions", methods=["POST"])
+@field_token_required
+@_merges_touch
+def field_positions_batch():
+    """Backlog de positions d'une tablette revenue en ligne (flushPositionBuffer).
+
+    Corps : {"points": [{lat, lng, accuracy, speed, heading, battery, ts}, ...]}
+    avec `ts` en ms epoch (heure de la mesure, pas de l'envoi). Au plus
+    POSITIONS_BATCH_MAX points. Les points invalides ou hors de la fenetre
+    de backlog sont ignores et comptes, pas rejetes en bloc : la tablette
+    purge son buffer sur un 200, un point bancal ne doit pas bloquer les
+    autres indefiniment.
+    """
+    data = request.get_json(silent=True) or {}
+    points = data.get("points")
+    if not isinstance(points, list) or not points:
+        return jsonify({"ok": False, "error": "missing_points"}), 400
+    if len(points) > POSITIONS_BATCH_MAX:
+        return jsonify({"ok": False, "error": "too_many_points",
+                        "max": POSITIONS_BATCH_MAX}), 400
+
+    now = _now()
+    positions = []
+    for point in points:
+        ts = _client_ts(point.get("ts"), now) if isinstance(point, dict) else None
+        if ts is None:
+            continue
+        pos, error = _parse_position(point, ts)
+        if pos is not None:
+            positions.append(pos)
+    if positions:
+        positions.sort(key=lambda p: p["ts"])
+        _record_positions(_get_mongo_db(), request.device, positions)
+    return jsonify({"ok": True, "accepted": len(positions),
+                    "ignored": len(points) - len(positions)})
+
+
 # ---------------------------------------------------------------------------
 # Statut de la patrouille
 # ---------------------------------------------------------------------------
@@ -1234,6 +1344,7 @@ def field_create_fiche():
         "extracted": {"phones": None, "plates": None},
         "tags": ["field-created"],
         "synced_at": None,
+        "modified_at": _now(),
         "sql_id": None,
         "guid": None,
         "server": "COCKPIT",
@@ -1241,6 +1352,7 @@ def field_create_fiche():
     }
 
     db["pcorg"].insert_one(fiche_doc)
+    bump_source_version(db, fiche_doc["event"], fiche_doc["year"])
 
     # Passer la tablette en statut 'intervention' et lier la fiche
     db["field_devices"].update_one(
@@ -1313,11 +1425,14 @@ def field_my_fiche_close(fiche_id):
                 "operator_close": operator,
                 "operator_id_close": "field:" + str(device.get("_id")),
                 "comment": new_comment,
+                "modified_at": now,
             },
             "$push": {"comment_history": history_entry},
             "$inc": {"bounce_rev": 1},
         },
     )
+    bump_source_version(db, fiche.get("event"), fiche.get("year"))
+    _forget_fiche_target(fiche_id)
 
     # Retour en patrouille si c'etait la fiche active
     cur = db["field_devices"].find_one({"_id": device["_id"]})
@@ -1503,6 +1618,7 @@ def field_reply(msg_id):
         "ack_at": None,
     }
     db["field_messages"].insert_one(reply_doc)
+    live_push.notify("field_unread")
 
     # Incrementer le reply_count sur le message racine du thread
     db["field_messages"].update_one(
@@ -1515,6 +1631,7 @@ def field_reply(msg_id):
 
 @field_bp.route("/field/photo/send", methods=["POST"])
 @field_token_required
+@heavy
 def field_photo_send():
     """Envoi d'une photo spontanee depuis la tablette vers les operateurs PC Org.
     Cree un message field_messages direction=field_to_cockpit, type=photo_report.
@@ -1619,6 +1736,7 @@ def field_photo_send():
         "ack_at": None,
     }
     res = db["field_messages"].insert_one(doc)
+    live_push.notify("field_unread")
 
     # Si une categorie est fournie (photo spontanee classifiee), creer aussi
     # une fiche pcorg pour qu'elle apparaisse sur la carte cockpit.
@@ -1675,12 +1793,14 @@ def field_photo_send():
             "extracted": {"phones": None, "plates": None},
             "tags": ["field-created"],
             "synced_at": None,
+            "modified_at": _now(),
             "sql_id": None,
             "guid": None,
             "server": "COCKPIT",
             "bounce_rev": 1,
         }
         db["pcorg"].insert_one(fiche_doc)
+        bump_source_version(db, fiche_doc["event"], fiche_doc["year"])
         db["field_devices"].update_one(
             {"_id": device["_id"]},
             {
@@ -1820,6 +1940,7 @@ def field_scan_send():
         "ack_at": None,
     }
     res = db["field_messages"].insert_one(doc)
+    live_push.notify("field_unread")
     return jsonify({"ok": True, "id": str(res.inserted_id), "codes": codes})
 
 
@@ -2954,6 +3075,7 @@ def field_admin_send():
 
 @field_bp.route("/field/admin/send-with-photo", methods=["POST"])
 @admin_required
+@heavy
 def field_admin_send_with_photo():
     """Envoie un message avec photo optionnelle vers une ou plusieurs tablettes.
     Accept multipart/form-data : champs texte + fichier 'photo' optionnel.
@@ -3208,6 +3330,7 @@ def field_admin_thread_mark_read(msg_id):
         },
         {"$set": {"admin_read_at": _now()}},
     )
+    live_push.notify("field_unread")
     return jsonify({"ok": True, "updated": res.modified_count})
 
 
@@ -3229,6 +3352,7 @@ def field_admin_conversation_mark_read(device_id):
         },
         {"$set": {"admin_read_at": _now()}},
     )
+    live_push.notify("field_unread")
     return jsonify({"ok": True, "updated": res.modified_count})
 
 
@@ -3237,7 +3361,12 @@ def field_admin_conversation_mark_read(device_id):
 def field_admin_unread_by_device():
     """Retourne le nombre de messages entrants non lus par admin, groupe par
     device_id. Utilise pour afficher les badges dans la table des tablettes."""
-    db = _get_mongo_db()
+    return jsonify({"ok": True, "unread": unread_by_device(_get_mongo_db())})
+
+
+def unread_by_device(db):
+    """{device_id: nombre de messages entrants non lus} (aussi le topic
+    live_push "field_unread")."""
     pipeline = [
         {"$match": {
             "direction": "field_to_cockpit",
@@ -3249,7 +3378,7 @@ def field_admin_unread_by_device():
     for row in db["field_messages"].aggregate(pipeline):
         if row.get("_id"):
             out[str(row["_id"])] = row.get("count", 0)
-    return jsonify({"ok": True, "unread": out})
+    return out
 
 
 @field_bp.route("/field/admin/thread/<msg_id>", methods=["GET"])
@@ -3847,6 +3976,7 @@ def field_my_fiche_comment_with_photo(fiche_id):
     update_sets = {}
     if comment:
         update_sets["comment"] = comment
+        update_sets["modified_at"] = _now()
 
     db["pcorg"].update_one(
         {"_id": fiche_id},
@@ -3855,6 +3985,8 @@ def field_my_fiche_comment_with_photo(fiche_id):
             "$push": {"comment_history": entry},
         },
     )
+    if comment:
+        bump_fiche_source(db, fiche_id)
     return jsonify({
         "ok": True,
         "photos": photos_meta,
@@ -3965,12 +4097,14 @@ def field_sos():
             "extracted": {"phones": None, "plates": None},
             "tags": ["field-sos"],
             "synced_at": None,
+            "modified_at": _now(),
             "sql_id": None,
             "guid": None,
             "server": "COCKPIT",
             "bounce_rev": 1,
         }
         db["pcorg"].insert_one(fiche_doc)
+        bump_source_version(db, fiche_doc["event"], fiche_doc["year"])
     except Exception as exc:
         logger.warning("[field_sos] auto-fiche failed: %s", exc)
         fiche_id = None
@@ -4001,6 +4135,7 @@ def field_sos():
     }
 
     db["cockpit_active_alerts"].insert_one(alert)
+    live_push.notify("alerts")
 
     # 3) Confirmer a la tablette emettrice
     db["field_messages"].insert_one({
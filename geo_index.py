@@ -0,0 +1,145 @@
+"""Index spatial par grille : voisins a distance bornee en temps quasi lineaire.
+
+Fonctions pures, aucun import Flask ni Mongo : se teste et se reutilise sans
+application, comme trafic_etat.py.
+
+Le principe est volontairement simple. Les points sont ranges dans une
+grille en DEGRES dont chaque cellule mesure au moins `cell_m` metres dans les
+deux axes. Tout point a moins de `cell_m` d'une position tombe alors dans la
+cellule de cette position ou dans l'une de ses 8 voisines : interroger ce
+bloc 3 x 3 rend un SUR-ENSEMBLE des voisins, que l'appelant filtre ensuite
+avec sa propre distance exacte. C'est ce filtre exact qui garantit un
+resultat identique a la double boucle qu'on remplace -- la grille ne fait
+qu'ecarter les paires qui ne pouvaient pas passer.
+
+La taille des cellules est calculee par exces :
+  - 110 000 m par degre de latitude, en dessous du meridien reel (111 195 m)
+    comme de la projection de trafic_etat (110 540 m) : une cellule couvre
+    donc toujours au moins `cell_m`, quelle que soit la distance employee ;
+  - la longueur d'un degre de longitude est prise a la latitude la PLUS
+    ELEVEE que la grille aura a servir (plus une marge), la ou elle est la
+    plus courte.
+"""
+
+import math
+
+# Metres par degre, minorants volontaires (cf. docstring du module).
+_M_PAR_DEG_MIN = 110000.0
+
+# Marge en latitude ajoutee a max_abs_lat pour le calcul du pas en
+# longitude : couvre les points a une cellule d'ecart du plus septentrional.
+_MARGE_LAT_DEG = 0.5
+
+_RAYON_TERRE_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Distance orthodromique en metres (meme formule que
+    alert_engine.haversine, pour que les resultats soient comparables au
+    bit pres)."""
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    a = (math.sin(dLat / 2) ** 2 +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(dLon / 2) ** 2)
+    return _RAYON_TERRE_M * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+class GeoGrid:
+    """Grille de buckets (lat, lon) -> [cle, ...].
+
+    `cell_m` doit etre >= au plus grand rayon qu'on interrogera : `near()`
+    ne regarde que le bloc 3 x 3 autour de la position.
+    `max_abs_lat` est la plus grande latitude absolue des points ET des
+    positions interrogees (cf. GeoGrid.for_points).
+    """
+
+    def __init__(self, cell_m, max_abs_lat):
+        if cell_m <= 0:
+            raise ValueError("cell_m doit etre strictement positif")
+        lat_ref = min(89.0, abs(max_abs_lat) + _MARGE_LAT_DEG)
+        self.cell_m = float(cell_m)
+        self.dlat = self.cell_m / _M_PAR_DEG_MIN
+        self.dlon = self.cell_m / (_M_PAR_DEG_MIN * math.cos(math.radians(lat_ref)))
+        self._cells = {}
+
+    @classmethod
+    def for_points(cls, points, cell_m):
+        """Grille dimensionnee pour une liste de (lat, lon)."""
+        max_abs_lat = max((abs(lat) for lat, _ in points), default=0.0)
+        return cls(cell_m, max_abs_lat)
+
+    def cell_of(self, lat, lon):
+        return (math.floor(lat / self.dlat), math.floor(lon / self.dlon))
+
+    def add(self, key, lat, lon):
+        self._cells.setdefault(self.cell_of(lat, lon), []).append(key)
+
+    def add_bbox(self, key, lat_min, lon_min, lat_max, lon_max):
+        """Range `key` dans toutes les cellules que couvre la boite : sert aux
+        objets etendus (segments de polyligne). Un point a moins de cell_m
+        d'un point quelconque de la boite la retrouve alors via near()."""
+        i0, j0 = self.cell_of(lat_min, lon_min)
+        i1, j1 = self.cell_of(lat_max, lon_max)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self._cells.setdefault((i, j), []).append(key)
+
+    def near(self, lat, lon):
+        """Cles candidates autour de la position (sur-ensemble, doublons
+        possibles avec add_bbox). Le filtre de distance reste a l'appelant."""
+        ci, cj = self.cell_of(lat, lon)
+        cells = self._cells
+        for i in (ci - 1, ci, ci + 1):
+            for j in (cj - 1, cj, cj + 1):
+                bucket = cells.get((i, j))
+                if bucket:
+                    yield from bucket
+
+    def ring(self, lat, lon, r):
+        """Cles des cellules a exactement `r` cellules (distance de
+        Chebyshev) de celle de la position. Tout point d'un anneau > r est a
+        plus de r * cell_m : c'est la borne d'arret d'une recherche des k
+        plus proches anneau par anneau."""
+        ci, cj = self.cell_of(lat, lon)
+        cells = self._cells
+        if r == 0:
+            yield from cells.get((ci, cj), ())
+            return
+        for i in range(ci - r, ci + r + 1):
+            cotes = (cj - r, cj + r) if abs(i - ci) < r else range(cj - r, cj + r + 1)
+            for j in cotes:
+                bucket = cells.get((i, j))
+                if bucket:
+                    yield from bucket
+
+    def max_ring(self, lat, lon):
+        """Anneau au-dela duquel la grille n'a plus aucune cellule."""
+        if not self._cells:
+            return -1
+        ci, cj = self.cell_of(lat, lon)
+        return max(max(abs(i - ci), abs(j - cj)) for i, j in self._cells)
+
+
+def neighbours_within(points, radius_m, distance=haversine_m):
+    """Pour chaque point, les indices des AUTRES points a `radius_m` ou moins.
+
+    `points` est une liste de (lat, lon). Chaque liste de voisins est rendue
+    triee par indice croissant : exactement l'ordre que produirait la double
+    boucle `for j in range(n)`, ce dont dependent les appelants qui
+    construisent un cluster dans l'ordre du flux.
+    """
+    if not points:
+        return []
+    grid = GeoGrid.for_points(points, max(float(radius_m), 1.0))
+    for idx, (lat, lon) in enumerate(points):
+        grid.add(idx, lat, lon)
+
+    out = []
+    for i, (lat, lon) in enumerate(points):
+        voisins = [j for j in grid.near(lat, lon)
+                   if j != i and distance(lat, lon,
+                                          points[j][0], points[j][1]) <= radius_m]
+        voisins.sort()
+        out.append(voisins)
+    return out
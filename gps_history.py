@@ -0,0 +1,267 @@
+"""Historique GPS des balises Anoloc et des tablettes Field.
+
+anoloc_positions recoit un document par balise toutes les 30 s
+(anoloc_collector) et un par ping /field/position, sans limite de duree, et
+/anoloc/trail rendait tous les points bruts d'une fenetre pouvant aller a
+24 h. Ce module porte les deux moities du remede :
+
+  - STOCKAGE : anoloc_positions devient une collection time-series
+    (timeField collected_at, metaField device_id) avec expiration a
+    GPS_RETENTION_DAYS. Mongo range alors les points par balise et par
+    tranche de temps, compresses, et purge seul l'historique perime. Une
+    collection ordinaire deja en place ne se convertit pas sur place :
+    scripts/migrate_gps_timeseries.py la bascule une fois.
+  - LECTURE : trail() rend une trace simplifiee cote serveur
+    (Douglas-Peucker, avec un budget de points et/ou une tolerance derivee
+    du zoom de la carte) au lieu de milliers de points quasi alignes.
+
+Les ecrivains n'ont rien a changer pour la time-series : un insert s'y
+ecrit comme dans une collection ordinaire. Ceux qui ecrivent point par point
+depuis une requete HTTP (field.py) passent par BufferedWriter, qui regroupe
+les points en un insert_many en tache de fond.
+
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+"""
+
+import atexit
+import heapq
+import logging
+import math
+import os
+import threading
+from collections import deque
+from datetime import timedelta
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+COL_POSITIONS = "anoloc_positions"
+TIME_FIELD = "collected_at"
+META_FIELD = "device_id"
+
+RETENTION = timedelta(days=int(os.getenv("GPS_RETENTION_DAYS", "30")))
+
+# Budget par defaut d'une trace : largement assez pour un trait fidele a
+# l'ecran, quelle que soit la duree demandee.
+DEFAULT_MAX_POINTS = 400
+MAX_POINTS_CAP = 5000
+
+# Metres par pixel a l'equateur au zoom 0 (tuiles web mercator de 256 px).
+_M_PAR_PX_Z0 = 156543.03392
+_RAYON_TERRE_M = 6371008.8
+
+
+# ----------------------------------------------------------------------------
+# Stockage
+# ----------------------------------------------------------------------------
+
+def _options(db, nom):
+    for info in db.list_collections(filter={"name": nom}):
+        return info.get("options") or {}
+    return None
+
+
+def ensure_collection(db):
+    """Cree anoloc_positions en time-series si elle n'existe pas encore, et
+    aligne son expiration sur RETENTION. Rend "timeseries", "plain" ou
+    "absent" (serveur trop ancien : la collection sera creee ordinaire au
+    premier insert).
+
+    Appelee au demarrage du collecteur : jamais bloquant, une base qui
+    refuse garde le comportement d'avant.
+    """
+    expire_s = int(RETENTION.total_seconds())
+    try:
+        options = _options(db, COL_POSITIONS)
+        if options is None:
+            db.create_collection(
+                COL_POSITIONS,
+                timeseries={"timeField": TIME_FIELD, "metaField": META_FIELD,
+                            "granularity": "seconds"},
+                expireAfterSeconds=expire_s,
+            )
+            logger.info("gps_history : %s creee en time-series (retention %d j)",
+                        COL_POSITIONS, RETENTION.days)
+            options = {"timeseries": True, "expireAfterSeconds": expire_s}
+        elif not options.get("timeseries"):
+            logger.warning("gps_history : %s est une collection ordinaire, sans "
+                           "retention ; lancer scripts/migrate_gps_timeseries.py",
+                           COL_POSITIONS)
+        elif options.get("expireAfterSeconds") != expire_s:
+            db.command("collMod", COL_POSITIONS, expireAfterSeconds=expire_s)
+        # Index (balise, instant) : cree d'office par Mongo >= 6.3 sur une
+        # time-series, a poser soi-meme avant, indispensable sur l'ordinaire.
+        db[COL_POSITIONS].create_index([(META_FIELD, ASCENDING), (TIME_FIELD, DESCENDING)])
+        return "timeseries" if options.get("timeseries") else "plain"
+    except (CollectionInvalid, OperationFailure) as exc:
+        logger.warning("gps_history : time-series indisponible (%s)", exc)
+        return "absent"
+
+
+class BufferedWriter:
+    """Ecriture differee et groupee de points d'historique.
+
+    add() ne fait qu'empiler en memoire : la requete qui recoit un ping
+    tablette ne paie plus d'aller-retour Mongo pour l'historique. Un thread
+    demon vide la file toutes les `flush_s` secondes (ou des `batch` points)
+    en un insert_many non ordonne. La file est bornee : si Mongo ne suit
+    plus, les points les plus anciens sont abandonnes (l'historique est
+    best-effort, la derniere position vit dans field_devices). Un atexit
+    vide ce qui reste a l'arret du processus.
+    """
+
+    def __init__(self, get_db, flush_s=2.0, batch=500, max_pending=20000):
+        self._get_db = get_db
+        self.flush_s = flush_s
+        self.batch = batch
+        self._file = deque(maxlen=max_pending)
+        self._cond = threading.Condition()
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+
+    def add(self, doc):
+        self.add_many([doc])
+
+    def add_many(self, docs):
+        with self._cond:
+            perdus = max(0, len(self._file) + len(docs) - self._file.maxlen)
+            self.dropped += perdus
+            self._file.extend(docs)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._boucle, name="gps-history-writer",
+                                                daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._file) >= self.batch:
+                self._cond.notify()
+
+    def pending(self):
+        return len(self._file)
+
+    def flush(self):
+        """Ecrit tout ce qui attend. Rend le nombre de points ecrits."""
+        total = 0
+        while True:
+            with self._cond:
+                lot = [self._file.popleft() for _ in range(min(self.batch, len(self._file)))]
+            if not lot:
+                return total
+            try:
+                self._get_db()[COL_POSITIONS].insert_many(lot, ordered=False)
+                total += len(lot)
+                self.written += len(lot)
+            except Exception as exc:
+                logger.warning("gps_history : %d points d'historique perdus (%s)", len(lot), exc)
+                return total
+
+    def _boucle(self):
+        while True:
+            with self._cond:
+                self._cond.wait(self.flush_s)
+            self.flush()
+
+
+# ----------------------------------------------------------------------------
+# Simplification
+# ----------------------------------------------------------------------------
+
+def meters_per_pixel(zoom, lat):
+    """Taille d'un pixel au sol, en metres, a ce zoom et cette latitude."""
+    return _M_PAR_PX_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def _projeter(points):
+    """Equirectangulaire locale, en metres : exacte a mieux que le metre a
+    l'echelle d'un circuit, et bien moins chere que du geodesique."""
+    lat0 = math.radians(points[0]["lat"])
+    kx = math.cos(lat0) * _RAYON_TERRE_M * math.pi / 180
+    ky = _RAYON_TERRE_M * math.pi / 180
+    return [(p["lng"] * kx, p["lat"] * ky) for p in points]
+
+
+def _ecart(xy, i, a, b):
+    """Distance du point i au segment [a, b], en metres."""
+    (px, py), (ax, ay), (bx, by) = xy[i], xy[a], xy[b]
+    dx, dy = bx - ax, by - ay
+    longueur2 = dx * dx + dy * dy
+    if longueur2 == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / longueur2))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def _plus_loin(xy, a, b):
+    meilleur, indice = -1.0, None
+    for i in range(a + 1, b):
+        d = _ecart(xy, i, a, b)
+        if d > meilleur:
+            meilleur, indice = d, i
+    return meilleur, indice
+
+
+def simplify(points, max_points=DEFAULT_MAX_POINTS, tolerance_m=None):
+    """Douglas-Peucker borne par un budget de points.
+
+    Plutot que la recursion classique (qui rend un nombre de points
+    imprevisible), on raffine toujours le segment dont le point le plus
+    eloigne l'est le plus : les `max_points` points gardes sont ainsi les
+    plus significatifs de la trace. `tolerance_m` arrete plus tot, des que
+    plus aucun point ne s'ecarte de plus que cela du trait simplifie.
+    Les extremites sont toujours gardees ; l'ordre chronologique aussi.
+    """
+    n = len(points)
+    max_points = max(2, max_points)
+    if n <= 2 or (n <= max_points and not tolerance_m):
+        return list(points)
+
+    xy = _projeter(points)
+    garde = {0, n - 1}
+    tas = []
+
+    def pousser(a, b):
+        if b - a > 1:
+            d, i = _plus_loin(xy, a, b)
+            heapq.heappush(tas, (-d, a, b, i))
+
+    pousser(0, n - 1)
+    while tas and len(garde) < max_points:
+        moins_d, a, b, i = heapq.heappop(tas)
+        if tolerance_m is not None and -moins_d <= tolerance_m:
+            break
+        garde.add(i)
+        pousser(a, i)
+        pousser(i, b)
+    return [points[i] for i in sorted(garde)]
+
+
+# ----------------------------------------------------------------------------
+# Lecture
+# ----------------------------------------------------------------------------
+
+def raw_points(db, device_id, since, until=None):
+    """Points bruts d'une balise, dans l'ordre chronologique."""
+    filtre = {META_FIELD: device_id, TIME_FIELD: {"$gte": since}}
+    if until is not None:
+        filtre[TIME_FIELD]["$lt"] = until
+    curseur = db[COL_POSITIONS].find(
+        filtre, {"lat": 1, "lng": 1, "speed": 1, TIME_FIELD: 1, "_id": 0},
+    ).sort(TIME_FIELD, 1)
+    return [d for d in curseur if d.get("lat") is not None and d.get("lng") is not None]
+
+
+def trail(db, device_id, since, until=None, max_points=DEFAULT_MAX_POINTS, zoom=None):
+    """Trace simplifiee d'une balise : (points, nombre_de_points_bruts).
+
+    Chemin unique pour la trace live de la carte et le rejeu d'une fenetre
+    passee (`until`). `zoom` (niveau de carte) fixe la tolerance a un pixel :
+    rien de ce qui est retire ne se verrait a l'ecran.
+    """
+    max_points = max(2, min(int(max_points or DEFAULT_MAX_POINTS), MAX_POINTS_CAP))
+    bruts = raw_points(db, device_id, since, until)
+    tolerance = None
+    if zoom is not None and bruts:
+        tolerance = meters_per_pixel(zoom, bruts[0]["lat"])
+    return simplify(bruts, max_points, tolerance), len(bruts)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+image_service.py - Images LAPI et snapshots Hik : miniatures, cache HTTP,
+migration GridFS -> disque.
+
+La console Hik et les grilles LAPI rechargent des dizaines de vignettes
+toutes les 5 s, et chacune recevait l'original pleine taille : JPEG disque
+via send_file, ou fichier GridFS charge en entier en memoire par
+grid_file.read(). Ce module fournit aux routes :
+
+  - derivative : miniature Pillow (SIZES px de large) generee une fois et
+    gardee sur disque sous <racine>/_thumbs/<largeur>/, regeneree si
+    l'original est plus recent ;
+  - file_etag / derivative_etag : ETag forts (taille + mtime de l'original,
+    largeur de la miniature) ; un snapshot n'est jamais reecrit sous le meme
+    nom, les routes peuvent donc le declarer immutable ;
+  - gridfs_chunks : lecture d'un fichier GridFS morceau par morceau ;
+  - migrate_gridfs : recopie des images encore dans GridFS (bucket
+    hik_images) vers <racine>/gridfs/AAAA-MM/<oid>.jpg, et renseigne
+    plate_image_path / vehicle_image_path des lectures hik_anpr.
+
+Pillow est optionnel : sans lui, les routes servent l'original.
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+
+Usage:
+    python image_service.py                 # migration GridFS puis arret
+    python image_service.py --daemon        # resident, toutes les CHECK_S
+    python image_service.py --purge         # migration puis suppression GridFS
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    from PIL import Image, ImageOps
+    _PIL_AVAILABLE = True
+except ImportError:
+    _PIL_AVAILABLE = False
+
+log = logging.getLogger("image_service")
+
+IMAGES_ROOT = os.path.abspath(os.getenv("HIK_IMAGES_ROOT", r"E:\TITAN\production\hik_images"))
+THUMBS_DIRNAME = "_thumbs"
+GRIDFS_DIRNAME = "gridfs"
+
+BUCKET = "hik_images"
+COL_ANPR = "hik_anpr"
+
+SIZES = (160, 480)
+THUMB_QUALITY = 80
+
+# Un an : la valeur conventionnelle pour un contenu declare immutable.
+IMMUTABLE_MAX_AGE = 365 * 86400
+
+BATCH = 200
+CHECK_S = 300
+
+_stop = False
+
+
+def _handle_signal(signum, frame):
+    global _stop
+    _stop = True
+
+
+# ---------------------------------------------------------------------------
+# Chemins
+# ---------------------------------------------------------------------------
+
+def resolve(root, path):
+    """Chemin absolu de `path` (relatif a `root`, ou absolu) s'il reste sous
+    `root`, sinon None (path traversal, autre lecteur)."""
+    if not path:
+        return None
+    full = os.path.abspath(os.path.join(root, path))
+    try:
+        if os.path.commonpath([full, root]) != root:
+            return None
+    except ValueError:
+        return None
+    return full
+
+
+def parse_width(value):
+    """?w= de la requete : une des SIZES, sinon None (original)."""
+    try:
+        width = int(value)
+    except (TypeError, ValueError):
+        return None
+    return width if width in SIZES else None
+
+
+def cache_control(public=True, max_age=IMMUTABLE_MAX_AGE):
+    return "%s, max-age=%d, immutable" % ("public" if public else "private", max(0, int(max_age)))
+
+
+def migrated_relpath(oid):
+    """Emplacement disque d'un fichier GridFS migre, deductible de l'ObjectId
+    seul : une ancienne reference par _id retrouve l'image apres migration."""
+    return "%s/%s/%s.jpg" % (GRIDFS_DIRNAME, oid.generation_time.strftime("%Y-%m"), oid)
+
+
+# ---------------------------------------------------------------------------
+# ETag et miniatures
+# ---------------------------------------------------------------------------
+
+def file_etag(path):
+    st = os.stat(path)
+    return "%x-%x" % (st.st_size, st.st_mtime_ns)
+
+
+def derivative_etag(path, width):
+    return "%s-w%d" % (file_etag(path), width)
+
+
+def _thumb_path(root, source, width):
+    rel = os.path.relpath(source, root)
+    return os.path.join(root, THUMBS_DIRNAME, str(width), os.path.splitext(rel)[0] + ".jpg")
+
+
+def derivative(root, source, width):
+    """Miniature de `source` (sous `root`) a `width` px de large. Rend le
+    chemin a servir : la miniature, l'original s'il est deja assez petit,
+    ou None si elle ne peut pas etre produite (pas de Pillow, image
+    illisible) -- la route sert alors l'original."""
+    if not _PIL_AVAILABLE or width not in SIZES:
+        return None
+    dest = _thumb_path(root, source, width)
+    try:
+        if os.stat(dest).st_mtime_ns >= os.stat(source).st_mtime_ns:
+            return dest
+    except OSError:
+        pass
+
+    tmp = "%s.%d.%d.tmp" % (dest, os.getpid(), threading.get_ident())
+    try:
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.width <= width:
+                return source
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            img.thumbnail((width, img.height), Image.LANCZOS)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            img.save(tmp, "JPEG", quality=THUMB_QUALITY, optimize=True)
+        # Ecriture atomique : deux requetes concurrentes ne servent jamais
+        # une miniature a moitie ecrite.
+        os.replace(tmp, dest)
+        return dest
+    except Exception as e:
+        log.warning("miniature %s (%dpx) impossible: %s", source, width, e)
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return None
+
+
+# ---------------------------------------------------------------------------
+# GridFS
+# ---------------------------------------------------------------------------
+
+def gridfs_file(db, oid):
+    return db[BUCKET + ".files"].find_one({"_id": oid})
+
+
+def gridfs_chunks(db, oid):
+    """Contenu d'un fichier GridFS, un morceau (255 Ko par defaut) a la fois."""
+    for chunk in db[BUCKET + ".chunks"].find({"files_id": oid}, {"data": 1}).sort("n", 1):
+        yield bytes(chunk["data"])
+
+
+def _write_atomic(dest, chunks):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = "%s.%d.tmp" % (dest, os.getpid())
+    size = 0
+    try:
+        with open(tmp, "wb") as f:
+            for data in chunks:
+                f.write(data)
+                size += len(data)
+        os.replace(tmp, dest)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def migrate_gridfs(db, root=IMAGES_ROOT, batch=BATCH, purge=False):
+    """Recopie sur disque les fichiers GridFS pas encore migres, par lots de
+    `batch`, et pointe les lectures hik_anpr vers le chemin disque. Avec
+    `purge`, supprime ensuite le fichier GridFS (taille verifiee).
+    Rend {"migrated", "failed", "purged"}."""
+    files, chunks = db[BUCKET + ".files"], db[BUCKET + ".chunks"]
+    counts = {"migrated": 0, "failed": 0, "purged": 0}
+    last_id = None
+    while not _stop:
+        # Avec purge, les fichiers deja recopies lors d'un passage sans purge
+        # sont repris aussi (sans etre reecrits).
+        query = {} if purge else {"migrated_path": None}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = list(files.find(query, {"length": 1, "migrated_path": 1}).sort("_id", 1).limit(batch))
+        if not docs:
+            break
+        for doc in docs:
+            oid = doc["_id"]
+            rel = migrated_relpath(oid)
+            dest = os.path.join(root, rel)
+            if not doc.get("migrated_path"):
+                try:
+                    size = _write_atomic(dest, gridfs_chunks(db, oid))
+                    if size != doc.get("length", size):
+                        raise IOError("taille %d au lieu de %d" % (size, doc["length"]))
+                except Exception as e:
+                    log.error("migration GridFS %s echouee: %s", oid, e)
+                    counts["failed"] += 1
+                    continue
+                for kind in ("plate", "vehicle"):
+                    db[COL_ANPR].update_many(
+                        {"%s_image_id" % kind: oid, "%s_image_path" % kind: None},
+                        {"$set": {"%s_image_path" % kind: rel}})
+                files.update_one({"_id": oid}, {"$set": {
+                    "migrated_path": rel, "migrated_at": datetime.now(timezone.utc)}})
+                counts["migrated"] += 1
+            if purge and os.path.isfile(dest) and os.path.getsize(dest) == doc.get("length"):
+                chunks.delete_many({"files_id": oid})
+                files.delete_one({"_id": oid})
+                counts["purged"] += 1
+        last_id = docs[-1]["_id"]
+        if len(docs) < batch:
+            break
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# Point d'entree
+# ---------------------------------------------------------------------------
+
+def run_resident(db, purge):
+    log.info("Migration GridFS residente : passage toutes les %ds", CHECK_S)
+    while not _stop:
+        try:
+            counts = migrate_gridfs(db, purge=purge)
+            if any(counts.values()):
+                log.info("images GridFS : %s", ", ".join(
+                    "%s %d" % (k, n) for k, n in counts.items()))
+        except Exception as e:
+            log.error("Passage de migration GridFS echoue: %s", e)
+        fin = time.monotonic() + CHECK_S
+        while not _stop and time.monotonic() < fin:
+            time.sleep(min(1.0, fin - time.monotonic()))
+
+
+def main():
+    from field import _get_mongo_db
+
+    parser = argparse.ArgumentParser(description="Migration des images GridFS hik_images vers le disque")
+    parser.add_argument("--daemon", action="store_true", help="Mode resident")
+    parser.add_argument("--purge", action="store_true",
+                        help="Supprime de GridFS les fichiers recopies sur disque")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    db = _get_mongo_db()
+    if args.daemon:
+        run_resident(db, args.purge)
+    else:
+        counts = migrate_gridfs(db, purge=args.purge)
+        log.info("images GridFS : %s", ", ".join("%s %d" % (k, n) for k, n in counts.items()))
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    main()
@@ -4,6 +4,7 @@
 live_controle.py — Script unifié de collecte Handshake
 Piloté par le document ___GLOBAL___ dans MongoDB (collection data_access).
 Lancé par Windows Task Scheduler toutes les 2 minutes, ou à la demande via API.
+Avec --daemon : collecteur résident (socket HSH persistante, cf. executer_resident).
 
 Trois fonctions combinées :
   1. Inventaire Counter global (première exécution après activation)
@@ -11,10 +12,11 @@ Trois fonctions combinées :
   3. Polling Counter pour les locations sélectionnées depuis le front
 """
 
+import select
 import socket
 import xml.etree.ElementTree as ET
 import xml.dom.minidom
-from pymongo import MongoClient, UpdateOne
+from pymongo import MongoClient, UpdateMany, UpdateOne
 import datetime
 import time
 import zoneinfo
@@ -22,7 +24,11 @@ import json
 import os
 import sys
 
+import peak_rollup
+import presence_ledger
+
 DEV_MODE = "--dev" in sys.argv
+DAEMON_MODE = "--daemon" in sys.argv
 
 # =========================================================
 #                    CONFIGURATION
@@ -40,6 +46,20 @@ READ_TIMEOUT_COUNTER = 5
 READ_TIMEOUT_TRANSACTIONS = 15
 
 MAX_TX = 100
+
+# Collecteur resident (--daemon) : la socket HSH reste ouverte, le curseur
+# LastTransactionId est interroge toutes les POLL_INTERVAL_S, et les pages
+# recues sont ecrites en base par fenetre de FLUSH_WINDOW_S (ou des que
+# FLUSH_MAX_TX transactions sont en attente). Objectif : tableaux de bord
+# portes a moins de 10 s du reel, contre 2 min avec la tache planifiee.
+POLL_INTERVAL_S = float(os.getenv("HSH_POLL_INTERVAL_S", "2"))
+FLUSH_WINDOW_S = float(os.getenv("HSH_FLUSH_WINDOW_S", "5"))
+FLUSH_MAX_TX = 5000
+COUNTER_INTERVAL_S = float(os.getenv("HSH_COUNTER_INTERVAL_S", "30"))
+GLOBAL_REFRESH_S = 10
+TITRES_REFRESH_S = 600
+RECONNECT_DELAY_S = 5
+PRESENCE_CHECKPOINT_S = 300   # checkpoints du registre des presents
 # Option des inquiries Transactions (spec HSHIF25 v2.34 SS4.27.4 : bits 0-6 =
 # bits de SUPPRESSION). 1409 = 1024 + 256 + 128 + 1 :
 #   bit 10 (1024) = recuperer aussi les transactions des autres billetteries
@@ -247,7 +267,9 @@ col_structure = db["hsh_structure"]
 col_erreurs = db["hsh_erreurs"]
 col_tx_agg = db["hsh_transactions_agg"]
 col_agg_titres = db["hsh_agg_titres"]
-col_barcodes_utids = db["access_barcodes_utids"]
+col_presence_deltas = db[presence_ledger.COL_DELTAS]
+col_presence = db[presence_ledger.COL_SOLDES]
+col_presence_checkpoints = db[presence_ledger.COL_CHECKPOINTS]
 
 GLOBAL_ID = "___GLOBAL___"
 
@@ -267,26 +289,11 @@ GLOBAL_DEFAULTS = {
 
 def charger_cache_titres():
     """Charge le mapping utid -> title depuis access_barcodes_utids."""
-    cache = {}
-    for doc in col_barcodes_utids.find({}, {"utid": 1, "title": 1}):
-        utid = doc.get("utid")
-        if utid:
-            cache[utid] = doc.get("title", "")
-    return cache
-
-
-def categoriser_scan(utid, cache_titres, upid=None):
-    """Retourne 'enfant', 'vehicule', 'accredite' ou 'personne'."""
-    if upid and upid.endswith("-ACCRED"):
-        return "accredite"
-    if utid and utid.startswith("EWC"):
-        return "accredite"
-    if utid and utid in cache_titres:
-        title = cache_titres[utid]
-        if "Bracelet Enfant" in title:
-            return "enfant"
-        return "vehicule"
-    return "personne"
+    return presence_ledger.charger_cache_titres(db)
+
+
+# Regle partagee avec le registre des presents et calcul_presents.
+categoriser_scan = presence_ledger.categoriser_scan
 
 
 def lire_global():
@@ -320,6 +327,8 @@ def assurer_index():
     col_agg_titres.create_index([("evenement", 1), ("titre", 1), ("tranche", -1)])
     col_agg_titres.create_index("tranche", expireAfterSeconds=30 * 24 * 3600)
     col_structure.create_index([("evenement", 1)])
+    presence_ledger.assurer_index(db)
+    peak_rollup.assurer_index(db)
 
 
 # =========================================================
@@ -536,12 +545,168 @@ def _all_attribs(elem):
     return dict(elem.attrib) if elem is not None else None
 
 
-def parse_transactions(xml_str):
+def _attr_id(attrs):
+    return (attrs.get("ID") or attrs.get("Id") or attrs.get("id")) if attrs else None
+
+
+def _attr_name(attrs):
+    return (attrs.get("Name") or attrs.get("name")) if attrs else None
+
+
+def _txid(raw):
+    return int(raw) if raw and raw.isdigit() else raw
+
+
+class TxRecord:
+    """Transaction compacte : uniquement ce que lisent les agrégats.
+
+    `full` porte le document complet historique (tous les attributs de
+    Venue/Area/Gate/Checkpoint, Conditions, ExtendedCheck...) quand il a été
+    demandé -- parse_transactions(..., full=True), chemin forensic -- et,
+    toujours, pour les transactions en erreur, que hsh_erreurs stocke
+    intégralement. None sinon.
+    """
+
+    __slots__ = (
+        "transaction_id", "date_utc", "status", "direction", "utid", "upid",
+        "checkpoint_id", "checkpoint_name", "gate_id", "gate_name",
+        "area_id", "area_name", "venue_id", "venue_name", "full",
+    )
+
+    def __init__(self, transaction_id, date_utc, status, direction, utid, upid,
+                 checkpoint_id, checkpoint_name, gate_id, gate_name,
+                 area_id, area_name, venue_id, venue_name, full=None):
+        self.transaction_id = transaction_id
+        self.date_utc = date_utc
+        self.status = status
+        self.direction = direction
+        self.utid = utid
+        self.upid = upid
+        self.checkpoint_id = checkpoint_id
+        self.checkpoint_name = checkpoint_name
+        self.gate_id = gate_id
+        self.gate_name = gate_name
+        self.area_id = area_id
+        self.area_name = area_name
+        self.venue_id = venue_id
+        self.venue_name = venue_name
+        self.full = full
+
+    def __repr__(self):
+        return f"TxRecord({self.transaction_id!r}, {self.status!r}, {self.direction!r})"
+
+
+def _date_paris(date_str):
+    if not date_str:
+        return date_str
+    try:
+        # Le HSH envoie l'heure locale (Paris), pas UTC
+        return datetime.datetime.strptime(
+            date_str, "%Y-%m-%dT%H:%M:%S"
+        ).strftime("%Y-%m-%d %H:%M:%S")
+    except Exception:
+        return date_str
+
+
+def _doc_complet(ticket, perm, tx, locs, extras):
+    """Document historique d'une transaction (format hsh_erreurs /
+    handshake_forensic). `ticket`/`perm` valent None hors hiérarchie."""
+    txid = tx.get("TransactionId")
+    date_str = tx.get("Date")
+    venue, area = locs.get("Venue"), locs.get("Area")
+    doc = {
+        # Ticket parent
+        "utid": ticket[0] if ticket else None,
+        "coding": ticket[1] if ticket else None,
+        "ticket_blocked": ticket[2] if ticket else None,
+        # Permission parent
+        "upid": perm[0] if perm else None,
+        "permission_blocked": perm[1] if perm else None,
+        # Transaction — tous les attributs
+        "transaction_id": _txid(txid),
+        "date_utc": date_str,
+        "date_paris": _date_paris(date_str),
+        "status": tx.get("Status"),
+        "validated": tx.get("Validated"),
+        "releases": tx.get("Releases"),
+        "test_mode": tx.get("TestMode"),
+        "direction": _direction_from_nodes(area, venue),
+        # Venue/Area/Gate/Checkpoint — tous les attributs
+        "venue": _all_attribs(venue),
+        "area": _all_attribs(area),
+        "gate": _all_attribs(locs.get("Gate")),
+        "checkpoint": _all_attribs(locs.get("Checkpoint")),
+    }
+    if ticket is not None:
+        # Attributs supplémentaires éventuels sur Transaction
+        for attr_name in ("BelongsTo", "Timestamp"):
+            val = tx.get(attr_name)
+            if val is not None:
+                doc[attr_name.lower()] = val
+        # Conditions (si Option bit 18)
+        conditions_el = extras.get("Conditions")
+        if conditions_el is not None:
+            doc["conditions"] = [
+                _all_attribs(c) for c in conditions_el if c.tag == "Condition"
+            ]
+        # ExtendedCheck (si Option bit 11)
+        ext_check = extras.get("ExtendedCheck")
+        if ext_check is not None:
+            doc["extended_check"] = _all_attribs(ext_check)
+    return doc
+
+
+_LOCATIONS_TX = frozenset(("Venue", "Area", "Gate", "Checkpoint"))
+_EXTRAS_TX = frozenset(("Conditions", "ExtendedCheck"))
+
+
+def _record(tx, ticket, perm, full):
+    """TxRecord d'un élément <Transaction>, en un seul parcours de ses
+    enfants directs (au lieu d'un .find() par sous-élément)."""
+    locs = {}
+    extras = {}
+    for child in tx:
+        tag = child.tag
+        if tag in _LOCATIONS_TX:
+            locs.setdefault(tag, child)
+        elif tag in _EXTRAS_TX:
+            extras.setdefault(tag, child)
+    attrs = tx.attrib
+    status = attrs.get("Status")
+    venue, area = locs.get("Venue"), locs.get("Area")
+    gate, cp = locs.get("Gate"), locs.get("Checkpoint")
+    va = venue.attrib if venue is not None else None
+    aa = area.attrib if area is not None else None
+    ga = gate.attrib if gate is not None else None
+    ca = cp.attrib if cp is not None else None
+    return TxRecord(
+        _txid(attrs.get("TransactionId")),
+        attrs.get("Date"),
+        status,
+        _direction_from_nodes(aa, va),
+        ticket[0] if ticket else None,
+        perm[0] if perm else None,
+        _attr_id(ca), _attr_name(ca),
+        _attr_id(ga), _attr_name(ga),
+        _attr_id(aa), _attr_name(aa),
+        _attr_id(va), _attr_name(va),
+        _doc_complet(ticket, perm, tx, locs, extras)
+        if (full or status != "0") else None,
+    )
+
+
+def parse_transactions(xml_str, full=False):
     """Parse les transactions d'une page en remontant la hiérarchie Ticket > Permission > Transaction.
-    Retourne (not_complete, txs, max_txid)."""
+    Retourne (not_complete, txs, max_txid), txs étant des TxRecord.
+
+    Un seul parcours des enfants directs de chaque Ticket, Permission et
+    Transaction ; seuls les attributs utiles aux agrégats sont extraits.
+    `full=True` (collecte forensic) attache en plus à chaque record son
+    document complet dans `record.full` ; les transactions en erreur l'ont
+    toujours, hsh_erreurs les stockant intégralement."""
     root = ET.fromstring(xml_str)
 
-    inq = root.find(".//Inquiry")
+    inq = root if root.tag == "Inquiry" else next(root.iter("Inquiry"), None)
     not_complete = False
     max_txid = None
     if inq is not None:
@@ -556,135 +721,56 @@ def parse_transactions(xml_str):
     txs = []
 
     # Parcours hiérarchique : Ticket > Permission > Transaction
-    for ticket in root.findall(".//Ticket"):
-        utid_el = ticket.find("UTID")
-        coding_el = ticket.find("Coding")
-        utid = utid_el.text if utid_el is not None else None
-        coding = coding_el.text if coding_el is not None else None
-        blocked = ticket.get("Blocked")
-
-        for perm in ticket.findall("Permission"):
-            upid_el = perm.find("UPID")
-            upid = upid_el.text if upid_el is not None else None
-            perm_blocked = perm.get("Blocked")
-
-            for tx in perm.findall("Transaction"):
-                txid = tx.get("TransactionId")
-                date_str = tx.get("Date")
-                date_utc = date_str
-                date_paris = date_str
-
-                if date_str:
-                    try:
-                        # Le HSH envoie l'heure locale (Paris), pas UTC
-                        date_paris = datetime.datetime.strptime(
-                            date_str, "%Y-%m-%dT%H:%M:%S"
-                        ).strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception:
-                        pass
-
-                venue = tx.find("Venue")
-                area = tx.find("Area")
-                gate = tx.find("Gate")
-                cp = tx.find("Checkpoint")
-
-                tx_doc = {
-                    # Ticket parent
-                    "utid": utid,
-                    "coding": coding,
-                    "ticket_blocked": blocked,
-                    # Permission parent
-                    "upid": upid,
-                    "permission_blocked": perm_blocked,
-                    # Transaction — tous les attributs
-                    "transaction_id": int(txid) if txid and txid.isdigit() else txid,
-                    "date_utc": date_utc,
-                    "date_paris": date_paris,
-                    "status": tx.get("Status"),
-                    "validated": tx.get("Validated"),
-                    "releases": tx.get("Releases"),
-                    "test_mode": tx.get("TestMode"),
-                    "direction": _direction_from_nodes(area, venue),
-                    # Venue — tous les attributs
-                    "venue": _all_attribs(venue),
-                    # Area — tous les attributs
-                    "area": _all_attribs(area),
-                    # Gate — tous les attributs
-                    "gate": _all_attribs(gate),
-                    # Checkpoint — tous les attributs
-                    "checkpoint": _all_attribs(cp),
-                }
-
-                # Attributs supplémentaires éventuels sur Transaction
-                for attr_name in ("BelongsTo", "Timestamp"):
-                    val = tx.get(attr_name)
-                    if val is not None:
-                        tx_doc[attr_name.lower()] = val
-
-                # Conditions (si Option bit 18)
-                conditions_el = tx.find("Conditions")
-                if conditions_el is not None:
-                    tx_doc["conditions"] = [
-                        _all_attribs(c) for c in conditions_el.findall("Condition")
-                    ]
-
-                # ExtendedCheck (si Option bit 11)
-                ext_check = tx.find("ExtendedCheck")
-                if ext_check is not None:
-                    tx_doc["extended_check"] = _all_attribs(ext_check)
-
-                txs.append(tx_doc)
-
-                # Fallback si MaxTransactionId absent (HSH < v2.26)
-                try:
-                    val = int(txid)
-                except (TypeError, ValueError):
-                    val = None
-                if val is not None and (max_txid is None or val > max_txid):
-                    max_txid = val
+    for ticket_el in root.iter("Ticket"):
+        utid = coding = None
+        perms = []
+        for child in ticket_el:
+            tag = child.tag
+            if tag == "Permission":
+                perms.append(child)
+            elif tag == "UTID" and utid is None:
+                utid = child.text
+            elif tag == "Coding" and coding is None:
+                coding = child.text
+        ticket = (utid, coding, ticket_el.get("Blocked"))
+
+        for perm_el in perms:
+            upid = None
+            tx_els = []
+            for child in perm_el:
+                tag = child.tag
+                if tag == "Transaction":
+                    tx_els.append(child)
+                elif tag == "UPID" and upid is None:
+                    upid = child.text
+            perm = (upid, perm_el.get("Blocked"))
+            for tx in tx_els:
+                txs.append(_record(tx, ticket, perm, full))
 
     # Fallback : transactions hors hiérarchie Ticket/Permission (ancien layout ou erreurs sans ticket)
-    for tx in root.findall(".//Inquiry/Transaction"):
-        txid = tx.get("TransactionId")
-        # Vérifier qu'on ne l'a pas déjà parsée
-        if any(t["transaction_id"] == (int(txid) if txid and txid.isdigit() else txid) for t in txs):
-            continue
+    vus = None
+    for inq_el in ([root] if root.tag == "Inquiry" else root.iter("Inquiry")):
+        for tx in inq_el:
+            if tx.tag != "Transaction":
+                continue
+            if vus is None:
+                vus = {t.transaction_id for t in txs}
+            # Vérifier qu'on ne l'a pas déjà parsée
+            txid = _txid(tx.get("TransactionId"))
+            if txid in vus:
+                continue
+            txs.append(_record(tx, None, None, full))
+            vus.add(txid)
 
-        date_str = tx.get("Date")
-        date_utc = date_str
-        date_paris = date_str
-        if date_str:
+    # Fallback si MaxTransactionId absent (HSH < v2.26)
+    for rec in txs:
+        val = rec.transaction_id
+        if not isinstance(val, int):
             try:
-                # Le HSH envoie l'heure locale (Paris), pas UTC
-                date_paris = datetime.datetime.strptime(
-                    date_str, "%Y-%m-%dT%H:%M:%S"
-                ).strftime("%Y-%m-%d %H:%M:%S")
-            except Exception:
-                pass
-
-        venue = tx.find("Venue")
-        area = tx.find("Area")
-        gate = tx.find("Gate")
-        cp = tx.find("Checkpoint")
-
-        tx_doc = {
-            "utid": None, "coding": None, "ticket_blocked": None,
-            "upid": None, "permission_blocked": None,
-            "transaction_id": int(txid) if txid and txid.isdigit() else txid,
-            "date_utc": date_utc, "date_paris": date_paris,
-            "status": tx.get("Status"), "validated": tx.get("Validated"),
-            "releases": tx.get("Releases"), "test_mode": tx.get("TestMode"),
-            "direction": _direction_from_nodes(area, venue),
-            "venue": _all_attribs(venue), "area": _all_attribs(area),
-            "gate": _all_attribs(gate), "checkpoint": _all_attribs(cp),
-        }
-        txs.append(tx_doc)
-
-        try:
-            val = int(txid)
-        except (TypeError, ValueError):
-            val = None
-        if val is not None and (max_txid is None or val > max_txid):
+                val = int(val)
+            except (TypeError, ValueError):
+                continue
+        if max_txid is None or val > max_txid:
             max_txid = val
 
     return not_complete, txs, max_txid
@@ -750,362 +836,439 @@ def executer_inventaire(sock, evenement):
     maj_global({"dernier_inventaire": ts})
 
 
-def mettre_a_jour_arbre(txs, evenement):
-    """Enrichit hsh_structure avec les relations parent-enfant deduites des transactions."""
-    ts = datetime.datetime.now(datetime.timezone.utc)
-    ops = []
+# Les sorties d'une page de transactions (hsh_erreurs, arbre hsh_structure,
+# hsh_transactions_agg, hsh_agg_titres, registre des presents) sont alimentees
+# en UNE passe par TransactionSinks : chaque transaction est categorisee et
+# datee une seule fois, puis distribuee aux accumulateurs. Les ecritures Mongo
+# partent au flush, une bulk_write par collection, quel que soit le nombre de
+# pages accumulees entre-temps : le collecteur resident flushe par fenetre de
+# FLUSH_WINDOW_S, le cycle ponctuel en fin de pagination.
 
-    # Helper pour lire ID/Name depuis les dicts d'attributs XML (clés en majuscules)
-    def _id(d):
-        return d.get("ID") or d.get("Id") or d.get("id") if d else None
-    def _name(d):
-        return d.get("Name") or d.get("name") if d else None
-
-    # Comptage des liens uniques déduits
-    liens_cp_gate = set()
-    liens_gate_area = set()
-    liens_area_venue = set()
-
-    for tx in txs:
-        venue = tx.get("venue")
-        area = tx.get("area")
-        gate = tx.get("gate")
-        cp = tx.get("checkpoint")
-
-        # Tracer les liens uniques
-        if _id(cp) and _id(gate):
-            liens_cp_gate.add((_id(cp), _name(cp) or "?", _id(gate), _name(gate) or "?"))
-        if _id(gate) and _id(area):
-            liens_gate_area.add((_id(gate), _name(gate) or "?", _id(area), _name(area) or "?"))
-        if _id(area) and _id(venue):
-            liens_area_venue.add((_id(area), _name(area) or "?", _id(venue), _name(venue) or "?"))
-
-        # Checkpoint → parents: Gate, Area, Venue
-        if _id(cp):
-            cp_doc_id = f"Checkpoint_{_id(cp)}"
-            # Extraire le timestamp de la transaction pour traquer l'activite
-            tx_date_str = tx.get("date_utc")
-            tx_ts = None
-            if tx_date_str:
-                try:
-                    tx_ts = datetime.datetime.strptime(
-                        tx_date_str, "%Y-%m-%dT%H:%M:%S"
-                    ).replace(tzinfo=datetime.timezone.utc)
-                except Exception:
-                    pass
-            update_set = {
-                "location_id": _id(cp),
-                "location_name": _name(cp),
-                "location_type": "Checkpoint",
-                "evenement": evenement,
-                "derniere_maj": ts,
-                "derniere_transaction": tx_ts or ts,
-            }
-            if _id(gate):
-                update_set["parent_gate"] = {"id": _id(gate), "name": _name(gate)}
-            if _id(area):
-                update_set["parent_area"] = {"id": _id(area), "name": _name(area)}
-            if _id(venue):
-                update_set["parent_venue"] = {"id": _id(venue), "name": _name(venue)}
-            ops.append(UpdateOne(
-                {"_id": cp_doc_id},
-                {"$set": update_set, "$setOnInsert": {"source": "transactions"}},
-                upsert=True,
-            ))
+def _parse_date_tx(date_str):
+    """date_utc d'une transaction -> datetime aware, ou None."""
+    if not date_str:
+        return None
+    try:
+        return datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S").replace(
+            tzinfo=datetime.timezone.utc
+        )
+    except Exception:
+        return None
 
-        # Gate → parent Area/Venue, enfant Checkpoint
-        if _id(gate):
-            gate_doc_id = f"Gate_{_id(gate)}"
-            update_set = {
-                "location_id": _id(gate),
-                "location_name": _name(gate),
-                "location_type": "Gate",
-                "evenement": evenement,
-                "derniere_maj": ts,
-            }
-            if _id(area):
-                update_set["parent_area"] = {"id": _id(area), "name": _name(area)}
-            if _id(venue):
-                update_set["parent_venue"] = {"id": _id(venue), "name": _name(venue)}
-            update_add = {}
-            if _id(cp):
-                update_add["enfants"] = {"id": _id(cp), "type": "Checkpoint", "name": _name(cp)}
-            op = {"$set": update_set, "$setOnInsert": {"source": "transactions"}}
-            if update_add:
-                op["$addToSet"] = update_add
-            ops.append(UpdateOne({"_id": gate_doc_id}, op, upsert=True))
-
-        # Area → parent Venue, enfant Gate
-        if _id(area):
-            area_doc_id = f"Area_{_id(area)}"
-            update_set = {
-                "location_id": _id(area),
-                "location_name": _name(area),
-                "location_type": "Area",
-                "evenement": evenement,
-                "derniere_maj": ts,
-            }
-            if _id(venue):
-                update_set["parent_venue"] = {"id": _id(venue), "name": _name(venue)}
-            update_add = {}
-            if _id(gate):
-                update_add["enfants"] = {"id": _id(gate), "type": "Gate", "name": _name(gate)}
-            op = {"$set": update_set, "$setOnInsert": {"source": "transactions"}}
-            if update_add:
-                op["$addToSet"] = update_add
-            ops.append(UpdateOne({"_id": area_doc_id}, op, upsert=True))
-
-        # Venue → enfant Area
-        if _id(venue):
-            venue_doc_id = f"Venue_{_id(venue)}"
-            update_set = {
-                "location_id": _id(venue),
-                "location_name": _name(venue),
-                "location_type": "Venue",
-                "evenement": evenement,
-                "derniere_maj": ts,
-            }
-            update_add = {}
-            if _id(area):
-                update_add["enfants"] = {"id": _id(area), "type": "Area", "name": _name(area)}
-            op = {"$set": update_set, "$setOnInsert": {"source": "transactions"}}
-            if update_add:
-                op["$addToSet"] = update_add
-            ops.append(UpdateOne({"_id": venue_doc_id}, op, upsert=True))
 
-    if ops:
-        col_structure.bulk_write(ops, ordered=False)
+def _tranche_5min(dt):
+    return dt.replace(minute=(dt.minute // 5) * 5, second=0, microsecond=0)
 
-    # Log des liens déduits
-    if liens_cp_gate or liens_gate_area or liens_area_venue:
-        print(f"  Arbre deduit: {len(liens_cp_gate)} checkpoint->gate, {len(liens_gate_area)} gate->area, {len(liens_area_venue)} area->venue")
-        for c_id, c_name, g_id, g_name in sorted(liens_cp_gate):
-            print(f"    Checkpoint {c_name} ({c_id}) -> Gate {g_name} ({g_id})")
-        for g_id, g_name, a_id, a_name in sorted(liens_gate_area):
-            print(f"    Gate {g_name} ({g_id}) -> Area {a_name} ({a_id})")
-        for a_id, a_name, v_id, v_name in sorted(liens_area_venue):
-            print(f"    Area {a_name} ({a_id}) -> Venue {v_name} ({v_id})")
 
+_COMPTEURS_AGG = (
+    "ok", "erreurs", "entrees", "sorties",
+    "entrees_vehicules", "sorties_vehicules",
+    "entrees_enfants", "sorties_enfants",
+    "entrees_accredites", "sorties_accredites",
+)
 
-def stocker_erreurs(txs, evenement, evenement_clean, cache_titres=None):
-    """Insère les transactions en erreur (Status != '0') dans hsh_erreurs.
-    Stocke l'intégralité des données de la transaction."""
-    ts = datetime.datetime.now(datetime.timezone.utc)
-    if cache_titres is None:
-        cache_titres = {}
-    ops = []
-    for tx in txs:
-        if tx["status"] == "0":
-            continue
-        tx_id = tx["transaction_id"]
-        doc_id = f"{evenement_clean}_{tx_id}"
+# Suffixe des compteurs par categorie de scan ("personne" n'a pas le sien :
+# elle n'est comptee que dans entrees/sorties).
+_SUFFIXE_CATEGORIE = {
+    "vehicule": "vehicules",
+    "enfant": "enfants",
+    "accredite": "accredites",
+}
+
+
+class TransactionSinks:
+    """Accumule les effets d'une ou plusieurs pages de transactions et les
+    ecrit en une bulk_write par collection au flush().
+
+    Le resultat en base est celui qu'auraient produit les anciennes passes
+    page par page : les $set d'un meme document sont fusionnes dans l'ordre
+    (le dernier l'emporte), les $inc additionnes, les $addToSet reunis.
+    """
+
+    def __init__(self, evenement, evenement_clean, cache_titres=None,
+                 presence_hwm=None):
+        self.evenement = evenement
+        self.evenement_clean = evenement_clean
+        self.cache_titres = cache_titres if cache_titres is not None else {}
+        # Dernier transaction_id deja compte au registre des presents
+        # (presence_ledger.high_water) : en deca, une recollecte ne recompte pas.
+        # Fige pendant un lot : les pages HSH sont groupees par Ticket, les
+        # ids n'y arrivent pas dans l'ordre. Il n'avance qu'au flush.
+        self.presence_hwm = presence_hwm
+        self._reset()
+
+    def _reset(self):
+        self.nb_tx = 0
+        self.erreurs = {}       # _id -> doc
+        self.arbre = {}         # _id -> {"set": {...}, "enfants": {cle: dict}}
+        self.tx_agg = {}        # (cp_id, tranche iso) -> bucket
+        self.titres = {}        # (titre, tranche iso) -> bucket
+        self.presence = {}      # (area_id, tranche iso) -> bucket
+        self.presence_ops = []  # [(collection, ops)] pas encore ecrites
+        self.presence_max_dt = None
+        self.presence_max_tx = None
+        self.liens_cp_gate = set()
+        self.liens_gate_area = set()
+        self.liens_area_venue = set()
+
+    def __len__(self):
+        return self.nb_tx
+
+    # ---------- ingestion ----------
+
+    def ingest(self, txs):
+        for tx in txs:
+            self.nb_tx += 1
+            cat = categoriser_scan(tx.utid, self.cache_titres, tx.upid)
+            dt = _parse_date_tx(tx.date_utc)
+            tranche = _tranche_5min(dt) if dt is not None else None
+            if tx.status != "0":
+                self._erreur(tx, cat)
+            self._arbre(tx, dt)
+            if tranche is not None:
+                self._agg_checkpoint(tx, cat, tranche)
+                if tx.status == "0":
+                    self._agg_titre(tx, tranche)
+                    self._presence(tx, cat, dt, tranche)
+
+    def _erreur(self, tx, cat):
+        """Copie integrale de la transaction en erreur + labels lisibles."""
         annee = None
-        if tx.get("date_utc"):
+        if tx.date_utc:
             try:
-                annee = int(tx["date_utc"][:4])
+                annee = int(tx.date_utc[:4])
             except (ValueError, TypeError):
                 pass
-
-        # Copie intégrale de la transaction + métadonnées + labels lisibles
-        doc = dict(tx)
-        doc["evenement"] = evenement
-        doc["evenement_clean"] = evenement_clean
+        # parse_transactions attache toujours le document complet aux erreurs.
+        doc = dict(tx.full)
+        doc["evenement"] = self.evenement
+        doc["evenement_clean"] = self.evenement_clean
         doc["annee"] = annee
-        doc["collecte_timestamp"] = ts
-        doc["status_label"] = _label_status(tx["status"])
-        doc["coding_label"] = _label_coding(tx.get("coding"))
-        doc["validated_label"] = _label_validated(tx.get("validated"))
-        doc["type_scan"] = categoriser_scan(tx.get("utid"), cache_titres, tx.get("upid"))
-
-        ops.append(UpdateOne({"_id": doc_id}, {"$set": doc}, upsert=True))
-
-    if ops:
-        col_erreurs.bulk_write(ops, ordered=False)
-        print(f"  {len(ops)} transactions en erreur upsertees dans hsh_erreurs.")
-
-
-def agreger_transactions(txs, evenement, cache_titres=None):
-    """Agrege les transactions par checkpoint + tranche de 5 minutes."""
-    if cache_titres is None:
-        cache_titres = {}
-    buckets = {}
-    for tx in txs:
-        cp = tx.get("checkpoint")
-        if not cp:
-            continue
-        cp_id = cp.get("ID") or cp.get("Id") or cp.get("id")
-        cp_name = cp.get("Name") or cp.get("name") or ""
+        doc["status_label"] = _label_status(tx.status)
+        doc["coding_label"] = _label_coding(doc.get("coding"))
+        doc["validated_label"] = _label_validated(doc.get("validated"))
+        doc["type_scan"] = cat
+        self.erreurs[f"{self.evenement_clean}_{tx.transaction_id}"] = doc
+
+    def _noeud(self, doc_id, champs, enfant=None):
+        noeud = self.arbre.setdefault(doc_id, {"set": {}, "enfants": {}})
+        noeud["set"].update(champs)
+        if enfant is not None:
+            noeud["enfants"][(enfant["id"], enfant["type"], enfant["name"])] = enfant
+
+    def _arbre(self, tx, tx_ts):
+        """Relations parent-enfant deduites de la transaction (hsh_structure)."""
+        cp_id, cp_name = tx.checkpoint_id, tx.checkpoint_name
+        gate_id, gate_name = tx.gate_id, tx.gate_name
+        area_id, area_name = tx.area_id, tx.area_name
+        venue_id, venue_name = tx.venue_id, tx.venue_name
+
+        if cp_id and gate_id:
+            self.liens_cp_gate.add((cp_id, cp_name or "?", gate_id, gate_name or "?"))
+        if gate_id and area_id:
+            self.liens_gate_area.add((gate_id, gate_name or "?", area_id, area_name or "?"))
+        if area_id and venue_id:
+            self.liens_area_venue.add((area_id, area_name or "?", venue_id, venue_name or "?"))
+
+        parents = {}
+        if gate_id:
+            parents["parent_gate"] = {"id": gate_id, "name": gate_name}
+        if area_id:
+            parents["parent_area"] = {"id": area_id, "name": area_name}
+        if venue_id:
+            parents["parent_venue"] = {"id": venue_id, "name": venue_name}
+
+        # Checkpoint -> parents Gate, Area, Venue
+        if cp_id:
+            champs = {
+                "location_id": cp_id,
+                "location_name": cp_name,
+                "location_type": "Checkpoint",
+                # None = date illisible : remplacee par l'heure du flush.
+                "derniere_transaction": tx_ts,
+            }
+            champs.update(parents)
+            self._noeud(f"Checkpoint_{cp_id}", champs)
+
+        # Gate -> parents Area/Venue, enfant Checkpoint
+        if gate_id:
+            champs = {"location_id": gate_id, "location_name": gate_name,
+                      "location_type": "Gate"}
+            for cle in ("parent_area", "parent_venue"):
+                if cle in parents:
+                    champs[cle] = parents[cle]
+            enfant = ({"id": cp_id, "type": "Checkpoint", "name": cp_name}
+                      if cp_id else None)
+            self._noeud(f"Gate_{gate_id}", champs, enfant)
+
+        # Area -> parent Venue, enfant Gate
+        if area_id:
+            champs = {"location_id": area_id, "location_name": area_name,
+                      "location_type": "Area"}
+            if "parent_venue" in parents:
+                champs["parent_venue"] = parents["parent_venue"]
+            enfant = ({"id": gate_id, "type": "Gate", "name": gate_name}
+                      if gate_id else None)
+            self._noeud(f"Area_{area_id}", champs, enfant)
+
+        # Venue -> enfant Area
+        if venue_id:
+            champs = {"location_id": venue_id, "location_name": venue_name,
+                      "location_type": "Venue"}
+            enfant = ({"id": area_id, "type": "Area", "name": area_name}
+                      if area_id else None)
+            self._noeud(f"Venue_{venue_id}", champs, enfant)
+
+    def _agg_checkpoint(self, tx, cat, tranche):
+        """Compteurs par checkpoint + tranche de 5 minutes."""
+        cp_id = tx.checkpoint_id
         if not cp_id:
-            continue
-
-        # Calculer la tranche de 5 min a partir de date_utc
-        date_str = tx.get("date_utc")
-        if not date_str:
-            continue
-        try:
-            dt = datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S").replace(
-                tzinfo=datetime.timezone.utc
-            )
-        except Exception:
-            continue
-        # Arrondir aux 5 min inferieures
-        minute = (dt.minute // 5) * 5
-        tranche = dt.replace(minute=minute, second=0, microsecond=0)
-
+            return
         key = (cp_id, tranche.isoformat())
-        if key not in buckets:
-            gate = tx.get("gate")
-            gate_name = ""
-            if gate:
-                gate_name = gate.get("Name") or gate.get("name") or ""
-            buckets[key] = {
-                "cp_id": cp_id, "cp_name": cp_name,
-                "gate_name": gate_name,
-                "tranche": tranche,
-                "ok": 0, "erreurs": 0, "entrees": 0, "sorties": 0,
-                "entrees_vehicules": 0, "sorties_vehicules": 0,
-                "entrees_enfants": 0, "sorties_enfants": 0,
-                "entrees_accredites": 0, "sorties_accredites": 0,
-            }
-
-        b = buckets[key]
-        if tx.get("status") == "0":
+        b = self.tx_agg.get(key)
+        if b is None:
+            b = {"cp_id": cp_id, "cp_name": tx.checkpoint_name or "",
+                 "gate_name": tx.gate_name or "",
+                 "tranche": tranche}
+            b.update({c: 0 for c in _COMPTEURS_AGG})
+            self.tx_agg[key] = b
+
+        if tx.status == "0":
             b["ok"] += 1
         else:
             b["erreurs"] += 1
-        direction = tx.get("direction", "")
+        direction = tx.direction
         if direction == "Entree":
-            b["entrees"] += 1
+            sens = "entrees"
         elif direction == "Sortie":
-            b["sorties"] += 1
-
-        # Compteurs par type de scan
-        cat = categoriser_scan(tx.get("utid"), cache_titres, tx.get("upid"))
-        if cat == "vehicule":
-            if direction == "Entree":
-                b["entrees_vehicules"] += 1
-            elif direction == "Sortie":
-                b["sorties_vehicules"] += 1
-        elif cat == "enfant":
-            if direction == "Entree":
-                b["entrees_enfants"] += 1
-            elif direction == "Sortie":
-                b["sorties_enfants"] += 1
-        elif cat == "accredite":
-            if direction == "Entree":
-                b["entrees_accredites"] += 1
-            elif direction == "Sortie":
-                b["sorties_accredites"] += 1
-
-    if not buckets:
-        return
-
-    ops = []
-    for b in buckets.values():
-        doc_id = f"{evenement}_{b['cp_id']}_{b['tranche'].strftime('%Y%m%dT%H%M')}"
-        ops.append(UpdateOne(
-            {"_id": doc_id},
-            {
-                "$inc": {
-                    "ok": b["ok"],
-                    "erreurs": b["erreurs"],
-                    "entrees": b["entrees"],
-                    "sorties": b["sorties"],
-                    "entrees_vehicules": b["entrees_vehicules"],
-                    "sorties_vehicules": b["sorties_vehicules"],
-                    "entrees_enfants": b["entrees_enfants"],
-                    "sorties_enfants": b["sorties_enfants"],
-                    "entrees_accredites": b["entrees_accredites"],
-                    "sorties_accredites": b["sorties_accredites"],
-                },
-                "$set": {
-                    "checkpoint_id": b["cp_id"],
-                    "checkpoint_name": b["cp_name"],
-                    "gate_name": b["gate_name"],
-                    "evenement": evenement,
-                    "tranche": b["tranche"],
-                },
-            },
-            upsert=True,
-        ))
-    if ops:
-        col_tx_agg.bulk_write(ops, ordered=False)
-        print(f"  {len(ops)} tranches agregees dans hsh_transactions_agg.")
-
-
-def agreger_par_titre(txs, evenement, cache_titres=None):
-    """Agrege les transactions par titre de billet + tranche de 5 minutes."""
-    if cache_titres is None:
-        cache_titres = {}
-    buckets = {}
-    for tx in txs:
-        if tx.get("status") != "0":
-            continue
-        utid = tx.get("utid")
-        if not utid or utid not in cache_titres:
-            continue
-        titre = cache_titres[utid]
+            sens = "sorties"
+        else:
+            return
+        b[sens] += 1
+        suffixe = _SUFFIXE_CATEGORIE.get(cat)
+        if suffixe:
+            b[f"{sens}_{suffixe}"] += 1
+
+    def _agg_titre(self, tx, tranche):
+        """Entrees/sorties par titre de billet + tranche de 5 minutes."""
+        utid = tx.utid
+        if not utid or utid not in self.cache_titres:
+            return
+        titre = self.cache_titres[utid]
         if not titre:
-            continue
-
-        date_str = tx.get("date_utc")
-        if not date_str:
-            continue
-        try:
-            dt = datetime.datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S").replace(
-                tzinfo=datetime.timezone.utc
-            )
-        except Exception:
-            continue
-        minute = (dt.minute // 5) * 5
-        tranche = dt.replace(minute=minute, second=0, microsecond=0)
-
+            return
         key = (titre, tranche.isoformat())
-        if key not in buckets:
-            buckets[key] = {"titre": titre, "tranche": tranche, "entrees": 0, "sorties": 0}
-
-        direction = tx.get("direction", "")
+        b = self.titres.get(key)
+        if b is None:
+            b = {"titre": titre, "tranche": tranche, "entrees": 0, "sorties": 0}
+            self.titres[key] = b
+        direction = tx.direction
         if direction == "Entree":
-            buckets[key]["entrees"] += 1
+            b["entrees"] += 1
         elif direction == "Sortie":
-            buckets[key]["sorties"] += 1
-
-    if not buckets:
-        return
+            b["sorties"] += 1
 
-    ops = []
-    for b in buckets.values():
-        doc_id = f"{evenement}_{b['titre']}_{b['tranche'].strftime('%Y%m%dT%H%M')}"
-        ops.append(UpdateOne(
-            {"_id": doc_id},
-            {
-                "$inc": {"entrees": b["entrees"], "sorties": b["sorties"]},
-                "$set": {
-                    "titre": b["titre"],
-                    "evenement": evenement,
-                    "tranche": b["tranche"],
+    def _presence(self, tx, cat, dt, tranche):
+        """Delta du registre des presents : zone (Area) + tranche de 5 min."""
+        txid = tx.transaction_id
+        if isinstance(txid, int):
+            if self.presence_hwm is not None and txid <= self.presence_hwm:
+                return
+            if self.presence_max_tx is None or txid > self.presence_max_tx:
+                self.presence_max_tx = txid
+        area_id = tx.area_id
+        direction = tx.direction
+        if not area_id or direction not in ("Entree", "Sortie"):
+            return
+        key = (area_id, tranche.isoformat())
+        b = self.presence.get(key)
+        if b is None:
+            b = {"area_id": area_id, "area_name": tx.area_name or "",
+                 "tranche": tranche}
+            b.update({c: 0 for c in presence_ledger.COMPTEURS})
+            self.presence[key] = b
+        sens = "entrees" if direction == "Entree" else "sorties"
+        b[f"{sens}_{cat}"] += 1
+        if self.presence_max_dt is None or dt > self.presence_max_dt:
+            self.presence_max_dt = dt
+
+    # ---------- ecriture ----------
+
+    def flush(self, verbose=True):
+        """Ecrit tout ce qui est accumule (une bulk_write par collection) puis
+        repart a vide. Rend le nombre de transactions flushees.
+
+        Chaque accumulateur est vide des que sa bulk_write passe : apres un
+        echec partiel, un nouveau flush ne reprend que ce qui n'est pas
+        ecrit, sans rejouer les $inc deja appliques."""
+        ts = datetime.datetime.now(datetime.timezone.utc)
+        evenement = self.evenement
+
+        if self.erreurs:
+            ops = []
+            for doc_id, doc in self.erreurs.items():
+                doc["collecte_timestamp"] = ts
+                ops.append(UpdateOne({"_id": doc_id}, {"$set": doc}, upsert=True))
+            col_erreurs.bulk_write(ops, ordered=False)
+            self.erreurs = {}
+            if verbose:
+                print(f"  {len(ops)} transactions en erreur upsertees dans hsh_erreurs.")
+
+        if self.arbre:
+            ops = []
+            for doc_id, noeud in self.arbre.items():
+                champs = dict(noeud["set"])
+                champs["evenement"] = evenement
+                champs["derniere_maj"] = ts
+                if "derniere_transaction" in champs and champs["derniere_transaction"] is None:
+                    champs["derniere_transaction"] = ts
+                op = {"$set": champs, "$setOnInsert": {"source": "transactions"}}
+                if noeud["enfants"]:
+                    op["$addToSet"] = {"enfants": {"$each": list(noeud["enfants"].values())}}
+                ops.append(UpdateOne({"_id": doc_id}, op, upsert=True))
+            col_structure.bulk_write(ops, ordered=False)
+            self.arbre = {}
+            if verbose:
+                self._log_liens()
+
+        if self.tx_agg:
+            ops = []
+            for b in self.tx_agg.values():
+                doc_id = f"{evenement}_{b['cp_id']}_{b['tranche'].strftime('%Y%m%dT%H%M')}"
+                ops.append(UpdateOne(
+                    {"_id": doc_id},
+                    {
+                        "$inc": {c: b[c] for c in _COMPTEURS_AGG},
+                        "$set": {
+                            "checkpoint_id": b["cp_id"],
+                            "checkpoint_name": b["cp_name"],
+                            "gate_name": b["gate_name"],
+                            "evenement": evenement,
+                            "tranche": b["tranche"],
+                        },
+                    },
+                    upsert=True,
+                ))
+            col_tx_agg.bulk_write(ops, ordered=False)
+            self.tx_agg = {}
+            if verbose:
+                print(f"  {len(ops)} tranches agregees dans hsh_transactions_agg.")
+
+        if self.titres:
+            ops = []
+            for b in self.titres.values():
+                doc_id = f"{evenement}_{b['titre']}_{b['tranche'].strftime('%Y%m%dT%H%M')}"
+                ops.append(UpdateOne(
+                    {"_id": doc_id},
+                    {
+                        "$inc": {"entrees": b["entrees"], "sorties": b["sorties"]},
+                        "$set": {
+                            "titre": b["titre"],
+                            "evenement": evenement,
+                            "tranche": b["tranche"],
+                        },
+                    },
+                    upsert=True,
+                ))
+            col_agg_titres.bulk_write(ops, ordered=False)
+            self.titres = {}
+            if verbose:
+                print(f"  {len(ops)} tranches agregees dans hsh_agg_titres.")
+
+        if self.presence or self.presence_ops:
+            self._flush_presence(ts, verbose)
+        if self.presence_max_tx is not None:
+            self.presence_hwm = self.presence_max_tx
+
+        nb = self.nb_tx
+        self._reset()
+        return nb
+
+    def _flush_presence(self, ts, verbose):
+        """Deltas par tranche, solde courant de l'evenement, et report sur
+        les checkpoints deja figes des transactions arrivees en retard.
+        Trois bulk_write en $inc : chacune sort de presence_ops une fois
+        passee, une reprise ne rejoue que les suivantes."""
+        if self.presence:
+            self.presence_ops.extend(self._presence_ops(ts))
+            self.presence = {}
+        while self.presence_ops:
+            col, ops = self.presence_ops[0]
+            col.bulk_write(ops, ordered=False)
+            self.presence_ops.pop(0)
+            if verbose and col is col_presence_deltas:
+                print(f"  {len(ops)} tranches de presence dans {presence_ledger.COL_DELTAS}.")
+
+    def _presence_ops(self, ts):
+        evenement = self.evenement
+        deltas, corrections = [], []
+        solde_inc, solde_set = {}, {}
+        for b in self.presence.values():
+            zone = presence_ledger.zone_key(b["area_id"])
+            inc = {c: b[c] for c in presence_ledger.COMPTEURS if b[c]}
+            deltas.append(UpdateOne(
+                {"_id": f"{evenement}_{b['area_id']}_{b['tranche'].strftime('%Y%m%dT%H%M')}"},
+                {
+                    "$inc": inc,
+                    "$set": {
+                        "evenement": evenement,
+                        "zone": zone,
+                        "area_id": b["area_id"],
+                        "area_name": b["area_name"],
+                        "tranche": b["tranche"],
+                    },
                 },
-            },
-            upsert=True,
-        ))
-    if ops:
-        col_agg_titres.bulk_write(ops, ordered=False)
-        print(f"  {len(ops)} tranches agregees dans hsh_agg_titres.")
-
+                upsert=True,
+            ))
+            zinc = {f"zones.{zone}.{c}": n for c, n in inc.items()}
+            # Ne touche que les checkpoints posterieurs a la tranche : aucun
+            # en regime normal, la tranche courante n'etant pas encore figee.
+            corrections.append(UpdateMany(
+                {"evenement": evenement, "at": {"$gt": b["tranche"]}},
+                {"$inc": zinc},
+            ))
+            for k, n in zinc.items():
+                solde_inc[k] = solde_inc.get(k, 0) + n
+            solde_set[f"zones.{zone}.name"] = b["area_name"]
+
+        solde_set.update({"evenement": evenement, "derniere_maj": ts})
+        op = {"$inc": solde_inc, "$set": solde_set}
+        maxima = {}
+        if self.presence_max_tx is not None:
+            maxima["max_tx_id"] = self.presence_max_tx
+        if self.presence_max_dt is not None:
+            maxima["derniere_transaction"] = self.presence_max_dt
+        if maxima:
+            op["$max"] = maxima
+        return [(col_presence_deltas, deltas),
+                (col_presence_checkpoints, corrections),
+                (col_presence, [UpdateOne({"_id": evenement}, op, upsert=True)])]
+
+    def _log_liens(self):
+        if not (self.liens_cp_gate or self.liens_gate_area or self.liens_area_venue):
+            return
+        print(f"  Arbre deduit: {len(self.liens_cp_gate)} checkpoint->gate, {len(self.liens_gate_area)} gate->area, {len(self.liens_area_venue)} area->venue")
+        for c_id, c_name, g_id, g_name in sorted(self.liens_cp_gate):
+            print(f"    Checkpoint {c_name} ({c_id}) -> Gate {g_name} ({g_id})")
+        for g_id, g_name, a_id, a_name in sorted(self.liens_gate_area):
+            print(f"    Gate {g_name} ({g_id}) -> Area {a_name} ({a_id})")
+        for a_id, a_name, v_id, v_name in sorted(self.liens_area_venue):
+            print(f"    Area {a_name} ({a_id}) -> Venue {v_name} ({v_id})")
 
-def executer_transactions(sock, doc_global, cache_titres=None):
-    """Collecte paginée des transactions → erreurs + arbre."""
-    if cache_titres is None:
-        cache_titres = {}
-    evenement = doc_global.get("evenement", "")
-    evenement_clean = doc_global.get("evenement_clean", "")
-    last_tx_id = doc_global.get("dernier_transaction_id")
 
+def _issuer_tx(doc_global):
     # Issuer des requetes Transactions : champ ___GLOBAL___ prioritaire, sinon defaut.
     tx_issuer = doc_global.get("hsh_issuer_tx")
     if tx_issuer is None:
         tx_issuer = DEFAULT_TX_ISSUER
-    print(f"  Issuer transactions: {tx_issuer}")
+    return tx_issuer
+
+
+def _fenetre_initiale(doc_global):
+    """Point de depart de la collecte : (from_dt, to_dt, curseur).
+    Curseur LastTransactionId si on en a un, sinon fenetre From/To ; un
+    forcage admin (force_collecte_jours) ignore le curseur et est consomme."""
+    last_tx_id = doc_global.get("dernier_transaction_id")
 
     # Forçage de période depuis l'admin (1-3 jours)
     force_jours = doc_global.get("force_collecte_jours")
@@ -1147,58 +1310,85 @@ def executer_transactions(sock, doc_global, cache_titres=None):
     else:
         print(f"  Transactions: depuis LastTransactionId={last_tx_id}")
 
+    cursor = str(last_tx_id) if last_tx_id is not None else None
+    return from_dt, to_dt, cursor
+
+
+def _demander_page(sock, from_dt, to_dt, cursor, tx_issuer):
+    """Une page de transactions : (reponse_ok, not_complete, txs, max_txid)."""
+    xml_req = build_transactions_xml(
+        from_dt=from_dt,
+        to_dt=to_dt,
+        last_tx_id=cursor,
+        issuer=tx_issuer,
+    )
+    resp = envoyer_et_recevoir(sock, encapsuler_transactions(xml_req))
+    if not resp:
+        return False, False, [], None
+    not_complete, txs, max_txid = parse_transactions(resp)
+    return True, not_complete, txs, max_txid
+
+
+def _sauver_curseur(cursor):
+    maj_global({"dernier_transaction_id": int(cursor) if cursor else None})
+
+
+def executer_transactions(sock, doc_global, cache_titres=None):
+    """Collecte paginée des transactions → erreurs + arbre + agrégats.
+    Les pages sont accumulées dans un TransactionSinks et écrites ensemble,
+    le curseur n'étant sauvé qu'après l'écriture correspondante."""
+    evenement = doc_global.get("evenement", "")
+    evenement_clean = doc_global.get("evenement_clean", "")
+    tx_issuer = _issuer_tx(doc_global)
+    print(f"  Issuer transactions: {tx_issuer}")
+
+    from_dt, to_dt, cursor = _fenetre_initiale(doc_global)
+    sinks = TransactionSinks(evenement, evenement_clean, cache_titres,
+                             presence_ledger.high_water(db, evenement))
+
     # Augmenter le timeout pour la pagination
     sock.settimeout(READ_TIMEOUT_TRANSACTIONS)
 
     page = 0
     total_tx = 0
     total_erreurs = 0
-    cursor = last_tx_id
 
     while True:
         page += 1
-        xml_req = build_transactions_xml(
-            from_dt=from_dt,
-            to_dt=to_dt,
-            last_tx_id=cursor,
-            issuer=tx_issuer,
-        )
-        frame = encapsuler_transactions(xml_req)
-        resp = envoyer_et_recevoir(sock, frame)
-        if not resp:
+        ok, not_complete, txs, max_txid = _demander_page(
+            sock, from_dt, to_dt, cursor, tx_issuer)
+        if not ok:
             print(f"  Page {page}: pas de reponse.")
             break
 
-        not_complete, txs, max_txid = parse_transactions(resp)
         nb = len(txs)
         total_tx += nb
-
-        # Stocker les erreurs
-        nb_erreurs = sum(1 for tx in txs if tx["status"] != "0")
+        nb_erreurs = sum(1 for tx in txs if tx.status != "0")
         total_erreurs += nb_erreurs
-        if txs:
-            stocker_erreurs(txs, evenement, evenement_clean, cache_titres)
-            mettre_a_jour_arbre(txs, evenement)
-            agreger_transactions(txs, evenement, cache_titres)
-            agreger_par_titre(txs, evenement, cache_titres)
+        sinks.ingest(txs)
 
         print(f"  Page {page:03d}: {nb} transactions ({nb_erreurs} erreurs) | NotComplete={'1' if not_complete else '0'}")
 
-        if not_complete and max_txid is not None:
+        if max_txid is not None:
             cursor = str(max_txid)
+        # Borne memoire sur un forcage de plusieurs jours : on ecrit et on
+        # sauve le curseur en cours de route.
+        if len(sinks) >= FLUSH_MAX_TX:
+            sinks.flush()
+            _sauver_curseur(cursor)
+
+        if not_complete and max_txid is not None:
             # Après la première page, on passe en mode curseur (plus de From/To)
             from_dt = None
             to_dt = None
             time.sleep(0.1)
         else:
-            # Mettre à jour le curseur pour le prochain cycle
-            if max_txid is not None:
-                cursor = str(max_txid)
             break
 
-    # Sauvegarder le curseur
-    update = {"dernier_transaction_id": int(cursor) if cursor else None}
-    maj_global(update)
+    sinks.flush()
+    # Sauvegarder le curseur pour le prochain cycle
+    _sauver_curseur(cursor)
+    presence_ledger.ecrire_checkpoints(db, evenement)
 
     print(f"  Total: {total_tx} transactions, {total_erreurs} erreurs.")
 
@@ -1244,12 +1434,205 @@ def executer_compteurs(sock, evenement, evenement_clean):
             data["requested_event_clean"] = evenement_clean
 
             col_data_access.insert_one(data)
+            peak_rollup.enregistrer(db, loc_id, data.get("current"), data.get("timestamp"))
             print(f"    {loc_id}/{loc_type}: {data.get('counter_name', '?')} — E:{data.get('entries')} S:{data.get('exits')} P:{data.get('current')}")
 
         except Exception as e:
             print(f"    {loc_id}/{loc_type}: erreur — {e}")
 
 
+# =========================================================
+#              COLLECTEUR RÉSIDENT
+# =========================================================
+def _attendre(sock, duree):
+    """Attend `duree` secondes sur la socket ouverte en repondant aux
+    KEEPALIVE du HSH : sans reponse, le serveur finit par couper."""
+    fin = time.monotonic() + duree
+    while True:
+        reste = fin - time.monotonic()
+        if reste <= 0:
+            return
+        lisibles, _, _ = select.select([sock], [], [], reste)
+        if not lisibles:
+            return
+        dt, payload = _read_frame(sock)
+        if not _maybe_handle_keepalive(sock, dt, payload):
+            print(f"  Trame inattendue ignoree (type {dt}, {len(payload)} octets)")
+
+
+def _connecter():
+    sock = socket.create_connection((HSH_IP, HSH_PORT), timeout=CONNECT_TIMEOUT)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(READ_TIMEOUT_COUNTER)
+    print(f"  Connexion HSH ouverte ({HSH_IP}:{HSH_PORT})")
+    return sock
+
+
+def _fermer(sock):
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def _reinitialiser_si_inactif(doc):
+    """Meme nettoyage que main() quand le live controle est desactive."""
+    if doc.get("dernier_inventaire") is not None or doc.get("dernier_transaction_id") is not None:
+        maj_global({
+            "dernier_inventaire": None,
+            "dernier_transaction_id": None,
+            "dernier_cycle": None,
+        })
+        print("Live controle desactive. Etat reinitialise.")
+
+
+def executer_resident():
+    """Collecteur resident : une socket HSH persistante, des pages de
+    transactions demandees en continu et ecrites par fenetre de flush.
+
+    ___GLOBAL___ est relu toutes les GLOBAL_REFRESH_S : desactivation,
+    changement d'evenement ou d'issuer et forcage admin ferment la session en
+    cours (flush + curseur) et en ouvrent une nouvelle, comme le ferait le
+    prochain lancement de la tache planifiee.
+    """
+    print(f"Collecteur resident{' [MODE DEV]' if DEV_MODE else ''} — poll {POLL_INTERVAL_S}s, flush {FLUSH_WINDOW_S}s")
+    assurer_index()
+
+    sock = None
+    sinks = None
+    session = None          # (evenement, evenement_clean, issuer)
+    from_dt = to_dt = cursor = None
+    cursor_sauve = None
+    cache_titres = {}
+    t_global = t_flush = t_compteurs = t_titres = t_status = float("-inf")
+    t_presence = float("-inf")
+    total_tx = 0
+
+    def _cloturer():
+        nonlocal sinks, cursor_sauve
+        if sinks is not None:
+            sinks.flush(verbose=False)
+            if cursor != cursor_sauve:
+                _sauver_curseur(cursor)
+                cursor_sauve = cursor
+        sinks = None
+
+    try:
+        while True:
+            maintenant = time.monotonic()
+            try:
+                if session is None or maintenant - t_global >= GLOBAL_REFRESH_S:
+                    t_global = maintenant
+                    doc = lire_global()
+                    actif = doc.get("live_controle_actif", False) and doc.get("evenement")
+                    cle = (doc.get("evenement", ""), doc.get("evenement_clean", ""),
+                           _issuer_tx(doc))
+                    if not actif or cle != session or doc.get("force_collecte_jours"):
+                        _cloturer()
+                        session = None
+                        if not actif:
+                            _fermer(sock)
+                            sock = None
+                            _reinitialiser_si_inactif(doc)
+                            time.sleep(GLOBAL_REFRESH_S)
+                            continue
+                        # Le curseur vient peut-etre d'etre sauve : relire.
+                        doc = lire_global()
+                        session = cle
+                        print(f"Session: evenement {cle[0]} — issuer {cle[2]}")
+                        from_dt, to_dt, cursor = _fenetre_initiale(doc)
+                        cursor_sauve = cursor
+                        sinks = TransactionSinks(
+                            cle[0], cle[1], cache_titres,
+                            presence_ledger.high_water(db, cle[0]))
+                    maj_global({"dernier_cycle": datetime.datetime.now(datetime.timezone.utc)})
+
+                if maintenant - t_titres >= TITRES_REFRESH_S:
+                    t_titres = maintenant
+                    # Mise a jour en place : sinks garde la meme reference.
+                    cache_titres.clear()
+                    cache_titres.update(charger_cache_titres())
+                    print(f"  Cache titres: {len(cache_titres)} UTID charges")
+
+                if sock is None:
+                    sock = _connecter()
+                    doc = lire_global()
+                    if est_premiere_execution(doc):
+                        executer_inventaire(sock, session[0])
+
+                sock.settimeout(READ_TIMEOUT_TRANSACTIONS)
+                if cursor is None:
+                    # Fenetre glissante tant qu'aucune transaction n'a fixe le curseur.
+                    to_dt = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+                ok, not_complete, txs, max_txid = _demander_page(
+                    sock, from_dt, to_dt, cursor, session[2])
+                sock.settimeout(READ_TIMEOUT_COUNTER)
+                if ok:
+                    sinks.ingest(txs)
+                    total_tx += len(txs)
+                    if max_txid is not None:
+                        cursor = str(max_txid)
+                        from_dt = to_dt = None
+
+                maintenant = time.monotonic()
+                if len(sinks) >= FLUSH_MAX_TX or (
+                        len(sinks) and maintenant - t_flush >= FLUSH_WINDOW_S):
+                    debut = time.monotonic()
+                    nb = sinks.flush(verbose=False)
+                    if cursor != cursor_sauve:
+                        _sauver_curseur(cursor)
+                        cursor_sauve = cursor
+                    t_flush = maintenant
+                    print(f"  Flush: {nb} transactions en {(time.monotonic() - debut) * 1000:.0f} ms (curseur {cursor}, total {total_tx})")
+                elif not len(sinks):
+                    t_flush = maintenant
+
+                if maintenant - t_compteurs >= COUNTER_INTERVAL_S:
+                    t_compteurs = maintenant
+                    executer_compteurs(sock, session[0], session[1])
+
+                if maintenant - t_presence >= PRESENCE_CHECKPOINT_S:
+                    t_presence = maintenant
+                    n = presence_ledger.ecrire_checkpoints(db, session[0])
+                    if n:
+                        print(f"  Presents: {n} checkpoint(s) ecrit(s)")
+
+                if not (ok and not_complete):
+                    _attendre(sock, POLL_INTERVAL_S)
+
+            except Exception as exc:
+                # Socket coupee, trame corrompue, timeout ou Mongo indisponible :
+                # on flushe ce qui est acquis, puis on se reconnecte depuis le
+                # curseur.
+                print(f"Erreur collecteur resident: {exc} — reconnexion dans {RECONNECT_DELAY_S}s")
+                _update_cron_status("down", str(exc))
+                _fermer(sock)
+                sock = None
+                try:
+                    if sinks is not None and len(sinks):
+                        sinks.flush(verbose=False)
+                        if cursor != cursor_sauve:
+                            _sauver_curseur(cursor)
+                            cursor_sauve = cursor
+                except Exception as flush_exc:
+                    print(f"  Flush impossible: {flush_exc}")
+                time.sleep(RECONNECT_DELAY_S)
+            else:
+                if maintenant - t_status >= 60:
+                    t_status = maintenant
+                    _update_cron_status("ok")
+    except KeyboardInterrupt:
+        print("Arret demande.")
+    finally:
+        try:
+            _cloturer()
+        finally:
+            _fermer(sock)
+
+
 # =========================================================
 #              CYCLE PRINCIPAL
 # =========================================================
@@ -1321,7 +1704,10 @@ def main():
 # =========================================================
 if __name__ == "__main__":
     try:
-        main()
+        if DAEMON_MODE:
+            executer_resident()
+        else:
+            main()
     except Exception as exc:
         _update_cron_status("down", str(exc))
         print(f"Erreur: {exc}")
@@ -0,0 +1,278 @@
+"""Canal de push Server-Sent Events pour les ecrans live du Cockpit.
+
+Chaque ecran ouvert interrogeait ses endpoints sur minuterie (fiches PCO,
+alertes actives, console Hik, balises Anoloc, non-lus Field) : autant de
+verifications de jeton, de requetes Mongo et de serialisations JSON que
+d'ecrans. Ici les lectures sont faites UNE fois par canal, quel que soit le
+nombre d'abonnes :
+
+  - un TOPIC decrit une source : `fetch(db, params) -> (items, meta)`, la
+    cle d'un item, la periode de relecture, et eventuellement une
+    `version(db, params)` peu couteuse qui dispense de relire tant qu'elle
+    ne bouge pas (version des fiches pcorg d'analyse_ops) ;
+  - un CANAL est un topic pour des parametres donnes (pcorg d'un
+    event/year) ; il n'est relu que s'il a au moins un abonne ;
+  - un thread unique relit les canaux echus et ne pousse que les DELTAS
+    (items ajoutes ou modifies, cles retirees, ordre courant) ; notify()
+    rend un topic echu tout de suite, depuis une route d'ecriture du meme
+    processus ;
+  - chaque abonne a son filtre (slugs d'alertes, groupes de balises
+    visibles) applique au moment de l'envoi, en memoire.
+
+Les collecteurs tournent dans d'autres processus : pour eux, c'est la
+relecture periodique du canal (ou la version) qui fait foi.
+
+Module helpers pur (pas de Flask) : la route SSE est dans app.py.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Un flux tient un thread waitress : on les borne, le client retombe sur le
+# polling quand le serveur refuse (503).
+MAX_STREAMS = int(os.getenv("LIVE_PUSH_MAX_STREAMS", "16"))
+KEEPALIVE_S = 15
+# Duree de vie d'un flux : le navigateur se reconnecte seul (EventSource),
+# ce qui rejoue l'authentification et recycle le thread.
+STREAM_MAX_S = 300
+RETRY_MS = 5000
+QUEUE_MAX = 200
+
+
+def _sse(event, data):
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data, default=str, separators=(",", ":")))
+
+
+class Topic:
+    def __init__(self, name, fetch, key, interval_s, version=None, admin_only=False,
+                 max_stale_s=None):
+        self.name = name
+        self.fetch = fetch
+        self.key = key
+        self.interval_s = interval_s
+        self.version = version
+        self.admin_only = admin_only
+        # Avec une version : relecture complete au moins a ce rythme, pour
+        # les ecritures qui ne la feraient pas monter.
+        self.max_stale_s = max_stale_s
+
+
+class _Channel:
+    def __init__(self, topic, params):
+        self.topic = topic
+        self.params = dict(params)
+        self.subs = set()
+        self.items = {}
+        self.order = []
+        self.meta = None
+        self.version = None
+        self.loaded = False
+        self.due = 0.0
+        self.fetched_at = 0.0
+
+
+class Subscription:
+    """Un flux SSE : une file de messages deja formates, propre a l'abonne."""
+
+    def __init__(self, hub):
+        self._hub = hub
+        self._queue = queue.Queue(maxsize=QUEUE_MAX)
+        self.accepts = {}   # channel -> filtre(item) -> bool
+        self.primed = set()  # canaux dont l'abonne a recu le snapshot
+        self.closed = False
+
+    def _put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            # Abonne trop lent : on coupe, il se reconnecte et repart d'un
+            # snapshot plutot que de laisser la file grossir.
+            self.closed = True
+
+    def _send(self, ch, upserts, removed, meta_changed):
+        # Items indexes par cle : le client applique upsert/remove puis
+        # reconstruit la liste dans `order`, sans connaitre la cle du topic.
+        accept = self.accepts.get(ch)
+        order = [k for k in ch.order if accept is None or accept(ch.items[k])]
+        if ch not in self.primed:
+            self.primed.add(ch)
+            self._put(_sse("snapshot", {"topic": ch.topic.name, "params": ch.params,
+                                        "items": {k: ch.items[k] for k in order},
+                                        "order": order, "meta": ch.meta}))
+            return
+        envoyes, retires = {}, list(removed)
+        for k in upserts:
+            if accept is None or accept(ch.items[k]):
+                envoyes[k] = ch.items[k]
+            else:
+                retires.append(k)
+        data = {"topic": ch.topic.name, "params": ch.params,
+                "upsert": envoyes, "remove": retires, "order": order}
+        if meta_changed:
+            data["meta"] = ch.meta
+        self._put(_sse("delta", data))
+
+    def events(self, max_s=STREAM_MAX_S, keepalive_s=KEEPALIVE_S):
+        """Generateur du corps de la reponse text/event-stream."""
+        fin = time.monotonic() + max_s
+        try:
+            yield "retry: %d\n\n" % RETRY_MS
+            while not self.closed and time.monotonic() < fin:
+                try:
+                    yield self._queue.get(timeout=min(keepalive_s, max(0.0, fin - time.monotonic())))
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self._hub.unsubscribe(self)
+
+
+class Hub:
+    def __init__(self, get_db, max_streams=MAX_STREAMS):
+        self._get_db = get_db
+        self.max_streams = max_streams
+        self._topics = {}
+        self._channels = {}
+        self._subs = set()
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.fetches = 0
+
+    def register(self, name, fetch, key, interval_s, version=None, admin_only=False,
+                 max_stale_s=None):
+        self._topics[name] = Topic(name, fetch, key, interval_s, version, admin_only,
+                                   max_stale_s)
+
+    def topic(self, name):
+        return self._topics.get(name)
+
+    def streams(self):
+        return len(self._subs)
+
+    # -- abonnements ---------------------------------------------------------
+
+    def subscribe(self, demandes):
+        """`demandes` : [(topic, params, filtre ou None)]. Rend une
+        Subscription, ou None si MAX_STREAMS flux sont deja ouverts."""
+        with self._lock:
+            if len(self._subs) >= self.max_streams:
+                return None
+            sub = Subscription(self)
+            for name, params, accept in demandes:
+                topic = self._topics[name]
+                cle = (name, tuple(sorted(params.items())))
+                ch = self._channels.get(cle)
+                if ch is None:
+                    ch = self._channels[cle] = _Channel(topic, params)
+                ch.subs.add(sub)
+                sub.accepts[ch] = accept
+                if ch.loaded:
+                    sub._send(ch, [], [], False)
+                else:
+                    ch.due = 0.0
+            self._subs.add(sub)
+        self._demarrer()
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+            for ch in list(sub.accepts):
+                ch.subs.discard(sub)
+                if not ch.subs:
+                    # Plus personne : le canal est oublie, rien ne le relit.
+                    self._channels = {k: c for k, c in self._channels.items() if c is not ch}
+            sub.accepts.clear()
+            sub.closed = True
+
+    def notify(self, name):
+        """Le topic a change (ecriture dans ce processus) : relecture tout de suite."""
+        with self._lock:
+            for ch in self._channels.values():
+                if ch.topic.name == name:
+                    ch.due = 0.0
+        self._wake.set()
+
+    # -- relecture -----------------------------------------------------------
+
+    def poll_once(self, now=None):
+        """Relit les canaux echus. Rend le nombre de canaux relus."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            echus = [ch for ch in self._channels.values() if ch.subs and ch.due <= now]
+        for ch in echus:
+            ch.due = now + ch.topic.interval_s
+            try:
+                self._refresh(ch, now)
+            except Exception as exc:
+                logger.warning("live_push : relecture %s echouee (%s)", ch.topic.name, exc)
+        return len(echus)
+
+    def _refresh(self, ch, now):
+        db = self._get_db()
+        topic = ch.topic
+        version = None
+        if topic.version is not None:
+            version = topic.version(db, ch.params)
+            frais = topic.max_stale_s is None or now - ch.fetched_at < topic.max_stale_s
+            if ch.loaded and version == ch.version and frais:
+                return
+        self.fetches += 1
+        ch.fetched_at = now
+        items, meta = topic.fetch(db, ch.params)
+        nouveaux = {}
+        order = []
+        for item in items:
+            k = str(topic.key(item))
+            if k not in nouveaux:
+                nouveaux[k] = item
+                order.append(k)
+        with self._lock:
+            upserts = [k for k in order if ch.items.get(k) != nouveaux[k]]
+            removed = [k for k in ch.items if k not in nouveaux]
+            meta_changed = meta != ch.meta
+            inchange = ch.loaded and not (upserts or removed or meta_changed or order != ch.order)
+            ch.items, ch.order, ch.meta, ch.version, ch.loaded = nouveaux, order, meta, version, True
+            if inchange:
+                return
+            for sub in list(ch.subs):
+                sub._send(ch, upserts, removed, meta_changed)
+
+    def _demarrer(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._boucle, name="live-push", daemon=True)
+            self._thread.start()
+
+    def _boucle(self):
+        while True:
+            self._wake.wait(1.0)
+            self._wake.clear()
+            self.poll_once()
+
+
+# ---------------------------------------------------------------------------
+# Instance du processus web
+# ---------------------------------------------------------------------------
+
+_hub = None
+
+
+def install(get_db, max_streams=MAX_STREAMS):
+    global _hub
+    _hub = Hub(get_db, max_streams)
+    return _hub
+
+
+def notify(name):
+    """Sans effet hors du processus web (collecteurs, scripts, tests)."""
+    if _hub is not None:
+        _hub.notify(name)
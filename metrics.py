@@ -0,0 +1,243 @@
+"""Mesures par route HTTP et par commande Mongo, pour le processus web.
+
+Personne ne savait quelles routes etaient lentes en production : seul
+traffic.py journalisait ses sources. Ce module donne la base de mesure avant
+tout reglage :
+
+  - un `CommandListener` pymongo enregistre globalement (donc sur tous les
+    MongoClient du processus, ceux de app.py comme ceux crees par les
+    blueprints) ; pendant une requete HTTP, chaque commande est rattachee a
+    la requete du thread courant (les evenements pymongo sont publies dans
+    le thread qui execute la commande) ;
+  - un `Registry` par route (regle Flask, pas l'URL : /api/x/<id> reste une
+    seule ligne) : histogramme de latence, echantillon recent pour les
+    percentiles, nombre et duree des commandes Mongo par requete, tailles
+    des corps de requete et de reponse ;
+  - un journal des requetes lentes (> METRICS_SLOW_MS) avec leurs commandes
+    Mongo les plus couteuses.
+
+Le branchement Flask (before/after_request et /api/_metrics) est dans
+app.py : ce module reste pur et se teste sans application.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Bornes superieures des cases de l'histogramme, en ms (la derniere : au-dela).
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Echantillon recent par route, pour des percentiles exacts sur le regime courant.
+SAMPLES = 512
+SLOW_MS = float(os.getenv("METRICS_SLOW_MS", "1000"))
+SLOW_LOG_MAX = 100
+TOP_COMMANDS = 5
+
+_local = threading.local()
+
+
+def _percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    if not valeurs:
+        return None
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+
+# ---------------------------------------------------------------------------
+# Commandes Mongo
+# ---------------------------------------------------------------------------
+
+def begin():
+    """Ouvre la collecte des commandes Mongo pour la requete du thread courant."""
+    _local.commands = []
+    _local.pending = {}
+    _local.t0 = time.perf_counter()
+
+
+def end():
+    """Ferme la collecte : (duree_ms depuis begin, [(commande, collection, ms, echec)])."""
+    commands = getattr(_local, "commands", None)
+    t0 = getattr(_local, "t0", None)
+    _local.commands = None
+    _local.pending = None
+    _local.t0 = None
+    if t0 is None:
+        return None, []
+    return (time.perf_counter() - t0) * 1000.0, commands or []
+
+
+def _collection(event):
+    valeur = event.command.get(event.command_name)
+    if event.command_name == "getMore":
+        valeur = event.command.get("collection")
+    return valeur if isinstance(valeur, str) else ""
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pending = getattr(_local, "pending", None)
+        if pending is None:
+            return
+        pending[event.request_id] = (event.command_name,
+                                     "%s.%s" % (event.database_name, _collection(event)))
+
+    def _fin(self, event, echec):
+        pending = getattr(_local, "pending", None)
+        if pending is None:
+            return
+        info = pending.pop(event.request_id, None)
+        if info is None:
+            return
+        _local.commands.append((info[0], info[1], event.duration_micros / 1000.0, echec))
+
+    def succeeded(self, event):
+        self._fin(event, False)
+
+    def failed(self, event):
+        self._fin(event, True)
+
+
+listener = MongoCommandListener()
+_listener_installe = False
+
+
+def install_listener():
+    """A appeler AVANT de creer les MongoClient du processus : pymongo ne
+    branche les listeners globaux que sur les clients crees ensuite."""
+    global _listener_installe
+    if not _listener_installe:
+        monitoring.register(listener)
+        _listener_installe = True
+
+
+# ---------------------------------------------------------------------------
+# Agregats par route
+# ---------------------------------------------------------------------------
+
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.errors_4xx = 0
+        self.errors_5xx = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=SAMPLES)
+        self.mongo_commands = 0
+        self.mongo_ms = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def add(self, status, duration_ms, bytes_in, bytes_out, commands):
+        self.count += 1
+        if 400 <= status < 500:
+            self.errors_4xx += 1
+        elif status >= 500:
+            self.errors_5xx += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        i = 0
+        while i < len(BUCKETS_MS) and duration_ms > BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.samples.append(duration_ms)
+        self.mongo_commands += len(commands)
+        self.mongo_ms += sum(c[2] for c in commands)
+        self.bytes_in += bytes_in or 0
+        self.bytes_out += bytes_out or 0
+
+    def as_dict(self):
+        n = self.count or 1
+        return {
+            "count": self.count,
+            "errors_4xx": self.errors_4xx,
+            "errors_5xx": self.errors_5xx,
+            "mean_ms": round(self.total_ms / n, 1),
+            "p50_ms": _arrondi(_percentile(self.samples, 50)),
+            "p95_ms": _arrondi(_percentile(self.samples, 95)),
+            "p99_ms": _arrondi(_percentile(self.samples, 99)),
+            "max_ms": round(self.max_ms, 1),
+            "total_s": round(self.total_ms / 1000.0, 2),
+            "histogram": dict(zip([str(b) for b in BUCKETS_MS] + ["inf"], self.buckets)),
+            "mongo_commands_per_request": round(self.mongo_commands / n, 2),
+            "mongo_ms_per_request": round(self.mongo_ms / n, 1),
+            "bytes_in_per_request": int(self.bytes_in / n),
+            "bytes_out_per_request": int(self.bytes_out / n),
+        }
+
+
+def _arrondi(v):
+    return None if v is None else round(v, 1)
+
+
+def top_commands(commands, n=TOP_COMMANDS):
+    """Commandes regroupees par (commande, collection), les plus longues d'abord."""
+    groupes = {}
+    for name, coll, ms, echec in commands:
+        g = groupes.setdefault((name, coll), {"command": name, "collection": coll,
+                                              "count": 0, "ms": 0.0, "failed": 0})
+        g["count"] += 1
+        g["ms"] += ms
+        g["failed"] += 1 if echec else 0
+    out = sorted(groupes.values(), key=lambda g: g["ms"], reverse=True)[:n]
+    for g in out:
+        g["ms"] = round(g["ms"], 1)
+    return out
+
+
+class Registry:
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._slow = deque(maxlen=SLOW_LOG_MAX)
+        self.started_at = time.time()
+
+    def record(self, route, endpoint, status, duration_ms, bytes_in=0, bytes_out=0, commands=()):
+        """Enregistre une requete ; rend l'entree du journal lent, ou None."""
+        commands = list(commands)
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+                stats.endpoint = endpoint
+            stats.add(status, duration_ms, bytes_in, bytes_out, commands)
+        if duration_ms < self.slow_ms:
+            return None
+        entree = {
+            "ts": time.time(), "route": route, "endpoint": endpoint, "status": status,
+            "ms": round(duration_ms, 1), "mongo_commands": len(commands),
+            "mongo_ms": round(sum(c[2] for c in commands), 1),
+            "top_commands": top_commands(commands),
+        }
+        with self._lock:
+            self._slow.append(entree)
+        logger.warning("requete lente %s %s : %.0f ms, %d commandes Mongo (%.0f ms) %s",
+                       route, status, duration_ms, entree["mongo_commands"], entree["mongo_ms"],
+                       ", ".join("%s %s x%d %.0f ms" % (c["command"], c["collection"],
+                                                          c["count"], c["ms"])
+                                 for c in entree["top_commands"]))
+        return entree
+
+    def snapshot(self, sort="total_s"):
+        with self._lock:
+            routes = [dict(s.as_dict(), route=r, endpoint=s.endpoint)
+                      for r, s in self._routes.items()]
+            slow = list(self._slow)
+        routes.sort(key=lambda d: d.get(sort) or 0, reverse=True)
+        return {"since": self.started_at, "slow_ms": self.slow_ms,
+                "routes": routes, "slow_requests": slow[::-1]}
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+            self._slow.clear()
+            self.started_at = time.time()
+
+
+registry = Registry()
@@ -0,0 +1,195 @@
+"""Compteur de vehicules sur site (entrees - sorties LAPI depuis la remise a zero).
+
+anpr_onsite, interroge toutes les 15 s par la page LAPI, lancait deux fois
+_count_direction : a chaque fois un distinct("camera_path") sur tout
+hik_anpr puis un $count avec un grand $or de couples camera / sens sur
+toutes les lectures depuis la remise a zero. Le compteur est maintenant un
+document de anpr_site_counter :
+
+    {_id: "counter", reset_at, generation, counted_to, entries, exits,
+     cameras: {"<camera>": {camera_path, entries, exits}}, updated_at}
+
+  - incremente au fil de l'ingestion (resident anpr_ingest), le sens brut
+    etant resolu par le forward_role de la camera ;
+  - remis a zero par `reset`, qui range d'abord les compteurs courants dans
+    anpr_site_counter_snapshots ;
+  - recalcule depuis l'historique par `rebuild` (une seule agregation par
+    camera / sens) quand la configuration des cameras change, ou s'il manque.
+
+Un recalcul (route web) peut croiser un lot du resident : `counted_to` (la
+derniere lecture comptee, par le recalcul ou par un lot) ecarte les
+lectures deja comptees, et `generation` rejette l'increment d'un lot lu
+avant le recalcul. Un lot rejoue apres un arret avant l'avancee du repere
+anpr_ingest ne compte donc rien.
+
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+"""
+
+import re
+from datetime import datetime, timezone
+
+import anpr_ingest
+
+COL = "anpr_site_counter"
+COL_SNAPSHOTS = "anpr_site_counter_snapshots"
+COL_CAMERAS = "anpr_camera_config"
+COUNTER_ID = "counter"
+STATE = "onsite"
+
+# Avant la premiere remise a zero : tout l'historique.
+EPOCH = datetime(2000, 1, 1)
+
+
+def _naive_utc(dt):
+    if isinstance(dt, datetime) and dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _cam_key(camera_path):
+    """'.' et '$' sont interdits dans un nom de champ Mongo."""
+    return re.sub(r"[.$]", "_", camera_path or "?")
+
+
+def resolve_direction(raw_direction, camera_path, cam_configs):
+    """forward / reverse -> entry / exit selon la camera (forward = entree
+    par defaut) ; 'unknown' pour tout autre sens."""
+    fwd_role = (cam_configs.get(camera_path) or {}).get("forward_role", "entry")
+    if raw_direction == "forward":
+        return "entry" if fwd_role == "entry" else "exit"
+    if raw_direction == "reverse":
+        return "exit" if fwd_role == "entry" else "entry"
+    return "unknown"
+
+
+def _cam_configs(db):
+    return {c["camera_path"]: c for c in db[COL_CAMERAS].find()}
+
+
+def _add(counts, camera_path, sens, n):
+    field = "entries" if sens == "entry" else "exits"
+    counts[field] = counts.get(field, 0) + n
+    cam = counts["cameras"].setdefault(_cam_key(camera_path), {
+        "camera_path": camera_path, "entries": 0, "exits": 0})
+    cam[field] += n
+
+
+# ---------------------------------------------------------------------------
+# Ecritures
+# ---------------------------------------------------------------------------
+
+def record(db, reads):
+    """Compte des lectures hik_anpr. Sans compteur, ne fait rien : `rebuild`
+    le creera en reprenant tout l'historique."""
+    doc = db[COL].find_one({"_id": COUNTER_ID})
+    if doc is None:
+        return 0
+    reset_at = _naive_utc(doc.get("reset_at")) or EPOCH
+    counted_to = doc.get("counted_to")
+    configs = _cam_configs(db)
+    counts = {"cameras": {}}
+    n = 0
+    for r in reads:
+        dt = _naive_utc(r.get("event_dt"))
+        if r.get("license_plate") == "UNKNOWN" or dt is None or dt < reset_at:
+            continue
+        if counted_to is not None and r["_id"] <= counted_to:
+            continue
+        sens = resolve_direction(r.get("direction"), r.get("camera_path"), configs)
+        if sens in ("entry", "exit"):
+            _add(counts, r.get("camera_path"), sens, 1)
+            n += 1
+    if not n:
+        return 0
+    inc = {f: counts[f] for f in ("entries", "exits") if counts.get(f)}
+    # counted_to avance dans la meme ecriture que l'increment
+    setters = {"updated_at": datetime.now(timezone.utc), "counted_to": reads[-1]["_id"]}
+    for key, cam in counts["cameras"].items():
+        setters["cameras.%s.camera_path" % key] = cam["camera_path"]
+        for f in ("entries", "exits"):
+            if cam[f]:
+                inc["cameras.%s.%s" % (key, f)] = cam[f]
+    # Filtre sur reset_at et generation : un lot lu avant une remise a zero
+    # ou un recalcul concurrent ne vient pas gonfler le nouveau compteur.
+    db[COL].update_one({"_id": COUNTER_ID, "reset_at": doc.get("reset_at"),
+                        "generation": doc.get("generation")},
+                       {"$inc": inc, "$set": setters})
+    return n
+
+
+def fold(db):
+    return anpr_ingest.fold(db, STATE, record)
+
+
+def rebuild(db, reset_at=None):
+    """Recalcule le compteur depuis l'historique (depuis `reset_at`, par
+    defaut la remise a zero en cours) avec la configuration actuelle des
+    cameras, et aligne le repere d'ingestion sur la derniere lecture comptee."""
+    courant = db[COL].find_one({"_id": COUNTER_ID}) or db[COL].find_one({"_id": "reset"}) or {}
+    if reset_at is None:
+        reset_at = courant.get("reset_at") or EPOCH
+    configs = _cam_configs(db)
+    counts = {"entries": 0, "exits": 0, "cameras": {}}
+    last = list(db[anpr_ingest.COL_ANPR].find({}, {"_id": 1}).sort("_id", -1).limit(1))
+    last_id = last[0]["_id"] if last else None
+    if last:
+        for row in db[anpr_ingest.COL_ANPR].aggregate([
+            {"$match": {"_id": {"$lte": last_id}, "event_dt": {"$gte": _naive_utc(reset_at)},
+                        "license_plate": {"$ne": "UNKNOWN"}}},
+            {"$group": {"_id": {"camera_path": "$camera_path", "direction": "$direction"},
+                        "count": {"$sum": 1}}},
+        ]):
+            cam = row["_id"].get("camera_path")
+            sens = resolve_direction(row["_id"].get("direction"), cam, configs)
+            if sens in ("entry", "exit"):
+                _add(counts, cam, sens, row["count"])
+    doc = {"_id": COUNTER_ID, "reset_at": reset_at, "generation": courant.get("generation", 0) + 1,
+           "counted_to": last_id, "updated_at": datetime.now(timezone.utc), **counts}
+    db[COL].replace_one({"_id": COUNTER_ID}, doc, upsert=True)
+    if last:
+        anpr_ingest.mark(db, STATE, last_id)
+    return doc
+
+
+def reset(db, now=None):
+    """Range les compteurs courants puis repart de zero a `now`. Rend la
+    periode qui vient d'etre close (ou None)."""
+    now = now or datetime.now(timezone.utc)
+    doc = db[COL].find_one({"_id": COUNTER_ID})
+    previous = None
+    if doc is not None:
+        previous = payload(doc)
+        db[COL_SNAPSHOTS].insert_one({
+            "reset_at": doc.get("reset_at"), "ended_at": now,
+            "entries": doc.get("entries", 0), "exits": doc.get("exits", 0),
+            "on_site": previous["on_site"], "cameras": doc.get("cameras") or {},
+        })
+    rebuild(db, reset_at=now)
+    return previous
+
+
+# ---------------------------------------------------------------------------
+# Lecture
+# ---------------------------------------------------------------------------
+
+def get(db):
+    doc = db[COL].find_one({"_id": COUNTER_ID})
+    if doc is None:
+        doc = rebuild(db)
+    return doc
+
+
+def payload(doc):
+    entries, exits = doc.get("entries", 0), doc.get("exits", 0)
+    reset_at = doc.get("reset_at")
+    cameras = sorted((doc.get("cameras") or {}).values(), key=lambda c: c.get("camera_path") or "")
+    return {
+        "on_site": max(0, entries - exits),
+        "entries": entries,
+        "exits": exits,
+        "reset_at": reset_at.isoformat() if isinstance(reset_at, datetime) else str(reset_at),
+        "cameras": [{"camera_path": c.get("camera_path"), "entries": c.get("entries", 0),
+                     "exits": c.get("exits", 0),
+                     "on_site": max(0, c.get("entries", 0) - c.get("exits", 0))}
+                    for c in cameras],
+    }
@@ -0,0 +1,190 @@
+"""Pics de `current` par compteur et par tranche de 15 minutes.
+
+watch_peaks.peak_for_edition balayait data_access et CHAQUE archive
+hsh_archive_compteurs_* sur la fenetre d'une edition (13 jours), en castant
+`current` en Python releve par releve : une centaine de milliers de
+documents au premier appel par edition, et a chaque minute pour l'edition
+en cours. Ici on tient a jour, pour chaque (location_id, tranche de 15 min),
+le max de `current` et l'instant du releve qui l'a porte :
+
+  - le collecteur live (live_controle.executer_compteurs) y replie chaque
+    releve au moment ou il l'ecrit dans data_access ;
+  - l'archivage (app.py, /api/live-controle/archive) y replie les releves
+    qu'il deplace, pour rattraper ce qu'un collecteur plus ancien n'aurait
+    pas replie ;
+  - l'historique est rempli une fois par scripts/backfill_peak_rollup.py,
+    qui pose ensuite le marqueur BACKFILL_ID.
+
+Le pic d'une fenetre devient alors une requete sur l'index
+(location_id, tranche) : un millier de petits documents au plus.
+
+Comme watch_peaks, ce module ignore le nom de la collection source et
+`requested_event` : seuls le compteur et le `timestamp` font foi.
+
+Module helpers pur (pas de Flask), `db` toujours passe en argument.
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+COL_PICS = "compteurs_pics_15min"
+
+TRANCHE = timedelta(minutes=15)
+
+# Pose par le backfill une fois l'historique replie. Tant qu'il manque, la
+# collection ne couvre que ce que le collecteur a vu depuis son deploiement :
+# watch_peaks retombe alors sur le balayage des releves bruts.
+BACKFILL_ID = "___BACKFILL___"
+
+
+def _naif_utc(moment):
+    """datetime naif-UTC, la forme que pymongo relit (client non tz_aware)."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def tranche(moment):
+    """Debut (naif-UTC) de la tranche de 15 minutes contenant `moment`."""
+    moment = _naif_utc(moment)
+    return moment.replace(minute=moment.minute - moment.minute % 15,
+                          second=0, microsecond=0)
+
+
+def tranche_suivante(moment):
+    """Premiere frontiere de tranche >= `moment` (naif-UTC)."""
+    debut = tranche(moment)
+    return debut if debut == _naif_utc(moment) else debut + TRANCHE
+
+
+def _entier(brut):
+    """`current` est une chaine qui vaut parfois "" ou "N/A" : None si
+    inconvertible, plutot que de faire tomber tout un repli."""
+    try:
+        return int(brut) if brut not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _cle(location_id, debut):
+    return "%s|%s" % (location_id, debut.strftime("%Y-%m-%dT%H:%M"))
+
+
+def assurer_index(db):
+    db[COL_PICS].create_index([("location_id", ASCENDING), ("tranche", ASCENDING)],
+                              name="pics_loc_tranche")
+
+
+# ----------------------------------------------------------------------------
+# Ecriture
+# ----------------------------------------------------------------------------
+
+def _ecrire(db, location_id, valeur, instant, now=None):
+    """Remonte le max de la tranche de `instant` a `valeur` si elle le bat.
+
+    Le filtre `max < valeur` rend l'ecriture atomique sans lecture prealable :
+    si la tranche existe avec un max superieur ou egal, le filtre ne trouve
+    rien, l'upsert tente d'inserer le meme _id et Mongo refuse
+    (DuplicateKeyError) -- la tranche est deja a jour, on n'a rien a faire.
+    A egalite, le premier releve garde le pic, comme dans _scan_peak.
+    """
+    instant = _naif_utc(instant)
+    debut = tranche(instant)
+    now = now or datetime.now(timezone.utc)
+    try:
+        db[COL_PICS].update_one(
+            {"_id": _cle(location_id, debut), "max": {"$lt": valeur}},
+            {"$set": {
+                "location_id": str(location_id),
+                "tranche": debut,
+                "max": valeur,
+                "max_ts": instant,
+                "updated_at": _naif_utc(now),
+            }},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        pass
+
+
+def enregistrer(db, location_id, current, instant, now=None):
+    """Replie un releve du collecteur. Jamais bloquant pour la collecte : un
+    pic manque se rattrape a l'archivage, un releve perdu non."""
+    valeur = _entier(current)
+    if location_id is None or valeur is None or not isinstance(instant, datetime):
+        return
+    try:
+        _ecrire(db, location_id, valeur, instant, now)
+    except Exception as exc:
+        logger.warning("peak_rollup : repli du releve %s echoue (%s)", location_id, exc)
+
+
+def replier(db, releves, now=None):
+    """Replie un lot de releves data_access (archivage, backfill).
+
+    Le max est d'abord calcule en memoire par tranche : une ecriture par
+    tranche touchee au lieu d'une par releve. Rend le nombre de tranches
+    ecrites.
+    """
+    maxima = {}
+    for releve in releves:
+        location_id = releve.get("requested_location_id")
+        instant = releve.get("timestamp")
+        valeur = _entier(releve.get("current"))
+        if location_id is None or valeur is None or not isinstance(instant, datetime):
+            continue
+        instant = _naif_utc(instant)
+        cle = (str(location_id), tranche(instant))
+        actuel = maxima.get(cle)
+        if (actuel is None or valeur > actuel[0]
+                or (valeur == actuel[0] and instant < actuel[1])):
+            maxima[cle] = (valeur, instant)
+    for (location_id, _debut), (valeur, instant) in maxima.items():
+        _ecrire(db, location_id, valeur, instant, now)
+    return len(maxima)
+
+
+def marquer_backfill(db, sources, now=None):
+    now = now or datetime.now(timezone.utc)
+    db[COL_PICS].update_one(
+        {"_id": BACKFILL_ID},
+        {"$set": {"done_at": _naif_utc(now), "sources": list(sources)}},
+        upsert=True,
+    )
+
+
+# ----------------------------------------------------------------------------
+# Lecture
+# ----------------------------------------------------------------------------
+
+def est_complet(db):
+    """Vrai si l'historique a ete replie : sans cela, un pic lu ici pourrait
+    ignorer une edition anterieure au deploiement du collecteur."""
+    try:
+        return db[COL_PICS].find_one({"_id": BACKFILL_ID}) is not None
+    except Exception as exc:
+        logger.warning("peak_rollup : lecture du marqueur impossible (%s)", exc)
+        return False
+
+
+def pic(db, location_id, debut, fin):
+    """Max sur les tranches ENTIERES de [debut, fin). (max, instant) ou (None, None).
+
+    `debut` et `fin` doivent tomber sur des frontieres de tranche : une
+    tranche a cheval sur une borne melangerait des releves hors fenetre.
+    C'est a l'appelant de balayer les bouts (voir watch_peaks).
+    """
+    doc = db[COL_PICS].find_one(
+        {"location_id": str(location_id),
+         "tranche": {"$gte": _naif_utc(debut), "$lt": _naif_utc(fin)}},
+        {"max": 1, "max_ts": 1},
+        sort=[("max", -1), ("max_ts", 1)],
+    )
+    if doc is None:
+        return None, None
+    return doc.get("max"), doc.get("max_ts")
@@ -0,0 +1,238 @@
+"""
+plate_crossref.py - Croisement LAPI x Vision tenu a jour, par plaque normalisee.
+
+Le mode << cross >> de /api/anpr/search reconstruisait le croisement a chaque
+requete : distinct("license_plate") sur hik_anpr, toutes les plaque_norm de
+vision_immatriculations chargees dans un set Python, puis une requete hik_anpr
+avec un $in de regex insensibles a la casse. La collection plate_crossref le
+tient a jour au fil de l'eau, un document par plaque normalisee :
+
+    {_id: "AB123CD",
+     has_anpr, anpr_count, anpr_first_seen, anpr_last_seen, anpr_last_camera,
+     has_vision, vision_lieu, vision: {"<evenement>|<annee>": {plaque, lieu,
+                                        billets_count, commentaire, date}},
+     blacklisted, blacklist_raison, blacklist_date,
+     watchlist}
+
+  - cote Vision : vision_sync appelle record_vision / sync_blacklist apres
+    chaque synchronisation ;
+  - cote LAPI : l'ecriture de hik_anpr est hors de ce depot (ecoutehik2.py) ;
+    fold_anpr replie les lectures arrivees depuis le dernier passage, appele
+    par le resident anpr_ingest. record_anpr peut aussi etre appele
+    directement a l'ingestion ;
+  - cote watchlist : les routes /api/anpr-watchlist posent le drapeau.
+
+Le mode cross, /api/anpr/vision/batch et la watchlist deviennent des lectures
+par _id ou par drapeaux indexes.
+
+Mise en service : python anpr_ingest.py --rebuild crossref
+"""
+
+import logging
+import re
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, UpdateOne
+
+import anpr_ingest
+from plate_index import normalize_plate
+
+log = logging.getLogger("plate_crossref")
+
+COL = "plate_crossref"
+COL_VISION = "vision_immatriculations"
+COL_BLACKLIST = "vision_blacklist"
+
+BATCH = 1000
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def event_key(evenement, annee):
+    """Cle de la sous-fiche Vision d'un evenement ; '.' et '$' sont interdits
+    dans un nom de champ Mongo."""
+    return re.sub(r"[.$]", "_", "%s|%s" % (evenement or "", annee or 0))
+
+
+def ensure_indexes(db):
+    db[COL].create_index([("has_vision", ASCENDING), ("has_anpr", ASCENDING)])
+    db[COL].create_index("blacklisted", sparse=True)
+    db[COL].create_index("watchlist", sparse=True)
+
+
+# ---------------------------------------------------------------------------
+# Ecritures
+# ---------------------------------------------------------------------------
+
+def record_anpr(db, reads):
+    """Replie des lectures hik_anpr (license_plate / plate_norm, event_dt,
+    camera_path) dans le croisement. Rend le nombre de plaques touchees.
+    Rejouer un lot ne recompte pas anpr_count (anpr_folded_to, voir
+    anpr_ingest.unfolded)."""
+    par_plaque = {}
+    for r in reads:
+        norm = r.get("plate_norm") or normalize_plate(r.get("license_plate"))
+        if not norm or norm == "UNKNOWN":
+            continue
+        g = par_plaque.setdefault(norm, {"count": 0, "first": None, "last": None, "camera": None})
+        g["count"] += 1
+        dt = r.get("event_dt")
+        if dt is None:
+            continue
+        if g["first"] is None or dt < g["first"]:
+            g["first"] = dt
+        if g["last"] is None or dt >= g["last"]:
+            g["last"] = dt
+            g["camera"] = r.get("camera_path")
+
+    last_id = reads[-1]["_id"] if reads else None
+    ops = []
+    for norm, g in par_plaque.items():
+        maj = {"$set": {"has_anpr": True, "updated_at": _now()}}
+        if g["last"] is not None:
+            maj["$min"] = {"anpr_first_seen": g["first"]}
+            maj["$max"] = {"anpr_last_seen": g["last"]}
+        ops.append(UpdateOne({"_id": norm}, maj, upsert=True))
+        ops.append(UpdateOne({"_id": norm, **anpr_ingest.unfolded("anpr_folded_to", last_id)},
+                             {"$inc": {"anpr_count": g["count"]},
+                              "$set": {"anpr_folded_to": last_id}}))
+        if g["last"] is not None:
+            # La camera ne suit que si cette lecture est bien la plus recente
+            # connue : le $max ci-dessus vient d'en decider.
+            ops.append(UpdateOne({"_id": norm, "anpr_last_seen": g["last"]},
+                                 {"$set": {"anpr_last_camera": g["camera"]}}))
+    if ops:
+        db[COL].bulk_write(ops, ordered=True)
+    return len(par_plaque)
+
+
+def fold_anpr(db, batch=BATCH):
+    """Replie les lectures hik_anpr arrivees depuis le dernier passage."""
+    return anpr_ingest.fold(db, "crossref", record_anpr, batch)
+
+
+def record_vision(db, records):
+    """Reporte des immatriculations Vision (forme de vision_sync) dans le
+    croisement, une sous-fiche par evenement."""
+    ops = []
+    for rec in records:
+        norm = rec.get("plaque_norm")
+        if not norm:
+            continue
+        fiche = {
+            "plaque": rec.get("plaque", ""),
+            "lieu": rec.get("lieu", ""),
+            "billets_count": len(rec.get("billets") or []),
+            "commentaire": rec.get("commentaire", ""),
+            "date": rec.get("date", ""),
+        }
+        ops.append(UpdateOne({"_id": norm}, {"$set": {
+            "has_vision": True,
+            "vision_lieu": fiche["lieu"],
+            "vision.%s" % event_key(rec.get("evenement"), rec.get("annee")): fiche,
+            "updated_at": _now(),
+        }}, upsert=True))
+    if ops:
+        db[COL].bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def sync_blacklist(db, entries):
+    """Aligne les drapeaux blacklist sur `entries` ({plaque_norm: {raison,
+    date_ajout}}), la blacklist Vision complete."""
+    if not entries:
+        # Meme garde que vision_sync : une lecture Firestore vide ne vide pas tout.
+        return 0
+    ops = [UpdateOne({"_id": norm}, {"$set": {
+        "blacklisted": True,
+        "blacklist_raison": e.get("raison", ""),
+        "blacklist_date": e.get("date_ajout", ""),
+        "updated_at": _now(),
+    }}, upsert=True) for norm, e in entries.items()]
+    db[COL].bulk_write(ops, ordered=False)
+    db[COL].update_many({"blacklisted": True, "_id": {"$nin": list(entries)}},
+                        {"$set": {"blacklisted": False, "updated_at": _now()}})
+    return len(ops)
+
+
+def set_watchlist(db, plate, on):
+    norm = normalize_plate(plate)
+    if not norm:
+        return
+    if on:
+        db[COL].update_one({"_id": norm}, {"$set": {"watchlist": True, "updated_at": _now()}},
+                           upsert=True)
+    else:
+        db[COL].update_one({"_id": norm}, {"$set": {"watchlist": False, "updated_at": _now()}})
+
+
+# ---------------------------------------------------------------------------
+# Lectures
+# ---------------------------------------------------------------------------
+
+def cross_plates(db, since=None, until=None):
+    """Plaques vues par la LAPI et presentes dans Vision. since / until
+    restreignent aux plaques dont la periode de lecture LAPI recoupe
+    l'intervalle (filtre grossier : la requete hik_anpr affine ensuite)."""
+    query = {"has_vision": True, "has_anpr": True}
+    if since is not None:
+        query["anpr_last_seen"] = {"$gte": since}
+    if until is not None:
+        query["anpr_first_seen"] = {"$lte": until}
+    return sorted(d["_id"] for d in db[COL].find(query, {"_id": 1}))
+
+
+def lookup(db, plates):
+    """{plaque_normalisee: fiche} pour les plaques connues du croisement."""
+    norms = sorted({normalize_plate(p) for p in plates} - {""})
+    if not norms:
+        return {}
+    return {d["_id"]: d for d in db[COL].find({"_id": {"$in": norms}})}
+
+
+def vision_for_event(doc, evenement, annee):
+    return ((doc or {}).get("vision") or {}).get(event_key(evenement, annee))
+
+
+def summary(doc):
+    """Resume d'une fiche pour l'affichage (watchlist)."""
+    if not doc:
+        return None
+    return {
+        "anpr_count": doc.get("anpr_count", 0),
+        "last_seen": doc.get("anpr_last_seen"),
+        "last_camera": doc.get("anpr_last_camera"),
+        "vision_lieu": doc.get("vision_lieu") if doc.get("has_vision") else None,
+        "blacklisted": bool(doc.get("blacklisted")),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reconstruction
+# ---------------------------------------------------------------------------
+
+def rebuild(db, batch=BATCH):
+    """Reconstruit le croisement depuis les collections sources."""
+    db[COL].delete_many({})
+    anpr_ingest.reset(db, "crossref")
+    ensure_indexes(db)
+    vision = 0
+    lot = []
+    for doc in db[COL_VISION].find({}):
+        lot.append(doc)
+        if len(lot) >= batch:
+            vision += record_vision(db, lot)
+            lot = []
+    vision += record_vision(db, lot)
+    sync_blacklist(db, {d["plaque_norm"]: d for d in db[COL_BLACKLIST].find({})
+                        if d.get("plaque_norm")})
+    watch = 0
+    for d in db["cockpit_anpr_watchlist"].find({"enabled": True}):
+        set_watchlist(db, d.get("plate"), True)
+        watch += 1
+    anpr = fold_anpr(db, batch)
+    log.info("croisement reconstruit : %d lectures LAPI, %d fiches Vision, %d plaques surveillees",
+             anpr, vision, watch)
+    return {"anpr": anpr, "vision": vision, "watchlist": watch}
@@ -0,0 +1,134 @@
+"""
+plate_index.py - Cles de recherche indexees des plaques (LAPI et Vision).
+
+La recherche LAPI filtrait hik_anpr par {"license_plate": {"$regex": plaque,
+"$options": "i"}} : une regex non ancree et insensible a la casse, qu'aucun
+index ne sert, donc un parcours de toutes les lectures. Les recherches Vision
+avaient la meme forme sur plaque_norm.
+
+Chaque document porte maintenant :
+
+  - une plaque normalisee (majuscules, alphanumerique seul, les regles de
+    anpr._normalize_plate) : plate_norm dans hik_anpr, plaque_norm dans
+    vision_immatriculations (deja ecrite par vision_sync) ;
+  - ses trigrammes : plate_grams / plaque_grams, index multikey.
+
+Un fragment de 3 caracteres ou plus ("AB12") devient {grams: {$all: [...]},
+norm: regex} : Mongo part de l'index des trigrammes, la regex ne fait que
+verifier la contiguite sur les quelques documents retenus. Un fragment plus
+court reste une regex, mais sur la plaque normalisee sans option "i" : Mongo
+la resout en parcourant les cles de l'index, pas les documents.
+
+L'ecriture dans hik_anpr est faite hors de ce depot (ecoutehik2.py sur la VM
+PCA) : `anpr_fields` donne les champs a y ajouter a l'insertion, et le
+resident anpr_ingest complete (`backfill`) les documents qui ne les portent
+pas encore. Tant qu'un document n'est pas complete (grams absent), les
+filtres gardent une branche de repli sur l'ancien champ, servie par le meme
+index (egalite a null).
+"""
+
+import re
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+COL_ANPR = "hik_anpr"
+COL_VISION = "vision_immatriculations"
+
+GRAM = 3
+BATCH = 1000
+
+# ---------------------------------------------------------------------------
+# Cles
+# ---------------------------------------------------------------------------
+
+def normalize_plate(plate):
+    """Memes regles que anpr._normalize_plate et vision_sync._normalize_plate."""
+    return re.sub(r"[^A-Z0-9]", "", (plate or "").strip().upper())
+
+
+def plate_grams(norm):
+    """Trigrammes distincts d'une plaque normalisee, tries (ordre stable)."""
+    if not norm or norm == "UNKNOWN" or len(norm) < GRAM:
+        return []
+    return sorted({norm[i:i + GRAM] for i in range(len(norm) - GRAM + 1)})
+
+
+def anpr_fields(license_plate):
+    """Champs a ecrire sur une lecture hik_anpr, a l'insertion ou en rattrapage."""
+    norm = normalize_plate(license_plate)
+    return {"plate_norm": norm, "plate_grams": plate_grams(norm)}
+
+
+def vision_fields(plaque_norm):
+    """Champ a ecrire sur une immatriculation Vision (plaque_norm existe deja)."""
+    return {"plaque_grams": plate_grams(plaque_norm)}
+
+
+# ---------------------------------------------------------------------------
+# Filtres
+# ---------------------------------------------------------------------------
+
+def fragment_filter(fragment, norm_field="plate_norm", grams_field="plate_grams",
+                    legacy_field="license_plate"):
+    """Filtre << la plaque contient ce fragment >>, ou None si le fragment
+    n'a aucun caractere alphanumerique.
+
+    La seconde branche couvre les documents pas encore completes : elle ne
+    porte que sur ceux dont grams_field est absent.
+    """
+    frag = normalize_plate(fragment)
+    if not frag:
+        return None
+    indexe = {norm_field: {"$regex": frag}}
+    grams = plate_grams(frag)
+    if grams:
+        indexe = {grams_field: {"$all": grams}, norm_field: {"$regex": frag}}
+    return {"$or": [indexe,
+                    {grams_field: None, legacy_field: {"$regex": frag, "$options": "i"}}]}
+
+
+def exact_filter(plates):
+    """Filtre << la plaque normalisee est l'une de celles-ci >> sur hik_anpr.
+
+    Le repli compare l'ancien champ a la forme brute comme a la forme
+    normalisee : license_plate est le plus souvent deja sans separateur.
+    """
+    plates = [p for p in plates if p]
+    norms = sorted({normalize_plate(p) for p in plates} - {""})
+    legacy = sorted(set(norms) | set(plates))
+    return {"$or": [{"plate_norm": {"$in": norms}},
+                    {"plate_grams": None, "license_plate": {"$in": legacy}}]}
+
+
+def ensure_indexes(db):
+    db[COL_ANPR].create_index([("plate_norm", ASCENDING), ("event_dt", DESCENDING)])
+    db[COL_ANPR].create_index("plate_grams")
+    db[COL_VISION].create_index("plaque_grams")
+
+
+# ---------------------------------------------------------------------------
+# Rattrapage
+# ---------------------------------------------------------------------------
+
+def _backfill_collection(col, grams_field, source_field, fields, batch):
+    total = 0
+    while True:
+        docs = list(col.find({grams_field: None}, {source_field: 1}).limit(batch))
+        if not docs:
+            break
+        col.bulk_write([UpdateOne({"_id": d["_id"]}, {"$set": fields(d.get(source_field))})
+                        for d in docs], ordered=False)
+        total += len(docs)
+        if len(docs) < batch:
+            break
+    return total
+
+
+def backfill(db, batch=BATCH):
+    """Complete les documents sans cles de recherche. Rend {collection: nombre}."""
+    return {
+        COL_ANPR: _backfill_collection(db[COL_ANPR], "plate_grams", "license_plate",
+                                       anpr_fields, batch),
+        COL_VISION: _backfill_collection(db[COL_VISION], "plaque_grams", "plaque_norm",
+                                         vision_fields, batch),
+    }
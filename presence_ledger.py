@@ -0,0 +1,303 @@
+"""Registre des presents par zone (Area HSH), tenu par le collecteur live.
+
+calcul_presents rejouait toutes les transactions de handshake_forensic depuis
+le debut de la journee : plusieurs millions de documents par question un jour
+a 250 000 personnes. Ici le collecteur (live_controle.TransactionSinks) tient
+a jour, a chaque flush :
+
+  - hsh_presence_deltas : entrees/sorties par zone, categorie et tranche de
+    5 minutes (transactions valides uniquement) ;
+  - hsh_presence : le solde courant par zone depuis le debut de l'evenement
+    (un document par evenement), soit les presents "maintenant" en une
+    lecture ;
+  - hsh_presence_checkpoints : le cumul par zone a chaque frontiere de
+    5 minutes, ecrit par ecrire_checkpoints().
+
+Les presents a T sont alors le checkpoint de la tranche de T, plus le rejeu
+des quelques minutes entre cette frontiere et T quand handshake_forensic les
+contient. Une transaction tardive (lecteur hors ligne qui se resynchronise)
+tombant dans une tranche deja figee est reportee sur les checkpoints
+posterieurs par le collecteur lui-meme : un checkpoint reste la somme exacte
+des deltas qui le precedent.
+
+Les instants sont ceux de l'horloge HSH (heure de Paris), etiquetes UTC comme
+les tranches de hsh_transactions_agg : "2026-06-13 10:00" designe la meme
+tranche ici que dans date_paris.
+
+Module helpers pur (pas de blueprint Flask) : la route vit dans app.py avec
+les autres /api/live-controle/*, le CLI dans calcul_presents.py.
+"""
+
+import datetime
+import zoneinfo
+
+from pymongo import ASCENDING, DESCENDING
+
+COL_DELTAS = "hsh_presence_deltas"
+COL_SOLDES = "hsh_presence"
+COL_CHECKPOINTS = "hsh_presence_checkpoints"
+
+TZ_PARIS = zoneinfo.ZoneInfo("Europe/Paris")
+
+TRANCHE = datetime.timedelta(minutes=5)
+ZONE_DEFAUT = "ENCEINTE GENERALE"
+
+CATEGORIES = ("personne", "vehicule", "enfant", "accredite")
+COMPTEURS = tuple(f"{sens}_{cat}" for sens in ("entrees", "sorties")
+                  for cat in CATEGORIES)
+
+
+def categoriser_scan(utid, cache_titres, upid=None):
+    """Retourne 'enfant', 'vehicule', 'accredite' ou 'personne'."""
+    if upid and upid.endswith("-ACCRED"):
+        return "accredite"
+    if utid and utid.startswith("EWC"):
+        return "accredite"
+    if utid and utid in cache_titres:
+        title = cache_titres[utid]
+        if "Bracelet Enfant" in title:
+            return "enfant"
+        return "vehicule"
+    return "personne"
+
+
+def charger_cache_titres(db):
+    """Charge le mapping utid -> title depuis access_barcodes_utids."""
+    cache = {}
+    for doc in db["access_barcodes_utids"].find({}, {"utid": 1, "title": 1}):
+        utid = doc.get("utid")
+        if utid:
+            cache[utid] = doc.get("title", "")
+    return cache
+
+
+def zone_key(area_id):
+    """Cle d'une zone dans les sous-documents `zones` : les ID HSH sont
+    numeriques, et un segment de chemin Mongo purement numerique se lit
+    comme un indice de tableau."""
+    return f"area_{area_id}"
+
+
+def _utc(dt):
+    # pymongo relit les dates naives (UTC).
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    return dt
+
+
+def tranche(dt):
+    return dt.replace(minute=(dt.minute // 5) * 5, second=0, microsecond=0)
+
+
+def instant_hsh(texte):
+    """'YYYY-MM-DD HH:MM[:SS]' (heure de Paris) -> instant sur l'horloge HSH."""
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S",
+                "%Y-%m-%dT%H:%M"):
+        try:
+            dt = datetime.datetime.strptime(texte, fmt)
+        except ValueError:
+            continue
+        return dt.replace(tzinfo=datetime.timezone.utc)
+    raise ValueError(f"date invalide : {texte!r} (attendu YYYY-MM-DD HH:MM)")
+
+
+def maintenant_hsh(now=None):
+    """Heure de Paris courante, sur l'horloge HSH."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return now.astimezone(TZ_PARIS).replace(tzinfo=datetime.timezone.utc)
+
+
+def assurer_index(db):
+    db[COL_DELTAS].create_index([("evenement", ASCENDING), ("tranche", ASCENDING)])
+    db[COL_CHECKPOINTS].create_index([("evenement", ASCENDING), ("at", DESCENDING)])
+
+
+def high_water(db, evenement):
+    """Dernier transaction_id deja compte pour l'evenement : une recollecte
+    forcee (force_collecte_jours) repasse sur des transactions deja vues,
+    qu'il ne faut pas compter deux fois dans les soldes."""
+    doc = db[COL_SOLDES].find_one({"_id": evenement})
+    return (doc or {}).get("max_tx_id")
+
+
+# ----------------------------------------------------------------------------
+# Checkpoints
+# ----------------------------------------------------------------------------
+
+def _ajouter(zones, zone, nom, compteurs):
+    z = zones.get(zone)
+    if z is None:
+        z = zones[zone] = {"name": nom}
+        z.update({c: 0 for c in COMPTEURS})
+    elif nom and not z.get("name"):
+        z["name"] = nom
+    for c in COMPTEURS:
+        z[c] = z.get(c, 0) + (compteurs.get(c) or 0)
+
+
+def _copie(zones):
+    return {zone: dict(z) for zone, z in (zones or {}).items()}
+
+
+def ecrire_checkpoints(db, evenement):
+    """Ecrit les checkpoints manquants jusqu'a la derniere tranche entamee.
+
+    Une frontiere B n'est figee qu'une fois qu'une transaction de la tranche
+    suivante a ete vue : le checkpoint en B est la somme des deltas des
+    tranches < B. Rend le nombre de checkpoints ecrits."""
+    deltas = db[COL_DELTAS]
+    checkpoints = db[COL_CHECKPOINTS]
+
+    derniere = deltas.find_one({"evenement": evenement}, sort=[("tranche", DESCENDING)])
+    if derniere is None:
+        return 0
+    jusqu_a = _utc(derniere["tranche"])
+
+    dernier_ck = checkpoints.find_one({"evenement": evenement}, sort=[("at", DESCENDING)])
+    if dernier_ck is None:
+        premiere = deltas.find_one({"evenement": evenement}, sort=[("tranche", ASCENDING)])
+        at = _utc(premiere["tranche"])
+        zones = {}
+    else:
+        at = _utc(dernier_ck["at"])
+        zones = _copie(dernier_ck.get("zones"))
+        if at >= jusqu_a:
+            return 0
+        at += TRANCHE
+
+    par_tranche = {}
+    for d in deltas.find({"evenement": evenement,
+                          "tranche": {"$gte": at - TRANCHE, "$lt": jusqu_a}}):
+        par_tranche.setdefault(_utc(d["tranche"]), []).append(d)
+
+    n = 0
+    while at <= jusqu_a:
+        for d in par_tranche.get(at - TRANCHE, ()):
+            _ajouter(zones, d["zone"], d.get("area_name"), d)
+        checkpoints.update_one(
+            {"_id": f"{evenement}_{at.strftime('%Y%m%dT%H%M')}"},
+            {"$set": {"evenement": evenement, "at": at, "zones": _copie(zones)}},
+            upsert=True,
+        )
+        n += 1
+        at += TRANCHE
+    return n
+
+
+# ----------------------------------------------------------------------------
+# Lecture
+# ----------------------------------------------------------------------------
+
+def _rejouer(db, source, debut, fin, cache_titres):
+    """Transactions valides de `source` dans [debut, fin[ -> (zones, nb)."""
+    zones = {}
+    nb = 0
+    filtre = {
+        "status": "0",
+        "date_paris": {"$gte": debut.strftime("%Y-%m-%d %H:%M:%S"),
+                       "$lt": fin.strftime("%Y-%m-%d %H:%M:%S")},
+    }
+    for tx in db[source].find(filtre, {"direction": 1, "utid": 1, "upid": 1, "area": 1}):
+        area = tx.get("area") or {}
+        area_id = area.get("ID") or area.get("Id") or area.get("id")
+        direction = tx.get("direction")
+        if not area_id or direction not in ("Entree", "Sortie"):
+            continue
+        if cache_titres is None:
+            cache_titres = charger_cache_titres(db)
+        nb += 1
+        cat = categoriser_scan(tx.get("utid"), cache_titres, tx.get("upid"))
+        sens = "entrees" if direction == "Entree" else "sorties"
+        _ajouter(zones, zone_key(area_id), area.get("Name"), {f"{sens}_{cat}": 1})
+    return zones, nb
+
+
+def cumul_avant(db, evenement, instant, source_rejeu="handshake_forensic",
+                cache_titres=None):
+    """Entrees/sorties cumulees par zone, depuis le debut du registre
+    jusqu'a `instant` exclu.
+
+    Rend (zones, meta) ; meta["methode"] vaut "solde" quand `instant` est
+    posterieur a la derniere transaction comptee (le solde courant est alors
+    exact), "checkpoint" sinon. meta["rejeu"] compte les transactions
+    rejouees depuis `source_rejeu` entre le checkpoint et `instant` : sans
+    elles, un instant hors frontiere n'est precis qu'a la tranche pres."""
+    solde = db[COL_SOLDES].find_one({"_id": evenement})
+    derniere = _utc((solde or {}).get("derniere_transaction"))
+    if derniere is not None and instant > derniere:
+        return _copie(solde.get("zones")), {"methode": "solde", "checkpoint": None,
+                                            "rejeu": 0}
+
+    borne = tranche(instant)
+    ck = db[COL_CHECKPOINTS].find_one(
+        {"evenement": evenement, "at": {"$lte": borne}}, sort=[("at", DESCENDING)])
+    zones = _copie(ck.get("zones")) if ck else {}
+    ck_at = _utc(ck["at"]) if ck else None
+
+    # Tranches pas encore figees entre le checkpoint et la tranche de T.
+    filtre = {"evenement": evenement, "tranche": {"$lt": borne}}
+    if ck_at is not None:
+        filtre["tranche"]["$gte"] = ck_at
+    for d in db[COL_DELTAS].find(filtre):
+        _ajouter(zones, d["zone"], d.get("area_name"), d)
+
+    nb = 0
+    if source_rejeu and instant > borne:
+        rejoues, nb = _rejouer(db, source_rejeu, borne, instant, cache_titres)
+        for zone, z in rejoues.items():
+            _ajouter(zones, zone, z.get("name"), z)
+    return zones, {"methode": "checkpoint",
+                   "checkpoint": ck_at.strftime("%Y-%m-%d %H:%M") if ck_at else None,
+                   "rejeu": nb}
+
+
+def _bilan(z):
+    out = {"name": z.get("name")}
+    presents = {}
+    for cat in CATEGORIES:
+        e = z.get(f"entrees_{cat}", 0)
+        s = z.get(f"sorties_{cat}", 0)
+        out[f"entrees_{cat}"] = e
+        out[f"sorties_{cat}"] = s
+        presents[cat] = e - s
+    out["presents"] = presents
+    # Total comme le compteur Skidata ; les vehicules ne sont pas des personnes.
+    out["total"] = sum(presents.values())
+    out["personnes"] = out["total"] - presents["vehicule"]
+    return out
+
+
+def presents(db, evenement, instant=None, depuis=None, zone=None,
+             source_rejeu="handshake_forensic", cache_titres=None):
+    """Presents par zone a `instant` inclus (defaut : maintenant), en
+    comptant les passages depuis `depuis` inclus (defaut : debut de la
+    journee de `instant`), comme calcul_presents le faisait en rejouant.
+
+    `zone` filtre sur le nom HSH de l'Area (ex. ZONE_DEFAUT)."""
+    instant = instant or maintenant_hsh()
+    if depuis is None:
+        depuis = instant.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # Les dates HSH sont a la seconde : "jusqu'a T inclus" = "avant T + 1 s".
+    fin, meta = cumul_avant(db, evenement, instant + datetime.timedelta(seconds=1),
+                            source_rejeu, cache_titres)
+    debut, meta_debut = cumul_avant(db, evenement, depuis, source_rejeu, cache_titres)
+
+    zones = {}
+    for key, z in fin.items():
+        d = debut.get(key, {})
+        delta = {c: z.get(c, 0) - d.get(c, 0) for c in COMPTEURS}
+        delta["name"] = z.get("name") or d.get("name")
+        if zone and delta["name"] != zone:
+            continue
+        zones[key] = _bilan(delta)
+
+    return {
+        "evenement": evenement,
+        "instant": instant.strftime("%Y-%m-%d %H:%M:%S"),
+        "depuis": depuis.strftime("%Y-%m-%d %H:%M:%S"),
+        "methode": meta["methode"],
+        "checkpoint": meta["checkpoint"],
+        "rejeu": meta["rejeu"] + meta_debut["rejeu"],
+        "zones": zones,
+    }
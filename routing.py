@@ -15,17 +15,31 @@
 #   - Fallback stub : si Valhalla est injoignable, retourne une polyline droite
 #     entre les points avec un ETA estime par haversine (utile en dev avant
 #     deploiement de Valhalla, et comme garde-fou en prod).
+#   - Cache d'itineraires : les memes trajets (parking -> porte, PC -> secteur)
+#     reviennent sans cesse pendant un evenement. Cle = cellules de
+#     ROUTE_CACHE_CELL_M des points (depart, vias, arrivee) + mode ; le cache
+#     est vide des que la version des overrides (routing_overrides._bump_cache)
+#     ou l'empreinte des exclusions Waze change.
+#   - Matrice de temps de trajet (travel_times) : un appel Valhalla
+#     /sources_to_targets pour N x M couples, au lieu de N appels /route.
+#     Utilisee par routing_matrix.py (POI cles) et le dispatch.
 #
 # Routes :
 #   - POST /field/api/route        (tablette Field, auth field_token)
 #   - POST /api/route              (Cockpit operateur, auth admin)
 #   - POST /api/route/forward      (Cockpit -> push itineraire vers tablette)
+#   - POST /api/dispatch/suggest   (Cockpit : patrouilles les plus proches d'une fiche)
 
 from flask import Blueprint, jsonify, request
 from datetime import datetime, timezone, timedelta
 import os
 import math
+import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
+
 import requests
 from bson.objectid import ObjectId
 
@@ -41,7 +55,10 @@ from field import (
 
 # Overrides edites par l'admin (portails fermes, routes barrees...).
 # Fusionnes avec les penalites Waze dans _compute().
-from routing_overrides import get_active_overrides_for_compute
+from routing_overrides import get_active_overrides_for_compute, overrides_version
+
+from geo_index import GeoGrid
+import dispatch
 
 
 routing_bp = Blueprint("routing", __name__)
@@ -96,10 +113,27 @@ WAZE_PENALTIES = {
 # fortement le point) - typiquement pour ROAD_CLOSED.
 HARD_AVOID_PENALTY_THRESHOLD = 1500
 
+# Plusieurs signalements Waze d'un meme bouchon tombent souvent au meme
+# endroit a quelques metres pres. Au-dela du premier, ils n'ajoutent a
+# Valhalla qu'un cercle d'exclusion quasi superpose : on les fusionne en
+# gardant la plus forte penalite. Tres inferieur au rayon des cercles (80 m).
+AVOID_MERGE_RADIUS_M = 10
+
 # Vitesses moyennes utilisees par le fallback stub (km/h)
 STUB_SPEED_NORMAL_KMH = 35
 STUB_SPEED_GOD_KMH = 60
 
+# Cache d'itineraires. Deux demandes dont chaque point tombe dans la meme
+# cellule (ROUTE_CACHE_CELL_M de cote) recoivent le meme trace : a cette
+# echelle Valhalla snape de toute facon sur la meme arete.
+ROUTE_CACHE_CELL_M = int(os.getenv("ROUTING_CACHE_CELL_M", "25"))
+ROUTE_CACHE_TTL_S = int(os.getenv("ROUTING_CACHE_TTL_S", "900"))
+ROUTE_CACHE_MAX = 2000
+
+# Les exclusions Waze sont reconstruites au plus une fois par WAZE_REFRESH_S
+# (le collecteur externe rafraichit waze_alerts a peu pres a ce rythme).
+WAZE_REFRESH_S = 30
+
 
 # ---------------------------------------------------------------------------
 # Helpers geometriques
@@ -235,8 +269,10 @@ def _get_recent_waze_alerts(max_age_minutes=None):
 def _build_avoid_locations(alerts):
     """Convertit les alertes en exclusions ponderees Valhalla.
     Renvoie une liste [{lat, lon, penalty_s, type, subtype}, ...] que
-    _call_valhalla() distribuera entre avoid_locations / exclude_polygons."""
-    out = []
+    _call_valhalla() distribuera entre avoid_locations / exclude_polygons.
+    Les alertes a moins de AVOID_MERGE_RADIUS_M d'une exclusion deja retenue
+    y sont fusionnees (penalite max), via la grille de geo_index."""
+    candidates = []
     for a in alerts:
         loc = a.get("location") or {}
         try:
@@ -251,32 +287,115 @@ def _build_avoid_locations(alerts):
             penalty = WAZE_PENALTIES.get((atype, None), 0)
         if penalty <= 0:
             continue
-        out.append({
+        candidates.append({
             "lat": lat, "lon": lon,
             "penalty_s": penalty,
             "type": atype, "subtype": subtype,
         })
+    if not candidates:
+        return []
+
+    grid = GeoGrid.for_points([(c["lat"], c["lon"]) for c in candidates],
+                              AVOID_MERGE_RADIUS_M)
+    out = []
+    for c in candidates:
+        kept = None
+        for k in sorted(grid.near(c["lat"], c["lon"])):
+            o = out[k]
+            if _haversine_m(c["lat"], c["lon"], o["lat"], o["lon"]) <= AVOID_MERGE_RADIUS_M:
+                kept = o
+                break
+        if kept is None:
+            grid.add(len(out), c["lat"], c["lon"])
+            out.append(c)
+        elif c["penalty_s"] > kept["penalty_s"]:
+            kept.update(penalty_s=c["penalty_s"], type=c["type"],
+                        subtype=c["subtype"])
     return out
 
 
 # ---------------------------------------------------------------------------
-# Appel Valhalla
+# Cache (exclusions Waze, itineraires)
 # ---------------------------------------------------------------------------
 
-def _call_valhalla(from_pt, to_pt, waypoints, god, avoids):
-    locations = [{"lat": from_pt[0], "lon": from_pt[1], "type": "break"}]
+_waze_cache = {"ts": 0.0, "avoids": [], "version": ""}
+
+# Grille de snap des cles de cache ; 60 deg couvre large la zone du circuit.
+_SNAP_GRID = GeoGrid(ROUTE_CACHE_CELL_M, 60.0)
+
+_route_cache = OrderedDict()  # cle -> (stored_ts, out)
+_route_cache_versions = {"current": None}
+_route_cache_lock = threading.Lock()
+
+
+def _current_avoids():
+    """(exclusions Waze, empreinte) avec au plus une lecture de waze_alerts
+    par WAZE_REFRESH_S. L'empreinte porte sur les exclusions elles-memes :
+    elle change avec un nouveau snapshot, mais aussi quand une alerte
+    vieillit au-dela de WAZE_MAX_AGE_MINUTES."""
+    now_ts = time.time()
+    if now_ts - _waze_cache["ts"] < WAZE_REFRESH_S:
+        return _waze_cache["avoids"], _waze_cache["version"]
+    avoids = _build_avoid_locations(_get_recent_waze_alerts())
+    signature = sorted((round(a["lat"], 5), round(a["lon"], 5), a["penalty_s"]) for a in avoids)
+    _waze_cache.update(
+        ts=now_ts, avoids=avoids,
+        version=hashlib.sha1(repr(signature).encode()).hexdigest()[:12],
+    )
+    return avoids, _waze_cache["version"]
+
+
+def reset_route_cache():
+    with _route_cache_lock:
+        _route_cache.clear()
+        _route_cache_versions["current"] = None
+    _waze_cache.update(ts=0.0, avoids=[], version="")
+
+
+def _route_key(from_pt, to_pt, waypoints, god):
+    cells = [_SNAP_GRID.cell_of(*from_pt)]
     for wp in (waypoints or []):
         ll = _parse_latlng(wp)
         if ll:
-            locations.append({"lat": ll[0], "lon": ll[1], "type": "via"})
-    locations.append({"lat": to_pt[0], "lon": to_pt[1], "type": "break"})
+            cells.append(_SNAP_GRID.cell_of(*ll))
+    cells.append(_SNAP_GRID.cell_of(*to_pt))
+    return (tuple(cells), "god" if god else "auto")
+
+
+def _route_cache_get(key, versions):
+    now_ts = time.time()
+    with _route_cache_lock:
+        if _route_cache_versions["current"] != versions:
+            # Overrides edites ou Waze change : plus aucune entree n'est valide.
+            _route_cache.clear()
+            _route_cache_versions["current"] = versions
+            return None
+        hit = _route_cache.get(key)
+        if hit is None:
+            return None
+        if now_ts - hit[0] >= ROUTE_CACHE_TTL_S:
+            del _route_cache[key]
+            return None
+        _route_cache.move_to_end(key)
+        return dict(hit[1])
+
+
+def _route_cache_put(key, versions, out):
+    with _route_cache_lock:
+        if _route_cache_versions["current"] != versions:
+            return
+        _route_cache[key] = (time.time(), dict(out))
+        while len(_route_cache) > ROUTE_CACHE_MAX:
+            _route_cache.popitem(last=False)
 
-    payload = {
-        "locations": locations,
-        "costing": "auto",
-        "directions_options": {"units": "kilometers"},
-        "id": "cockpit-routing",
-    }
+
+# ---------------------------------------------------------------------------
+# Appel Valhalla
+# ---------------------------------------------------------------------------
+
+def _apply_costing(payload, god, avoids):
+    """Mode god et exclusions (Waze + overrides) dans un payload Valhalla,
+    commun a /route et /sources_to_targets."""
     if god:
         payload["costing_options"] = {"auto": dict(ROUTING_GOD_COSTING_OPTIONS)}
 
@@ -300,6 +419,23 @@ def _call_valhalla(from_pt, to_pt, waypoints, god, avoids):
     if exclude_polygons:
         payload["exclude_polygons"] = exclude_polygons
 
+
+def _call_valhalla(from_pt, to_pt, waypoints, god, avoids):
+    locations = [{"lat": from_pt[0], "lon": from_pt[1], "type": "break"}]
+    for wp in (waypoints or []):
+        ll = _parse_latlng(wp)
+        if ll:
+            locations.append({"lat": ll[0], "lon": ll[1], "type": "via"})
+    locations.append({"lat": to_pt[0], "lon": to_pt[1], "type": "break"})
+
+    payload = {
+        "locations": locations,
+        "costing": "auto",
+        "directions_options": {"units": "kilometers"},
+        "id": "cockpit-routing",
+    }
+    _apply_costing(payload, god, avoids)
+
     try:
         url = VALHALLA_URL + "/route"
         r = requests.post(url, json=payload, timeout=VALHALLA_TIMEOUT)
@@ -365,9 +501,19 @@ def _stub_route(from_pt, to_pt, waypoints, god):
 
 
 def _compute(from_pt, to_pt, waypoints, god):
-    avoids = [] if god else _build_avoid_locations(_get_recent_waze_alerts())
+    avoids, waze_version = ([], "") if god else _current_avoids()
+    versions = (overrides_version(), waze_version)
+    key = _route_key(from_pt, to_pt, waypoints, god)
+    out = _route_cache_get(key, versions)
+    if out is not None:
+        out["eta_iso"] = (datetime.now(timezone.utc)
+                          + timedelta(seconds=out["duration_s"])).isoformat()
+        out["cached"] = True
+        return out, None
+
     resp, err = _call_valhalla(from_pt, to_pt, waypoints, god, avoids)
     if resp is None:
+        # Pas de stub en cache : Valhalla doit reprendre la main des son retour.
         out = _stub_route(from_pt, to_pt, waypoints, god)
         out["waze_avoided"] = len(avoids)
         return out, None
@@ -375,9 +521,70 @@ def _compute(from_pt, to_pt, waypoints, god):
     if out is None:
         return None, "no_route"
     out["waze_avoided"] = len(avoids)
+    _route_cache_put(key, versions, out)
     return out, None
 
 
+# ---------------------------------------------------------------------------
+# Matrice de temps de trajet
+# ---------------------------------------------------------------------------
+
+def _call_valhalla_matrix(sources, targets, god, avoids):
+    payload = {
+        "sources": [{"lat": p[0], "lon": p[1]} for p in sources],
+        "targets": [{"lat": p[0], "lon": p[1]} for p in targets],
+        "costing": "auto",
+        "units": "kilometers",
+        "id": "cockpit-matrix",
+    }
+    _apply_costing(payload, god, avoids)
+    try:
+        r = requests.post(VALHALLA_URL + "/sources_to_targets", json=payload,
+                          timeout=VALHALLA_TIMEOUT)
+        r.raise_for_status()
+        return r.json(), None
+    except requests.exceptions.RequestException as e:
+        logger.info("routing: matrice Valhalla injoignable, fallback stub: %s", e)
+        return None, "valhalla_unreachable"
+
+
+def travel_times(sources, targets, god=False):
+    """Temps (s) et distances (m) de chaque source vers chaque cible, en un
+    seul appel Valhalla. Rend (durations, distances, engine) ;
+    durations[i][j] vaut None si Valhalla ne trouve pas de chemin.
+
+    Valhalla injoignable : estimation haversine a la vitesse du stub, comme
+    _stub_route, signalee par engine="stub".
+    """
+    sources, targets = list(sources), list(targets)
+    durations = [[None] * len(targets) for _ in sources]
+    distances = [[None] * len(targets) for _ in sources]
+    if not sources or not targets:
+        return durations, distances, "valhalla"
+
+    avoids = [] if god else _current_avoids()[0]
+    resp, err = _call_valhalla_matrix(sources, targets, god, avoids)
+    if resp is None:
+        speed_mps = (STUB_SPEED_GOD_KMH if god else STUB_SPEED_NORMAL_KMH) * 1000.0 / 3600.0
+        for i, s in enumerate(sources):
+            for j, t in enumerate(targets):
+                d = _haversine_m(s[0], s[1], t[0], t[1])
+                distances[i][j] = int(d)
+                durations[i][j] = int(d / speed_mps)
+        return durations, distances, "stub"
+
+    for row in resp.get("sources_to_targets") or []:
+        for cell in row or []:
+            i, j = cell.get("from_index"), cell.get("to_index")
+            if i is None or j is None or i >= len(sources) or j >= len(targets):
+                continue
+            if cell.get("time") is not None:
+                durations[i][j] = int(cell["time"])
+            if cell.get("distance") is not None:
+                distances[i][j] = int(float(cell["distance"]) * 1000)
+    return durations, distances, "valhalla"
+
+
 # ---------------------------------------------------------------------------
 # Resolution fiche / vehicule (Cockpit)
 # ---------------------------------------------------------------------------
@@ -459,7 +666,10 @@ def cockpit_route():
     data = request.get_json(silent=True) or {}
     from_pt = _parse_latlng(data.get("from"))
     to_pt = _parse_latlng(data.get("to"))
-    fiche_id = (data.get("fiche_id") or "").strip()
+    fiche_id = data.get("fiche_id") or ""
+    if isinstance(fiche_id, bool) or not isinstance(fiche_id, (str, int)):
+        return jsonify({"ok": False, "error": "invalid_fiche_id"}), 400
+    fiche_id = str(fiche_id).strip()
 
     device_id = None
     device_name = None
@@ -568,3 +778,96 @@ def forward_route():
         db["field_messages"].insert_many(docs)
 
     return jsonify({"ok": True, "sent_count": len(docs), "device_id": device_id})
+
+
+@routing_bp.route("/api/dispatch/suggest", methods=["POST"])
+@admin_required
+def dispatch_suggest():
+    """Patrouilles disponibles les plus proches d'une fiche, au temps de trajet.
+
+    Body JSON :
+      {fiche_id, k?, god?, statuses?: ["patrouille", "intervention"],
+       beacon_group?, min_battery?}
+      ou {to: [lat,lng], event, year, ...} sans fiche.
+    Les k plus proches a vol d'oiseau (dispatch.candidates) sont reclasses
+    au temps de trajet par un seul appel matrice Valhalla.
+    """
+    data = request.get_json(silent=True) or {}
+    t0 = time.perf_counter()
+    to_pt = _parse_latlng(data.get("to"))
+    event = data.get("event")
+    year = data.get("year")
+    fiche_id = data.get("fiche_id") or ""
+    if isinstance(fiche_id, bool) or not isinstance(fiche_id, (str, int)):
+        return jsonify({"ok": False, "error": "invalid_fiche_id"}), 400
+    fiche_id = str(fiche_id).strip()
+
+    db = _get_mongo_db()
+    if fiche_id:
+        fiche = db["pcorg"].find_one({"_id": fiche_id}, {"gps": 1, "event": 1, "year": 1})
+        if not fiche:
+            return jsonify({"ok": False, "error": "fiche_not_found"}), 404
+        coords = (fiche.get("gps") or {}).get("coordinates") or []
+        if not to_pt and len(coords) >= 2:
+            to_pt = _parse_latlng([coords[1], coords[0]])
+        event = event or fiche.get("event")
+        year = year or fiche.get("year")
+    if not to_pt:
+        return jsonify({"ok": False, "error": "invalid_coordinates"}), 400
+    if not event or not year:
+        return jsonify({"ok": False, "error": "missing_event"}), 400
+
+    try:
+        k = max(1, min(int(data.get("k") or dispatch.DEFAULT_K), 20))
+        min_battery = data.get("min_battery")
+        min_battery = float(min_battery) if min_battery not in (None, "") else None
+    except (TypeError, ValueError):
+        return jsonify({"ok": False, "error": "invalid_parameters"}), 400
+    statuses = [s for s in (data.get("statuses") or dispatch.DEFAULT_STATUSES)
+                if s in ("patrouille", "intervention")]
+    if not statuses:
+        return jsonify({"ok": False, "error": "invalid_statuses"}), 400
+    god = bool(data.get("god"))
+
+    proches = dispatch.candidates(
+        db, event, year, to_pt[0], to_pt[1], k=k,
+        statuses=statuses, beacon_group=data.get("beacon_group") or None,
+        min_battery=min_battery,
+    )
+    rank_ms = (time.perf_counter() - t0) * 1000
+
+    sources = [(float(d["last_position"]["lat"]), float(d["last_position"]["lng"]))
+               for _, d in proches]
+    durations, distances, engine = travel_times(sources, [to_pt], god=god)
+    now = datetime.now(timezone.utc)
+    out = []
+    for n, (dist, device) in enumerate(proches):
+        pos = device.get("last_position") or {}
+        ts = pos.get("ts")
+        if isinstance(ts, datetime) and ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        out.append({
+            "device_id": str(device["_id"]),
+            "name": device.get("name"),
+            "status": device.get("status") or "patrouille",
+            "beacon_group_id": device.get("beacon_group_id"),
+            "battery": pos.get("battery"),
+            "position": [pos.get("lat"), pos.get("lng")],
+            "position_age_s": int((now - ts).total_seconds()) if isinstance(ts, datetime) else None,
+            "distance_m": int(dist),
+            "drive_distance_m": distances[n][0],
+            "duration_s": durations[n][0],
+        })
+    # Sans chemin routier (None) : apres les autres, dans l'ordre vol d'oiseau.
+    out.sort(key=lambda c: (c["duration_s"] is None, c["duration_s"] or 0))
+
+    return jsonify({
+        "ok": True,
+        "to": list(to_pt),
+        "event": event,
+        "year": str(year),
+        "mode": "god" if god else "auto",
+        "engine": engine,
+        "candidates": out,
+        "rank_ms": round(rank_ms, 2),
+    })
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+routing_matrix.py - Matrice des temps de trajet entre les POI cles.
+
+Les POI (portes, parkings, PC, postes medicaux) sont dans la collection
+routing_pois : {_id, kind, label, lat, lon, active}. Le job calcule, pour
+chaque mode (auto / god), la matrice complete POI x POI en un seul appel
+Valhalla /sources_to_targets (routing.travel_times) et la range dans
+routing_matrix, un document par mode :
+
+    {_id: "auto", poi_ids: [...], durations: [[s, ...], ...],
+     distances: [[m, ...], ...], engine, computed_at, versions}
+
+Le document est recalcule quand il a plus de REFRESH_S, quand la liste des
+POI change, ou des que la version des overrides ou l'empreinte des
+exclusions Waze bouge (les memes cles que le cache d'itineraires de
+routing.py). Le dispatch lit alors un temps de trajet sans appel Valhalla.
+
+Usage:
+    python routing_matrix.py             # un calcul puis arret
+    python routing_matrix.py --daemon    # resident, verifie toutes les CHECK_S
+"""
+
+import argparse
+import logging
+import signal
+import time
+from datetime import datetime, timezone
+
+from field import _get_mongo_db
+import routing
+from routing_overrides import overrides_version
+
+log = logging.getLogger("routing_matrix")
+
+COL_POIS = "routing_pois"
+COL_MATRIX = "routing_matrix"
+POI_KINDS = ("gate", "parking", "pc", "medical")
+MODES = ("auto", "god")
+
+REFRESH_S = 600
+CHECK_S = 30
+
+# Garde-fou : Valhalla borne lui aussi la taille d'une matrice
+# (service_limits.auto.max_matrix_distance / max_matrix_location_pairs).
+MAX_POIS = 150
+
+_stop = False
+
+
+def _handle_signal(signum, frame):
+    global _stop
+    _stop = True
+
+
+# ---------------------------------------------------------------------------
+# Lecture / calcul
+# ---------------------------------------------------------------------------
+
+def load_pois(db):
+    """POI actifs et geolocalises, tries par _id (ordre stable des lignes)."""
+    pois = []
+    for doc in db[COL_POIS].find({"active": {"$ne": False}, "kind": {"$in": list(POI_KINDS)}}):
+        try:
+            lat, lon = float(doc["lat"]), float(doc["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        pois.append({"id": str(doc["_id"]), "kind": doc["kind"],
+                     "label": doc.get("label") or "", "lat": lat, "lon": lon})
+    pois.sort(key=lambda p: p["id"])
+    if len(pois) > MAX_POIS:
+        log.warning("%d POI, seuls les %d premiers entrent dans la matrice", len(pois), MAX_POIS)
+        pois = pois[:MAX_POIS]
+    return pois
+
+
+def current_versions(mode):
+    waze = "" if mode == "god" else routing._current_avoids()[1]
+    return {"overrides": overrides_version(), "waze": waze}
+
+
+def is_stale(doc, pois, versions, now_ts):
+    if not doc:
+        return True
+    if doc.get("poi_ids") != [p["id"] for p in pois]:
+        return True
+    if doc.get("versions") != versions:
+        return True
+    computed = doc.get("computed_at")
+    if not isinstance(computed, datetime):
+        return True
+    if computed.tzinfo is None:
+        computed = computed.replace(tzinfo=timezone.utc)
+    return now_ts - computed.timestamp() >= REFRESH_S
+
+
+def rebuild(db, mode, pois, versions):
+    points = [(p["lat"], p["lon"]) for p in pois]
+    t0 = time.perf_counter()
+    durations, distances, engine = routing.travel_times(points, points, god=(mode == "god"))
+    doc = {
+        "_id": mode,
+        "poi_ids": [p["id"] for p in pois],
+        "pois": pois,
+        "durations": durations,
+        "distances": distances,
+        "engine": engine,
+        "versions": versions,
+        "computed_at": datetime.now(timezone.utc),
+        "compute_ms": int((time.perf_counter() - t0) * 1000),
+    }
+    db[COL_MATRIX].replace_one({"_id": mode}, doc, upsert=True)
+    return doc
+
+
+def run_once(db, force=False):
+    """Recalcule les matrices perimees. Rend la liste des modes recalcules."""
+    pois = load_pois(db)
+    now_ts = time.time()
+    rebuilt = []
+    for mode in MODES:
+        versions = current_versions(mode)
+        doc = db[COL_MATRIX].find_one({"_id": mode})
+        if force or is_stale(doc, pois, versions, now_ts):
+            doc = rebuild(db, mode, pois, versions)
+            log.info("matrice %s : %d POI, %s, %d ms", mode, len(pois),
+                     doc["engine"], doc["compute_ms"])
+            rebuilt.append(mode)
+    return rebuilt
+
+
+def travel_time(db, from_poi, to_poi, god=False):
+    """Temps de trajet (s) entre deux POI d'apres la derniere matrice, ou
+    None si l'un des deux n'y figure pas."""
+    doc = db[COL_MATRIX].find_one({"_id": "god" if god else "auto"})
+    if not doc:
+        return None
+    ids = doc.get("poi_ids") or []
+    try:
+        i, j = ids.index(str(from_poi)), ids.index(str(to_poi))
+    except ValueError:
+        return None
+    return doc["durations"][i][j]
+
+
+# ---------------------------------------------------------------------------
+# Point d'entree
+# ---------------------------------------------------------------------------
+
+def run_resident(db):
+    log.info("Matrice resident : verification toutes les %ds, recalcul au plus tard a %ds",
+             CHECK_S, REFRESH_S)
+    while not _stop:
+        try:
+            run_once(db)
+        except Exception as e:
+            log.error("Calcul de matrice echoue: %s", e)
+        fin = time.monotonic() + CHECK_S
+        while not _stop and time.monotonic() < fin:
+            time.sleep(min(1.0, fin - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Matrice des temps de trajet entre POI cles")
+    parser.add_argument("--daemon", action="store_true", help="Mode resident")
+    parser.add_argument("--force", action="store_true", help="Recalcule meme si a jour")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    db = _get_mongo_db()
+    if args.daemon:
+        run_resident(db)
+    else:
+        run_once(db, force=args.force)
+
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, _handle_signal)
+    signal.signal(signal.SIGTERM, _handle_signal)
+    main()
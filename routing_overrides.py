@@ -30,10 +30,13 @@
 #
 # Consomme par routing.py :
 #   get_active_overrides_for_compute(god) -> (avoid_locations, exclude_polygons)
+#   overrides_version() -> str (cle d'invalidation du cache d'itineraires)
 
 from flask import Blueprint, jsonify, request
 from datetime import datetime, timezone
 from bson.objectid import ObjectId
+import hashlib
+import json
 import logging
 import time
 
@@ -246,6 +249,26 @@ def _get_all_active():
     return data
 
 
+def _fingerprint(docs):
+    """Empreinte stable des champs qui changent un itineraire."""
+    champs = sorted(
+        [str(d.get("_id")), d.get("type"), d.get("scope", "all"), d.get("lat"),
+         d.get("lon"), d.get("coords"), d.get("expires_at"), d.get("updated_at")]
+        for d in docs)
+    brut = json.dumps(champs, default=str, separators=(",", ":"))
+    return hashlib.sha1(brut.encode("utf-8")).hexdigest()[:16]
+
+
+def overrides_version():
+    """Empreinte du contenu des overrides actifs (relit la collection si le
+    cache a expire, pour qu'une expiration soit vue). routing.py s'en sert
+    pour invalider son cache d'itineraires ; derivee du contenu et non d'un
+    compteur en memoire, elle est la meme dans le resident routing_matrix
+    (autre processus, redemarrages) que dans le web, et change aussi quand
+    un override existant est modifie."""
+    return _fingerprint(_get_all_active())
+
+
 def get_active_overrides_for_compute(god):
     """Retourne (avoid_locations, exclude_polygons) au format Valhalla,
     filtres selon le mode (god ou normal).
@@ -33,6 +33,8 @@ from zoneinfo import ZoneInfo
 
 import openpyxl
 
+import affluence_snapshot
+
 # Toute la chaine scans travaille en datetimes NAIFS, heure locale Paris :
 # c'est la convention des documents deja en base et de ce que lisent les
 # autres logiciels. Ce fuseau ne sert qu'a ramener une source horodatee en
@@ -1013,6 +1015,9 @@ def archive_and_replace(db, doc, archived_by=None, import_id=None,
         archive_id = db[ARCHIVE_COLLECTION].insert_one(snapshot).inserted_id
 
     db['historique_controle'].replace_one(key, doc, upsert=True)
+    if doc['type'] in ('frequentation', 'portes'):
+        # Pics N-1 et dates de course de reference de /get_affluence.
+        affluence_snapshot.invalidate(db)
     return {'archived': existing is not None, 'archive_id': archive_id,
             'bytes': size}
 
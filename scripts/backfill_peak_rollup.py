@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+backfill_peak_rollup.py — Replie l'historique des compteurs dans peak_rollup.
+
+A lancer une fois apres le deploiement du collecteur qui tient
+compteurs_pics_15min : relit data_access et chaque hsh_archive_compteurs_*
+(la liste de watch_peaks.snapshot_collections, sans tri sur le nom ni sur
+l'evenement), replie les releves par tranche de 15 minutes, puis pose le
+marqueur qui fait basculer watch_peaks.peak_for_edition sur les tranches.
+
+Idempotent : une tranche n'est reecrite que si un releve la bat. Relancer le
+script apres une interruption reprend sans rien fausser.
+
+Usage:
+    python scripts/backfill_peak_rollup.py
+    python scripts/backfill_peak_rollup.py --lot 20000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Permet d'executer le script depuis n'importe quel cwd
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+COCKPIT_DIR = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, COCKPIT_DIR)
+
+from pymongo import MongoClient
+
+import peak_rollup
+import watch_peaks
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+_TITAN_ENV = os.getenv("TITAN_ENV", "dev").strip().lower()
+DB_NAME = "titan" if _TITAN_ENV in {"prod", "production"} else "titan_dev"
+
+
+def replier_collection(db, nom, lot):
+    """Replie une source par lots de `lot` releves. Rend (releves, tranches)."""
+    curseur = db[nom].find(
+        {"_id": {"$ne": "___GLOBAL___"}, "requested_location_id": {"$exists": True}},
+        {"requested_location_id": 1, "current": 1, "timestamp": 1},
+    )
+    releves = tranches = 0
+    tampon = []
+    for releve in curseur:
+        tampon.append(releve)
+        if len(tampon) >= lot:
+            tranches += peak_rollup.replier(db, tampon)
+            releves += len(tampon)
+            tampon = []
+    if tampon:
+        tranches += peak_rollup.replier(db, tampon)
+        releves += len(tampon)
+    return releves, tranches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replie l'historique des compteurs par tranche de 15 min")
+    parser.add_argument("--lot", type=int, default=50000, help="Releves replies par lot")
+    args = parser.parse_args()
+
+    db = MongoClient(MONGO_URI)[DB_NAME]
+    peak_rollup.assurer_index(db)
+    sources = watch_peaks.snapshot_collections(db)
+    for nom in sources:
+        t0 = time.perf_counter()
+        releves, tranches = replier_collection(db, nom, args.lot)
+        print(f"  {nom:<48} {releves:>9} releves -> {tranches:>6} tranches"
+              f" ({time.perf_counter() - t0:.1f} s)")
+    peak_rollup.marquer_backfill(db, sources)
+    print(f"Marqueur {peak_rollup.BACKFILL_ID} pose dans {peak_rollup.COL_PICS}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Benchmark du calcul complet analyse_ops sur un jeu synthetique.
+
+Genere N fiches PCOrg synthetiques (50 000 par defaut, l'ordre de grandeur
+d'une SAISON), les sert depuis une base en memoire et chronometre
+analyse_ops._run_compute en recalcul complet, module par module.
+
+--against REV execute aussi le _run_compute d'une revision git anterieure
+sur les memes fiches et compare les 21 modules octet pour octet (JSON
+canonique), pour prouver qu'une optimisation ne change pas les resultats :
+
+    python scripts/bench_analyse_ops.py
+    python scripts/bench_analyse_ops.py --fiches 50000 --against HEAD~1
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime, timedelta, timezone
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_HERE)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+import pandas as pd
+from bson import json_util
+from pandas.core.indexes.accessors import DatetimeProperties
+
+import analyse_ops as ao
+
+EVENT, YEAR = "24H AUTOS", 2025
+
+
+# ---------------------------------------------------------------------------
+# Base en memoire : juste ce que _run_compute appelle
+# ---------------------------------------------------------------------------
+class _Cursor(list):
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, n):
+        return _Cursor(self[:n])
+
+
+def _match(doc, query):
+    for key, want in (query or {}).items():
+        if key == "$or":
+            if not any(_match(doc, sub) for sub in want):
+                return False
+            continue
+        have = doc.get(key)
+        if isinstance(want, dict):
+            if "$in" in want and have not in want["$in"]:
+                return False
+            if "$gte" in want and not (have is not None and have >= want["$gte"]):
+                return False
+            if "$lte" in want and not (have is not None and have <= want["$lte"]):
+                return False
+        elif have != want:
+            return False
+    return True
+
+
+class _Collection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.written = {}
+
+    def find(self, query=None, projection=None, sort=None):
+        return _Cursor(d for d in self.docs if _match(d, query))
+
+    def find_one(self, query=None, projection=None, sort=None):
+        found = self.find(query)
+        if sort:
+            key, direction = sort[0]
+            found = sorted(found, key=lambda d: d.get(key), reverse=direction == -1)
+        return found[0] if found else None
+
+    def count_documents(self, query=None):
+        return len(self.find(query))
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def update_one(self, filtre, update, upsert=False):
+        self.written[filtre["module"]] = update["$set"]["data"]
+
+
+class _Db(dict):
+    def __missing__(self, name):
+        self[name] = _Collection()
+        return self[name]
+
+
+def synthetic_fiches(n, year=YEAR, seed=0):
+    rnd = random.Random(seed)
+    operators = ["DUPONT Jean", "martin paul [PC]", "LEROY Anne", "petit luc", "", None] + \
+        [f"OP{i} nom{i}" for i in range(200)]
+    services = ["SECU", "Pompiers;SAMU", "Police/SECU", "SAMU., Depannage",
+                "Accueil\\Nettoyage", "", None, "Voirie | Secu", "x3BSAMU&amp;x3BPolice"]
+    base = datetime(year, 6, 1, 6, tzinfo=timezone.utc)
+    fiches = []
+    for i in range(n):
+        ts = base + timedelta(minutes=rnd.randint(0, 60 * 24 * 30))
+        close = ts + timedelta(minutes=rnd.expovariate(1 / 40)) if rnd.random() < 0.85 else None
+        gps = None
+        if rnd.random() < 0.4:
+            gps = {"type": "Point", "coordinates": [0.2 + rnd.random() * 0.05, 47.93 + rnd.random() * 0.03]}
+        xml = {
+            "caller": {"appelant": rnd.choice(["PCO", "opv", "SECU 3", None]),
+                       "flags": {"telephone": rnd.random() < 0.3, "radio": rnd.random() < 0.5}},
+            "classification": {"sous": rnd.choice(["Rixe", "Malaise", "Stationnement", "", "Inconnu", None])},
+            "resource": {"carroye": rnd.choice(["a 12", "B13", "c14", None, "zz99"] + [f"D{k}" for k in range(40)])},
+            "service_contacte": rnd.choice(services),
+        }
+        for k in range(1, rnd.randint(1, 5)):
+            xml[f"intervenant{k}"] = rnd.choice(["SAMU", "Pompiers", "Secu", "Police"])
+        fiches.append({
+            "_id": f"F{year}_{i}", "event": EVENT, "year": year, "ts": ts, "close_ts": close,
+            "source": rnd.choice(["PCO SECU", "PCO MED", "PCO TRAFIC", "AUTRE", None]),
+            "category": rnd.choice(["PCO.Secu", "PCO.Med", "PCO.Flux"]),
+            "area": {"id": str(rnd.randint(1, 30)),
+                     "desc": rnd.choice(["Zone A / Nord", "Zone B", "Parking / P1", "Village", None])},
+            "group": {"names": "G"}, "status_code": 10, "severity": rnd.choice([1, 2, 3, None]),
+            "is_incident": rnd.random() < 0.5,
+            "operator": rnd.choice(operators), "operator_close": rnd.choice(operators),
+            "text": rnd.choice(["Bagarre entree nord personne blessee", "Malaise spectateur tribune",
+                                "Vehicule mal gare parking AB-123-CD", None]),
+            "text_full": "Statut : termine\n12/06/2025 10:00:00, [OP] intervention des secours sur place",
+            "comment": rnd.choice([None, "RAS retour calme"]),
+            "xml_struct": xml, "content_category": {}, "gps": gps,
+            "extracted": {"plates": rnd.choice([[], ["AB123CD"], ["ZZ999ZZ", "AB123CD"]])},
+        })
+    return fiches
+
+
+def make_db(n, seed=0):
+    db = _Db()
+    db["pcorg"] = _Collection(synthetic_fiches(n, YEAR, seed) + synthetic_fiches(max(10, n // 5), YEAR - 1, seed + 1))
+    db["grid_ref"] = _Collection([{"grid_ref": r, "latitude": 47.9 + i * 0.001, "longitude": 0.2 + i * 0.001}
+                                  for i, r in enumerate(["A12", "B13", "C14"] + [f"D{k}" for k in range(40)])])
+    db["donnees_meteo"] = _Collection([{"Date": f"{YEAR}-06-{d:02d}", "Température max (°C)": 20 + d % 7,
+                                        "Précipitations (mm)": d % 3} for d in range(1, 31)])
+    return db
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+_JOURS_FR = dict(zip(["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"],
+                     ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]))
+
+
+def _french_day_names():
+    """Les revisions anterieures nomment les jours via la locale fr_FR ; sans
+    elle (conteneur minimal), leur heatmap casse. On sert alors les noms que
+    la locale aurait rendus, pour que la comparaison porte sur le code."""
+    try:
+        pd.Series(pd.to_datetime(["2025-06-09"])).dt.day_name(locale="fr_FR")
+        return
+    except Exception:
+        pass
+    day_name = DatetimeProperties.day_name
+
+    def _day_name(self, locale=None):
+        names = day_name(self)
+        return names.map(_JOURS_FR) if locale == "fr_FR" else names
+
+    DatetimeProperties.day_name = _day_name
+
+
+def module_at(rev):
+    """analyse_ops tel qu'il etait a la revision `rev` (le module ne touche
+    Mongo qu'a travers _ensure_db, remplace ci-dessous)."""
+    src = subprocess.check_output(["git", "show", f"{rev}:analyse_ops.py"], cwd=_ROOT, text=True)
+    mod = types.ModuleType(f"analyse_ops@{rev}")
+    mod.__file__ = os.path.join(_ROOT, "analyse_ops.py")
+    exec(compile(src, mod.__name__, "exec"), mod.__dict__)
+    return mod
+
+
+def run(mod, db):
+    mod._db = db
+    mod._col_pcorg = db["pcorg"]
+    mod._col_grid_ref = db["grid_ref"]
+    mod._col_cache = cache = _Collection()
+    mod._ensure_db = lambda: None
+    if hasattr(mod, "_retained"):
+        mod._retained.clear()
+    t0 = time.perf_counter()
+    mod._run_compute(EVENT, YEAR)
+    duration = time.perf_counter() - t0
+    states = getattr(mod, "_compute_states", None)
+    state = states[(EVENT, YEAR)] if states is not None else mod._compute_state
+    if state["status"] != "done":
+        sys.exit(f"{mod.__name__}: calcul en erreur : {state.get('error')}")
+    return cache.written, duration, state.get("timings") or {}
+
+
+def canonical(data):
+    return {m: json_util.dumps(v, sort_keys=True) for m, v in data.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fiches", type=int, default=50000)
+    parser.add_argument("--against", default=None, help="Revision git de reference (ex: HEAD~1)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    db = make_db(args.fiches)
+    print(f"{args.fiches} fiches synthetiques ({time.perf_counter() - t0:.1f} s)")
+
+    written, duration, timings = run(ao, db)
+    print(f"{'courant':<14} {duration:8.2f} s")
+    for name, ms in sorted(timings.items(), key=lambda kv: -kv[1])[:10]:
+        print(f"    {name:<22} {ms:7d} ms")
+
+    if args.against:
+        _french_day_names()
+        old, old_duration, _ = run(module_at(args.against), db)
+        print(f"{'@' + args.against:<14} {old_duration:8.2f} s")
+        new_c, old_c = canonical(written), canonical(old)
+        diff = sorted(m for m in set(new_c) | set(old_c) if new_c.get(m) != old_c.get(m))
+        if diff:
+            sys.exit("DIFFERENT de %s : %s" % (args.against, ", ".join(diff)))
+        print(f"{len(new_c)} modules identiques octet pour octet a {args.against}")
+
+
+if __name__ == "__main__":
+    main()
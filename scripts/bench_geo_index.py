@@ -0,0 +1,99 @@
+"""Benchmark du voisinage Waze : double boucle historique vs grille geo_index.
+
+Flux synthetiques de 100, 1 000 et 10 000 alertes autour du circuit, dont
+une partie concentree en grappes (un samedi soir bouchonne). Pour chaque
+taille, verifie que les deux methodes rendent les memes voisins -- donc le
+meme best_cluster et le meme score dans alert_engine.detect_traffic_cluster
+-- et mesure leurs durees.
+
+Au-dela de --max-full alertes, la double boucle complete prendrait plusieurs
+minutes : elle est alors chronometree sur un echantillon de centres puis
+extrapolee, et l'egalite verifiee sur ce meme echantillon.
+
+    python scripts/bench_geo_index.py
+    python scripts/bench_geo_index.py --sizes 100 1000 10000 --radius 500
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_HERE)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from geo_index import haversine_m, neighbours_within
+from trafic_etat import ZONE_CENTER_LAT, ZONE_CENTER_LON
+
+TYPES = ["JAM", "JAM", "JAM", "ACCIDENT", "HAZARD", "WEATHERHAZARD"]
+
+
+def synthetic_feed(n, seed=0):
+    """(lat, lon) : 70 % en grappes de ~300 m, le reste sur ~15 km."""
+    rnd = random.Random(seed)
+    centres = [(ZONE_CENTER_LAT + rnd.uniform(-0.05, 0.05),
+                ZONE_CENTER_LON + rnd.uniform(-0.07, 0.07))
+               for _ in range(max(1, n // 40))]
+    points = []
+    for i in range(n):
+        if rnd.random() < 0.7:
+            clat, clon = rnd.choice(centres)
+            points.append((clat + rnd.gauss(0, 0.0015),
+                           clon + rnd.gauss(0, 0.002)))
+        else:
+            points.append((ZONE_CENTER_LAT + rnd.uniform(-0.07, 0.07),
+                           ZONE_CENTER_LON + rnd.uniform(-0.1, 0.1)))
+    return points
+
+
+def legacy_neighbours(points, radius_m, centres):
+    out = []
+    for i in centres:
+        lat, lon = points[i]
+        out.append([j for j in range(len(points))
+                    if j != i and haversine_m(lat, lon,
+                                              points[j][0], points[j][1]) <= radius_m])
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--radius", type=float, default=500.0)
+    parser.add_argument("--max-full", type=int, default=2000,
+                        help="Taille max pour la double boucle complete")
+    parser.add_argument("--sample", type=int, default=300,
+                        help="Centres chronometres au-dela de --max-full")
+    args = parser.parse_args()
+
+    print("%8s %12s %12s %9s %s" % ("alertes", "legacy (s)", "grille (s)",
+                                    "gain", "verif"))
+    for n in args.sizes:
+        points = synthetic_feed(n)
+
+        t0 = time.perf_counter()
+        grid = neighbours_within(points, args.radius)
+        t_grid = time.perf_counter() - t0
+
+        if n <= args.max_full:
+            centres = list(range(n))
+        else:
+            centres = sorted(random.Random(1).sample(range(n), args.sample))
+        t0 = time.perf_counter()
+        legacy = legacy_neighbours(points, args.radius, centres)
+        t_legacy = (time.perf_counter() - t0) * n / len(centres)
+
+        ok = all(grid[i] == legacy[k] for k, i in enumerate(centres))
+        verif = "identique" if ok else "DIFFERENT"
+        if len(centres) < n:
+            verif += " (echantillon %d, legacy extrapole)" % len(centres)
+        print("%8d %12.3f %12.3f %8.1fx %s" % (
+            n, t_legacy, t_grid, t_legacy / t_grid if t_grid else 0, verif))
+        if not ok:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Micro-benchmark du parseur de pages Transactions Handshake.
+
+Mesure live_controle.parse_transactions en mode compact (collecteur) et en
+mode full=True (forensic), en microsecondes par transaction, sur :
+  - des pages enregistrees (--pages fichier.xml ..., une ou plusieurs
+    reponses <TSData> par fichier, comme les dumps de all.py) ;
+  - a defaut, des pages synthetiques de MAX_TX transactions au layout
+    Option 1409 (Ticket > Permission > Transaction, ~10 % d'erreurs).
+
+--against REV charge aussi le parse_transactions d'une revision git
+anterieure et verifie que le mode full=True rend les memes documents, pour
+voir d'un coup d'oeil un gain ou une regression :
+
+    python scripts/bench_hsh_parse.py
+    python scripts/bench_hsh_parse.py --pages dumps/*.xml --against HEAD~1
+"""
+import argparse
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import types
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_HERE)
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+import live_controle as lc
+
+
+def synthetic_page(n, seed=0):
+    rnd = random.Random(seed)
+    tickets = []
+    for i in range(n):
+        status = "0" if rnd.random() > 0.1 else rnd.choice(["31", "105", "111"])
+        sens = 'Entry="1"' if rnd.random() > 0.3 else 'Exit="1"'
+        cp = rnd.randint(1000, 1040)
+        tickets.append(
+            f'<Ticket Blocked="0"><UTID>{"EWC" if i % 17 == 0 else "T"}{rnd.randint(1, 10**9)}</UTID>'
+            f'<Coding>270</Coding><Permission Blocked="0"><UPID>P{i}</UPID>'
+            f'<Transaction TransactionId="{50000 + i}" Date="2026-06-13T10:{i % 60:02d}:{(i * 7) % 60:02d}" '
+            f'Status="{status}" Validated="0" Releases="1" TestMode="0">'
+            f'<Venue ID="1" Name="Circuit des 24 Heures" Type="Venue" {sens}/>'
+            f'<Area ID="{10 + cp % 4}" Name="Enceinte generale" Type="Area" {sens}/>'
+            f'<Gate ID="{100 + cp % 12}" Name="Porte {cp % 12}" Type="Gate"/>'
+            f'<Checkpoint ID="{cp}" Name="Tripode {cp}" Type="Checkpoint" Device="{cp * 3}"/>'
+            f'</Transaction></Permission></Ticket>')
+    return (f'<TSData><Header><Version>HSHIF25</Version></Header>'
+            f'<Inquiry Type="Transactions" NotComplete="1" MaxTransactionId="{50000 + n - 1}">'
+            + "".join(tickets) + "</Inquiry></TSData>")
+
+
+def load_pages(paths):
+    pages = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="ignore") as fh:
+            raw = fh.read()
+        pages.extend(m.group(0) for m in re.finditer(r"<TSData>.*?</TSData>", raw, re.S))
+    return pages
+
+
+def parser_at(rev):
+    """parse_transactions tel qu'il etait a la revision `rev`."""
+    src = subprocess.check_output(["git", "show", f"{rev}:live_controle.py"],
+                                  cwd=_ROOT, text=True)
+    # Le module cree un MongoClient a l'import : on n'execute que les
+    # fonctions de parsing, extraites avec leurs dependances directes.
+    mod = types.ModuleType(f"live_controle@{rev}")
+    mod.__dict__.update({"ET": lc.ET, "datetime": lc.datetime})
+    debut = src.index("def _direction_from_nodes")
+    fin = src.index("# =========================================================\n#              LOGIQUE")
+    exec(compile(src[debut:fin], mod.__name__, "exec"), mod.__dict__)
+    return mod.parse_transactions
+
+
+def bench(fn, pages, repeat):
+    n_tx = 0
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n_tx = 0
+        for page in pages:
+            n_tx += len(fn(page)[1])
+        best = min(best, time.perf_counter() - t0)
+    return best, n_tx
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", nargs="*", default=[])
+    parser.add_argument("--synthetic", type=int, default=200,
+                        help="Nombre de pages synthetiques sans --pages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--against", default=None,
+                        help="Revision git de reference (ex: HEAD~1)")
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages) if args.pages else [
+        synthetic_page(lc.MAX_TX, seed=i) for i in range(args.synthetic)]
+    if not pages:
+        sys.exit("Aucune page <TSData> trouvee.")
+
+    candidats = [
+        ("compact", lambda p: lc.parse_transactions(p)),
+        ("full", lambda p: lc.parse_transactions(p, full=True)),
+    ]
+    if args.against:
+        ancien = parser_at(args.against)
+        candidats.append((f"@{args.against}", ancien))
+        for page in pages:
+            attendu = ancien(page)
+            obtenu = lc.parse_transactions(page, full=True)
+            if (attendu[0], attendu[2]) != (obtenu[0], obtenu[2]) or \
+                    attendu[1] != [r.full for r in obtenu[1]]:
+                sys.exit("DIFFERENT : full=True ne rend pas les documents de %s"
+                         % args.against)
+        print(f"full=True identique a {args.against} sur {len(pages)} pages")
+
+    print(f"{len(pages)} pages")
+    print("%-14s %10s %12s" % ("parseur", "total (s)", "us / tx"))
+    for nom, fn in candidats:
+        duree, n_tx = bench(fn, pages, args.repeat)
+        print("%-14s %10.3f %12.1f" % (nom, duree, duree / max(n_tx, 1) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Test de charge HTTP : rejoue les pollings de N cockpits contre un serveur lance.
+
+Chaque cockpit interroge les routes de scripts/dashboard_mix.json a leur
+periode, avec un dephasage aleatoire, pendant --duration secondes. Les
+requetes partent a heure fixe (boucle ouverte) : la latence mesuree compte
+l'attente dans la file de waitress, ce qu'un client qui attend sa reponse
+avant de relancer masquerait. --streams ouvre en plus autant de flux SSE
+(/api/live/stream), qui tiennent chacun un thread du serveur comme les
+ecrans live.
+
+Affiche par route : nombre, erreurs (dont 503 de la garde des routes
+lourdes, cf. serving.py), p50 / p95 / p99 et max en ms.
+
+    python scripts/loadtest_dashboard.py --base-url http://127.0.0.1:5000 \\
+        --token <access_token> --event 24H --year 2026 --cockpits 40 --duration 300
+
+A lancer avec differents WAITRESS_THREADS / HEAVY_CONCURRENCY cote serveur
+pour comparer les profils.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+
+def load_mix(path, event, year):
+    with open(path, encoding="utf-8") as fh:
+        routes = json.load(fh)["routes"]
+    for r in routes:
+        r["path"] = r["path"].format(event=urllib.request.quote(str(event)),
+                                     year=urllib.request.quote(str(year)))
+    return routes
+
+
+def schedule(routes, cockpits, duration_s, seed=1):
+    """[(instant_s, route)] de toutes les requetes, tries par instant."""
+    rnd = random.Random(seed)
+    plan = []
+    for _ in range(cockpits):
+        for r in routes:
+            t = rnd.uniform(0, r["interval_s"])
+            while t < duration_s:
+                plan.append((t, r))
+                t += r["interval_s"]
+    plan.sort(key=lambda x: x[0])
+    return plan
+
+
+class Client:
+    def __init__(self, base_url, token, timeout_s):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Cookie": "access_token=%s" % token} if token else {}
+        self.timeout_s = timeout_s
+
+    def get(self, path):
+        req = urllib.request.Request(self.base_url + path, headers=self.headers)
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout_s) as rep:
+                rep.read()
+                return rep.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+        except Exception:
+            return 0
+
+    def stream(self, path, stop):
+        """Garde un flux SSE ouvert jusqu'a `stop`, en le rouvrant s'il se ferme."""
+        req = urllib.request.Request(self.base_url + path, headers=self.headers)
+        while not stop.is_set():
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout_s) as rep:
+                    while not stop.is_set() and rep.readline():
+                        pass
+            except Exception:
+                stop.wait(1.0)
+
+
+def run(client, plan, workers, streams, stream_path):
+    latences = defaultdict(list)
+    codes = defaultdict(Counter)
+    verrou = threading.Lock()
+    stop = threading.Event()
+
+    flux = [threading.Thread(target=client.stream, args=(stream_path, stop), daemon=True)
+            for _ in range(streams)]
+    for t in flux:
+        t.start()
+
+    def tir(route, prevu):
+        code = client.get(route["path"])
+        fin = time.perf_counter()
+        with verrou:
+            latences[route["name"]].append(fin - prevu)
+            codes[route["name"]][code] += 1
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for instant, route in plan:
+            attente = debut + instant - time.perf_counter()
+            if attente > 0:
+                time.sleep(attente)
+            pool.submit(tir, route, debut + instant)
+    stop.set()
+    return latences, codes
+
+
+def report(latences, codes, out=sys.stdout):
+    print(f"{'route':<26} {'n':>6} {'err':>5} {'503':>5} {'p50 ms':>8} {'p95 ms':>8}"
+          f" {'p99 ms':>8} {'max ms':>8}", file=out)
+    tout = []
+    for nom in sorted(latences):
+        vals = latences[nom]
+        tout.extend(vals)
+        c = codes[nom]
+        err = sum(n for code, n in c.items() if not 200 <= code < 400)
+        print(f"{nom:<26} {len(vals):>6} {err:>5} {c.get(503, 0):>5}"
+              f" {_percentile(vals, 50) * 1000:>8.1f} {_percentile(vals, 95) * 1000:>8.1f}"
+              f" {_percentile(vals, 99) * 1000:>8.1f} {max(vals) * 1000:>8.1f}", file=out)
+    if tout:
+        print(f"{'(toutes)':<26} {len(tout):>6} {'':>5} {'':>5}"
+              f" {_percentile(tout, 50) * 1000:>8.1f} {_percentile(tout, 95) * 1000:>8.1f}"
+              f" {_percentile(tout, 99) * 1000:>8.1f} {max(tout) * 1000:>8.1f}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--token", default=os.getenv("TITAN_ACCESS_TOKEN", ""),
+                        help="Cookie access_token d'un compte user (ou TITAN_ACCESS_TOKEN)")
+    parser.add_argument("--event", required=True)
+    parser.add_argument("--year", required=True)
+    parser.add_argument("--mix", default=os.path.join(_HERE, "dashboard_mix.json"))
+    parser.add_argument("--cockpits", type=int, default=20)
+    parser.add_argument("--duration", type=int, default=120, help="Secondes de rejeu")
+    parser.add_argument("--streams", type=int, default=0, help="Flux SSE ouverts pendant le rejeu")
+    parser.add_argument("--workers", type=int, default=200,
+                        help="Requetes simultanees maximum cote client")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    routes = load_mix(args.mix, args.event, args.year)
+    plan = schedule(routes, args.cockpits, args.duration, args.seed)
+    stream_path = "/api/live/stream?topics=pcorg,alerts,anoloc&event=%s&year=%s" % (
+        urllib.request.quote(args.event), urllib.request.quote(args.year))
+    print(f"{len(plan)} requetes, {args.cockpits} cockpits, {args.duration} s,"
+          f" {args.streams} flux SSE -> {args.base_url}")
+    client = Client(args.base_url, args.token, args.timeout)
+    latences, codes = run(client, plan, args.workers, args.streams, stream_path)
+    report(latences, codes)
+
+
+if __name__ == "__main__":
+    main()
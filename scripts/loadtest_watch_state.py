@@ -0,0 +1,210 @@
+"""Test de charge de /api/v1/watch/state, de 5 a 500 montres.
+
+Sert le blueprint montre depuis le double Mongo des tests (tests/conftest.py),
+enveloppe pour compter chaque appel par collection, et rejoue deux phases :
+
+  - rafale : toutes les montres interrogent au meme instant un cache vide
+    (demarrage, ou expiration sans pre-chauffage) -- le cas du troupeau --,
+    servies par --threads workers comme waitress (4 par defaut) : la latence
+    compte l'attente en file depuis l'arrivee de la rafale ;
+  - regime : --minutes de polling a une requete par minute et par montre,
+    decalees au hasard, sur une horloge simulee (pas d'attente reelle).
+
+Pour chaque taille de parc, affiche le nombre de build_state, les appels
+Mongo PARTAGES (tout sauf watch_tokens : ils doivent rester plats quand le
+parc grossit) et PAR MONTRE (watch_tokens : verification du jeton,
+lineaire par nature ; la telemetrie est bridee sur l'horloge reelle et ne
+compte donc qu'en rafale), et les latences de la rafale.
+
+--against REV rejoue les memes phases sur le watch_api d'une revision git
+anterieure :
+
+    python scripts/loadtest_watch_state.py
+    python scripts/loadtest_watch_state.py --watches 5 50 500 --against HEAD~1
+"""
+import argparse
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_ROOT = os.path.dirname(_HERE)
+for _p in (_ROOT, os.path.join(_ROOT, "tests")):
+    if _p not in sys.path:
+        sys.path.insert(0, _p)
+
+from flask import Flask
+
+from conftest import FakeDb
+
+import watch_api
+import watch_state
+
+# Temps d'un build_state reel sur la base de prod (ordre de grandeur mesure
+# en pic) : c'est pendant ce temps que le troupeau s'accumule.
+BUILD_S = 0.05
+
+
+# ---------------------------------------------------------------------------
+# Double Mongo compte
+# ---------------------------------------------------------------------------
+class _CollectionComptee:
+    def __init__(self, col, nom, compteur, verrou):
+        self._col, self._nom, self._compteur, self._verrou = col, nom, compteur, verrou
+
+    def __getattr__(self, attr):
+        valeur = getattr(self._col, attr)
+        if not callable(valeur):
+            return valeur
+
+        def appel(*args, **kwargs):
+            with self._verrou:
+                self._compteur[self._nom] += 1
+            return valeur(*args, **kwargs)
+        return appel
+
+
+class _DbComptee:
+    def __init__(self, db):
+        self._db = db
+        self.compteur = Counter()
+        self._verrou = threading.Lock()
+
+    def __getitem__(self, nom):
+        return _CollectionComptee(self._db[nom], nom, self.compteur, self._verrou)
+
+
+def make_db(n):
+    db = FakeDb(
+        watch_tokens=[{"_id": "m%d" % i, "token_sha256": watch_api.hash_token("s%d" % i),
+                       "revoked": False, "last_used_at": None} for i in range(n)],
+        watch_guidage=[{"token_id": "m%d" % i, "lat": 47.95, "lon": 0.22,
+                        "label": "Porte %d" % i, "seq": 1, "sent_at": None}
+                       for i in range(0, n, 10)],
+    )
+    return _DbComptee(db)
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+def module_at(rev):
+    src = subprocess.check_output(["git", "show", f"{rev}:watch_api.py"], cwd=_ROOT, text=True)
+    mod = types.ModuleType(f"watch_api@{rev}")
+    mod.__file__ = os.path.join(_ROOT, "watch_api.py")
+    exec(compile(src, mod.__name__, "exec"), mod.__dict__)
+    return mod
+
+
+class _Horloge:
+    """time.time() simule pour la phase regime ; le reste du module time
+    (sleep, monotonic) reste le vrai."""
+
+    def __init__(self):
+        self.t = time.time()
+
+    def __getattr__(self, attr):
+        return getattr(time, attr)
+
+    def time(self):
+        return self.t
+
+
+def _percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+
+def run(api, n, minutes, threads):
+    db = make_db(n)
+    builds = []
+    build_state = watch_state.build_state
+
+    def construit(*args, **kwargs):
+        builds.append(1)
+        time.sleep(BUILD_S)
+        return build_state(*args, **kwargs)
+
+    api._db = lambda: db
+    api.watch_state = types.SimpleNamespace(**{k: getattr(watch_state, k) for k in dir(watch_state)
+                                              if not k.startswith("__")})
+    api.watch_state.build_state = construit
+    api.reset_cache()
+    api.reset_rate_limit()
+    app = Flask(f"charge_{n}")
+    app.register_blueprint(api.watch_bp)
+
+    # Rafale : toutes les montres en meme temps sur un cache vide.
+    latences = []
+    arrivee = time.perf_counter()
+
+    def montre(i):
+        client = app.test_client()
+        rep = client.get("/api/v1/watch/state", headers={"Authorization": "Bearer s%d" % i})
+        latences.append(time.perf_counter() - arrivee)
+        return rep.status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        codes = list(pool.map(montre, range(n)))
+    if set(codes) != {200}:
+        sys.exit(f"{api.__name__}: codes inattendus {Counter(codes)}")
+    rafale = {"builds": len(builds), "mongo": dict(db.compteur),
+              "p50": _percentile(latences, 50), "p95": _percentile(latences, 95)}
+
+    # Regime : une requete par minute et par montre, horloge simulee.
+    builds.clear()
+    db.compteur.clear()
+    horloge = _Horloge()
+    api.time = horloge
+    rnd = random.Random(n)
+    client = app.test_client()
+    requetes = sorted((minute * 60 + rnd.uniform(0, 60), i)
+                      for minute in range(minutes) for i in range(n))
+    debut = horloge.t
+    for instant, i in requetes:
+        horloge.t = debut + instant
+        client.get("/api/v1/watch/state", headers={"Authorization": "Bearer s%d" % i})
+        # Laisse finir un eventuel pre-chauffage avant d'avancer l'horloge.
+        verrou = getattr(api, "_build_lock", None)
+        while verrou is not None and verrou.locked():
+            time.sleep(0.001)
+    api.time = time
+    regime = {"builds": len(builds), "mongo": dict(db.compteur), "requetes": len(requetes)}
+    return rafale, regime
+
+
+def _partage(mongo):
+    return sum(v for k, v in mongo.items() if k != "watch_tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--watches", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--minutes", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=4, help="Workers (threads de waitress)")
+    parser.add_argument("--against", default=None, help="Revision git de reference (ex: HEAD~1)")
+    args = parser.parse_args()
+
+    modules = [("courant", watch_api)]
+    if args.against:
+        modules.append(("@" + args.against, module_at(args.against)))
+
+    print(f"{'':<12} {'montres':>7} | {'rafale: builds':>14} {'partage':>8} {'p50 ms':>7} {'p95 ms':>7}"
+          f" | {'regime: builds':>14} {'partage':>8} {'par montre':>10}")
+    for nom, api in modules:
+        for n in args.watches:
+            rafale, regime = run(api, n, args.minutes, args.threads)
+            print(f"{nom:<12} {n:>7} | {rafale['builds']:>14} {_partage(rafale['mongo']):>8}"
+                  f" {rafale['p50'] * 1000:>7.1f} {rafale['p95'] * 1000:>7.1f}"
+                  f" | {regime['builds']:>14} {_partage(regime['mongo']):>8}"
+                  f" {regime['mongo'].get('watch_tokens', 0) / n:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+migrate_gps_timeseries.py — Bascule anoloc_positions en collection time-series.
+
+Une collection ordinaire ne se convertit pas sur place. Le script :
+  1. renomme anoloc_positions en anoloc_positions_legacy (atomique : les
+     ecrivains ne voient jamais de trou, ils recreent au pire une
+     collection ordinaire, reprise a l'etape 2) ;
+  2. cree anoloc_positions en time-series (gps_history.ensure_collection) ;
+  3. recopie par lots les points de la legacy encore dans la retention
+     (GPS_RETENTION_DAYS), les plus anciens etant de toute facon purges.
+
+La legacy est conservee : la supprimer a la main une fois la carte verifiee
+(affiche la commande a la fin). Arreter anoloc_collector pendant la bascule
+reste preferable.
+
+Usage:
+    python scripts/migrate_gps_timeseries.py
+    python scripts/migrate_gps_timeseries.py --lot 5000
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+# Permet d'executer le script depuis n'importe quel cwd
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+COCKPIT_DIR = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, COCKPIT_DIR)
+
+from pymongo import MongoClient
+
+import gps_history
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+_TITAN_ENV = os.getenv("TITAN_ENV", "dev").strip().lower()
+DB_NAME = "titan" if _TITAN_ENV in {"prod", "production"} else "titan_dev"
+
+LEGACY = gps_history.COL_POSITIONS + "_legacy"
+
+
+def recopier(db, source, lot, depuis):
+    """Recopie les points de `source` posterieurs a `depuis`. Rend le compte."""
+    n = 0
+    tampon = []
+    curseur = db[source].find({gps_history.TIME_FIELD: {"$gte": depuis}}, {"_id": 0})
+    for doc in curseur:
+        if not doc.get(gps_history.META_FIELD) or not isinstance(doc.get(gps_history.TIME_FIELD), datetime):
+            continue
+        tampon.append(doc)
+        if len(tampon) >= lot:
+            db[gps_history.COL_POSITIONS].insert_many(tampon, ordered=False)
+            n += len(tampon)
+            tampon = []
+    if tampon:
+        db[gps_history.COL_POSITIONS].insert_many(tampon, ordered=False)
+        n += len(tampon)
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bascule anoloc_positions en time-series")
+    parser.add_argument("--lot", type=int, default=10000, help="Points recopies par insert_many")
+    args = parser.parse_args()
+
+    db = MongoClient(MONGO_URI)[DB_NAME]
+    noms = set(db.list_collection_names())
+    if LEGACY in noms:
+        sys.exit(f"{LEGACY} existe deja : migration deja faite ou interrompue, a verifier a la main.")
+
+    sources = []
+    if gps_history.COL_POSITIONS in noms:
+        if (gps_history._options(db, gps_history.COL_POSITIONS) or {}).get("timeseries"):
+            print(f"{gps_history.COL_POSITIONS} est deja une time-series, rien a faire.")
+            gps_history.ensure_collection(db)
+            return
+        db[gps_history.COL_POSITIONS].rename(LEGACY)
+        sources.append(LEGACY)
+        print(f"{gps_history.COL_POSITIONS} renommee en {LEGACY}")
+
+    etat = gps_history.ensure_collection(db)
+    if etat == "plain":
+        # Un ecrivain a recree une collection ordinaire entre le renommage et
+        # la creation : on la met de cote a son tour et on recommence.
+        queue = LEGACY + "_queue"
+        db[gps_history.COL_POSITIONS].rename(queue)
+        sources.append(queue)
+        etat = gps_history.ensure_collection(db)
+    if etat != "timeseries":
+        sys.exit(f"Creation de la time-series impossible (etat : {etat}) ; "
+                 f"les donnees sont intactes dans {', '.join(sources) or 'aucune source'}.")
+
+    depuis = datetime.now(timezone.utc) - gps_history.RETENTION
+    for source in sources:
+        n = recopier(db, source, args.lot, depuis)
+        print(f"  {source}: {n} points recopies (depuis {depuis:%Y-%m-%d})")
+    print(f"Termine. Apres verification : db.{LEGACY}.drop()")
+
+
+if __name__ == "__main__":
+    main()
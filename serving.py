@@ -0,0 +1,145 @@
+"""Profil de service waitress et garde des routes lourdes.
+
+waitress sert toutes les requetes depuis un pool fixe de threads (4 par
+defaut). Dans ce processus, ce pool est partage par :
+
+  - les pollings legers des cockpits (alertes, balises, fiches...) ;
+  - les flux SSE de live_push, qui tiennent chacun un thread jusqu'a
+    STREAM_MAX_S ;
+  - quelques routes lourdes (get_affluence, tableau de bord live-controle,
+    envois de photos) qui peuvent prendre plusieurs secondes en pic.
+
+Avec 4 threads, deux ecrans SSE et deux get_affluence suffisaient a geler
+tout le reste. Le profil dimensionne donc le pool en trois parts
+(legeres + lourdes + flux) et la garde `heavy` borne le nombre de routes
+lourdes servies en meme temps : au-dela, la requete attend HEAVY_WAIT_S
+puis recoit un 503 (Retry-After) au lieu d'occuper un thread de plus. Les
+threads restants sont ainsi toujours disponibles pour les pollings courts.
+
+Tout se regle par variables d'environnement (voir ServingProfile.from_env) ;
+`python scripts/loadtest_dashboard.py` mesure l'effet d'un reglage.
+
+Module helpers pur (pas de Flask) : la reponse 503 est un tuple que Flask
+convertit lui-meme.
+"""
+
+import logging
+import os
+import threading
+import time
+from functools import wraps
+
+import live_push
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, ""))
+    except ValueError:
+        return default
+
+
+class ServingProfile:
+    def __init__(self, light_threads=8, heavy_concurrency=4, streams=live_push.MAX_STREAMS,
+                 threads=None, connection_limit=200, channel_timeout=120, backlog=1024,
+                 heavy_wait_s=2.0):
+        self.light_threads = light_threads
+        self.heavy_concurrency = heavy_concurrency
+        self.streams = streams
+        # Par defaut : une part pour chaque usage, pour qu'aucun ne puisse
+        # affamer les deux autres.
+        self.threads = threads or (light_threads + heavy_concurrency + streams)
+        self.connection_limit = connection_limit
+        self.channel_timeout = channel_timeout
+        self.backlog = backlog
+        self.heavy_wait_s = heavy_wait_s
+
+    @classmethod
+    def from_env(cls):
+        """WAITRESS_THREADS (sinon la somme des trois parts), WAITRESS_LIGHT_THREADS,
+        WAITRESS_CONNECTION_LIMIT, WAITRESS_CHANNEL_TIMEOUT, WAITRESS_BACKLOG,
+        HEAVY_CONCURRENCY, HEAVY_WAIT_S ; les flux viennent de
+        LIVE_PUSH_MAX_STREAMS (live_push.MAX_STREAMS)."""
+        try:
+            heavy_wait_s = float(os.getenv("HEAVY_WAIT_S", "2"))
+        except ValueError:
+            heavy_wait_s = 2.0
+        return cls(
+            light_threads=_env_int("WAITRESS_LIGHT_THREADS", 8),
+            heavy_concurrency=max(1, _env_int("HEAVY_CONCURRENCY", 4)),
+            threads=_env_int("WAITRESS_THREADS", 0) or None,
+            connection_limit=_env_int("WAITRESS_CONNECTION_LIMIT", 200),
+            channel_timeout=_env_int("WAITRESS_CHANNEL_TIMEOUT", 120),
+            backlog=_env_int("WAITRESS_BACKLOG", 1024),
+            heavy_wait_s=heavy_wait_s,
+        )
+
+    def waitress_kwargs(self):
+        return {
+            "threads": self.threads,
+            "connection_limit": self.connection_limit,
+            "channel_timeout": self.channel_timeout,
+            "backlog": self.backlog,
+        }
+
+    def check(self):
+        """Avertissements de dimensionnement, a journaliser au demarrage."""
+        out = []
+        if self.threads < self.streams + self.heavy_concurrency + 2:
+            out.append("threads=%d : flux SSE (%d) et routes lourdes (%d) peuvent prendre "
+                       "tous les threads" % (self.threads, self.streams, self.heavy_concurrency))
+        if self.connection_limit < self.threads + self.streams:
+            out.append("connection_limit=%d inferieur a threads + flux" % self.connection_limit)
+        return out
+
+    def __repr__(self):
+        return ("ServingProfile(threads=%d, light=%d, heavy=%d, streams=%d, connection_limit=%d, "
+                "channel_timeout=%d, backlog=%d)" % (
+                    self.threads, self.light_threads, self.heavy_concurrency, self.streams,
+                    self.connection_limit, self.channel_timeout, self.backlog))
+
+
+# ---------------------------------------------------------------------------
+# Garde des routes lourdes
+# ---------------------------------------------------------------------------
+
+class HeavyGate:
+    """Semaphore partage par toutes les routes marquees @heavy."""
+
+    def __init__(self, concurrency, wait_s):
+        self.concurrency = concurrency
+        self.wait_s = wait_s
+        self._sem = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.rejected = 0
+
+    def __call__(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self._sem.acquire(timeout=self.wait_s):
+                with self._lock:
+                    self.rejected += 1
+                logger.warning("route lourde %s refusee : %d deja en cours",
+                               view.__name__, self.concurrency)
+                return ({"error": "serveur occupe, reessayer"}, 503,
+                        {"Retry-After": str(max(1, int(round(self.wait_s * 2))))})
+            t0 = time.perf_counter()
+            with self._lock:
+                self.active += 1
+            try:
+                return view(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                self._sem.release()
+                duree = time.perf_counter() - t0
+                if duree > 5:
+                    logger.info("route lourde %s : %.1f s", view.__name__, duree)
+        return wrapper
+
+
+profile = ServingProfile.from_env()
+heavy = HeavyGate(profile.heavy_concurrency, profile.heavy_wait_s)
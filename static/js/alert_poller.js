@@ -335,7 +335,7 @@
             if (item.alertId && actionData.has_snapshot) {
                 var img = document.createElement("img");
                 img.className = "critical-alert-snapshot";
-                img.src = "/api/hik-snapshot/" + encodeURIComponent(item.alertId);
+                img.src = "/api/hik-snapshot/" + encodeURIComponent(item.alertId) + "?w=480";
                 img.alt = "Snapshot " + (actionData.camera_label || actionData.camera_path || "");
                 img.onerror = function(){ this.style.display = "none"; };
                 body.appendChild(img);
@@ -516,6 +516,8 @@
 
     // --- Polling ---
     function pollActiveAlerts() {
+        // Flux SSE actif : les alertes arrivent par handleAlerts
+        if (window.LivePush && LivePush.covers("alerts")) return;
         fetch("/api/active-alerts")
             .then(function(r) {
                 if (!r.ok) throw new Error("HTTP " + r.status);
@@ -523,40 +525,7 @@
             })
             .then(function(alerts) {
                 _consecutiveErrors = 0;
-                if (!Array.isArray(alerts)) return;
-
-                if (!_firstPollDone) {
-                    // Premier poll : alertes < 5 min -> fullscreen, les autres -> historique seulement
-                    _firstPollDone = true;
-                    var now = Date.now();
-                    var recentAlerts = [];
-                    alerts.forEach(function(a) {
-                        _markSeen(a._id);
-                        var age = a.triggeredAt ? (now - new Date(a.triggeredAt).getTime()) : Infinity;
-                        if (age <= GRACE_PERIOD_MS) {
-                            recentAlerts.push(a);
-                        } else if (typeof window._pushAlertHistory === "function") {
-                            var slug = a.definition_slug || "";
-                            window._pushAlertHistory(slug, ICON_MAP[slug] || "info", TITLE_MAP[slug] || slug, fmtAlertDateTime(a.triggeredAt), a.message || "", null);
-                        }
-                    });
-                    // Afficher en fullscreen les alertes recentes (< 5 min)
-                    recentAlerts.forEach(function(a) {
-                        var slug = a.definition_slug || "";
-                        var onView = _buildOnView(slug, a);
-                        enqueueAlert(slug, a.triggeredAt || "", a.message || "", onView, a.actionData, a._id);
-                    });
-                    return;
-                }
-
-                // Polls suivants : afficher en fullscreen uniquement les nouvelles
-                alerts.forEach(function(a) {
-                    if (_seenAlertIds[a._id]) return;
-                    _markSeen(a._id);
-                    var slug = a.definition_slug || "";
-                    var onView = _buildOnView(slug, a);
-                    enqueueAlert(slug, a.triggeredAt || "", a.message || "", onView, a.actionData, a._id);
-                });
+                handleAlerts(alerts);
             })
             .catch(function(err) {
                 _consecutiveErrors++;
@@ -566,7 +535,45 @@
             });
     }
 
+    function handleAlerts(alerts) {
+        if (!Array.isArray(alerts)) return;
+
+        if (!_firstPollDone) {
+            // Premier poll : alertes < 5 min -> fullscreen, les autres -> historique seulement
+            _firstPollDone = true;
+            var now = Date.now();
+            var recentAlerts = [];
+            alerts.forEach(function(a) {
+                _markSeen(a._id);
+                var age = a.triggeredAt ? (now - new Date(a.triggeredAt).getTime()) : Infinity;
+                if (age <= GRACE_PERIOD_MS) {
+                    recentAlerts.push(a);
+                } else if (typeof window._pushAlertHistory === "function") {
+                    var slug = a.definition_slug || "";
+                    window._pushAlertHistory(slug, ICON_MAP[slug] || "info", TITLE_MAP[slug] || slug, fmtAlertDateTime(a.triggeredAt), a.message || "", null);
+                }
+            });
+            // Afficher en fullscreen les alertes recentes (< 5 min)
+            recentAlerts.forEach(function(a) {
+                var slug = a.definition_slug || "";
+                var onView = _buildOnView(slug, a);
+                enqueueAlert(slug, a.triggeredAt || "", a.message || "", onView, a.actionData, a._id);
+            });
+            return;
+        }
+
+        // Polls suivants : afficher en fullscreen uniquement les nouvelles
+        alerts.forEach(function(a) {
+            if (_seenAlertIds[a._id]) return;
+            _markSeen(a._id);
+            var slug = a.definition_slug || "";
+            var onView = _buildOnView(slug, a);
+            enqueueAlert(slug, a.triggeredAt || "", a.message || "", onView, a.actionData, a._id);
+        });
+    }
+
     document.addEventListener("DOMContentLoaded", function() {
+        if (window.LivePush) LivePush.subscribe("alerts", {}, handleAlerts);
         pollActiveAlerts();
         setInterval(pollActiveAlerts, POLL_INTERVAL);
     });
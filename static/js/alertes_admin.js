@@ -641,7 +641,7 @@
     if(!items.length){
       var tr = document.createElement("tr");
       var td = document.createElement("td");
-      td.colSpan = 4;
+      td.colSpan = 5;
       td.style.cssText = "text-align:center; color:var(--muted); padding:16px;";
       td.textContent = "Aucune plaque surveillee";
       tr.appendChild(td);
@@ -662,6 +662,21 @@
       tdLabel.textContent = w.label || "";
       tdLabel.style.color = "var(--muted)";
       tr.appendChild(tdLabel);
+      // Derniere lecture LAPI, fiche Vision, blacklist (croisement plaques)
+      var tdSeen = document.createElement("td");
+      tdSeen.style.color = "var(--muted)";
+      var x = w.crossref || {};
+      var parts = [];
+      if(x.last_seen){
+        parts.push(new Date(x.last_seen).toLocaleString("fr-FR", {day:"2-digit", month:"2-digit", hour:"2-digit", minute:"2-digit"})
+          + (x.last_camera ? " - " + x.last_camera : ""));
+      } else {
+        parts.push("Jamais lue");
+      }
+      if(x.vision_lieu) parts.push("Vision : " + x.vision_lieu);
+      if(x.blacklisted) parts.push("Blacklist");
+      tdSeen.textContent = parts.join(" | ");
+      tr.appendChild(tdSeen);
       // Toggle
       var tdEnabled = document.createElement("td");
       tdEnabled.className = "col-shrink";
@@ -815,7 +830,7 @@
         imgWrap.href = "/api/hik-events-stream/snapshot/" + encodeURIComponent(r.last_id);
         imgWrap.target = "_blank";
         var img = document.createElement("img");
-        img.src = "/api/hik-events-stream/snapshot/" + encodeURIComponent(r.last_id);
+        img.src = "/api/hik-events-stream/snapshot/" + encodeURIComponent(r.last_id) + "?w=160";
         img.alt = "Snapshot";
         img.style.cssText = "width:64px; height:36px; object-fit:cover; border-radius:4px; border:1px solid var(--line); background:#000; cursor:pointer;";
         img.loading = "lazy";
@@ -874,16 +889,27 @@
     });
   }
 
-  function loadHikConsole(){
+  function showHikRows(rows){
+    var statusEl = $("#hik-console-status");
+    renderHikConsole(rows);
+    if (statusEl) {
+      statusEl.textContent = rows.length + " (camera, type) sur la fenetre (mise a jour " + new Date().toLocaleTimeString("fr-FR") + ")";
+    }
+  }
+
+  // Flux SSE (topic "hik") : le polling ci-dessous ne sert plus que de repli
+  function subscribeHikPush(){
+    if (!window.LivePush) return;
+    LivePush.subscribe("hik", { since: _hikConsoleWindow }, function(rows){ showHikRows(rows); });
+  }
+
+  function loadHikConsole(force){
     var statusEl = $("#hik-console-status");
+    if (force !== true && window.LivePush && LivePush.covers("hik")) return;
     fetch("/api/hik-events-stream?since=" + encodeURIComponent(_hikConsoleWindow))
       .then(function(r){ return r.json(); })
       .then(function(d){
-        var rows = (d && d.rows) || [];
-        renderHikConsole(rows);
-        if (statusEl) {
-          statusEl.textContent = rows.length + " (camera, type) sur la fenetre (mise a jour " + new Date().toLocaleTimeString("fr-FR") + ")";
-        }
+        showHikRows((d && d.rows) || []);
       })
       .catch(function(err){
         if (statusEl) {
@@ -895,6 +921,7 @@
 
   function startHikConsolePolling(){
     if (_hikConsoleTimer) clearInterval(_hikConsoleTimer);
+    subscribeHikPush();
     loadHikConsole();
     _hikConsoleTimer = setInterval(loadHikConsole, 5000);
   }
@@ -903,11 +930,12 @@
   if (hikWinSelect) {
     hikWinSelect.addEventListener("change", function(){
       _hikConsoleWindow = parseInt(this.value, 10) || 900;
-      loadHikConsole();
+      subscribeHikPush();
+      loadHikConsole(true);
     });
   }
   var hikRefreshBtn = $("#btn-hik-console-refresh");
-  if (hikRefreshBtn) hikRefreshBtn.addEventListener("click", loadHikConsole);
+  if (hikRefreshBtn) hikRefreshBtn.addEventListener("click", function(){ loadHikConsole(true); });
 
   // ============================================================
   // Chargement initial
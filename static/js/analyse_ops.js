@@ -1388,7 +1388,8 @@
         var statusEl = $("lab-status");
         var btn = $("lab-compute-btn");
 
-        apiGet("/api/analyse-ops/status")
+        var base = "?event=" + encodeURIComponent(currentEvent) + "&year=" + encodeURIComponent(currentYear);
+        apiGet("/api/analyse-ops/status" + base)
             .then(function(data) {
                 if (data.status === "computing") {
                     if (statusText) statusText.textContent = "Calcul... " + (data.progress || 0) + "%";
@@ -1444,19 +1445,16 @@
     function loadCachedAnalysis() {
         if (!currentEvent || !currentYear) return;
         showEmptyState();
-        apiGet("/api/analyse-ops/kpis?event=" + encodeURIComponent(currentEvent) + "&year=" + encodeURIComponent(currentYear))
-            .then(function(res) {
-                if (res.status === "ok" && res.data) {
-                    removeEmptyState();
-                    loadAllModules();
-                }
-            })
-            .catch(function() {});
+        loadAllModules(true);
     }
 
-    function loadAllModules() {
-        removeEmptyState();
-        removeSkeletons();
+    // Un seul GET /modules pour toute la page (au lieu d'un par module).
+    // onlyIfCached : ne quitte l'etat vide que si les KPIs sont en cache.
+    function loadAllModules(onlyIfCached) {
+        if (!onlyIfCached) {
+            removeEmptyState();
+            removeSkeletons();
+        }
         var base = "?event=" + encodeURIComponent(currentEvent) + "&year=" + encodeURIComponent(currentYear);
         var modules = [
             {name: "kpis", render: renderKPIs},
@@ -1480,13 +1478,21 @@
             {name: "anpr-cross", render: renderANPR},
             {name: "network", render: renderNetwork},
         ];
-        modules.forEach(function(m) {
-            apiGet("/api/analyse-ops/" + m.name + base)
-                .then(function(res) {
-                    if (res.status === "ok" && res.data) m.render(res.data);
-                })
-                .catch(function() {});
-        });
+        apiGet("/api/analyse-ops/modules" + base)
+            .then(function(res) {
+                var data = res.data || {};
+                if (onlyIfCached) {
+                    if (!data.kpis) return;
+                    removeEmptyState();
+                    removeSkeletons();
+                }
+                modules.forEach(function(m) {
+                    if (!data[m.name]) return;
+                    // Un rendu en erreur ne doit pas priver les suivants de leurs donnees
+                    try { m.render(data[m.name]); } catch (e) {}
+                });
+            })
+            .catch(function() {});
     }
 
     // =========================================================================
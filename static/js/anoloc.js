@@ -147,12 +147,14 @@
       }
     });
     refreshBtn.addEventListener("click", function () {
-      refresh();
+      refresh(true);
     });
   }
 
   // --- Refresh: fetch /anoloc/live (avec scope event/year pour inclure tablettes) ---
-  function refresh() {
+  function refresh(force) {
+    syncPush();
+    if (!force && window.LivePush && LivePush.covers("anoloc")) return;
     var qs = new URLSearchParams();
     if (window.selectedEvent) qs.set("event", window.selectedEvent);
     if (window.selectedYear) qs.set("year", String(window.selectedYear));
@@ -162,25 +164,43 @@
       .then(function (data) {
         console.log("[Anoloc] /anoloc/live response:", JSON.stringify(data).substring(0, 500));
         console.log("[Anoloc] groups count:", Object.keys(data.groups || {}).length, "enabled:", data.enabled);
-        if (!data.enabled) {
-          showDisabled();
-          return;
-        }
-        lastData = data;
-        updatePanel(data);
-        updateMarkers(data);
-        refreshActiveTrails();
-        followLockedDevice();
-        // Mettre a jour les tooltips des pins PCORG avec les statuts frais
-        if (typeof window.pcorgUpdateTooltips === "function") {
-          window.pcorgUpdateTooltips();
-        }
+        applyLive(data);
       })
       .catch(function (err) {
         console.error("[Anoloc] refresh error:", err);
       });
   }
 
+  // --- Flux SSE : groupes pousses, meme rendu que /anoloc/live ---
+  var pushKey = null;
+  function syncPush() {
+    if (!window.LivePush) return;
+    var key = (window.selectedEvent || "") + "|" + (window.selectedYear || "");
+    if (key === pushKey) return;
+    pushKey = key;
+    LivePush.subscribe("anoloc", {event: window.selectedEvent, year: window.selectedYear}, function (items, meta) {
+      var groups = {};
+      items.forEach(function (g) { groups[g.key] = g; });
+      applyLive({groups: groups, enabled: !!(meta && meta.enabled)});
+    });
+  }
+
+  function applyLive(data) {
+    if (!data.enabled) {
+      showDisabled();
+      return;
+    }
+    lastData = data;
+    updatePanel(data);
+    updateMarkers(data);
+    refreshActiveTrails();
+    followLockedDevice();
+    // Mettre a jour les tooltips des pins PCORG avec les statuts frais
+    if (typeof window.pcorgUpdateTooltips === "function") {
+      window.pcorgUpdateTooltips();
+    }
+  }
+
   function showDisabled() {
     var body = document.getElementById("widget-right-4-body");
     if (!body) return;
@@ -621,8 +641,16 @@
   }
 
   // --- Trail functions ---
+  var TRAIL_MAX_POINTS = 400;
+
   function fetchTrail(deviceId, minutes, color, groupId) {
-    fetch("/anoloc/trail?device_id=" + encodeURIComponent(deviceId) + "&minutes=" + minutes)
+    // Trace simplifiee cote serveur : au zoom courant, a un pixel pres.
+    var mapObj = window.CockpitMapView && window.CockpitMapView.getMap
+      ? window.CockpitMapView.getMap() : null;
+    var url = "/anoloc/trail?device_id=" + encodeURIComponent(deviceId) + "&minutes=" + minutes +
+      "&max_points=" + TRAIL_MAX_POINTS;
+    if (mapObj && mapObj.getZoom) url += "&zoom=" + mapObj.getZoom();
+    fetch(url)
       .then(function (r) { return r.json(); })
       .then(function (data) {
         if (!data || !data.ok) return;
@@ -21,11 +21,13 @@
         visionStats:  "/api/anpr/vision/stats",
     };
 
-    function imgUrl(r, type) {
+    // width : miniature servie par le serveur (160 ou 480 px), original sinon
+    function imgUrl(r, type, width) {
         var path = r[type + "_image_path"];
         var id   = r[type + "_image_id"];
-        if (path) return API.image + encodeURIComponent(path);
-        if (id)   return API.image + encodeURIComponent(id);
+        var q = width ? "?w=" + width : "";
+        if (path) return API.image + encodeURIComponent(path) + q;
+        if (id)   return API.image + encodeURIComponent(id) + q;
         return null;
     }
 
@@ -261,7 +263,7 @@
             if (r.photo_vehicule) { var im = document.createElement("img"); im.className = "anpr-thumb"; im.src = r.photo_vehicule; im.loading = "lazy"; tdi.appendChild(im); }
             else { var ne = mk("div", "anpr-thumb-empty"); ne.appendChild(mk("span", "material-symbols-outlined", "confirmation_number")); ne.style.color = "#f59e0b"; tdi.appendChild(ne); }
         } else {
-            var vehicleUrl = imgUrl(r, "vehicle");
+            var vehicleUrl = imgUrl(r, "vehicle", 160);
             if (vehicleUrl) { var im2 = document.createElement("img"); im2.className = "anpr-thumb"; im2.src = vehicleUrl; im2.loading = "lazy"; tdi.appendChild(im2); }
             else { var ne2 = mk("div", "anpr-thumb-empty"); ne2.appendChild(mk("span", "material-symbols-outlined", "no_photography")); tdi.appendChild(ne2); }
         }
@@ -360,7 +362,7 @@
             if (isVision && r.photo_vehicule) {
                 var im = document.createElement("img"); im.src = r.photo_vehicule; im.loading = "lazy"; th.appendChild(im);
             } else {
-                var feedVehicleUrl = imgUrl(r, "vehicle");
+                var feedVehicleUrl = imgUrl(r, "vehicle", 480);
                 if (feedVehicleUrl) { var im2 = document.createElement("img"); im2.src = feedVehicleUrl; im2.loading = "lazy"; th.appendChild(im2); }
                 else th.appendChild(mk("span", "material-symbols-outlined", isVision ? "confirmation_number" : "directions_car"));
             }
@@ -6964,32 +6964,44 @@
     }).catch(function () { /* ignore */ });
   }
 
+  // Taille max d'un lot accepte par /field/positions (POSITIONS_BATCH_MAX).
+  var POSITION_BATCH_MAX = 500;
+
   function flushPositionBuffer() {
     if (!navigator.onLine) return;
     openIdb().then(function (db) {
-      var tx = db.transaction(IDB_STORE, "readwrite");
-      var store = tx.objectStore(IDB_STORE);
-      var req = store.getAll();
+      var tx = db.transaction(IDB_STORE, "readonly");
+      var req = tx.objectStore(IDB_STORE).getAll();
       req.onsuccess = function () {
         var items = req.result || [];
         if (items.length === 0) return;
-        // Envoyer le dernier point seulement (optimisation : on ne rejoue
-        // pas tout l'historique, on veut juste la position a jour)
-        var last = items[items.length - 1];
-        fetch("/field/position", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify(last),
-        }).then(function (r) {
-          if (r && r.ok) {
-            var txDel = db.transaction(IDB_STORE, "readwrite");
-            txDel.objectStore(IDB_STORE).clear();
-          }
-        }).catch(function () { /* retry au prochain online */ });
+        // Tout le backlog est rejoue (la trace de la tablette garde ses
+        // trous hors ligne sinon), par lots, chaque point avec son ts de
+        // mesure. Un lot accepte est retire du buffer par plage de cles :
+        // les points bufferises pendant l'envoi restent pour le prochain flush.
+        sendPositionBatches(db, items, 0);
       };
     }).catch(function () { /* ignore */ });
   }
 
+  function sendPositionBatches(db, items, start) {
+    if (start >= items.length) return;
+    var chunk = items.slice(start, start + POSITION_BATCH_MAX);
+    fetch("/field/positions", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ points: chunk }),
+    }).then(function (r) {
+      if (!r || !r.ok) return;  // retry au prochain flush
+      var txDel = db.transaction(IDB_STORE, "readwrite");
+      txDel.objectStore(IDB_STORE).delete(
+        IDBKeyRange.bound(chunk[0].id, chunk[chunk.length - 1].id));
+      txDel.oncomplete = function () {
+        sendPositionBatches(db, items, start + POSITION_BATCH_MAX);
+      };
+    }).catch(function () { /* retry au prochain online */ });
+  }
+
   function initPositionBuffer() {
     window.addEventListener("online", flushPositionBuffer);
     // Flush periodique au cas ou
@@ -166,7 +166,15 @@
       loadMessages();
     }, 30000);
 
-    // Poll leger des compteurs non-lus : plus frequent pour reactivite
+    // Compteurs non-lus : pousses par le flux SSE, poll leger en repli
+    if (window.LivePush) {
+      LivePush.subscribe("field_unread", {}, function (items) {
+        var unread = {};
+        items.forEach(function (it) { unread[it.device_id] = it.count; });
+        state.unreadByDevice = unread;
+        updateUnreadBadges();
+      });
+    }
     setInterval(loadUnreadByDevice, 8000);
 
     // Reagir aux changements globaux event/year
@@ -1390,6 +1398,11 @@
 
   // Charge le nombre de messages non lus par tablette (pour badge dans la table)
   function loadUnreadByDevice() {
+    // Flux SSE actif : compteurs deja a jour, il suffit de reposer les badges
+    if (window.LivePush && LivePush.covers("field_unread")) {
+      updateUnreadBadges();
+      return;
+    }
     apiGet("/field/admin/unread-by-device")
       .then(function (data) {
         if (!data || !data.ok) return;
@@ -0,0 +1,118 @@
+/**
+ * live_push.js - Flux Server-Sent Events des ecrans live (/api/live/stream).
+ * Script autonome, sans dependance a main.js. A inclure AVANT les scripts
+ * qui s'y abonnent (alert_poller, pcorg, anoloc, alertes_admin, field_admin).
+ *
+ * Un seul EventSource par page, quel que soit le nombre d'abonnes : les
+ * abonnements du meme tour sont regroupes, puis le flux est (re)ouvert avec
+ * la liste des topics. Le serveur envoie un `snapshot` par topic puis des
+ * `delta` {upsert, remove, order, meta?} ; le handler recoit toujours la
+ * liste complete, dans l'ordre du serveur.
+ *
+ * Le polling existant reste le filet de securite : tant que
+ * LivePush.covers(topic) est faux (flux refuse en 503, coupe, pas encore de
+ * snapshot), les ecrans continuent d'interroger leurs endpoints.
+ */
+(function() {
+    "use strict";
+
+    var RETRY_CLOSED_MS = 60000;
+
+    var _subs = {};       // topic -> {params, handlers: []}
+    var _state = {};      // topic -> {items: {}, order: [], meta}
+    var _primed = {};     // topic -> true une fois le snapshot recu
+    var _source = null;
+    var _sourceUrl = "";
+    var _openTimer = null;
+    var _retryTimer = null;
+
+    function _buildUrl() {
+        var topics = Object.keys(_subs).sort();
+        if (!topics.length || typeof EventSource === "undefined") return "";
+        var q = ["topics=" + encodeURIComponent(topics.join(","))];
+        var seen = {};
+        topics.forEach(function(t) {
+            var p = _subs[t].params || {};
+            Object.keys(p).forEach(function(k) {
+                if (seen[k] || p[k] === undefined || p[k] === null || p[k] === "") return;
+                seen[k] = true;
+                q.push(encodeURIComponent(k) + "=" + encodeURIComponent(p[k]));
+            });
+        });
+        return "/api/live/stream?" + q.join("&");
+    }
+
+    function _close() {
+        if (_source) _source.close();
+        _source = null;
+        _sourceUrl = "";
+        _primed = {};
+    }
+
+    function _open() {
+        _openTimer = null;
+        var url = _buildUrl();
+        if (url === _sourceUrl && _source) return;
+        _close();
+        if (!url) return;
+        _sourceUrl = url;
+        _source = new EventSource(url);
+        _source.addEventListener("snapshot", function(e) { _onMessage(e, true); });
+        _source.addEventListener("delta", function(e) { _onMessage(e, false); });
+        _source.onerror = function() {
+            // Le polling reprend tant qu'un nouveau snapshot n'est pas arrive.
+            _primed = {};
+            if (_source && _source.readyState === EventSource.CLOSED) {
+                // Refus (503 : flux satures) : pas de reconnexion auto, on retente plus tard.
+                _close();
+                clearTimeout(_retryTimer);
+                _retryTimer = setTimeout(_schedule, RETRY_CLOSED_MS);
+            }
+        };
+    }
+
+    function _schedule() {
+        if (_openTimer) return;
+        _openTimer = setTimeout(_open, 0);
+    }
+
+    function _onMessage(e, isSnapshot) {
+        var msg;
+        try { msg = JSON.parse(e.data); } catch (err) { return; }
+        var topic = msg.topic;
+        if (!_subs[topic]) return;
+        var st = _state[topic];
+        if (isSnapshot || !st) {
+            st = _state[topic] = {items: msg.items || {}, order: msg.order || [], meta: msg.meta};
+        } else {
+            (msg.remove || []).forEach(function(k) { delete st.items[k]; });
+            var up = msg.upsert || {};
+            Object.keys(up).forEach(function(k) { st.items[k] = up[k]; });
+            st.order = msg.order || st.order;
+            if (msg.hasOwnProperty("meta")) st.meta = msg.meta;
+        }
+        _primed[topic] = true;
+        var list = [];
+        st.order.forEach(function(k) { if (st.items[k] !== undefined) list.push(st.items[k]); });
+        _subs[topic].handlers.forEach(function(h) {
+            try { h(list, st.meta); } catch (err) { console.error("[live_push] " + topic, err); }
+        });
+    }
+
+    window.LivePush = {
+        /** Abonne `handler(items, meta)` a un topic. `params` : {event, year, since}. */
+        subscribe: function(topic, params, handler) {
+            var sub = _subs[topic];
+            if (!sub) sub = _subs[topic] = {params: params || {}, handlers: []};
+            sub.params = params || sub.params;
+            if (handler && sub.handlers.indexOf(handler) === -1) sub.handlers.push(handler);
+            delete _state[topic];
+            delete _primed[topic];
+            _schedule();
+        },
+        /** Vrai si le topic est servi par le flux : le polling peut s'abstenir. */
+        covers: function(topic) {
+            return !!(_source && _primed[topic]);
+        },
+    };
+})();
@@ -794,32 +794,53 @@
       loadVehiclesByCategory();
     }
     refresh._vbcCounter = (refresh._vbcCounter || 0) + 1;
+    syncPush(ey);
+    if (window.LivePush && LivePush.covers("pcorg")) return;
     var liveUrl = "/api/pcorg/live?event=" + encodeURIComponent(ey.event) + "&year=" + encodeURIComponent(ey.year);
     var statsUrl = "/api/pcorg/stats?event=" + encodeURIComponent(ey.event) + "&year=" + encodeURIComponent(ey.year);
     Promise.all([
       fetch(liveUrl, { cache: "no-store" }).then(function (r) { return r.json(); }),
       fetch(statsUrl, { cache: "no-store" }).then(function (r) { return r.json(); }).catch(function () { return null; }),
     ]).then(function (results) {
-      var data = results[0];
-      var stats = results[1];
-      lastData = data;
-      // Filtrer par categories autorisees
-      var ac = window.__userAllowedCategories;
-      var filterCat = ac ? function (it) { return ac.indexOf(it.category) !== -1; } : function () { return true; };
-      var openFiltered = (data.open || []).filter(filterCat);
-      var closedFiltered = (data.closed || []).filter(filterCat);
-      renderList(listOpen, openFiltered, false, placeholderOpen);
-      renderList(listClosed, closedFiltered, true, placeholderClosed);
-      // Stats: compte sur la collection complete (fallback aux items charges si l'endpoint echoue)
-      var statsCounts = (stats && stats.counts) ? stats.counts : null;
-      renderStats(openFiltered, closedFiltered, statsCounts);
-      syncTabHeights();
-      updateBadge(openFiltered.length);
-      updateMapPins(openFiltered);
-      if (expPanel && expPanel.style.display !== "none") renderExpanded();
+      applyLive(results[0], results[1]);
     }).catch(function (err) { console.error("[pcorg] refresh error", err); });
   }
 
+  // Flux SSE : meme rendu que le polling, a partir de la liste poussee
+  var pushKey = "";
+  function syncPush(ey) {
+    if (!window.LivePush) return;
+    var key = ey.event + "|" + ey.year;
+    if (key === pushKey) return;
+    pushKey = key;
+    LivePush.subscribe("pcorg", { event: ey.event, year: ey.year }, onPush);
+  }
+
+  function onPush(items, meta) {
+    meta = meta || {};
+    var data = { open: [], closed: [], counts: meta.counts, closed_page_size: meta.closed_page_size };
+    items.forEach(function (it) { (it.status_code === 10 ? data.closed : data.open).push(it); });
+    applyLive(data, meta.stats || null);
+  }
+
+  function applyLive(data, stats) {
+    lastData = data;
+    // Filtrer par categories autorisees
+    var ac = window.__userAllowedCategories;
+    var filterCat = ac ? function (it) { return ac.indexOf(it.category) !== -1; } : function () { return true; };
+    var openFiltered = (data.open || []).filter(filterCat);
+    var closedFiltered = (data.closed || []).filter(filterCat);
+    renderList(listOpen, openFiltered, false, placeholderOpen);
+    renderList(listClosed, closedFiltered, true, placeholderClosed);
+    // Stats: compte sur la collection complete (fallback aux items charges si l'endpoint echoue)
+    var statsCounts = (stats && stats.counts) ? stats.counts : null;
+    renderStats(openFiltered, closedFiltered, statsCounts);
+    syncTabHeights();
+    updateBadge(openFiltered.length);
+    updateMapPins(openFiltered);
+    if (expPanel && expPanel.style.display !== "none") renderExpanded();
+  }
+
   // ── Render list ────────────────────────────────────────────────────────────
   function renderList(container, items, isClosed, placeholder) {
     if (!container) return;
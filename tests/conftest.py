@@ -9,7 +9,27 @@ tautologiques, ce qui est pire que pas de test du tout.
 import re
 from datetime import datetime, timezone
 
-_OPERATEURS_CONNUS = {"$lte", "$lt", "$gt", "$gte", "$in", "$ne", "$regex"}
+from pymongo.errors import DuplicateKeyError
+
+_OPERATEURS_CONNUS = {"$lte", "$lt", "$gt", "$gte", "$in", "$ne", "$regex", "$options", "$all",
+                      "$nin"}
+
+
+def _lire(doc, chemin):
+    for cle in chemin.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(cle)
+    return doc
+
+
+def _poser(doc, chemin, valeur):
+    """$set sur un chemin pointe ("vision.24H|2026") : les niveaux
+    intermediaires sont crees, comme le fait Mongo."""
+    *parents, feuille = chemin.split(".")
+    for cle in parents:
+        doc = doc.setdefault(cle, {})
+    doc[feuille] = valeur
 
 
 class FakeCursor:
@@ -37,6 +57,12 @@ class FakeCursor:
         self.docs.sort(key=lambda d: d[cle], reverse=(sens == -1))
         return self
 
+    def limit(self, n):
+        # Comme pymongo, limit(0) veut dire << pas de limite >>.
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
     def __iter__(self):
         return iter(self.docs)
 
@@ -83,14 +109,86 @@ class FakeCollection:
         return kwargs.get("name")
 
     def update_one(self, filtre, update, upsert=False):
+        """$set (chemins pointes compris), $inc, $min, $max, $push et
+        $addToSet (avec $each), avec upsert.
+        Comme Mongo, un upsert dont le filtre ne trouve rien mais dont l'_id
+        existe deja leve DuplicateKeyError : c'est ce refus qui porte le
+        << max conditionnel >> de peak_rollup. Un double qui insererait un
+        second document au meme _id laisserait passer un pic ecrase par une
+        valeur plus basse. Tout autre operateur leve."""
+        inconnus = set(update.keys()) - {"$set", "$inc", "$min", "$max",
+                                         "$push", "$addToSet"}
+        if inconnus:
+            raise NotImplementedError(
+                "operateurs non geres par le double : %s" % sorted(inconnus))
+        cible = self.find_one(filtre)
+        if cible is None:
+            if not upsert:
+                return
+            if "_id" in filtre and any(d.get("_id") == filtre["_id"]
+                                       for d in self.docs):
+                raise DuplicateKeyError("E11000 duplicate key : %r"
+                                        % (filtre["_id"],))
+            # Seules les egalites du filtre passent dans le document insere.
+            cible = {cle: val for cle, val in filtre.items()
+                     if not isinstance(val, dict) and not cle.startswith("$")}
+            self.docs.append(cible)
+        for cle, val in (update.get("$set") or {}).items():
+            _poser(cible, cle, val)
+        for cle, pas in (update.get("$inc") or {}).items():
+            _poser(cible, cle, (_lire(cible, cle) or 0) + pas)
+        for cle, val in (update.get("$min") or {}).items():
+            actuel = _lire(cible, cle)
+            if actuel is None or val < actuel:
+                _poser(cible, cle, val)
+        for cle, val in (update.get("$max") or {}).items():
+            actuel = _lire(cible, cle)
+            if actuel is None or val > actuel:
+                _poser(cible, cle, val)
+        for cle, val in (update.get("$push") or {}).items():
+            _poser(cible, cle, list(_lire(cible, cle) or []) + [val])
+        for cle, val in (update.get("$addToSet") or {}).items():
+            liste = list(_lire(cible, cle) or [])
+            ajouts = val["$each"] if isinstance(val, dict) and "$each" in val else [val]
+            liste.extend(v for v in ajouts if v not in liste)
+            _poser(cible, cle, liste)
+
+    def update_many(self, filtre, update):
+        """$set seulement, sans upsert."""
+        for cible in self._matching(filtre):
+            cible.update(update.get("$set", {}))
+
+    def insert_one(self, doc):
+        self.docs.append(doc)
+
+    def insert_many(self, docs, ordered=True):
+        self.docs.extend(docs)
+
+    def replace_one(self, filtre, doc, upsert=False):
         cible = self.find_one(filtre)
-        valeurs = update.get("$set", {})
         if cible is not None:
-            cible.update(valeurs)
-        elif upsert:
-            nouveau = dict(filtre)
-            nouveau.update(valeurs)
-            self.docs.append(nouveau)
+            self.docs = [d for d in self.docs if d is not cible]
+        elif not upsert:
+            return
+        self.docs.append(dict(doc))
+
+    def bulk_write(self, ops, ordered=True):
+        """ReplaceOne (ce qu'ecrit anoloc_collector) et UpdateOne en $set
+        (plate_index.backfill) ; toute autre operation leve plutot que
+        d'etre ignoree."""
+        for op in ops:
+            if type(op).__name__ == "UpdateOne":
+                self.update_one(op._filter, op._doc, upsert=bool(op._upsert))
+                continue
+            if type(op).__name__ != "ReplaceOne":
+                raise NotImplementedError(
+                    "FakeCollection.bulk_write ne sait pas traiter %r" % op)
+            cible = self.find_one(op._filter)
+            if cible is not None:
+                self.docs = [d for d in self.docs if d is not cible]
+            elif not op._upsert:
+                continue
+            self.docs.append(dict(op._doc))
 
     def delete_many(self, query=None):
         restants = [d for d in self.docs if d not in self._matching(query)]
@@ -228,6 +326,12 @@ class FakeCollection:
 
     @classmethod
     def _match(cls, doc, cle, val):
+        if cle == "$or":
+            return any(all(cls._match(doc, c, v) for c, v in branche.items())
+                       for branche in val)
+        if cle == "$and":
+            return all(all(cls._match(doc, c, v) for c, v in branche.items())
+                       for branche in val)
         actuel = cls._as_comparable_utc(doc.get(cle))
         if isinstance(val, dict):
             # Un operateur inconnu laisserait passer le document en silence :
@@ -257,9 +361,17 @@ class FakeCollection:
                 return False
             if "$ne" in val and actuel == val["$ne"]:
                 return False
+            if "$nin" in val and actuel in val["$nin"]:
+                return False
             if "$regex" in val and not (
                     isinstance(actuel, str)
-                    and re.search(val["$regex"], actuel)):
+                    and re.search(val["$regex"], actuel,
+                                  re.IGNORECASE if "i" in val.get("$options", "")
+                                  else 0)):
+                return False
+            if "$all" in val and not (
+                    isinstance(actuel, list)
+                    and all(v in actuel for v in val["$all"])):
                 return False
             return True
         # Les deux cotes passent par la normalisation, pas seulement le
@@ -282,3 +394,6 @@ class FakeDb:
 
     def list_collection_names(self):
         return list(self._cols)
+
+    def drop_collection(self, name):
+        self._cols.pop(name, None)
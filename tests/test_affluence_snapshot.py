@@ -0,0 +1,93 @@
+import threading
+import time
+from datetime import date
+
+from conftest import FakeDb
+
+import affluence_snapshot as snap
+
+
+def _db(last_update="2026-05-01"):
+    return FakeDb(parametrages=[{"event": "24H", "year": "2026",
+                                 "tickets": {"lastUpdate": last_update}}])
+
+
+class _Calcul:
+    def __init__(self, db, delai_s=0.0):
+        self.db = db
+        self.appels = 0
+        self.delai_s = delai_s
+
+    def __call__(self, event, year):
+        self.appels += 1
+        time.sleep(self.delai_s)
+        lu = snap.current_last_update(self.db, event, year)
+        return {"days": [], "total_ventes": self.appels, "last_update": lu}
+
+
+class TestInstantane:
+    def test_un_calcul_puis_des_lectures(self):
+        db = _db()
+        calcul = _Calcul(db)
+        assert snap.get(db, "24H", "2026", calcul, now=1000)["total_ventes"] == 1
+        for t in (1001, 1200, 1000 + snap.REVALIDATE_S - 1):
+            assert snap.get(db, "24H", "2026", calcul, now=t)["total_ventes"] == 1
+        assert calcul.appels == 1
+
+    def test_invalidation_par_evenement(self):
+        db = _db()
+        calcul = _Calcul(db)
+        snap.get(db, "24H", "2026", calcul, now=1000)
+        snap.get(db, "24H", "2025", calcul, now=1000)
+        snap.invalidate(db, "AUTRE")
+        snap.get(db, "24H", "2026", calcul, now=1001)
+        assert calcul.appels == 2
+        snap.invalidate(db, "24H")
+        snap.get(db, "24H", "2026", calcul, now=1002)
+        snap.get(db, "24H", "2025", calcul, now=1002)
+        assert calcul.appels == 4
+
+    def test_revalidation_sur_last_update(self):
+        db = _db()
+        calcul = _Calcul(db)
+        snap.get(db, "24H", "2026", calcul, now=1000)
+        # Revalidation sans changement : pas de recalcul, echeance repoussee
+        t = 1000 + snap.REVALIDATE_S
+        assert snap.get(db, "24H", "2026", calcul, now=t)["total_ventes"] == 1
+        # Billetterie mise a jour sans webhook : rattrapee a la revalidation
+        db["parametrages"].update_one({"event": "24H"}, {"$set": {"tickets": {"lastUpdate": "2026-05-08"}}})
+        assert snap.get(db, "24H", "2026", calcul, now=t + 10)["total_ventes"] == 1
+        doc = snap.get(db, "24H", "2026", calcul, now=t + snap.REVALIDATE_S)
+        assert doc == {"days": [], "total_ventes": 2, "last_update": "2026-05-08"}
+
+    def test_un_seul_calcul_pour_des_polls_simultanes(self):
+        db = _db()
+        calcul = _Calcul(db, delai_s=0.05)
+        resultats = []
+        threads = [threading.Thread(target=lambda: resultats.append(
+            snap.get(db, "24H", "2026", calcul, now=1000))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert calcul.appels == 1
+        assert len(resultats) == 8
+
+
+class TestCourbesDeReference:
+    def test_calculees_une_fois_par_version(self):
+        db = FakeDb()
+        appels = []
+
+        def build():
+            appels.append(1)
+            return {"points": [[10, 50], [0, 100]], "final": 100, "groups": []}
+
+        course = date(2025, 6, 14)
+        for _ in range(3):
+            courbes = snap.reference_curves(db, "24H", "2025", "2025-06-20", course, build)
+        assert courbes["final"] == 100
+        assert len(appels) == 1
+        snap.reference_curves(db, "24H", "2025", "2025-06-21", course, build)
+        snap.reference_curves(db, "24H", "2025", "2025-06-21", date(2025, 6, 15), build)
+        assert len(appels) == 3
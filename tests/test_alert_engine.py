@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+
+from conftest import FakeDb
+
+import alert_engine
+
+
+def _defn(slug, detection_type, **params):
+    return {"slug": slug, "detection_type": detection_type,
+            "enabled": True, "params": params}
+
+
+class TestHandlerInterval:
+    def test_cadence_par_type(self):
+        assert alert_engine.handler_interval(
+            _defn("a", "checkpoint_error_burst")) == 10
+        assert alert_engine.handler_interval(
+            _defn("b", "meteo_rain_onset")) == 300
+
+    def test_type_inconnu_garde_la_cadence_historique(self):
+        assert alert_engine.handler_interval(_defn("c", "autre")) == \
+            alert_engine.DEFAULT_INTERVAL_S
+
+    def test_surcharge_par_definition_bornee_au_tick(self):
+        assert alert_engine.handler_interval(
+            _defn("d", "meteo_rain_onset", interval_s=60)) == 60
+        # Plus rapide que le tick n'a pas de sens : la boucle ne se reveille
+        # pas plus souvent.
+        assert alert_engine.handler_interval(
+            _defn("e", "meteo_rain_onset", interval_s=1)) == \
+            alert_engine.DAEMON_TICK_S
+
+
+class TestHandlerSchedule:
+    def test_chaque_definition_tourne_a_sa_cadence(self):
+        sched = alert_engine.HandlerSchedule()
+        defs = [_defn("burst", "checkpoint_error_burst"),
+                _defn("pluie", "meteo_rain_onset")]
+        assert [d["slug"] for d in sched.due(defs, 0.0)] == ["burst", "pluie"]
+        assert sched.due(defs, 5.0) == []
+        assert [d["slug"] for d in sched.due(defs, 10.0)] == ["burst"]
+        assert [d["slug"] for d in sched.due(defs, 300.0)] == \
+            ["burst", "pluie"]
+
+    def test_prochain_reveil_borne_par_le_tick(self):
+        sched = alert_engine.HandlerSchedule()
+        sched.due([_defn("burst", "checkpoint_error_burst")], 0.0)
+        assert sched.next_wakeup(8.0, tick_s=5) == 2.0
+        assert sched.next_wakeup(0.0, tick_s=5) == 5
+
+    def test_definition_reactivee_repart_immediatement(self):
+        sched = alert_engine.HandlerSchedule()
+        d = _defn("pluie", "meteo_rain_onset")
+        sched.due([d], 0.0)
+        sched.due([], 1.0)
+        assert sched.due([d], 2.0) == [d]
+
+
+class TestEngineCache:
+    NOW = datetime(2026, 6, 13, 12, 0, tzinfo=timezone.utc)
+
+    def _cache(self, monkeypatch):
+        appels = []
+
+        def build_context(db, sim_time=None):
+            appels.append(sim_time)
+            return {"now": sim_time, "event": "24H AUTOS", "year": "2026"}
+
+        monkeypatch.setattr(alert_engine, "build_context", build_context)
+        return alert_engine.EngineCache(), appels
+
+    def test_sans_invalidation_rien_n_est_relu(self, monkeypatch):
+        cache, appels = self._cache(monkeypatch)
+        db = FakeDb(cockpit_alert_definitions=[_defn("a", "pcorg_urgency")])
+        cache.refresh(db, self.NOW, 0.0)
+        db["cockpit_alert_definitions"].docs.append(_defn("b", "pcorg_urgency"))
+        defs, ctx = cache.refresh(db, self.NOW, 30.0)
+        assert [d["slug"] for d in defs] == ["a"]
+        assert len(appels) == 1
+
+    def test_bump_definitions_recharge(self, monkeypatch):
+        cache, _ = self._cache(monkeypatch)
+        db = FakeDb(cockpit_alert_definitions=[_defn("a", "pcorg_urgency")])
+        cache.refresh(db, self.NOW, 0.0)
+        db["cockpit_alert_definitions"].docs.append(_defn("b", "pcorg_urgency"))
+        db[alert_engine.VERSIONS_COLLECTION].docs.append(
+            {"_id": "definitions", "version": 1})
+        defs, _ = cache.refresh(db, self.NOW, 30.0)
+        assert [d["slug"] for d in defs] == ["a", "b"]
+
+    def test_contexte_reconstruit_sur_bump_ou_age(self, monkeypatch):
+        cache, appels = self._cache(monkeypatch)
+        db = FakeDb(cockpit_alert_definitions=[])
+        cache.refresh(db, self.NOW, 0.0)
+        db[alert_engine.VERSIONS_COLLECTION].docs.append(
+            {"_id": "context", "version": 1})
+        cache.refresh(db, self.NOW, 10.0)
+        assert len(appels) == 2
+        cache.refresh(db, self.NOW, 10.0 + alert_engine.CONTEXT_MAX_AGE_S)
+        assert len(appels) == 3
+
+    def test_now_est_rafraichi_a_chaque_tick(self, monkeypatch):
+        cache, _ = self._cache(monkeypatch)
+        db = FakeDb(cockpit_alert_definitions=[])
+        cache.refresh(db, self.NOW, 0.0)
+        plus_tard = self.NOW.replace(minute=5)
+        _, ctx = cache.refresh(db, plus_tard, 300.0)
+        assert ctx["now"] == plus_tard
+        assert ctx["event"] == "24H AUTOS"
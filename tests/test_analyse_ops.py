@@ -0,0 +1,228 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+import analyse_ops as ao
+
+
+def _collect(tasks, job=None):
+    done = []
+    results = ao._run_tasks(job or {}, tasks, lambda t, v, s: done.append(t.name))
+    return results, done
+
+
+class TestRunTasks:
+    def test_entrees_transmises_et_ordre_des_dependances(self):
+        tasks = [
+            ao._Task("c", lambda job, inp: inp["a"] + inp["b"], ["a", "b"]),
+            ao._Task("a", lambda job, inp: job["x"], kind="io", module=False),
+            ao._Task("b", lambda job, inp: inp["a"] * 10, ["a"]),
+        ]
+        results, done = _collect(tasks, {"x": 2})
+        assert results == {"a": 2, "b": 20, "c": 22}
+        assert done.index("a") < done.index("b") < done.index("c")
+
+    def test_taches_independantes_concurrentes(self):
+        # Deux taches sans lien doivent tourner en meme temps : chacune attend
+        # l'autre, un ordonnancement sequentiel expirerait.
+        barrier = threading.Barrier(2, timeout=5)
+
+        def _wait(job, inp):
+            barrier.wait()
+            return True
+
+        tasks = [ao._Task("m1", _wait, kind="io"), ao._Task("m2", _wait, kind="io")]
+        results, _ = _collect(tasks)
+        assert results == {"m1": True, "m2": True}
+
+    def test_dependance_circulaire(self):
+        tasks = [
+            ao._Task("a", lambda job, inp: 1, ["b"]),
+            ao._Task("b", lambda job, inp: 1, ["a"]),
+        ]
+        with pytest.raises(ValueError, match="circulaires"):
+            _collect(tasks)
+
+    def test_entree_inconnue(self):
+        with pytest.raises(ValueError, match="inconnues"):
+            _collect([ao._Task("a", lambda job, inp: 1, ["frame"])])
+
+    def test_exception_remonte(self):
+        def _boom(job, inp):
+            raise RuntimeError("boom")
+
+        tasks = [ao._Task("a", lambda job, inp: 1), ao._Task("b", _boom, ["a"])]
+        with pytest.raises(RuntimeError, match="boom"):
+            _collect(tasks)
+
+
+def test_graphe_des_modules_complet():
+    names = {t.name for t in ao._TASKS if t.module}
+    assert names == set(ao._MODULES)
+    known = {t.name for t in ao._TASKS}
+    assert all(i in known for t in ao._TASKS for i in t.inputs)
+
+
+def test_run_compute_sans_document(monkeypatch):
+    monkeypatch.setattr(ao, "_ensure_db", lambda: None)
+    monkeypatch.setattr(ao, "_source_version", lambda event, year, fresh=False: 0)
+
+    def _docs(job, inp):
+        raise ao._NoDocuments(f"Aucun document pour {job['event']} {job['year']}")
+
+    monkeypatch.setattr(ao, "_TASKS", [ao._Task("docs", _docs, kind="io", module=False)])
+    ao._compute_states.pop(("X", 1999), None)
+    ao._run_compute("X", 1999)
+    state = ao._compute_states[("X", 1999)]
+    assert state["status"] == "error"
+    assert state["error"] == "Aucun document pour X 1999"
+    assert state["duration_ms"] is not None
+
+
+# ---------------------------------------------------------------------------
+# Recalcul incremental
+# ---------------------------------------------------------------------------
+T0 = datetime(2025, 6, 12, 8, 0, tzinfo=timezone.utc)
+
+
+def _fiche(i, minutes=0, close=None, operator="DUPONT Jean", sous="Rixe",
+           services="SECU;SAMU", source="PCO.Secours"):
+    ts = T0 + timedelta(minutes=minutes)
+    return {
+        "_id": f"F{i}", "event": "E", "year": 2025, "ts": ts,
+        "close_ts": ts + timedelta(minutes=close) if close is not None else None,
+        "source": source, "operator": operator, "operator_close": operator,
+        "xml_struct": {"classification": {"sous": sous}, "service_contacte": services,
+                       "caller": {"appelant": "PCO", "flags": {"telephone": i % 2 == 0}},
+                       "resource": {"carroye": "A12"}, "intervenant1": "SAMU"},
+    }
+
+
+def _frame_complet(docs):
+    df = ao._frame(docs)
+    return {"df": df, "dft": ao._temporal_frame(df)}
+
+
+@pytest.fixture
+def pcorg(monkeypatch):
+    docs = [_fiche(0, 0, close=5), _fiche(1, 30, close=45, operator="MARTIN Paul"),
+            _fiche(2, 70), _fiche(3, 150, close=20, sous="Malaise", services="")]
+    db = FakeDb(pcorg=docs)
+    monkeypatch.setattr(ao, "_col_pcorg", db["pcorg"])
+    df = ao._frame(docs)
+    retained = ao._Retained(df, ao._temporal_frame(df), ao._interv_frame(docs),
+                            cursor=datetime.now(timezone.utc))
+    return db["pcorg"], retained
+
+
+class TestIncremental:
+    def test_delta_identique_a_une_relecture_complete(self, pcorg):
+        col, retained = pcorg
+        now = datetime.now(timezone.utc)
+        # Fiche 2 close par l'application, fiche 4 arrivee par la synchro.
+        col.docs[2] = dict(_fiche(2, 70, close=12, operator="MARTIN Paul"), modified_at=now)
+        col.docs.append(dict(_fiche(4, 200, close=90, services="POMPIERS"), synced_at=now))
+
+        assert ao._merge_delta("E", 2025, retained) == 2
+        assert list(retained.df["_id"]) == ["F0", "F1", "F2", "F3", "F4"]
+
+        frame = _frame_complet(col.docs)
+        agg = retained.aggregates
+        inp = {"frame": frame}
+        assert agg.kpis() == ao._m_kpis(None, inp)
+        assert agg.categories() == ao._m_categories(None, inp)
+        assert agg.operators() == ao._m_operators(None, inp)
+        assert agg.services() == ao._m_services(None, inp)
+        assert agg.temporal(retained.df, retained.dft) == ao._m_temporal(None, inp)
+        assert agg.kpis()["fcr_count"] == 3
+
+    def test_sans_changement_rien_a_relire(self, pcorg):
+        col, retained = pcorg
+        assert ao._merge_delta("E", 2025, retained) == 0
+        assert retained.aggregates.kpis()["total"] == 4
+
+    def test_suppression_force_un_recalcul_complet(self, pcorg):
+        col, retained = pcorg
+        del col.docs[0]
+        with pytest.raises(ao._FullRebuild):
+            ao._merge_delta("E", 2025, retained)
+
+    def test_hors_fenetre_de_recouvrement_non_relu(self, pcorg):
+        col, retained = pcorg
+        ancien = retained.cursor - ao.INCR_OVERLAP - timedelta(seconds=1)
+        col.docs[1] = dict(col.docs[1], modified_at=ancien)
+        assert ao._merge_delta("E", 2025, retained) == 0
+
+
+# ---------------------------------------------------------------------------
+# Version des sources et cache des modules
+# ---------------------------------------------------------------------------
+@pytest.fixture
+def cache_db(monkeypatch):
+    db = FakeDb()
+    monkeypatch.setattr(ao, "_ensure_db", lambda: None)
+    monkeypatch.setattr(ao, "_db", db)
+    monkeypatch.setattr(ao, "_col_cache", db["analyse_ops_cache"])
+    monkeypatch.setattr(ao, "_versions", {})
+    return db
+
+
+class TestSourceVersion:
+    def test_ecriture_perime_le_cache(self, cache_db):
+        ao._cache_set("E", 2025, "kpis", {"total": 4})
+        ao._cache_set("E", 2025, "temporal", {"by_hour": []})
+        assert ao._cache_get_many("E", 2025, ["kpis", "temporal", "text"]) == {
+            "kpis": {"total": 4}, "temporal": {"by_hour": []}}
+
+        assert ao.bump_source_version(cache_db, "E", "2025") == 1
+        assert ao._cache_get("E", 2025, "kpis") is None
+        # Un autre evenement n'est pas touche
+        ao._cache_set("F", 2025, "kpis", {"total": 1})
+        ao.bump_source_version(cache_db, "E", 2025)
+        assert ao._cache_get("F", 2025, "kpis") == {"total": 1}
+
+    def test_version_gardee_en_memoire(self, cache_db, monkeypatch):
+        lectures = []
+        sources = cache_db[ao.COL_SOURCES]
+        find_one = sources.find_one
+        monkeypatch.setattr(sources, "find_one", lambda *a, **k: lectures.append(a) or find_one(*a, **k))
+        for _ in range(21):
+            ao._source_version("E", 2025)
+        assert len(lectures) == 1
+        # La sync tourne dans un autre processus : vue apres expiration.
+        sources.docs.append({"_id": "E|2025", "version": 7})
+        assert ao._source_version("E", 2025) == 0
+        monkeypatch.setattr(ao, "SOURCE_VERSION_TTL", 0)
+        assert ao._source_version("E", 2025) == 7
+
+    def test_bump_par_id_de_fiche(self, cache_db):
+        cache_db["pcorg"].docs.append({"_id": "F1", "event": "E", "year": 2025})
+        assert ao.bump_fiche_source(cache_db, "F1") == 1
+        assert ao.bump_fiche_source(cache_db, "absente") is None
+        assert ao._source_version("E", 2025, fresh=True) == 1
+
+
+# ---------------------------------------------------------------------------
+# Normalisation memoisee
+# ---------------------------------------------------------------------------
+def test_normalize_services_rend_une_liste_neuve():
+    a = ao.normalize_services("Pompiers;SAMU / Police.")
+    assert a == ["Pompiers", "SAMU", "Police"]
+    a.append("modifie")
+    assert ao.normalize_services("Pompiers;SAMU / Police.") == ["Pompiers", "SAMU", "Police"]
+
+
+def test_clean_operator_name_memoise():
+    ao.clean_operator_name.cache_clear()
+    for _ in range(3):
+        assert ao.clean_operator_name("martin paul [PC]") == "MARTIN Paul"
+    assert ao.clean_operator_name.cache_info().hits == 2
+    assert ao.clean_operator_name(None) == "Inconnu"
+
+
+def test_jours_en_francais_sans_locale():
+    df = ao._frame([_fiche(0, 0), _fiche(1, 60 * 24)])
+    assert list(ao._temporal_frame(df)["dow_name"]) == ["Jeudi", "Vendredi"]
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+import anoloc_collector as ac
+
+
+GROUPE = {"id": "secu", "label": "Secu", "icon": "shield", "color": "#f00",
+          "anoloc_device_ids": ["B1", "B2"]}
+
+
+def _frame(lat, lng, status="running", last_real="2026-06-13T10:00:00Z"):
+    return {"latitude": lat, "longitude": lng, "status": status,
+            "sent_at": "2026-06-13T10:00:30Z", "last_real_frame_sent_at": last_real}
+
+
+class _Horloge:
+    def __init__(self, debut):
+        self.t = debut
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def collecte(monkeypatch):
+    """collect_once sur une base en memoire, /live et l'heure pilotes."""
+    etat = {"live": {}}
+    horloge = _Horloge(datetime(2026, 6, 13, 12, 0, tzinfo=ac.TZ_LOCAL))
+    monkeypatch.setattr(ac, "get_live", lambda token: etat["live"])
+    monkeypatch.setattr(ac, "now_local", horloge)
+    db = FakeDb()
+    seen = {}
+    mapping = ac.build_device_to_group_map({"beacon_groups": [GROUPE]})
+
+    def cycle(live, logging_enabled=False):
+        etat["live"] = live
+        return ac.collect_once("tok", mapping, {}, db, logging_enabled=logging_enabled, seen=seen)
+
+    cycle.db, cycle.seen, cycle.horloge = db, seen, horloge
+    return cycle
+
+
+class TestCollectOnce:
+    def test_un_insert_many_et_un_bulk_write(self, collecte, monkeypatch):
+        appels = []
+        monkeypatch.setattr(ac, "write_cycle",
+                            lambda db, positions, ops: appels.append((len(positions), len(ops))))
+        collecte({"B1": _frame(47.9, 0.2), "B2": _frame(47.8, 0.1), "X": _frame(1, 1)})
+        assert appels == [(2, 2)]
+
+    def test_balise_inchangee_sautee(self, collecte):
+        collecte({"B1": _frame(47.9, 0.2), "B2": _frame(47.8, 0.1)})
+        collecte.horloge.t += timedelta(seconds=30)
+        stats = collecte({"B1": _frame(47.9, 0.2), "B2": _frame(47.81, 0.1)})
+        assert (stats["positions"], stats["skipped"]) == (1, 1)
+        assert [p["device_id"] for p in collecte.db["anoloc_positions"].docs] == ["B1", "B2", "B2"]
+        assert len(collecte.db["anoloc_latest"].docs) == 2
+
+    def test_changement_de_statut_ou_de_vraie_frame_reecrit(self, collecte):
+        # Immobile, mais une nouvelle vraie frame : anoloc.py deduit l'etat
+        # en ligne de son age, la sauter ferait passer la balise hors ligne.
+        collecte({"B1": _frame(47.9, 0.2)})
+        stats = collecte({"B1": _frame(47.9, 0.2, last_real="2026-06-13T10:01:00Z")})
+        assert stats["positions"] == 1
+        stats = collecte({"B1": _frame(47.9, 0.2, status="offline",
+                                       last_real="2026-06-13T10:01:00Z")})
+        assert stats["positions"] == 1
+        assert collecte.db["anoloc_latest"].docs[0]["status"] == "offline"
+
+    def test_balise_immobile_reecrite_apres_le_delai(self, collecte):
+        collecte({"B1": _frame(47.9, 0.2)})
+        collecte.horloge.t += timedelta(seconds=ac.LATEST_REFRESH_S + 1)
+        assert collecte({"B1": _frame(47.9, 0.2)})["positions"] == 1
+
+    def test_echec_mongo_ne_marque_pas_la_balise_vue(self, collecte, monkeypatch):
+        def panne(*args):
+            raise RuntimeError("mongo indisponible")
+        monkeypatch.setattr(ac, "write_cycle", panne)
+        with pytest.raises(RuntimeError):
+            collecte({"B1": _frame(47.9, 0.2)})
+        assert collecte.seen == {}
+
+    def test_latence_consignee_a_chaque_cycle(self, collecte):
+        collecte({"B1": _frame(47.9, 0.2)})
+        collecte({"B1": _frame(47.9, 0.2)}, logging_enabled=True)
+        logs = collecte.db["anoloc_logs"].docs
+        assert len(logs) == 2
+        for entree in logs:
+            assert set(entree["details"]["cycle"]) == {"positions", "skipped", "fetch_ms",
+                                                     "write_ms", "total_ms"}
+        assert "devices" not in logs[0]["details"]
+        assert logs[1]["details"]["devices"][0]["collected"] is False
+
+
+class TestLoadSeen:
+    def test_relu_depuis_anoloc_latest(self, collecte):
+        collecte({"B1": _frame(47.9, 0.2)})
+        # Relecture pymongo : datetimes naifs en UTC.
+        for doc in collecte.db["anoloc_latest"].docs:
+            for cle in ("collected_at", "last_real_at"):
+                doc[cle] = doc[cle].astimezone(timezone.utc).replace(tzinfo=None)
+        seen = ac.load_seen(collecte.db)
+        collecte.seen.clear()
+        collecte.seen.update(seen)
+        assert collecte({"B1": _frame(47.9, 0.2)})["skipped"] == 1
+
+
+class TestAuthenticate:
+    def test_token_en_cache_reutilise(self, monkeypatch):
+        connexions = []
+        monkeypatch.setattr(ac, "anoloc_login",
+                            lambda login, pwd: connexions.append(login) or "T%d" % len(connexions))
+        db = FakeDb()
+        assert ac.authenticate(db, "pco", "x") == "T1"
+        assert ac.authenticate(db, "pco", "x") == "T1"
+        assert ac.authenticate(db, "pco", "x", force=True) == "T2"
+        assert ac.authenticate(db, "autre", "x") == "T3"
+        assert connexions == ["pco", "pco", "autre"]
+
+    def test_session_http_partagee(self):
+        assert ac.http_session() is ac.http_session()
+        assert ac.http_session().headers["User-Agent"] == ac.USER_AGENT
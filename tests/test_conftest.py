@@ -9,6 +9,7 @@ Ces quelques tests verrouillent la partie du double qui vient de changer.
 from datetime import datetime, timezone
 
 import pytest
+from pymongo.errors import DuplicateKeyError
 
 from conftest import FakeDb
 
@@ -45,6 +46,13 @@ class TestEgaliteDesDatetimes:
         assert db["x"].find_one({"run_at": conscient})["n"] == 1
 
 
+class TestOu:
+    def test_or_retient_toute_branche_satisfaite(self):
+        db = FakeDb(x=[{"a": 1, "n": 1}, {"b": 5, "n": 2}, {"a": 0, "n": 3}])
+        trouves = db["x"].find({"$or": [{"a": 1}, {"b": {"$gte": 5}}]})
+        assert sorted(d["n"] for d in trouves) == [1, 2]
+
+
 class TestAggregate:
     def test_match_puis_group_compte_vraiment(self):
         # Verifie le travail reel du pipeline (filtrage + comptage par cle
@@ -143,3 +151,20 @@ class TestDeleteOne:
         db = FakeDb(x=[{"k": 1}, {"k": 1}])
         db["x"].delete_one({"k": 1})
         assert len(db["x"].docs) == 1
+
+
+class TestUpdateOneUpsert:
+    def test_upsert_n_insere_que_les_egalites_du_filtre(self):
+        db = FakeDb(x=[])
+        db["x"].update_one({"_id": "a", "max": {"$lt": 5}},
+                           {"$set": {"max": 5}}, upsert=True)
+        assert db["x"].docs == [{"_id": "a", "max": 5}]
+
+    def test_upsert_sur_un_id_existant_leve(self):
+        # Ce que fait Mongo (E11000) quand le filtre ecarte le document
+        # existant : peak_rollup s'appuie dessus pour ne jamais baisser un max.
+        db = FakeDb(x=[{"_id": "a", "max": 9}])
+        with pytest.raises(DuplicateKeyError):
+            db["x"].update_one({"_id": "a", "max": {"$lt": 5}},
+                               {"$set": {"max": 5}}, upsert=True)
+        assert db["x"].docs == [{"_id": "a", "max": 9}]
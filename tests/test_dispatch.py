@@ -0,0 +1,124 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+import dispatch
+from geo_index import haversine_m
+
+
+def _device(i, lat, lng, status="patrouille", battery=80, age_s=30, group="g1"):
+    return {
+        "_id": "d%d" % i, "name": "Tab %d" % i, "event": "24H", "year": "2026",
+        "status": status, "beacon_group_id": group,
+        "last_position": {"lat": lat, "lng": lng, "battery": battery,
+                          "ts": datetime.now(timezone.utc) - timedelta(seconds=age_s)},
+    }
+
+
+def _parc(n, seed=1):
+    rnd = random.Random(seed)
+    return [_device(i, 47.93 + rnd.uniform(0, 0.06), 0.18 + rnd.uniform(0, 0.08))
+            for i in range(n)]
+
+
+class TestDeviceIndex:
+    def test_identique_au_tri_brut(self):
+        parc = _parc(300)
+        index = dispatch.DeviceIndex(parc)
+        for lat, lng in [(47.95, 0.22), (47.93, 0.18), (48.2, 0.5)]:
+            attendu = sorted(parc, key=lambda d: haversine_m(
+                lat, lng, d["last_position"]["lat"], d["last_position"]["lng"]))[:7]
+            obtenu = [d for _, d in index.nearest(lat, lng, 7)]
+            assert [d["_id"] for d in obtenu] == [d["_id"] for d in attendu]
+
+    def test_moins_de_candidats_que_k(self):
+        index = dispatch.DeviceIndex(_parc(3) + [{"_id": "sans_position"}])
+        assert len(index.nearest(47.95, 0.22, 10)) == 3
+
+    def test_classement_rapide_sur_des_centaines(self):
+        index = dispatch.DeviceIndex(_parc(800))
+        accept = dispatch.make_filter()
+        t0 = time.perf_counter()
+        for _ in range(20):
+            index.nearest(47.95, 0.22, 5, accept)
+        assert (time.perf_counter() - t0) / 20 < 0.05
+
+
+class TestFiltres:
+    def test_statut_groupe_batterie_fraicheur(self):
+        parc = [
+            _device(0, 47.95, 0.22, status="intervention"),
+            _device(1, 47.9501, 0.22, battery=10),
+            _device(2, 47.9502, 0.22, group="g2"),
+            _device(3, 47.9503, 0.22, age_s=3600),
+            _device(4, 47.9504, 0.22),
+        ]
+        index = dispatch.DeviceIndex(parc)
+        accept = dispatch.make_filter(beacon_group="g1", min_battery=20)
+        assert [d["_id"] for _, d in index.nearest(47.95, 0.22, 5, accept)] == ["d4"]
+        accept = dispatch.make_filter(statuses=("patrouille", "intervention"))
+        ids = [d["_id"] for _, d in index.nearest(47.95, 0.22, 5, accept)]
+        assert ids == ["d0", "d1", "d2", "d4"]
+
+
+class TestDeviceIndexCache:
+    def test_une_lecture_par_ttl_et_par_evenement(self, monkeypatch):
+        db = FakeDb(field_devices=_parc(5) + [dict(_device(9, 47.95, 0.22), revoked=True)])
+        lectures = []
+        col = db["field_devices"]
+        find = col.find
+        monkeypatch.setattr(col, "find", lambda *a, **k: lectures.append(a) or find(*a, **k))
+        dispatch.reset_cache()
+        index = dispatch.device_index(db, "24H", 2026, now_ts=1000)
+        assert dispatch.device_index(db, "24H", "2026", now_ts=1004) is index
+        assert len(index.devices) == 5
+        dispatch.device_index(db, "24H", "2026", now_ts=1000 + dispatch.INDEX_TTL_S)
+        assert len(lectures) == 2
+        dispatch.reset_cache()
+
+
+class TestDispatchSuggest:
+    @pytest.fixture
+    def appel(self, monkeypatch):
+        from flask import Flask
+        import routing
+
+        db = FakeDb(
+            field_devices=[_device(0, 47.951, 0.22), _device(1, 47.949, 0.22),
+                           _device(2, 47.90, 0.22)],
+            pcorg=[{"_id": "f1", "event": "24H", "year": 2026,
+                    "gps": {"type": "Point", "coordinates": [0.22, 47.95]}}],
+        )
+        monkeypatch.setattr(routing, "_get_mongo_db", lambda: db)
+        # d0 est le plus pres a vol d'oiseau mais le plus long en voiture.
+        monkeypatch.setattr(routing, "travel_times", lambda s, t, god=False: (
+            [[600], [120], [None]][:len(s)], [[900], [300], [None]][:len(s)], "valhalla"))
+        dispatch.reset_cache()
+        app = Flask(__name__)
+
+        def appel(body):
+            with app.test_request_context(json=body, method="POST"):
+                return routing.dispatch_suggest.__wrapped__()
+        yield appel
+        dispatch.reset_cache()
+
+    def test_reclasse_au_temps_de_trajet(self, appel):
+        rep = appel({"fiche_id": "f1", "k": 3})
+        data = rep.get_json()
+        assert data["ok"] is True
+        assert [c["device_id"] for c in data["candidates"]] == ["d1", "d0", "d2"]
+        assert data["candidates"][0]["duration_s"] == 120
+        assert data["to"] == [47.95, 0.22]
+
+    def test_fiche_inconnue_et_statuts_invalides(self, appel):
+        assert appel({"fiche_id": "absente"})[1] == 404
+        assert appel({"fiche_id": "f1", "statuses": ["pause"]})[1] == 400
+
+    def test_fiche_id_non_chaine(self, appel):
+        # Un id numerique est lu comme sa forme texte, un objet est refuse
+        assert appel({"fiche_id": 42})[1] == 404
+        assert appel({"fiche_id": {"$ne": None}})[1] == 400
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+
+class _Ecrivain:
+    """Remplace le BufferedWriter : garde les points sans thread."""
+
+    def __init__(self):
+        self.points = []
+
+    def add_many(self, docs):
+        self.points.extend(docs)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    from flask import Flask
+    import field
+
+    db = FakeDb(
+        field_devices=[{
+            "_id": "tab1", "token_hash": field._hash_token("jeton"), "name": "Tab 1",
+            "event": "24H", "year": "2026", "status": "intervention",
+            "active_fiche_id": "f1",
+        }],
+        pcorg=[{"_id": "f1", "status_code": 2,
+                "gps": {"type": "Point", "coordinates": [0.2200, 47.9500]}}],
+    )
+    ecrivain = _Ecrivain()
+    monkeypatch.setattr(field, "_get_mongo_db", lambda: db)
+    monkeypatch.setattr(field, "_sweep_event_if_ended", lambda *a: False)
+    monkeypatch.setattr(field, "_history_writer", ecrivain)
+    field._fiche_gps_cache.clear()
+
+    app = Flask(__name__)
+    app.config["TESTING"] = True
+    app.register_blueprint(field.field_bp)
+    client = app.test_client()
+    client.set_cookie(field.FIELD_COOKIE_NAME, "jeton", path=field.FIELD_COOKIE_PATH)
+    return client, db, ecrivain
+
+
+def _device(db):
+    return db["field_devices"].find_one({"_id": "tab1"})
+
+
+def _ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+class TestFieldPosition:
+    def test_une_seule_ecriture_tablette_et_historique_en_file(self, env, monkeypatch):
+        client, db, ecrivain = env
+        appels = []
+        col = db["field_devices"]
+        update_one = col.update_one
+        monkeypatch.setattr(col, "update_one",
+                            lambda *a, **k: appels.append(a) or update_one(*a, **k))
+        # Loin de la fiche : pas de passage sur_place.
+        rep = client.post("/field/position", json={"lat": 47.96, "lng": 0.23, "battery": 80})
+        assert rep.status_code == 200
+        assert len(appels) == 1
+        maj = appels[0][1]["$set"]
+        assert maj["last_position"]["lat"] == 47.96
+        assert "last_seen" in maj and "last_ip" in maj
+        assert [p["device_id"] for p in ecrivain.points] == ["field:tab1"]
+        assert ecrivain.points[0]["battery_pct"] == 80
+
+    def test_coordonnees_invalides_400(self, env):
+        client, _db, ecrivain = env
+        assert client.post("/field/position", json={"lat": "x", "lng": 0}).status_code == 400
+        assert client.post("/field/position", json={"lat": 95, "lng": 0}).status_code == 400
+        assert ecrivain.points == []
+
+    def test_proximite_passe_sur_place(self, env):
+        client, db, _ = env
+        client.post("/field/position", json={"lat": 47.95001, "lng": 0.22001})
+        assert _device(db)["status"] == "sur_place"
+
+    def test_fiche_relue_une_fois_par_ttl(self, env, monkeypatch):
+        import field
+        client, db, _ = env
+        lectures = []
+        col = db["pcorg"]
+        find_one = col.find_one
+        monkeypatch.setattr(col, "find_one",
+                            lambda *a, **k: lectures.append(a) or find_one(*a, **k))
+        for _ in range(3):
+            client.post("/field/position", json={"lat": 47.96, "lng": 0.23})
+        assert len(lectures) == 1
+        field._forget_fiche_target("f1")
+        client.post("/field/position", json={"lat": 47.96, "lng": 0.23})
+        assert len(lectures) == 2
+
+    def test_fiche_close_pas_de_sur_place(self, env):
+        client, db, _ = env
+        db["pcorg"].update_one({"_id": "f1"}, {"$set": {"status_code": 10}})
+        client.post("/field/position", json={"lat": 47.95001, "lng": 0.22001})
+        assert _device(db)["status"] == "intervention"
+
+
+class TestFieldPositionsBatch:
+    def test_backlog_complet_avec_horodatage_tablette(self, env):
+        client, db, ecrivain = env
+        now = datetime.now(timezone.utc)
+        points = [{"lat": 47.96 + i * 0.001, "lng": 0.23, "ts": _ms(now - timedelta(minutes=10 - i))}
+                  for i in range(5)]
+        rep = client.post("/field/positions", json={"points": list(reversed(points))})
+        assert rep.get_json() == {"ok": True, "accepted": 5, "ignored": 0}
+        instants = [p["collected_at"] for p in ecrivain.points]
+        assert instants == sorted(instants)
+        assert _device(db)["last_position"]["lat"] == pytest.approx(47.964)
+
+    def test_points_hors_fenetre_ou_invalides_ignores(self, env):
+        client, _db, ecrivain = env
+        now = datetime.now(timezone.utc)
+        rep = client.post("/field/positions", json={"points": [
+            {"lat": 47.96, "lng": 0.23, "ts": _ms(now - timedelta(days=2))},
+            {"lat": 47.96, "lng": 0.23, "ts": _ms(now + timedelta(hours=1))},
+            {"lat": 47.96, "lng": 0.23},
+            {"lat": "x", "lng": 0.23, "ts": _ms(now)},
+            {"lat": 47.96, "lng": 0.23, "ts": _ms(now)},
+        ]})
+        assert rep.get_json() == {"ok": True, "accepted": 1, "ignored": 4}
+        assert len(ecrivain.points) == 1
+
+    def test_backlog_ne_recule_pas_la_position(self, env):
+        client, db, ecrivain = env
+        client.post("/field/position", json={"lat": 47.97, "lng": 0.23})
+        vieux = _ms(datetime.now(timezone.utc) - timedelta(minutes=30))
+        client.post("/field/positions", json={"points": [{"lat": 47.90, "lng": 0.23, "ts": vieux}]})
+        assert _device(db)["last_position"]["lat"] == 47.97
+        assert len(ecrivain.points) == 2
+
+    def test_lot_trop_gros_ou_vide_400(self, env):
+        import field
+        client, _db, _ = env
+        trop = [{"lat": 1, "lng": 1, "ts": 0}] * (field.POSITIONS_BATCH_MAX + 1)
+        assert client.post("/field/positions", json={"points": trop}).status_code == 400
+        assert client.post("/field/positions", json={"points": []}).status_code == 400
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+import geo_index
+
+
+def _brute(points, radius_m):
+    return [[j for j in range(len(points))
+             if j != i and geo_index.haversine_m(
+                 points[i][0], points[i][1],
+                 points[j][0], points[j][1]) <= radius_m]
+            for i in range(len(points))]
+
+
+class TestNeighboursWithin:
+    def test_identique_a_la_double_boucle(self):
+        rnd = random.Random(42)
+        points = [(47.938 + rnd.uniform(-0.03, 0.03),
+                   0.223 + rnd.uniform(-0.04, 0.04)) for _ in range(400)]
+        for rayon in (50, 500, 2000):
+            assert geo_index.neighbours_within(points, rayon) == \
+                _brute(points, rayon)
+
+    def test_voisin_juste_de_l_autre_cote_d_une_cellule(self):
+        # Deux points a 499 m, de part et d'autre d'une frontiere de cellule
+        # en longitude : c'est le cas que le bloc 3 x 3 doit couvrir.
+        grille = geo_index.GeoGrid(500, 48.0)
+        lon_frontiere = grille.dlon * 100
+        a = (47.938, lon_frontiere - 1e-9)
+        dlon = 499 / geo_index.haversine_m(47.938, 0.0, 47.938, 1.0)
+        b = (47.938, a[1] - dlon)
+        c = (47.938, a[1] + dlon)
+        assert geo_index.neighbours_within([a, b, c], 500) == \
+            [[1, 2], [0], [0]]
+
+    def test_voisins_tries_par_indice(self):
+        points = [(47.9, 0.2)] * 5
+        assert geo_index.neighbours_within(points, 10)[2] == [0, 1, 3, 4]
+
+    def test_flux_vide(self):
+        assert geo_index.neighbours_within([], 500) == []
+
+
+class TestGeoGrid:
+    def test_cellule_nulle_refusee(self):
+        with pytest.raises(ValueError):
+            geo_index.GeoGrid(0, 48.0)
+
+    def test_bbox_retrouvee_depuis_une_cellule_voisine(self):
+        # Un long segment est range dans toutes les cellules qu'il couvre :
+        # un point proche de son milieu le retrouve, meme loin des sommets.
+        grille = geo_index.GeoGrid(250, 48.0)
+        grille.add_bbox("axe", 47.90, 0.20, 47.90, 0.30)
+        assert "axe" in set(grille.near(47.901, 0.25))
+        assert "axe" not in set(grille.near(47.95, 0.25))
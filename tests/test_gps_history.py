@@ -0,0 +1,133 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+from conftest import FakeDb
+
+import gps_history as gh
+
+
+T0 = datetime(2026, 6, 13, 10, 0, tzinfo=timezone.utc)
+# ~1 m en latitude
+UN_METRE = 1 / 111195
+
+
+def _pt(lat, lng, i=0):
+    return {"lat": lat, "lng": lng, "collected_at": T0 + timedelta(seconds=30 * i)}
+
+
+def _ligne_droite(n):
+    return [_pt(47.95 + i * 10 * UN_METRE, 0.2, i) for i in range(n)]
+
+
+class TestSimplify:
+    def test_ligne_droite_reduite_a_ses_extremites(self):
+        points = _ligne_droite(500)
+        garde = gh.simplify(points, max_points=100, tolerance_m=1)
+        assert garde == [points[0], points[-1]]
+
+    def test_budget_respecte_extremites_et_ordre(self):
+        points = [_pt(47.95 + math.sin(i / 7) * 0.001, 0.2 + i * 0.0001, i) for i in range(2000)]
+        garde = gh.simplify(points, max_points=50)
+        assert len(garde) == 50
+        assert garde[0] is points[0] and garde[-1] is points[-1]
+        instants = [p["collected_at"] for p in garde]
+        assert instants == sorted(instants)
+
+    def test_le_virage_est_garde(self):
+        # Un aller-retour : sans le point de demi-tour, la trace disparait.
+        aller = [_pt(47.95 + i * 10 * UN_METRE, 0.2, i) for i in range(50)]
+        retour = [_pt(47.95 + (49 - i) * 10 * UN_METRE, 0.2 + 20 * UN_METRE, 50 + i) for i in range(50)]
+        garde = gh.simplify(aller + retour, max_points=4)
+        assert aller[-1] in garde or retour[0] in garde
+
+    def test_petite_trace_intacte_sans_tolerance(self):
+        points = _ligne_droite(10)
+        assert gh.simplify(points, max_points=400) == points
+
+
+class TestTrail:
+    def test_filtre_balise_fenetre_et_simplifie(self):
+        docs = [dict(p, device_id="B1") for p in _ligne_droite(300)]
+        docs.append(dict(_pt(47.0, 0.1, 1000), device_id="B1"))   # hors fenetre
+        docs.append(dict(_pt(47.0, 0.1, 5), device_id="B2"))      # autre balise
+        docs.append({"device_id": "B1", "lat": None, "lng": None,
+                     "collected_at": T0 + timedelta(seconds=45)})
+        db = FakeDb(anoloc_positions=docs)
+        points, bruts = gh.trail(db, "B1", T0, T0 + timedelta(hours=3), max_points=20, zoom=18)
+        assert bruts == 300
+        assert [p["lat"] for p in points] == [docs[0]["lat"], docs[299]["lat"]]
+
+    def test_zoom_fixe_la_tolerance_a_un_pixel(self):
+        assert gh.meters_per_pixel(0, 0) == gh._M_PAR_PX_Z0
+        assert round(gh.meters_per_pixel(18, 47.95), 2) == 0.4
+
+
+class _DbCreation:
+    """Juste ce que touche ensure_collection."""
+
+    def __init__(self, options=None):
+        self.options = options
+        self.commandes = []
+        self.col = FakeDb()[gh.COL_POSITIONS]
+
+    def list_collections(self, filter=None):
+        return [] if self.options is None else [{"name": gh.COL_POSITIONS, "options": self.options}]
+
+    def create_collection(self, nom, **kwargs):
+        self.commandes.append(("create", nom, kwargs))
+
+    def command(self, *args, **kwargs):
+        self.commandes.append(("command", args, kwargs))
+
+    def __getitem__(self, nom):
+        return self.col
+
+
+class TestEnsureCollection:
+    def test_creee_en_time_series_avec_retention(self):
+        db = _DbCreation()
+        assert gh.ensure_collection(db) == "timeseries"
+        (quoi, nom, kwargs), = db.commandes
+        assert kwargs["timeseries"]["metaField"] == "device_id"
+        assert kwargs["timeseries"]["timeField"] == "collected_at"
+        assert kwargs["expireAfterSeconds"] == int(gh.RETENTION.total_seconds())
+
+    def test_retention_realignee(self):
+        db = _DbCreation({"timeseries": {"timeField": "collected_at"}, "expireAfterSeconds": 1})
+        assert gh.ensure_collection(db) == "timeseries"
+        assert db.commandes[0][0] == "command"
+
+    def test_collection_ordinaire_laissee_en_place(self):
+        db = _DbCreation({})
+        assert gh.ensure_collection(db) == "plain"
+        assert db.commandes == []
+
+
+class TestBufferedWriter:
+    def test_flush_par_lots_non_ordonnes(self):
+        db = FakeDb()
+        lots = []
+        col = db[gh.COL_POSITIONS]
+        insert_many = col.insert_many
+        col.insert_many = lambda docs, ordered=True: lots.append((len(docs), ordered)) or insert_many(docs, ordered=ordered)
+        ecrivain = gh.BufferedWriter(lambda: db, batch=2)
+        ecrivain._thread = object()  # pas de thread : flush a la main
+        ecrivain.add_many([{"device_id": "d", "i": i} for i in range(5)])
+        assert ecrivain.pending() == 5
+        assert ecrivain.flush() == 5
+        assert lots == [(2, False), (2, False), (1, False)]
+        assert ecrivain.pending() == 0 and ecrivain.written == 5
+
+    def test_file_bornee_compte_les_pertes(self):
+        ecrivain = gh.BufferedWriter(lambda: FakeDb(), max_pending=3)
+        ecrivain._thread = object()
+        ecrivain.add_many([{"i": i} for i in range(5)])
+        assert ecrivain.pending() == 3 and ecrivain.dropped == 2
+
+    def test_echec_mongo_ne_leve_pas(self):
+        def db_en_panne():
+            raise RuntimeError("mongo down")
+        ecrivain = gh.BufferedWriter(db_en_panne)
+        ecrivain._thread = object()
+        ecrivain.add({"i": 1})
+        assert ecrivain.flush() == 0
@@ -0,0 +1,119 @@
+import os
+
+from bson.objectid import ObjectId
+from PIL import Image
+
+from conftest import FakeDb
+
+import image_service
+
+
+def _jpeg(path, size=(1280, 720)):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGB", size, (200, 30, 30)).save(path, "JPEG")
+    return path
+
+
+class TestChemins:
+    def test_resolution_sous_la_racine(self, tmp_path):
+        racine = str(tmp_path)
+        assert image_service.resolve(racine, "2026/06/a.jpg") == os.path.join(racine, "2026", "06", "a.jpg")
+        assert image_service.resolve(racine, os.path.join(racine, "a.jpg")) == os.path.join(racine, "a.jpg")
+        assert image_service.resolve(racine, "../hors.jpg") is None
+        assert image_service.resolve(racine, "/etc/passwd") is None
+        assert image_service.resolve(racine, "") is None
+
+    def test_largeurs_acceptees(self):
+        assert [image_service.parse_width(v) for v in ("160", "480", "300", "x", None)] == [
+            160, 480, None, None, None]
+
+    def test_cache_control(self):
+        assert image_service.cache_control(public=False) == "private, max-age=31536000, immutable"
+        assert image_service.cache_control(public=True, max_age=-5) == "public, max-age=0, immutable"
+
+
+class TestMiniatures:
+    def test_generee_une_fois_puis_reprise(self, tmp_path):
+        racine = str(tmp_path)
+        source = _jpeg(os.path.join(racine, "cam", "a.jpg"))
+        mini = image_service.derivative(racine, source, 160)
+        assert mini == os.path.join(racine, "_thumbs", "160", "cam", "a.jpg")
+        with Image.open(mini) as img:
+            assert img.size == (160, 90)
+        os.utime(mini, ns=(1, os.stat(source).st_mtime_ns + 10))
+        avant = os.stat(mini).st_mtime_ns
+        assert image_service.derivative(racine, source, 160) == mini
+        assert os.stat(mini).st_mtime_ns == avant
+        assert not [f for f in os.listdir(os.path.dirname(mini)) if f.endswith(".tmp")]
+
+    def test_regeneree_si_l_original_est_plus_recent(self, tmp_path):
+        racine = str(tmp_path)
+        source = _jpeg(os.path.join(racine, "a.jpg"))
+        mini = image_service.derivative(racine, source, 480)
+        os.utime(mini, ns=(1, 1))
+        image_service.derivative(racine, source, 480)
+        assert os.stat(mini).st_mtime_ns > 1
+
+    def test_original_deja_petit_ou_illisible(self, tmp_path):
+        racine = str(tmp_path)
+        petit = _jpeg(os.path.join(racine, "petit.jpg"), size=(120, 80))
+        assert image_service.derivative(racine, petit, 160) == petit
+        casse = os.path.join(racine, "casse.jpg")
+        with open(casse, "wb") as f:
+            f.write(b"pas une image")
+        assert image_service.derivative(racine, casse, 160) is None
+        assert image_service.derivative(racine, petit, 300) is None
+
+    def test_etag_change_avec_le_fichier(self, tmp_path):
+        source = _jpeg(os.path.join(str(tmp_path), "a.jpg"))
+        etag = image_service.file_etag(source)
+        assert image_service.derivative_etag(source, 160) == etag + "-w160"
+        os.utime(source, ns=(1, 1))
+        assert image_service.file_etag(source) != etag
+
+
+def _gridfs(oid, data, chunk=4):
+    morceaux = [{"_id": ObjectId(), "files_id": oid, "n": i, "data": data[o:o + chunk]}
+                for i, o in enumerate(range(0, len(data), chunk))]
+    return {"_id": oid, "length": len(data)}, morceaux
+
+
+class TestMigrationGridFS:
+    def _db(self):
+        oid_a, oid_b = ObjectId(), ObjectId()
+        fichier_a, morceaux_a = _gridfs(oid_a, b"0123456789")
+        fichier_b, morceaux_b = _gridfs(oid_b, b"abcdef")
+        db = FakeDb(**{
+            "hik_images.files": [fichier_a, fichier_b],
+            "hik_images.chunks": morceaux_b + morceaux_a,
+            "hik_anpr": [{"_id": 1, "plate_image_id": oid_a, "vehicle_image_id": oid_b,
+                          "plate_image_path": None, "vehicle_image_path": None}],
+        })
+        return db, oid_a, oid_b
+
+    def test_lecture_par_morceaux_dans_l_ordre(self):
+        db, oid_a, _ = self._db()
+        assert list(image_service.gridfs_chunks(db, oid_a)) == [b"0123", b"4567", b"89"]
+
+    def test_recopie_et_repointe_les_lectures(self, tmp_path):
+        db, oid_a, oid_b = self._db()
+        racine = str(tmp_path)
+        assert image_service.migrate_gridfs(db, root=racine, batch=1) == {
+            "migrated": 2, "failed": 0, "purged": 0}
+        rel_a = image_service.migrated_relpath(oid_a)
+        with open(os.path.join(racine, rel_a), "rb") as f:
+            assert f.read() == b"0123456789"
+        lecture = db["hik_anpr"].find_one({"_id": 1})
+        assert lecture["plate_image_path"] == rel_a
+        assert lecture["vehicle_image_path"] == image_service.migrated_relpath(oid_b)
+        # Deuxieme passage : rien a refaire
+        assert image_service.migrate_gridfs(db, root=racine)["migrated"] == 0
+
+    def test_purge_apres_migration(self, tmp_path):
+        db, _, _ = self._db()
+        racine = str(tmp_path)
+        image_service.migrate_gridfs(db, root=racine)
+        assert image_service.migrate_gridfs(db, root=racine, purge=True) == {
+            "migrated": 0, "failed": 0, "purged": 2}
+        assert db["hik_images.files"].find_one({}) is None
+        assert db["hik_images.chunks"].find_one({}) is None
@@ -0,0 +1,265 @@
+import copy
+
+import pytest
+
+import live_controle
+
+
+PAGE = """<TSData>
+  <Header><Version>HSHIF25</Version></Header>
+  <Inquiry Type="Transactions" NotComplete="0" MaxTransactionId="1003">
+    <Ticket>
+      <UTID>EWC123</UTID>
+      <Coding>270</Coding>
+      <Permission>
+        <UPID>P1</UPID>
+        <Transaction TransactionId="1001" Date="2026-06-13T10:02:11" Status="0" Validated="0">
+          <Venue ID="1" Name="Circuit" Entry="1"/>
+          <Area ID="10" Name="Enceinte generale" Entry="1"/>
+          <Gate ID="100" Name="Porte Nord"/>
+          <Checkpoint ID="1000" Name="Tripode 1"/>
+        </Transaction>
+      </Permission>
+    </Ticket>
+    <Ticket>
+      <UTID>BILLET9</UTID>
+      <Coding>270</Coding>
+      <Permission>
+        <UPID>P2</UPID>
+        <Transaction TransactionId="1002" Date="2026-06-13T10:03:40" Status="0" Validated="0">
+          <Venue ID="1" Name="Circuit"/>
+          <Area ID="10" Name="Enceinte generale" Exit="1"/>
+          <Gate ID="100" Name="Porte Nord"/>
+          <Checkpoint ID="1000" Name="Tripode 1"/>
+        </Transaction>
+        <Transaction TransactionId="1003" Date="2026-06-13T10:04:59" Status="105" Validated="1">
+          <Venue ID="1" Name="Circuit"/>
+          <Area ID="10" Name="Enceinte generale" Entry="1"/>
+          <Gate ID="100" Name="Porte Nord"/>
+          <Checkpoint ID="1001" Name="Tripode 2"/>
+        </Transaction>
+      </Permission>
+    </Ticket>
+  </Inquiry>
+</TSData>"""
+
+
+class _Enregistreur:
+    """Collection qui ne fait que retenir ses bulk_write."""
+
+    def __init__(self):
+        self.appels = []
+
+    def bulk_write(self, ops, ordered=True):
+        self.appels.append(list(ops))
+
+    def ops(self):
+        return [op for appel in self.appels for op in appel]
+
+
+@pytest.fixture
+def cols(monkeypatch):
+    out = {}
+    for nom in ("col_erreurs", "col_structure", "col_tx_agg", "col_agg_titres",
+                "col_presence_deltas", "col_presence", "col_presence_checkpoints"):
+        out[nom] = _Enregistreur()
+        monkeypatch.setattr(live_controle, nom, out[nom])
+    return out
+
+
+def _txs():
+    _, txs, _ = live_controle.parse_transactions(PAGE)
+    return txs
+
+
+class TestParseTransactions:
+    def test_record_compact_sans_document_complet_si_ok(self):
+        not_complete, txs, max_txid = live_controle.parse_transactions(PAGE)
+        assert (not_complete, max_txid) == (False, 1003)
+        assert [t.transaction_id for t in txs] == [1001, 1002, 1003]
+        ok = txs[0]
+        assert (ok.utid, ok.upid, ok.direction) == ("EWC123", "P1", "Entree")
+        assert (ok.checkpoint_id, ok.gate_name, ok.area_id) == (
+            "1000", "Porte Nord", "10")
+        assert ok.full is None
+        # Les erreurs gardent toujours leur document complet (hsh_erreurs).
+        assert txs[2].full["status"] == "105"
+        assert txs[2].full["checkpoint"] == {"ID": "1001", "Name": "Tripode 2"}
+
+    def test_full_rend_le_document_historique(self):
+        _, txs, _ = live_controle.parse_transactions(PAGE, full=True)
+        doc = txs[1].full
+        assert doc["utid"] == "BILLET9"
+        assert doc["upid"] == "P2"
+        assert doc["date_paris"] == "2026-06-13 10:03:40"
+        assert doc["direction"] == "Sortie"
+        assert doc["area"] == {"ID": "10", "Name": "Enceinte generale",
+                               "Exit": "1"}
+
+    def test_transaction_hors_ticket_et_max_txid_de_repli(self):
+        page = """<TSData><Inquiry Type="Transactions" NotComplete="1">
+          <Transaction TransactionId="77" Date="2026-06-13T11:00:00" Status="0">
+            <Checkpoint ID="5" Name="Tripode 5"/>
+          </Transaction>
+        </Inquiry></TSData>"""
+        not_complete, txs, max_txid = live_controle.parse_transactions(page)
+        assert (not_complete, max_txid) == (True, 77)
+        assert txs[0].utid is None
+        assert txs[0].checkpoint_id == "5"
+
+
+class TestTransactionSinks:
+    def test_une_bulk_write_par_collection_quel_que_soit_le_nombre_de_pages(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS",
+                                               {"BILLET9": "Pass Week-end"})
+        sinks.ingest(_txs())
+        sinks.ingest(_txs())
+        assert sinks.flush(verbose=False) == 6
+        for nom in cols:
+            assert len(cols[nom].appels) == 1, nom
+
+    def test_les_pages_s_additionnent_dans_la_meme_tranche(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS")
+        sinks.ingest(_txs())
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        par_id = {op._filter["_id"]: op._doc for op in cols["col_tx_agg"].ops()}
+        tripode1 = par_id["24H AUTOS_1000_20260613T1000"]["$inc"]
+        assert tripode1["ok"] == 4
+        assert tripode1["entrees"] == 2
+        assert tripode1["sorties"] == 2
+        # EWC = accredite : compte a part, en plus de entrees.
+        assert tripode1["entrees_accredites"] == 2
+        tripode2 = par_id["24H AUTOS_1001_20260613T1000"]["$inc"]
+        assert tripode2["erreurs"] == 2
+        assert tripode2["ok"] == 0
+
+    def test_seules_les_erreurs_vont_dans_hsh_erreurs(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS")
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        ops = cols["col_erreurs"].ops()
+        assert [op._filter["_id"] for op in ops] == ["24H_AUTOS_1003"]
+        doc = ops[0]._doc["$set"]
+        assert doc["status_label"] == "Ticket journee/longue duree expire"
+        assert doc["type_scan"] == "personne"
+        assert "collecte_timestamp" in doc
+
+    def test_arbre_fusionne_les_enfants_d_une_porte(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS")
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        par_id = {op._filter["_id"]: op._doc for op in cols["col_structure"].ops()}
+        porte = par_id["Gate_100"]
+        enfants = porte["$addToSet"]["enfants"]["$each"]
+        assert sorted(e["id"] for e in enfants) == ["1000", "1001"]
+        assert porte["$set"]["parent_area"] == {"id": "10",
+                                                "name": "Enceinte generale"}
+        # derniere_transaction : la derniere vue pour ce checkpoint.
+        cp = par_id["Checkpoint_1000"]["$set"]
+        assert cp["derniere_transaction"].strftime("%H:%M:%S") == "10:03:40"
+
+    def test_titres_ne_comptent_que_les_scans_valides(self, cols):
+        sinks = live_controle.TransactionSinks(
+            "24H AUTOS", "24H_AUTOS", {"BILLET9": "Pass Week-end"})
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        ops = cols["col_agg_titres"].ops()
+        assert len(ops) == 1
+        assert ops[0]._doc["$inc"] == {"entrees": 0, "sorties": 1}
+
+    def test_flush_vide_n_ecrit_rien(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS")
+        assert sinks.flush(verbose=False) == 0
+        assert all(not c.appels for c in cols.values())
+
+
+    def test_reprise_apres_echec_partiel_ne_recompte_pas(self, cols):
+        sinks = live_controle.TransactionSinks(
+            "24H AUTOS", "24H_AUTOS", {"BILLET9": "Pass Week-end"})
+        sinks.ingest(_txs())
+        titres = cols["col_agg_titres"]
+
+        def panne(ops, ordered=True):
+            raise RuntimeError("Mongo indisponible")
+        titres.bulk_write = panne
+        with pytest.raises(RuntimeError):
+            sinks.flush(verbose=False)
+        del titres.bulk_write
+        # Comme la branche except du resident : on retente le flush.
+        assert sinks.flush(verbose=False) == 3
+        assert len(cols["col_tx_agg"].appels) == 1
+        assert len(titres.appels) == 1
+        assert len(cols["col_presence_deltas"].appels) == 1
+
+
+class TestRegistrePresents:
+    def test_deltas_par_zone_et_solde_de_l_evenement(self, cols):
+        sinks = live_controle.TransactionSinks(
+            "24H AUTOS", "24H_AUTOS", {"BILLET9": "Pass Week-end"})
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        (delta,) = cols["col_presence_deltas"].ops()
+        assert delta._filter["_id"] == "24H AUTOS_10_20260613T1000"
+        # 1003 est en erreur : seules les deux transactions valides comptent.
+        assert delta._doc["$inc"] == {"entrees_accredite": 1,
+                                      "sorties_vehicule": 1}
+        assert delta._doc["$set"]["zone"] == "area_10"
+        (solde,) = cols["col_presence"].ops()
+        assert solde._doc["$inc"] == {"zones.area_10.entrees_accredite": 1,
+                                      "zones.area_10.sorties_vehicule": 1}
+        assert solde._doc["$max"]["max_tx_id"] == 1002
+        # Report sur les checkpoints deja figes apres cette tranche.
+        (correction,) = cols["col_presence_checkpoints"].ops()
+        assert correction._filter["at"] == {"$gt": delta._doc["$set"]["tranche"]}
+
+    def test_recollecte_ne_recompte_pas_les_transactions_deja_vues(self, cols):
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS",
+                                               presence_hwm=1001)
+        sinks.ingest(_txs())
+        sinks.flush(verbose=False)
+        (delta,) = cols["col_presence_deltas"].ops()
+        assert delta._doc["$inc"] == {"sorties_personne": 1}
+        # Les autres agregats, eux, ne changent pas de regle.
+        assert len(cols["col_tx_agg"].ops()) == 2
+
+    def test_ids_dans_le_desordre_au_sein_d_une_page(self, cols):
+        # Pages HSH groupees par Ticket : 101, 110 puis 105.
+        entree, sortie, _ = _txs()
+        tardive = copy.copy(entree)
+        entree.transaction_id, sortie.transaction_id, tardive.transaction_id = 101, 110, 105
+        sinks = live_controle.TransactionSinks("24H AUTOS", "24H_AUTOS",
+                                               {"BILLET9": "Pass Week-end"},
+                                               presence_hwm=100)
+        sinks.ingest([entree, sortie, tardive])
+        sinks.flush(verbose=False)
+        (delta,) = cols["col_presence_deltas"].ops()
+        assert delta._doc["$inc"] == {"entrees_accredite": 2,
+                                      "sorties_vehicule": 1}
+        (solde,) = cols["col_presence"].ops()
+        assert solde._doc["$max"]["max_tx_id"] == 110
+        # Le repere n'avance qu'au flush : la page suivante ne recompte pas.
+        assert sinks.presence_hwm == 110
+        sinks.ingest([tardive])
+        sinks.flush(verbose=False)
+        assert len(cols["col_presence_deltas"].ops()) == 1
+
+
+    def test_reprise_au_milieu_des_ecritures_de_presence(self, cols):
+        sinks = live_controle.TransactionSinks(
+            "24H AUTOS", "24H_AUTOS", {"BILLET9": "Pass Week-end"})
+        sinks.ingest(_txs())
+        checkpoints = cols["col_presence_checkpoints"]
+
+        def panne(ops, ordered=True):
+            raise RuntimeError("Mongo indisponible")
+        checkpoints.bulk_write = panne
+        with pytest.raises(RuntimeError):
+            sinks.flush(verbose=False)
+        del checkpoints.bulk_write
+        sinks.flush(verbose=False)
+        # Les deltas, deja ecrits, ne repartent pas ; la suite passe une fois.
+        assert len(cols["col_presence_deltas"].appels) == 1
+        assert len(checkpoints.appels) == 1
+        assert len(cols["col_presence"].appels) == 1
+        assert sinks.presence_hwm == 1002
@@ -0,0 +1,147 @@
+import json
+
+from conftest import FakeDb
+
+import live_push
+
+
+def _messages(sub):
+    out = []
+    while not sub._queue.empty():
+        brut = sub._queue.get_nowait()
+        event, data = brut.strip().split("\n")
+        out.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return out
+
+
+def _hub(db, **kw):
+    hub = live_push.Hub(lambda: db, **kw)
+    # Pas de thread de fond : les tests relisent a la main avec poll_once.
+    hub._demarrer = lambda: None
+    return hub
+
+
+def _fetch_alerts(db, params):
+    # Copies : comme pymongo, chaque lecture rend des documents neufs.
+    return [dict(d) for d in db["alerts"].find({})], None
+
+
+class TestCanalPartage:
+    def test_une_lecture_pour_tous_les_abonnes(self):
+        db = FakeDb(alerts=[{"_id": "a1", "slug": "x"}, {"_id": "a2", "slug": "y"}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        subs = [hub.subscribe([("alerts", {}, None)]) for _ in range(5)]
+        assert hub.poll_once(now=0) == 1
+        assert hub.fetches == 1
+        for sub in subs:
+            (event, data), = _messages(sub)
+            assert event == "snapshot"
+            assert data["order"] == ["a1", "a2"]
+        # Pas echu : aucune relecture
+        assert hub.poll_once(now=5) == 0
+        assert hub.fetches == 1
+
+    def test_abonne_tardif_recoit_le_snapshot_sans_relecture(self):
+        db = FakeDb(alerts=[{"_id": "a1"}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        hub.subscribe([("alerts", {}, None)])
+        hub.poll_once(now=0)
+        tard = hub.subscribe([("alerts", {}, None)])
+        assert [e for e, _ in _messages(tard)] == ["snapshot"]
+        assert hub.fetches == 1
+
+
+class TestDeltas:
+    def test_seuls_les_changements_sont_pousses(self):
+        db = FakeDb(alerts=[{"_id": "a1", "n": 1}, {"_id": "a2", "n": 1}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        sub = hub.subscribe([("alerts", {}, None)])
+        hub.poll_once(now=0)
+        _messages(sub)
+
+        hub.poll_once(now=10)
+        assert _messages(sub) == []
+
+        db["alerts"].update_one({"_id": "a1"}, {"$set": {"n": 2}})
+        db["alerts"].delete_one({"_id": "a2"})
+        db["alerts"].insert_one({"_id": "a3", "n": 1})
+        hub.poll_once(now=20)
+        (event, data), = _messages(sub)
+        assert event == "delta"
+        assert set(data["upsert"]) == {"a1", "a3"}
+        assert data["remove"] == ["a2"]
+        assert data["order"] == ["a1", "a3"]
+        assert "meta" not in data
+
+    def test_filtre_par_abonne(self):
+        db = FakeDb(alerts=[{"_id": "a1", "slug": "x"}, {"_id": "a2", "slug": "y"}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        tous = hub.subscribe([("alerts", {}, None)])
+        x_seul = hub.subscribe([("alerts", {}, lambda a: a["slug"] == "x")])
+        hub.poll_once(now=0)
+        assert _messages(tous)[0][1]["order"] == ["a1", "a2"]
+        assert list(_messages(x_seul)[0][1]["items"]) == ["a1"]
+
+        # a1 sort du filtre : retire pour l'abonne filtre, modifie pour l'autre
+        db["alerts"].update_one({"_id": "a1"}, {"$set": {"slug": "z"}})
+        hub.poll_once(now=10)
+        assert _messages(x_seul)[0][1]["remove"] == ["a1"]
+        assert list(_messages(tous)[0][1]["upsert"]) == ["a1"]
+        assert hub.fetches == 2
+
+
+class TestVersion:
+    def test_relecture_seulement_si_la_version_bouge(self):
+        db = FakeDb(alerts=[{"_id": "a1"}], versions=[{"_id": "v", "n": 1}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=5,
+                     version=lambda db_, p: db_["versions"].find_one({"_id": "v"})["n"],
+                     max_stale_s=60)
+        hub.subscribe([("alerts", {}, None)])
+        hub.poll_once(now=0)
+        hub.poll_once(now=5)
+        hub.poll_once(now=10)
+        assert hub.fetches == 1
+        db["versions"].update_one({"_id": "v"}, {"$set": {"n": 2}})
+        hub.poll_once(now=15)
+        assert hub.fetches == 2
+        # Version figee : relecture complete quand meme apres max_stale_s
+        hub.poll_once(now=80)
+        assert hub.fetches == 3
+
+    def test_notify_rend_le_canal_echu(self):
+        db = FakeDb(alerts=[{"_id": "a1"}])
+        hub = _hub(db)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        hub.subscribe([("alerts", {}, None)])
+        hub.poll_once(now=0)
+        assert hub.poll_once(now=1) == 0
+        hub.notify("alerts")
+        assert hub.poll_once(now=1) == 1
+
+
+class TestFlux:
+    def test_nombre_de_flux_borne(self):
+        hub = _hub(FakeDb(alerts=[]), max_streams=2)
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        a = hub.subscribe([("alerts", {}, None)])
+        assert hub.subscribe([("alerts", {}, None)]) is not None
+        assert hub.subscribe([("alerts", {}, None)]) is None
+        hub.unsubscribe(a)
+        assert hub.streams() == 1
+        assert hub.subscribe([("alerts", {}, None)]) is not None
+
+    def test_fin_du_generateur_libere_le_canal(self):
+        hub = _hub(FakeDb(alerts=[{"_id": "a1"}]))
+        hub.register("alerts", _fetch_alerts, key=lambda a: a["_id"], interval_s=10)
+        sub = hub.subscribe([("alerts", {}, None)])
+        hub.poll_once(now=0)
+        corps = list(sub.events(max_s=0.05, keepalive_s=0.01))
+        assert corps[0].startswith("retry:")
+        assert corps[1].startswith("event: snapshot")
+        assert hub.streams() == 0
+        assert hub.poll_once(now=100) == 0
@@ -0,0 +1,70 @@
+import threading
+from types import SimpleNamespace
+
+import metrics
+
+
+def _commande(request_id, name, coll, micros, echec=False):
+    debut = SimpleNamespace(request_id=request_id, command_name=name, database_name="titan",
+                            command={name: coll})
+    metrics.listener.started(debut)
+    fin = SimpleNamespace(request_id=request_id, duration_micros=micros)
+    if echec:
+        metrics.listener.failed(fin)
+    else:
+        metrics.listener.succeeded(fin)
+
+
+class TestListener:
+    def test_commandes_rattachees_a_la_requete_du_thread(self):
+        metrics.begin()
+        _commande(1, "find", "pcorg", 3000)
+        _commande(2, "aggregate", "hik_anpr", 120000)
+
+        # Un autre thread (autre requete, ou thread de fond) n'y touche pas
+        autre = threading.Thread(target=lambda: _commande(3, "find", "users", 1000))
+        autre.start()
+        autre.join()
+
+        duree_ms, commandes = metrics.end()
+        assert duree_ms >= 0
+        assert [(c[0], c[1], c[2]) for c in commandes] == [
+            ("find", "titan.pcorg", 3.0), ("aggregate", "titan.hik_anpr", 120.0)]
+
+    def test_hors_requete_rien_n_est_garde(self):
+        metrics.end()
+        _commande(1, "find", "pcorg", 3000)
+        assert metrics.end() == (None, [])
+
+
+class TestRegistry:
+    def test_agregats_par_route(self):
+        reg = metrics.Registry(slow_ms=1000)
+        for ms in range(1, 101):
+            reg.record("GET /api/x/<id>", "x", 200, float(ms), bytes_out=1000,
+                       commands=[("find", "titan.x", 1.0, False)] * 2)
+        reg.record("GET /api/x/<id>", "x", 500, 3.0)
+        (ligne,) = reg.snapshot()["routes"]
+        assert ligne["count"] == 101
+        assert ligne["errors_5xx"] == 1
+        assert ligne["p50_ms"] == 50.0
+        assert ligne["p99_ms"] == 99.0
+        assert ligne["histogram"]["5"] == 6
+        assert sum(ligne["histogram"].values()) == 101
+        assert ligne["mongo_commands_per_request"] == round(200 / 101, 2)
+        assert ligne["bytes_out_per_request"] == 990
+
+    def test_journal_des_requetes_lentes(self):
+        reg = metrics.Registry(slow_ms=500)
+        assert reg.record("GET /rapide", "r", 200, 20.0) is None
+        commandes = [("find", "titan.a", 10.0, False), ("aggregate", "titan.b", 400.0, False),
+                     ("find", "titan.a", 30.0, False)]
+        entree = reg.record("GET /lente", "l", 200, 800.0, commands=commandes)
+        assert entree["mongo_commands"] == 3
+        assert [(c["command"], c["collection"], c["count"]) for c in entree["top_commands"]] == [
+            ("aggregate", "titan.b", 1), ("find", "titan.a", 2)]
+        snap = reg.snapshot(sort="p95_ms")
+        assert [r["route"] for r in snap["routes"]] == ["GET /lente", "GET /rapide"]
+        assert snap["slow_requests"][0]["route"] == "GET /lente"
+        reg.reset()
+        assert reg.snapshot()["routes"] == []
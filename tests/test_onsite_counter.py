@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import FakeDb
+
+import anpr_ingest
+import onsite_counter as onsite
+
+
+def _lecture(i, h, camera="cam.a", direction="forward", plaque="AB123CD"):
+    return {"_id": i, "license_plate": plaque, "event_dt": datetime(2026, 6, 13, h),
+            "camera_path": camera, "direction": direction}
+
+
+def _db():
+    return FakeDb(hik_anpr=[_lecture(1, 8), _lecture(2, 9), _lecture(3, 9, direction="reverse"),
+                            _lecture(4, 10, plaque="UNKNOWN"),
+                            _lecture(5, 10, camera="cam-b")],
+                  anpr_camera_config=[{"camera_path": "cam-b", "forward_role": "exit"}])
+
+
+class TestCompteur:
+    def test_recalcul_puis_increments(self):
+        db = _db()
+        onsite.get(db)
+        p = onsite.payload(onsite.get(db))
+        assert (p["entries"], p["exits"], p["on_site"]) == (2, 2, 0)
+        assert [c["camera_path"] for c in p["cameras"]] == ["cam-b", "cam.a"]
+
+        db["hik_anpr"].insert_one(_lecture(6, 11))
+        db["hik_anpr"].insert_one(_lecture(7, 11, camera="cam-b", direction="reverse"))
+        assert onsite.fold(db) == 2
+        p = onsite.payload(onsite.get(db))
+        assert (p["entries"], p["exits"], p["on_site"]) == (4, 2, 2)
+        cam_b = next(c for c in p["cameras"] if c["camera_path"] == "cam-b")
+        assert (cam_b["entries"], cam_b["exits"]) == (1, 1)
+
+    def test_sans_compteur_le_repli_attend_le_recalcul(self):
+        db = _db()
+        onsite.fold(db)
+        assert db[onsite.COL].find_one({"_id": onsite.COUNTER_ID}) is None
+        # Le recalcul reprend tout l'historique, repere d'ingestion compris
+        assert onsite.get(db)["entries"] == 2
+        db["hik_anpr"].insert_one(_lecture(6, 11))
+        assert onsite.fold(db) == 1
+
+    def test_remise_a_zero_garde_la_periode_close(self):
+        db = _db()
+        onsite.get(db)
+        precedent = onsite.reset(db, now=datetime(2026, 6, 13, 10, 30))
+        assert precedent["entries"] == 2
+        (cliche,) = db[onsite.COL_SNAPSHOTS].find({})
+        assert cliche["ended_at"] == datetime(2026, 6, 13, 10, 30)
+        assert onsite.payload(onsite.get(db))["entries"] == 0
+        # Une lecture anterieure a la remise a zero, ingeree en retard, ne compte pas
+        db["hik_anpr"].insert_one(_lecture(6, 10))
+        db["hik_anpr"].insert_one(_lecture(7, 11))
+        onsite.fold(db)
+        assert onsite.payload(onsite.get(db))["entries"] == 1
+
+    def test_changement_de_configuration(self):
+        db = _db()
+        onsite.get(db)
+        db["anpr_camera_config"].update_one({"camera_path": "cam-b"},
+                                            {"$set": {"forward_role": "entry"}})
+        p = onsite.payload(onsite.rebuild(db))
+        assert (p["entries"], p["exits"]) == (3, 1)
+
+    def test_lot_en_vol_pendant_un_recalcul(self):
+        db = _db()
+        onsite.get(db)
+        db["hik_anpr"].insert_one(_lecture(6, 11))
+        # Le resident a lu la lecture 6, puis la route web recalcule...
+        lot = list(db["hik_anpr"].find({"_id": {"$gt": 5}}))
+        onsite.rebuild(db)
+        # ...et le lot arrive apres : deja comptee, elle ne l'est pas deux fois
+        assert onsite.record(db, lot) == 0
+        anpr_ingest.mark(db, onsite.STATE, 5)
+        assert db[anpr_ingest.COL_STATE].find_one({"_id": onsite.STATE})["last_id"] == 6
+        assert onsite.payload(onsite.get(db))["entries"] == 3
+
+    def test_lot_rejoue_apres_un_arret_ne_compte_pas_deux_fois(self, monkeypatch):
+        db = _db()
+        onsite.get(db)
+        db["hik_anpr"].insert_one(_lecture(6, 11))
+
+        def arret(db, name, last_id):
+            raise RuntimeError("arret avant l'avancee du repere")
+        monkeypatch.setattr(anpr_ingest, "mark", arret)
+        with pytest.raises(RuntimeError):
+            onsite.fold(db)
+        monkeypatch.undo()
+        onsite.fold(db)
+        assert onsite.payload(onsite.get(db))["entries"] == 3
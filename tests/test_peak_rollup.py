@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone
+
+from conftest import FakeDb
+
+import peak_rollup as pr
+
+
+T0 = datetime(2026, 4, 18, 13, 0)  # naif-UTC, comme pymongo le rend
+
+
+def _releve(current, instant, location="628"):
+    return {"requested_location_id": location, "current": current,
+            "timestamp": instant}
+
+
+def _tranches(db):
+    return {d["_id"]: (d["max"], d["max_ts"]) for d in db[pr.COL_PICS].docs
+            if d["_id"] != pr.BACKFILL_ID}
+
+
+class TestTranche:
+    def test_arrondi_au_quart_d_heure(self):
+        assert pr.tranche(datetime(2026, 4, 18, 13, 29, 59)) == datetime(2026, 4, 18, 13, 15)
+
+    def test_conscient_ramene_en_naif_utc(self):
+        paris = timezone(timedelta(hours=2))
+        assert pr.tranche(datetime(2026, 4, 18, 15, 7, tzinfo=paris)) == datetime(2026, 4, 18, 13, 0)
+
+    def test_tranche_suivante(self):
+        assert pr.tranche_suivante(T0) == T0
+        assert pr.tranche_suivante(T0 + timedelta(seconds=1)) == T0 + pr.TRANCHE
+
+
+class TestEnregistrer:
+    def test_garde_le_max_et_son_instant(self):
+        db = FakeDb()
+        pr.enregistrer(db, "628", "40000", T0 + timedelta(minutes=1))
+        pr.enregistrer(db, "628", "50690", T0 + timedelta(minutes=5))
+        pr.enregistrer(db, "628", "48000", T0 + timedelta(minutes=9))
+        assert _tranches(db) == {"628|2026-04-18T13:00": (50690, T0 + timedelta(minutes=5))}
+
+    def test_une_valeur_plus_basse_ne_baisse_jamais_le_max(self):
+        db = FakeDb()
+        pr.enregistrer(db, "628", "50690", T0)
+        pr.enregistrer(db, "628", "100", T0 + timedelta(minutes=1))
+        pr.enregistrer(db, "628", "50690", T0 + timedelta(minutes=2))
+        assert _tranches(db) == {"628|2026-04-18T13:00": (50690, T0)}
+
+    def test_valeurs_inconvertibles_ignorees(self):
+        db = FakeDb()
+        for brut in ("N/A", "", None):
+            pr.enregistrer(db, "628", brut, T0)
+        pr.enregistrer(db, "628", "12", None)
+        assert _tranches(db) == {}
+
+    def test_tranches_et_compteurs_separes(self):
+        db = FakeDb()
+        pr.enregistrer(db, "628", "10", T0)
+        pr.enregistrer(db, "628", "20", T0 + timedelta(minutes=15))
+        pr.enregistrer(db, 1156, "99", T0)
+        assert set(_tranches(db)) == {"628|2026-04-18T13:00", "628|2026-04-18T13:15",
+                                      "1156|2026-04-18T13:00"}
+
+
+class TestReplier:
+    def test_une_ecriture_par_tranche(self):
+        db = FakeDb()
+        n = pr.replier(db, [_releve(str(v), T0 + timedelta(minutes=m))
+                            for m, v in ((0, 10), (3, 30), (7, 20), (16, 5))])
+        assert n == 2
+        assert _tranches(db) == {
+            "628|2026-04-18T13:00": (30, T0 + timedelta(minutes=3)),
+            "628|2026-04-18T13:15": (5, T0 + timedelta(minutes=16)),
+        }
+
+    def test_idempotent_et_cumulatif_avec_le_collecteur(self):
+        # L'archivage replie des releves que le collecteur a deja vus : rien
+        # ne doit bouger, sauf si un releve bat la tranche.
+        db = FakeDb()
+        pr.enregistrer(db, "628", "30", T0 + timedelta(minutes=3))
+        releves = [_releve("30", T0 + timedelta(minutes=3)), _releve("45", T0 + timedelta(minutes=20))]
+        pr.replier(db, releves)
+        pr.replier(db, releves)
+        assert _tranches(db) == {
+            "628|2026-04-18T13:00": (30, T0 + timedelta(minutes=3)),
+            "628|2026-04-18T13:15": (45, T0 + timedelta(minutes=20)),
+        }
+
+
+class TestPic:
+    def test_max_sur_la_plage(self):
+        db = FakeDb()
+        pr.replier(db, [_releve("10", T0), _releve("70", T0 + timedelta(hours=1)),
+                        _releve("99", T0 + timedelta(days=30)),
+                        _releve("500", T0, location="1156")])
+        assert pr.pic(db, "628", T0, T0 + timedelta(days=1)) == (70, T0 + timedelta(hours=1))
+        assert pr.pic(db, "628", T0 + timedelta(days=2), T0 + timedelta(days=3)) == (None, None)
+
+    def test_marqueur_de_backfill(self):
+        db = FakeDb()
+        assert pr.est_complet(db) is False
+        pr.marquer_backfill(db, ["data_access"])
+        assert pr.est_complet(db) is True
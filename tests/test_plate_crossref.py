@@ -0,0 +1,153 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask
+
+from conftest import FakeCollection, FakeDb
+
+import anpr
+import anpr_ingest
+import plate_crossref as crossref
+
+
+def _lecture(i, plaque, heure, camera="cam-a"):
+    return {"_id": i, "license_plate": plaque, "event_dt": datetime(2026, 6, 13, heure),
+            "camera_path": camera}
+
+
+def _vision(plaque_norm, lieu, evenement="24H", annee=2026):
+    return {"plaque": plaque_norm, "plaque_norm": plaque_norm, "lieu": lieu,
+            "billets": ["b1", "b2"], "commentaire": "", "date": "2026-06-12",
+            "evenement": evenement, "annee": annee}
+
+
+class TestLapi:
+    def test_repli_incremental_et_derniere_camera(self):
+        db = FakeDb(hik_anpr=[_lecture(1, "AB-123-CD", 10, "cam-a"),
+                              _lecture(2, "UNKNOWN", 11),
+                              _lecture(3, "AB123CD", 8, "cam-b")])
+        assert crossref.fold_anpr(db, batch=2) == 3
+        fiche = db["plate_crossref"].find_one({"_id": "AB123CD"})
+        assert fiche["anpr_count"] == 2
+        assert fiche["anpr_first_seen"] == datetime(2026, 6, 13, 8)
+        assert fiche["anpr_last_seen"] == datetime(2026, 6, 13, 10)
+        # La lecture de 8 h, repliee apres, ne deplace pas la derniere camera
+        assert fiche["anpr_last_camera"] == "cam-a"
+        assert db["plate_crossref"].find_one({"_id": "UNKNOWN"}) is None
+
+        db["hik_anpr"].insert_one(_lecture(4, "AB123CD", 12, "cam-c"))
+        assert crossref.fold_anpr(db) == 1
+        fiche = db["plate_crossref"].find_one({"_id": "AB123CD"})
+        assert (fiche["anpr_count"], fiche["anpr_last_camera"]) == (3, "cam-c")
+        assert crossref.fold_anpr(db) == 0
+
+    def test_lot_rejoue_apres_un_arret_ne_compte_pas_deux_fois(self, monkeypatch):
+        db = FakeDb(hik_anpr=[_lecture(1, "AB123CD", 9), _lecture(2, "AB123CD", 10)])
+
+        def arret(db, name, last_id):
+            raise RuntimeError("arret avant l'avancee du repere")
+        monkeypatch.setattr(anpr_ingest, "mark", arret)
+        with pytest.raises(RuntimeError):
+            crossref.fold_anpr(db)
+        monkeypatch.undo()
+        assert crossref.fold_anpr(db) == 2
+        assert db["plate_crossref"].find_one({"_id": "AB123CD"})["anpr_count"] == 2
+
+
+class TestCroisement:
+    def test_plaques_croisees_et_fiche_vision_par_evenement(self):
+        db = FakeDb(hik_anpr=[_lecture(1, "AB123CD", 10), _lecture(2, "ZZ999ZZ", 10)])
+        crossref.fold_anpr(db)
+        crossref.record_vision(db, [_vision("AB123CD", "P1"), _vision("QQ111QQ", "P2"),
+                                    _vision("AB123CD", "P9", annee=2025)])
+        assert crossref.cross_plates(db) == ["AB123CD"]
+        assert crossref.cross_plates(db, since=datetime(2026, 6, 14)) == []
+
+        fiches = crossref.lookup(db, ["ab-123-cd", "QQ111QQ", "XX"])
+        assert sorted(fiches) == ["AB123CD", "QQ111QQ"]
+        assert crossref.vision_for_event(fiches["AB123CD"], "24H", 2026)["lieu"] == "P1"
+        assert crossref.vision_for_event(fiches["AB123CD"], "24H", 2025)["billets_count"] == 2
+        assert crossref.vision_for_event(fiches["QQ111QQ"], "GPF", 2026) is None
+
+    def test_blacklist_alignee_sur_la_source(self):
+        db = FakeDb()
+        crossref.sync_blacklist(db, {"AB123CD": {"raison": "x"}, "GH456AB": {"raison": "y"}})
+        crossref.sync_blacklist(db, {"GH456AB": {"raison": "y"}})
+        assert db["plate_crossref"].find_one({"_id": "AB123CD"})["blacklisted"] is False
+        assert db["plate_crossref"].find_one({"_id": "GH456AB"})["blacklisted"] is True
+        # Une blacklist lue vide ne leve pas tous les drapeaux
+        crossref.sync_blacklist(db, {})
+        assert db["plate_crossref"].find_one({"_id": "GH456AB"})["blacklisted"] is True
+
+    def test_reconstruction(self):
+        db = FakeDb(hik_anpr=[_lecture(1, "AB123CD", 10)],
+                    vision_immatriculations=[_vision("AB123CD", "P1")],
+                    vision_blacklist=[{"plaque_norm": "AB123CD", "raison": "r"}],
+                    cockpit_anpr_watchlist=[{"plate": "AB-123-CD", "enabled": True}])
+        assert crossref.rebuild(db) == {"anpr": 1, "vision": 1, "watchlist": 1}
+        resume = crossref.summary(crossref.lookup(db, ["AB123CD"])["AB123CD"])
+        assert resume == {"anpr_count": 1, "last_seen": datetime(2026, 6, 13, 10),
+                          "last_camera": "cam-a", "vision_lieu": "P1", "blacklisted": True}
+
+    def test_reprise_de_l_ancien_repere(self):
+        db = FakeDb(hik_anpr=[_lecture(1, "AB123CD", 9), _lecture(2, "AB123CD", 10)],
+                    plate_crossref_state=[{"_id": "anpr", "last_id": 1}])
+        assert anpr_ingest.migrate_legacy_state(db) is True
+        assert "plate_crossref_state" not in db.list_collection_names()
+        # Seule la lecture posterieure a l'ancien repere est repliee
+        assert crossref.fold_anpr(db) == 1
+        assert anpr_ingest.migrate_legacy_state(db) is False
+
+
+class _Lapi(FakeCollection):
+    """hik_anpr qui note chaque appel : le mode croise ne doit pas la
+    parcourir en dehors de la requete finale."""
+
+    def __init__(self, docs):
+        super().__init__(docs)
+        self.appels = []
+
+    def find(self, query=None, projection=None):
+        self.appels.append(("find", query))
+        return super().find(query, projection)
+
+    def count_documents(self, query=None):
+        self.appels.append(("count_documents", query))
+        return super().count_documents(query)
+
+    def distinct(self, key, query=None):
+        self.appels.append(("distinct", query))
+        return sorted({d.get(key) for d in self._matching(query)} - {None})
+
+
+class TestRechercheCroisee:
+    def _rechercher(self, monkeypatch, args):
+        fiches = [dict(_vision("AB123CD", "P1"), _id=1), dict(_vision("GH456AB", "P2"), _id=2)]
+        db = FakeDb(hik_anpr=[_lecture(1, "AB123CD", 10, camera="cam-a"),
+                              _lecture(2, "GH456AB", 11, camera="cam-b")],
+                    vision_immatriculations=fiches)
+        crossref.fold_anpr(db)
+        crossref.record_vision(db, fiches)
+        for d in db["hik_anpr"].docs:
+            d["plate_norm"] = d["license_plate"]
+        lapi = _Lapi(db["hik_anpr"].docs)
+        db._cols["hik_anpr"] = lapi
+        for nom, col in (("_db", db), ("_col_anpr", lapi),
+                         ("_col_camera_config", db["anpr_camera_config"]),
+                         ("_col_vision_imm", db["vision_immatriculations"])):
+            monkeypatch.setattr(anpr, nom, col)
+        with Flask(__name__).test_request_context("/api/anpr/search", query_string=args):
+            return anpr.anpr_search().get_json(), lapi.appels
+
+    def test_sans_filtre_seule_la_requete_finale(self, monkeypatch):
+        res, appels = self._rechercher(monkeypatch, {"source": "cross"})
+        assert res["total"] == 4
+        assert [nom for nom, _ in appels] == ["count_documents", "find"]
+        assert "$and" in appels[0][1]
+
+    def test_filtre_lapi_restreint_aussi_la_vision(self, monkeypatch):
+        res, appels = self._rechercher(monkeypatch, {"source": "cross", "camera": "cam-a"})
+        assert sorted(r["plate"] for r in res["results"]) == ["AB123CD", "AB123CD"]
+        # Le rapprochement reste borne aux plaques croisees (index plate_norm)
+        assert appels[0][0] == "distinct"
+        assert "license_plate" not in appels[0][1]
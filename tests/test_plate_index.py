@@ -0,0 +1,61 @@
+from conftest import FakeDb
+
+import plate_index
+
+
+def _lectures():
+    return [
+        {"_id": 1, "license_plate": "AB123CD"},
+        {"_id": 2, "license_plate": "GH-456-AB"},
+        {"_id": 3, "license_plate": "UNKNOWN"},
+        {"_id": 4, "license_plate": "XAB1Z12"},
+    ]
+
+
+class TestCles:
+    def test_normalisation_et_trigrammes(self):
+        assert plate_index.normalize_plate(" ab-123 cd ") == "AB123CD"
+        assert plate_index.plate_grams("AB12") == ["AB1", "B12"]
+        assert plate_index.plate_grams("AB") == []
+        assert plate_index.anpr_fields("UNKNOWN") == {"plate_norm": "UNKNOWN", "plate_grams": []}
+
+    def test_fragment_vide(self):
+        assert plate_index.fragment_filter(" - ") is None
+
+
+class TestRecherche:
+    def test_fragment_par_trigrammes_puis_contiguite(self):
+        db = FakeDb(hik_anpr=_lectures())
+        plate_index.backfill(db)
+        trouves = db["hik_anpr"].find(plate_index.fragment_filter("ab12"))
+        # XAB1Z12 porte AB1 et B12 sans contenir AB12 : la regex l'ecarte
+        assert [d["_id"] for d in trouves] == [1]
+        courts = db["hik_anpr"].find(plate_index.fragment_filter("AB"))
+        assert sorted(d["_id"] for d in courts) == [1, 2, 4]
+
+    def test_documents_pas_encore_completes(self):
+        db = FakeDb(hik_anpr=_lectures())
+        trouves = db["hik_anpr"].find(plate_index.fragment_filter("AB12"))
+        assert [d["_id"] for d in trouves] == [1]
+        exacts = db["hik_anpr"].find(plate_index.exact_filter(["AB-123-CD"]))
+        assert [d["_id"] for d in exacts] == [1]
+
+    def test_plaque_exacte_apres_rattrapage(self):
+        db = FakeDb(hik_anpr=_lectures())
+        plate_index.backfill(db)
+        trouves = db["hik_anpr"].find(plate_index.exact_filter(["GH456AB"]))
+        assert [d["_id"] for d in trouves] == [2]
+
+
+class TestRattrapage:
+    def test_par_lots_jusqu_au_bout(self):
+        db = FakeDb(hik_anpr=_lectures(),
+                    vision_immatriculations=[{"_id": "v1", "plaque_norm": "AB123CD"},
+                                             {"_id": "v2", "plaque_norm": "ZZ1",
+                                              "plaque_grams": ["ZZ1"]}])
+        assert plate_index.backfill(db, batch=3) == {"hik_anpr": 4, "vision_immatriculations": 1}
+        assert db["hik_anpr"].find_one({"_id": 2})["plate_norm"] == "GH456AB"
+        assert db["vision_immatriculations"].find_one({"_id": "v1"})["plaque_grams"] == [
+            "123", "23C", "3CD", "AB1", "B12"]
+        # Rien a refaire au passage suivant
+        assert plate_index.backfill(db) == {"hik_anpr": 0, "vision_immatriculations": 0}
@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+import presence_ledger as pl
+
+EVT = "24H AUTOS"
+
+
+def _t(texte):
+    return pl.instant_hsh(texte)
+
+
+def _delta(hhmm, zone="area_10", name="ENCEINTE GENERALE", **compteurs):
+    doc = {"evenement": EVT, "zone": zone, "area_id": zone[5:],
+           "area_name": name, "tranche": _t("2026-06-13 " + hhmm)}
+    doc.update({c: 0 for c in pl.COMPTEURS})
+    doc.update(compteurs)
+    return doc
+
+
+def _tx(hhmm_ss, direction="Entree", utid="T1", area_id="10",
+        name="ENCEINTE GENERALE", status="0"):
+    return {"status": status, "direction": direction, "utid": utid,
+            "upid": None, "area": {"ID": area_id, "Name": name},
+            "date_paris": "2026-06-13 " + hhmm_ss}
+
+
+def _db(deltas, forensic=(), solde=None):
+    return FakeDb(**{
+        pl.COL_DELTAS: deltas,
+        pl.COL_CHECKPOINTS: [],
+        pl.COL_SOLDES: [solde] if solde else [],
+        "handshake_forensic": list(forensic),
+        "access_barcodes_utids": [{"utid": "V1", "title": "Parking P1"}],
+    })
+
+
+class TestCheckpoints:
+    def test_cumul_fige_jusqu_a_la_derniere_tranche_entamee(self):
+        db = _db([_delta("10:00", entrees_personne=5),
+                  _delta("10:05", entrees_personne=3, sorties_personne=1),
+                  _delta("10:15", entrees_vehicule=2)])
+        assert pl.ecrire_checkpoints(db, EVT) == 4
+        cks = {d["at"].strftime("%H:%M"): d["zones"].get("area_10")
+               for d in db[pl.COL_CHECKPOINTS].docs}
+        # La tranche 10:15 n'est pas figee : aucun checkpoint en 10:20.
+        assert sorted(cks) == ["10:00", "10:05", "10:10", "10:15"]
+        assert cks["10:00"] is None
+        assert cks["10:05"]["entrees_personne"] == 5
+        assert cks["10:15"]["entrees_personne"] == 8
+        assert cks["10:15"]["sorties_personne"] == 1
+        assert cks["10:15"]["entrees_vehicule"] == 0
+
+    def test_reprise_depuis_le_dernier_checkpoint(self):
+        db = _db([_delta("10:00", entrees_personne=5),
+                  _delta("10:05", entrees_personne=3)])
+        pl.ecrire_checkpoints(db, EVT)
+        assert pl.ecrire_checkpoints(db, EVT) == 0
+        db[pl.COL_DELTAS].docs.append(_delta("10:10", entrees_enfant=1))
+        assert pl.ecrire_checkpoints(db, EVT) == 1
+        dernier = max(db[pl.COL_CHECKPOINTS].docs, key=lambda d: d["at"])
+        assert dernier["at"] == _t("2026-06-13 10:10")
+        assert dernier["zones"]["area_10"]["entrees_personne"] == 8
+
+
+class TestPresents:
+    def test_frontiere_de_tranche_sans_rejeu(self):
+        db = _db([_delta("10:00", entrees_personne=5, entrees_vehicule=2),
+                  _delta("10:05", sorties_personne=1),
+                  _delta("10:10", entrees_personne=100)])
+        pl.ecrire_checkpoints(db, EVT)
+        res = pl.presents(db, EVT, instant=_t("2026-06-13 10:09:59"),
+                          depuis=_t("2026-06-13 00:00"))
+        zone = res["zones"]["area_10"]
+        assert res["methode"] == "checkpoint"
+        assert res["checkpoint"] == "2026-06-13 10:10"
+        assert res["rejeu"] == 0
+        assert zone["presents"] == {"personne": 4, "vehicule": 2,
+                                    "enfant": 0, "accredite": 0}
+        assert zone["total"] == 6
+        assert zone["personnes"] == 4
+
+    def test_rejeu_court_entre_le_checkpoint_et_l_instant(self):
+        forensic = [_tx("10:10:30"), _tx("10:11:00", utid="V1"),
+                    _tx("10:12:00", direction="Sortie"),
+                    _tx("10:12:30", status="105"),
+                    _tx("10:14:00")]
+        db = _db([_delta("10:00", entrees_personne=5),
+                  _delta("10:10", entrees_personne=3, entrees_vehicule=1)],
+                 forensic)
+        pl.ecrire_checkpoints(db, EVT)
+        res = pl.presents(db, EVT, instant=_t("2026-06-13 10:12:00"),
+                          depuis=_t("2026-06-13 00:00"))
+        zone = res["zones"]["area_10"]
+        assert res["rejeu"] == 3
+        assert zone["entrees_personne"] == 6
+        assert zone["sorties_personne"] == 1
+        assert zone["entrees_vehicule"] == 1
+
+    def test_depuis_retranche_le_cumul_anterieur(self):
+        db = _db([_delta("05:55", entrees_personne=50),
+                  _delta("06:00", entrees_personne=5),
+                  _delta("06:05", entrees_personne=1)])
+        pl.ecrire_checkpoints(db, EVT)
+        res = pl.presents(db, EVT, instant=_t("2026-06-13 06:04:59"),
+                          depuis=_t("2026-06-13 06:00"), source_rejeu=None)
+        assert res["zones"]["area_10"]["entrees_personne"] == 5
+
+    def test_apres_la_derniere_transaction_le_solde_fait_foi(self):
+        solde = {"_id": EVT, "evenement": EVT,
+                 "derniere_transaction": datetime(2026, 6, 13, 10, 12),
+                 "zones": {"area_10": {"name": "ENCEINTE GENERALE",
+                                       "entrees_personne": 42,
+                                       "sorties_personne": 2}}}
+        db = _db([], solde=solde)
+        res = pl.presents(db, EVT, instant=_t("2026-06-13 10:30"),
+                          depuis=_t("2026-06-12 00:00"))
+        assert res["methode"] == "solde"
+        assert res["zones"]["area_10"]["presents"]["personne"] == 40
+
+    def test_filtre_de_zone_par_nom(self):
+        db = _db([_delta("10:00", entrees_personne=5),
+                  _delta("10:00", zone="area_11", name="PADDOCK",
+                         entrees_accredite=2),
+                  _delta("10:05")])
+        pl.ecrire_checkpoints(db, EVT)
+        res = pl.presents(db, EVT, instant=_t("2026-06-13 10:04:59"),
+                          zone="PADDOCK", source_rejeu=None)
+        assert list(res["zones"]) == ["area_11"]
+        assert res["zones"]["area_11"]["presents"]["accredite"] == 2
+
+
+def test_instant_invalide():
+    with pytest.raises(ValueError):
+        pl.instant_hsh("13/06/2026 10:00")
+
+
+def test_maintenant_en_heure_de_paris():
+    ete = datetime(2026, 6, 13, 8, 0, tzinfo=timezone.utc)
+    assert pl.maintenant_hsh(ete) == _t("2026-06-13 10:00")
@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import FakeDb
+
+import routing
+import routing_overrides
+
+
+_REPONSE = {"trip": {"summary": {"length": 1.2, "time": 180},
+                     "legs": [{"shape": "_c`|@_c`|@"}]}}
+
+
+@pytest.fixture
+def valhalla(monkeypatch):
+    """Valhalla et waze_alerts simules ; rend la liste des appels /route."""
+    appels = []
+    alertes = []
+
+    def call(from_pt, to_pt, waypoints, god, avoids):
+        appels.append((from_pt, to_pt, god, len(avoids)))
+        return _REPONSE, None
+
+    monkeypatch.setattr(routing, "_call_valhalla", call)
+    monkeypatch.setattr(routing, "_get_recent_waze_alerts", lambda: list(alertes))
+    monkeypatch.setattr(routing_overrides, "_get_all_active", lambda: [])
+    routing.reset_route_cache()
+    yield appels, alertes
+    routing.reset_route_cache()
+
+
+def _alerte(lat, lon, type_="ACCIDENT"):
+    return {"type": type_, "location": {"x": lon, "y": lat}}
+
+
+class TestRouteCache:
+    def test_meme_cellule_sert_le_cache(self, valhalla):
+        appels, _ = valhalla
+        out1, _ = routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        out2, _ = routing._compute((47.95003, 0.22003), (47.96002, 0.23), [], False)
+        assert len(appels) == 1
+        assert out2["cached"] is True and "cached" not in out1
+        assert out2["polyline"] == out1["polyline"]
+
+    def test_mode_et_cellules_distinctes(self, valhalla):
+        appels, _ = valhalla
+        routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        routing._compute((47.95, 0.22), (47.96, 0.23), [], True)
+        routing._compute((47.95, 0.22), (47.97, 0.23), [], False)
+        routing._compute((47.95, 0.22), (47.96, 0.23), [[47.955, 0.225]], False)
+        assert len(appels) == 4
+
+    def test_changement_d_overrides_invalide(self, valhalla, monkeypatch):
+        appels, _ = valhalla
+        routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        monkeypatch.setattr(routing_overrides, "_get_all_active",
+                            lambda: [{"_id": "a", "type": "force_open", "lat": 47.9, "lon": 0.2}])
+        routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        assert len(appels) == 2
+
+    def test_nouveau_snapshot_waze_invalide(self, valhalla, monkeypatch):
+        appels, alertes = valhalla
+        routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        alertes.append(_alerte(47.955, 0.225))
+        monkeypatch.setattr(routing, "WAZE_REFRESH_S", 0)
+        out, _ = routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        assert len(appels) == 2
+        assert out["waze_avoided"] == 1
+
+    def test_waze_relu_au_plus_une_fois_par_periode(self, valhalla, monkeypatch):
+        lectures = []
+        monkeypatch.setattr(routing, "_get_recent_waze_alerts",
+                            lambda: lectures.append(1) or [])
+        for lat in (47.90, 47.91, 47.92):
+            routing._compute((lat, 0.22), (47.96, 0.23), [], False)
+        assert len(lectures) == 1
+
+    def test_stub_pas_mis_en_cache(self, valhalla, monkeypatch):
+        monkeypatch.setattr(routing, "_call_valhalla",
+                            lambda *a: (None, "valhalla_unreachable"))
+        out, _ = routing._compute((47.95, 0.22), (47.96, 0.23), [], False)
+        assert out["engine"] == "stub"
+        assert len(routing._route_cache) == 0
+
+
+class TestOverridesVersion:
+    @pytest.fixture
+    def docs(self, monkeypatch):
+        docs = [{"_id": "a", "active": True, "type": "block_point", "lat": 47.9, "lon": 0.2},
+                {"_id": "b", "active": True,
+                 "expires_at": datetime.now(timezone.utc) + timedelta(hours=1)}]
+        db = FakeDb(routing_overrides=docs)
+        monkeypatch.setattr(routing_overrides, "_get_mongo_db", lambda: db)
+        monkeypatch.setattr(routing_overrides, "_ensure_indexes", lambda db: None)
+        monkeypatch.setattr(routing_overrides, "CACHE_TTL_S", 0)
+        routing_overrides._bump_cache()
+        return docs
+
+    def test_expiration_change_la_version(self, docs):
+        v1 = routing_overrides.overrides_version()
+        assert routing_overrides.overrides_version() == v1
+        docs[1]["expires_at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+        assert routing_overrides.overrides_version() != v1
+
+    def test_modification_d_un_override_existant(self, docs):
+        v1 = routing_overrides.overrides_version()
+        docs[0]["lat"] = 47.95
+        assert routing_overrides.overrides_version() != v1
+
+    def test_meme_contenu_meme_version_apres_redemarrage(self, docs):
+        v1 = routing_overrides.overrides_version()
+        # Un autre processus (ou un redemarrage) part d'un cache vide.
+        routing_overrides._cache.update({"data": None, "ts": 0.0})
+        assert routing_overrides.overrides_version() == v1
+
+
+class TestTravelTimes:
+    def test_reponse_valhalla(self, valhalla, monkeypatch):
+        reponse = {"sources_to_targets": [
+            [{"from_index": 0, "to_index": 0, "time": 0, "distance": 0.0},
+             {"from_index": 0, "to_index": 1, "time": 240, "distance": 2.5}],
+            [{"from_index": 1, "to_index": 0, "time": None, "distance": None},
+             {"from_index": 1, "to_index": 1, "time": 0, "distance": 0.0}],
+        ]}
+        appels = []
+        monkeypatch.setattr(routing, "_call_valhalla_matrix",
+                            lambda s, t, god, av: appels.append(1) or (reponse, None))
+        pts = [(47.95, 0.22), (47.96, 0.23)]
+        durations, distances, engine = routing.travel_times(pts, pts)
+        assert engine == "valhalla" and len(appels) == 1
+        assert durations == [[0, 240], [None, 0]]
+        assert distances[0][1] == 2500
+
+    def test_stub_si_injoignable(self, valhalla, monkeypatch):
+        monkeypatch.setattr(routing, "_call_valhalla_matrix",
+                            lambda *a: (None, "valhalla_unreachable"))
+        durations, distances, engine = routing.travel_times([(47.95, 0.22)], [(47.96, 0.22)])
+        assert engine == "stub"
+        assert 1000 < distances[0][0] < 1200
+        assert durations[0][0] == int(distances[0][0] / (routing.STUB_SPEED_NORMAL_KMH / 3.6))
+
+
+class TestRoutingMatrix:
+    def test_recalcul_si_poi_ou_version_change(self, valhalla, monkeypatch):
+        import routing_matrix
+        db = FakeDb(routing_pois=[
+            {"_id": "pc", "kind": "pc", "lat": 47.95, "lon": 0.22},
+            {"_id": "p1", "kind": "parking", "lat": 47.96, "lon": 0.23},
+            {"_id": "x", "kind": "autre", "lat": 47.0, "lon": 0.2},
+        ])
+
+        def travel_times(sources, targets, god=False):
+            n = len(sources)
+            return [[i * 10 + j for j in range(n)] for i in range(n)], [[0] * n] * n, "valhalla"
+
+        monkeypatch.setattr(routing, "travel_times", travel_times)
+        assert routing_matrix.run_once(db) == ["auto", "god"]
+        assert routing_matrix.run_once(db) == []
+        # Lignes triees par _id : p1 puis pc.
+        assert routing_matrix.travel_time(db, "p1", "pc") == 1
+        assert routing_matrix.travel_time(db, "pc", "p1") == 10
+        assert routing_matrix.travel_time(db, "pc", "x") is None
+
+        monkeypatch.setattr(routing_overrides, "_get_all_active",
+                            lambda: [{"_id": "a", "type": "force_open", "lat": 47.9, "lon": 0.2}])
+        assert routing_matrix.run_once(db) == ["auto", "god"]
+        db["routing_pois"].insert_one({"_id": "m1", "kind": "medical", "lat": 47.97, "lon": 0.2})
+        assert routing_matrix.run_once(db) == ["auto", "god"]
+        assert routing_matrix.travel_time(db, "m1", "pc", god=True) is not None
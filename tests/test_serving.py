@@ -0,0 +1,65 @@
+import threading
+
+from flask import Flask
+
+import serving
+
+
+class TestServingProfile:
+    def test_threads_par_defaut_couvrent_les_trois_parts(self, monkeypatch):
+        for var in ("WAITRESS_THREADS", "WAITRESS_LIGHT_THREADS", "HEAVY_CONCURRENCY"):
+            monkeypatch.delenv(var, raising=False)
+        profil = serving.ServingProfile.from_env()
+        assert profil.threads == profil.light_threads + profil.heavy_concurrency + profil.streams
+        assert profil.check() == []
+        assert profil.waitress_kwargs()["threads"] == profil.threads
+
+    def test_variables_d_environnement(self, monkeypatch):
+        monkeypatch.setenv("WAITRESS_THREADS", "6")
+        monkeypatch.setenv("WAITRESS_CHANNEL_TIMEOUT", "30")
+        monkeypatch.setenv("HEAVY_CONCURRENCY", "pas-un-nombre")
+        profil = serving.ServingProfile.from_env()
+        assert profil.waitress_kwargs()["threads"] == 6
+        assert profil.channel_timeout == 30
+        assert profil.heavy_concurrency == 4
+        # 6 threads pour 16 flux : le profil le signale
+        assert profil.check()
+
+
+class TestHeavyGate:
+    def test_au_dela_de_la_concurrence_503(self):
+        gate = serving.HeavyGate(concurrency=1, wait_s=0.05)
+        entree, sortie = threading.Event(), threading.Event()
+
+        @gate
+        def lente():
+            entree.set()
+            sortie.wait(2)
+            return "ok"
+
+        resultats = []
+        t = threading.Thread(target=lambda: resultats.append(lente()))
+        t.start()
+        entree.wait(2)
+        assert gate.active == 1
+        corps, code, entetes = lente()
+        assert code == 503
+        assert "Retry-After" in entetes
+        assert gate.rejected == 1
+        sortie.set()
+        t.join()
+        assert resultats == ["ok"]
+        assert gate.active == 0
+        # Le jeton est rendu : la route repasse
+        assert lente() == "ok"
+
+    def test_reponse_503_convertie_par_flask(self):
+        gate = serving.HeavyGate(concurrency=1, wait_s=0.01)
+        gate._sem.acquire()
+        app = Flask(__name__)
+        app.add_url_rule("/lourde", "lourde", gate(lambda: "ok"))
+        rep = app.test_client().get("/lourde")
+        assert rep.status_code == 503
+        assert rep.get_json()["error"]
+        gate._sem.release()
+        assert app.test_client().get("/lourde").status_code == 200
@@ -1,4 +1,6 @@
 import hashlib
+import threading
+import time
 from datetime import datetime, timezone
 
 import pytest
@@ -95,6 +97,126 @@ class TestState:
         assert appels["n"] == 1
 
 
+class TestSnapshotPartage:
+    """Le payload /state est commun a toutes les montres : il ne doit jamais
+    etre reconstruit autant de fois qu'il y a de montres."""
+
+    def _monde(self, monkeypatch, n=1, pause=0.0):
+        import watch_api
+        from conftest import FakeDb
+        db = FakeDb(watch_tokens=[
+            {"_id": "m%d" % i, "token_sha256": watch_api.hash_token("s%d" % i),
+             "revoked": False} for i in range(n)], watch_guidage=[])
+        monkeypatch.setattr(watch_api, "_db", lambda: db)
+        self.appels = []
+
+        def construit(d, n_local, n_utc, **kw):
+            self.appels.append(n_utc)
+            time.sleep(pause)
+            return {"t": len(self.appels), "al": []}
+
+        monkeypatch.setattr(watch_api.watch_state, "build_state", construit)
+        return db
+
+    def _get(self, client, i=0, etag=None):
+        entetes = {"Authorization": "Bearer s%d" % i}
+        if etag:
+            entetes["If-None-Match"] = etag
+        return client.get("/api/v1/watch/state", headers=entetes)
+
+    def _vieillir(self, secondes):
+        import watch_api
+        watch_api._cache["at"] -= secondes
+
+    def test_expiration_simultanee_un_seul_calcul(self, client, monkeypatch):
+        # Le troupeau : 40 montres arrivent ensemble sur un cache vide, et la
+        # construction prend du temps. Une seule doit la faire.
+        n = 40
+        self._monde(monkeypatch, n=n, pause=0.05)
+        depart = threading.Barrier(n)
+        codes = []
+
+        def montre(i):
+            c = client.application.test_client()
+            depart.wait()
+            codes.append(self._get(c, i).status_code)
+
+        threads = [threading.Thread(target=montre, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert codes == [200] * n
+        assert len(self.appels) == 1
+
+    def test_copie_precedente_servie_pendant_la_reconstruction(self, client, monkeypatch):
+        import watch_api
+        self._monde(monkeypatch)
+        self._get(client)
+        self._vieillir(watch_api.CACHE_TTL_S + 1)
+        with watch_api._build_lock:      # un autre constructeur est en cours
+            rep = self._get(client)
+        assert rep.get_json()["t"] == 1
+        assert len(self.appels) == 1
+
+    def test_copie_trop_vieille_reconstruite(self, client, monkeypatch):
+        import watch_api
+        self._monde(monkeypatch)
+        self._get(client)
+        self._vieillir(watch_api.CACHE_STALE_MAX_S + 1)
+        assert self._get(client).get_json()["t"] == 2
+
+    def test_prechauffage_avant_expiration(self, client, monkeypatch):
+        import watch_api
+        self._monde(monkeypatch)
+        self._get(client)
+        self._vieillir(watch_api.CACHE_TTL_S - 1)
+        # Servie tout de suite depuis la copie, reconstruite en fond.
+        assert self._get(client).get_json()["t"] == 1
+        for _ in range(200):
+            if len(self.appels) == 2 and not watch_api._build_lock.locked():
+                break
+            time.sleep(0.01)
+        assert self._get(client).get_json()["t"] == 2
+        assert len(self.appels) == 2
+
+    def test_guidage_lu_une_fois_pour_toutes_les_montres(self, client, monkeypatch):
+        db = self._monde(monkeypatch, n=10)
+        lectures = []
+        find = db["watch_guidage"].find
+        monkeypatch.setattr(db["watch_guidage"], "find",
+                            lambda *a, **k: lectures.append(1) or find(*a, **k))
+        for i in range(10):
+            self._get(client, i)
+        assert len(lectures) == 1
+
+    def test_304_si_rien_n_a_change(self, client, monkeypatch):
+        import watch_api
+        self._monde(monkeypatch)
+        premiere = self._get(client)
+        etag = premiere.headers["ETag"]
+        rep = self._get(client, etag=etag)
+        assert rep.status_code == 304
+        assert rep.data == b""
+        assert rep.headers["ETag"] == etag
+        # Nouveau payload : 200 et nouvel ETag
+        self._vieillir(watch_api.CACHE_STALE_MAX_S + 1)
+        rep = self._get(client, etag=etag)
+        assert rep.status_code == 200
+        assert rep.headers["ETag"] != etag
+
+    def test_etag_propre_a_la_montre_guidee(self, client, monkeypatch):
+        import watch_api
+        db = self._monde(monkeypatch, n=2)
+        etags = [self._get(client, i).headers["ETag"] for i in range(2)]
+        watch_api.watch_guidage.set_point(db, "m0", 47.95, 0.22, "Porte Houx 5")
+        watch_api.oublier_guidages()
+        rep = self._get(client, 0, etag=etags[0])
+        assert rep.status_code == 200
+        assert rep.get_json()["gd"]["n"] == "Porte Houx 5"
+        assert self._get(client, 1, etag=etags[1]).status_code == 304
+
+
 class TestEditions:
     PIC_TS = datetime(2026, 4, 18, 13, 5, 9, tzinfo=timezone.utc)
 
@@ -477,9 +599,10 @@ class TestGuidage:
     def test_guidage_illisible_ne_casse_pas_le_payload(self, client, monkeypatch):
         # Regle commune a tous les blocs : une source abimee met le bloc a
         # null, elle ne fait pas tomber le reste de l'etat.
-        import watch_api
-        self._monde(monkeypatch)
-        monkeypatch.setattr(watch_api.watch_guidage, "read_point",
+        # Le point existe : c'est bien la lecture qui echoue, pas l'absence.
+        db = self._monde(monkeypatch)
+        self._envoyer(client, self.id_a, 47.95, 0.22, "Porte Houx 5")
+        monkeypatch.setattr(db["watch_guidage"], "find",
                             lambda *a, **k: (_ for _ in ()).throw(RuntimeError()))
         etat = self._etat(client, self.SECRET_A)
         assert etat["gd"] is None
@@ -176,6 +176,30 @@ class TestReadPoint:
         assert watch_guidage.read_point(DbCassee(), TOKEN) is None
 
 
+class TestReadPoints:
+    def test_une_lecture_pour_toutes_les_montres(self):
+        db = _db()
+        watch_guidage.set_point(db, TOKEN, LAT, LON, "Pour A")
+        watch_guidage.set_point(db, AUTRE, LAT, LON, "Pour B")
+        watch_guidage.set_point(db, AUTRE, LAT, LON, "Pour B")
+        points = watch_guidage.read_points(db)
+        assert points[TOKEN] == watch_guidage.read_point(db, TOKEN)
+        assert points[AUTRE]["s"] == 2
+
+    def test_point_malforme_omis(self):
+        db = FakeDb(watch_guidage=[{"token_id": TOKEN, "lat": "au nord",
+                                    "lon": LON, "seq": 1}])
+        assert watch_guidage.read_points(db) == {}
+
+    def test_panne_distincte_de_l_absence(self):
+        # {} voudrait dire << personne n'est guide >> : une panne doit se lire
+        # autrement, sinon watch_api la garderait en cache comme un etat.
+        class DbCassee:
+            def __getitem__(self, _):
+                raise RuntimeError("mongo injoignable")
+        assert watch_guidage.read_points(DbCassee()) is None
+
+
 class TestClearPoint:
     def test_efface_et_rend_vrai(self):
         db = _db()
@@ -2,6 +2,7 @@ from datetime import datetime, timedelta, timezone
 
 from conftest import FakeDb
 
+import peak_rollup
 import watch_peaks
 
 
@@ -196,6 +197,51 @@ class TestPeakForEdition:
             (None, None)
 
 
+class TestPeakFromRollup:
+    """Une fois l'historique replie (marqueur pose), le pic se lit sur les
+    tranches de peak_rollup et plus sur les releves bruts."""
+
+    def _db(self, race_iso="2026-04-18T13:00:00.000Z", **archives):
+        base = dict(
+            parametrages=[_parametrages("24H MOTOS", 2026, race_iso)],
+            evenement=[{"nom": "24H MOTOS", "short": "24HM"}],
+        )
+        base.update(archives)
+        return FakeDb(**base)
+
+    def test_lit_les_tranches_sans_balayer(self):
+        db = self._db()
+        peak_rollup.replier(db, [_snapshot("50690", COURSE_2026 + timedelta(minutes=5)),
+                                 _snapshot("148919", COURSE_2026 + timedelta(days=56))])
+        peak_rollup.marquer_backfill(db, [])
+        # Un releve brut plus haut que le rollup ne connait pas : s'il
+        # ressortait, c'est que le balayage tourne encore.
+        db["data_access"].docs.append(_snapshot("99999", COURSE_2026))
+        pic, instant = watch_peaks.peak_for_edition(db, "24H MOTOS", 2026)
+        assert (pic, instant) == (50690, COURSE_2026 + timedelta(minutes=5))
+
+    def test_sans_marqueur_repli_sur_le_balayage(self):
+        # Le collecteur n'a replie que le direct : l'archive n'y est pas.
+        db = self._db(**{"hsh_archive_compteurs_GPF_2026": [_snapshot("50690", COURSE_2026)]})
+        peak_rollup.enregistrer(db, "628", "100", COURSE_2026)
+        pic, _ = watch_peaks.peak_for_edition(db, "24H MOTOS", 2026)
+        assert pic == 50690
+
+    def test_bornes_hors_frontiere_balayees_sur_les_releves(self):
+        # Course a 13h07 : la fenetre commence a 13h07 dix jours avant. La
+        # tranche 13h00-13h15 de ce jour-la est a cheval ; un releve a 13h02,
+        # hors fenetre, ne doit pas compter, celui de 13h10 si.
+        db = self._db(race_iso="2026-04-18T13:07:00.000Z")
+        bord = COURSE_2026 + timedelta(minutes=7) - watch_peaks.WINDOW_BEFORE
+        hors = _snapshot("90000", bord - timedelta(minutes=5))
+        dedans = _snapshot("80000", bord + timedelta(minutes=3))
+        db["data_access"].docs.extend([hors, dedans])
+        peak_rollup.replier(db, [hors, dedans, _snapshot("50690", COURSE_2026)])
+        peak_rollup.marquer_backfill(db, [])
+        pic, instant = watch_peaks.peak_for_edition(db, "24H MOTOS", 2026)
+        assert (pic, instant) == (80000, bord + timedelta(minutes=3))
+
+
 class TestListEditions:
     def _db(self):
         return FakeDb(
@@ -10,6 +10,8 @@ import logging
 import math
 import re
 
+from geo_index import GeoGrid
+
 logger = logging.getLogger(__name__)
 
 # Geofence du mur trafic (circulation.html:388). Sans lui, on compterait des
@@ -280,6 +282,7 @@ def rattacher_alertes(axes, alertes, seuil_m=DISTANCE_RATTACHEMENT_M):
     if not axes:
         return axes
 
+    placees = []
     for alerte in alertes or []:
         if not alerte_en_zone(alerte):
             continue
@@ -293,9 +296,20 @@ def rattacher_alertes(axes, alertes, seuil_m=DISTANCE_RATTACHEMENT_M):
             lon = float(loc.get("x"))
         except (TypeError, ValueError):
             continue
+        placees.append((type_, lat, lon))
+    if not placees:
+        return axes
+
+    # Seuls les axes dont un segment passe a moins de seuil_m de l'alerte
+    # peuvent la recevoir : la grille les designe sans mesurer les autres.
+    # Les candidats sont ensuite parcourus dans l'ordre de `axes`, ce qui
+    # garde le depart d'egalite de la boucle complete (le premier l'emporte).
+    grille = _grille_segments(axes, placees, seuil_m)
+    for type_, lat, lon in placees:
         proche = None
         distance = None
-        for axe in axes:
+        for k in sorted(set(grille.near(lat, lon))):
+            axe = axes[k]
             d = distance_point_axe_m(lat, lon, axe)
             if d is None:
                 continue
@@ -307,6 +321,27 @@ def rattacher_alertes(axes, alertes, seuil_m=DISTANCE_RATTACHEMENT_M):
     return axes
 
 
+def _grille_segments(axes, placees, seuil_m):
+    """GeoGrid des segments de chaque axe, indexes par position dans `axes`.
+    Un segment est range dans toutes les cellules de sa boite englobante."""
+    segments = []
+    max_abs_lat = max(abs(lat) for _, lat, _ in placees)
+    for k, axe in enumerate(axes):
+        ligne = (axe or {}).get("line") or []
+        for i in range(len(ligne) - 1):
+            try:
+                y1, x1 = float(ligne[i]["y"]), float(ligne[i]["x"])
+                y2, x2 = float(ligne[i + 1]["y"]), float(ligne[i + 1]["x"])
+            except (TypeError, KeyError, ValueError):
+                continue
+            segments.append((k, y1, x1, y2, x2))
+            max_abs_lat = max(max_abs_lat, abs(y1), abs(y2))
+    grille = GeoGrid(max(float(seuil_m), 1.0), max_abs_lat)
+    for k, y1, x1, y2, x2 in segments:
+        grille.add_bbox(k, min(y1, y2), min(x1, x2), max(y1, y2), max(x1, x2))
+    return grille
+
+
 def pire_severite_mur(routes):
     """Pire severite_axe() sur TOUTES les routes que le panneau << Axes >>
     du mur retient -- routes brutes, AUCUNE agregation par terrain.
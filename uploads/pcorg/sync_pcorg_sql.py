@@ -54,6 +54,7 @@ MONGO_DB = "titan"
 MONGO_COLLECTION = "pcorg"
 MONGO_SYNC_COLLECTION = "pcorg_sync_cursor"
 MONGO_PARAMETRAGES_COLLECTION = "parametrages"
+MONGO_SOURCES_COLLECTION = "analyse_ops_sources"
 
 PARIS_TZ = ZoneInfo("Europe/Paris")
 
@@ -573,6 +574,27 @@ def set_sync_cursor(mongo_col, last_date_write):
     )
 
 
+# ─── Version des sources (cache Analyse Ops) ────────────────────────────────
+
+def bump_source_versions(mongo_db, event_years):
+    """Incrémente la version de chaque (event, year) touché.
+
+    Même document que analyse_ops.bump_source_version (ce script tourne hors
+    de l'application, d'où la copie) : le cache des modules Analyse Ops est
+    périmé dès que la version bouge, sans recompter les fiches.
+    """
+    now = datetime.now(timezone.utc)
+    for evt, yr in event_years:
+        if not evt or yr is None:
+            continue
+        mongo_db[MONGO_SOURCES_COLLECTION].update_one(
+            {"_id": f"{evt}|{yr}"},
+            {"$inc": {"version": 1},
+             "$set": {"event": evt, "year": yr, "updated_at": now}},
+            upsert=True,
+        )
+
+
 # ─── Requête SQL paginée ────────────────────────────────────────────────────
 
 def build_category_filter():
@@ -1006,6 +1028,7 @@ def main():
         batch_size = len(batch)
         total_sql += batch_size
         ops = []
+        batch_events = set()
         batch_max_dw = None
 
         for row in batch:
@@ -1017,6 +1040,7 @@ def main():
                 doc = transform_row(row, evt, yr)
                 cat_counts[doc.get("category", "?")] += 1
                 event_counts[f"{evt} {yr}"] += 1
+                batch_events.add((evt, yr))
 
                 if not args.dry_run:
                     ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True))
@@ -1030,7 +1054,10 @@ def main():
         # Upsert le lot
         if not args.dry_run and ops:
             res = pcorg_col.bulk_write(ops, ordered=False)
-            total_upserted += (res.upserted_count or 0) + (res.modified_count or 0)
+            changed = (res.upserted_count or 0) + (res.modified_count or 0)
+            total_upserted += changed
+            if changed:
+                bump_source_versions(mongo_db, batch_events)
 
         # Mise à jour du curseur après chaque lot (reprise possible)
         if batch_max_dw and (max_date_write is None or batch_max_dw > max_date_write):
@@ -1073,20 +1100,23 @@ def main():
             {"$match": {"sql_id": {"$ne": None}}},
             {"$group": {
                 "_id": "$sql_id", "count": {"$sum": 1},
-                "docs": {"$push": {"id": "$_id", "event": "$event"}},
+                "docs": {"$push": {"id": "$_id", "event": "$event", "year": "$year"}},
             }},
             {"$match": {"count": {"$gt": 1}}},
         ]
         saison_to_delete = []
+        saison_years = set()
         for dup in pcorg_col.aggregate(dup_pipeline):
             has_non_saison = any(d["event"] != "SAISON" for d in dup["docs"])
             if has_non_saison:
                 for d in dup["docs"]:
                     if d["event"] == "SAISON":
                         saison_to_delete.append(d["id"])
+                        saison_years.add(("SAISON", d.get("year")))
         if saison_to_delete:
             res = pcorg_col.delete_many({"_id": {"$in": saison_to_delete}})
             print(f"  Doublons SAISON purges : {res.deleted_count}")
+            bump_source_versions(mongo_db, saison_years)
 
     # Enrichir la config pcorg avec les nouvelles valeurs decouvertes
     if not args.dry_run:
@@ -21,6 +21,9 @@ from datetime import datetime, timedelta
 
 from pymongo import MongoClient
 
+import plate_crossref
+from plate_index import plate_grams
+
 TASK_NAME = "Sync Vision ACO"
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_FILE = os.path.join(SCRIPT_DIR, "vision_sync.log")
@@ -188,6 +191,7 @@ def sync_immatriculations(fs_db, mongo_db, evenement=None, annee=None, full=Fals
 
     # Index
     col.create_index("plaque_norm")
+    col.create_index("plaque_grams")
     col.create_index([("evenement", 1), ("annee", 1)])
     col.create_index("lieu")
     col.create_index("device_id")
@@ -198,6 +202,7 @@ def sync_immatriculations(fs_db, mongo_db, evenement=None, annee=None, full=Fals
 
     count_upsert = 0
     count_skip = 0
+    records = []
     try:
         for doc in query.stream():
             data = doc.to_dict()
@@ -209,6 +214,7 @@ def sync_immatriculations(fs_db, mongo_db, evenement=None, annee=None, full=Fals
             record = {
                 "plaque": plaque,
                 "plaque_norm": plaque_norm,
+                "plaque_grams": plate_grams(plaque_norm),
                 "lieu": data.get("lieu", ""),
                 "commentaire": data.get("commentaire", ""),
                 "billets": data.get("billets", []),
@@ -232,6 +238,9 @@ def sync_immatriculations(fs_db, mongo_db, evenement=None, annee=None, full=Fals
                 upsert=True,
             )
             count_upsert += 1
+            records.append(record)
+
+        plate_crossref.record_vision(mongo_db, records)
 
     except Exception as exc:
         log.error("Erreur sync immatriculations: %s", exc)
@@ -248,6 +257,7 @@ def sync_blacklist(fs_db, mongo_db):
 
     count = 0
     seen_norms = set()
+    entries = {}
     try:
         for doc in fs_db.collection("blacklist").stream():
             data = doc.to_dict()
@@ -256,6 +266,8 @@ def sync_blacklist(fs_db, mongo_db):
             if not plaque_norm:
                 continue
             seen_norms.add(plaque_norm)
+            entries[plaque_norm] = {"raison": data.get("raison", ""),
+                                    "date_ajout": data.get("dateAjout", "")}
 
             col.update_one(
                 {"plaque_norm": plaque_norm},
@@ -276,6 +288,8 @@ def sync_blacklist(fs_db, mongo_db):
             if result.deleted_count:
                 log.info("Blacklist: %d entrees supprimees (plus dans Vision)", result.deleted_count)
 
+        plate_crossref.sync_blacklist(mongo_db, entries)
+
     except Exception as exc:
         log.error("Erreur sync blacklist: %s", exc)
         return 0
@@ -5,15 +5,17 @@ Mongo depuis l'exterieur : cette couche est la seule surface exposee.
 """
 
 import hashlib
+import json
 import logging
 import secrets
+import threading
 import time
 from datetime import datetime, timezone
 from functools import wraps
 
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 
 import watch_guidage
 import watch_pages
@@ -29,6 +31,19 @@ watch_bp = Blueprint("watch", __name__, url_prefix="/api/v1/watch")
 # quel que soit le rythme de polling, sans process supplementaire.
 CACHE_TTL_S = 20
 
+# UN SEUL constructeur a la fois (single-flight). A l'expiration, sans cette
+# garde, toutes les montres arrivees dans la meme seconde relancaient chacune
+# build_state : la charge Mongo croissait avec le parc. Pendant qu'un
+# constructeur travaille, les autres requetes servent la copie precedente si
+# elle a moins de CACHE_STALE_MAX_S, et l'attendent sinon (ou au demarrage,
+# quand il n'y a rien a servir).
+CACHE_STALE_MAX_S = 120
+
+# Une requete tombee dans les PREWARM_S dernieres secondes de validite lance
+# la reconstruction en tache de fond : tant que des montres interrogent, la
+# copie est refaite avant d'expirer et personne n'attend build_state.
+PREWARM_S = 3
+
 # Fenetre glissante par jeton. La montre consomme 5 requetes (app a 1 min) plus
 # 1 (background) : la marge absorbe les reprises reseau sans jamais couvrir une
 # boucle folle.
@@ -51,7 +66,18 @@ EDITIONS_CACHE_TTL_S = 3600
 # retarde jamais de plus d'une minute sur ce que le cockpit affiche.
 TIMELINE_CACHE_TTL_S = 60
 
-_cache = {"at": 0.0, "payload": None}
+_CACHE_VIDE = {"at": 0.0, "payload": None, "etag": None, "guidage": None}
+# Remplace d'un bloc a chaque reconstruction (jamais modifie cle par cle,
+# sauf `guidage`) : un lecteur qui prend `_cache` une fois voit un payload et
+# son ETag coherents, meme si une reconstruction se termine entre-temps.
+_cache = dict(_CACHE_VIDE)
+_build_lock = threading.Lock()
+# Reveille d'un coup les requetes qui attendent le constructeur, plutot que
+# de leur faire reprendre _build_lock a tour de role pour constater que le
+# travail est fait.
+_construit = threading.Condition()
+_guidage_lock = threading.Lock()
+_guidage_gen = 0
 _editions_cache = {"at": 0.0, "payload": None}
 _timeline_cache = {"at": 0.0, "payload": None}
 _rate_log = {}
@@ -65,8 +91,8 @@ def _db():
 
 
 def reset_cache():
-    _cache["at"] = 0.0
-    _cache["payload"] = None
+    global _cache
+    _cache = dict(_CACHE_VIDE)
     _editions_cache["at"] = 0.0
     _editions_cache["payload"] = None
     _timeline_cache["at"] = 0.0
@@ -388,21 +414,140 @@ def state():
 
     La copie est superficielle (`dict(...)`) : on n'ajoute que des cles de
     premier niveau, les blocs imbriques ne sont jamais modifies.
+
+    ETag / If-None-Match : un client qui renvoie l'ETag de sa derniere
+    reponse recoit un 304 sans corps tant que ni le payload partage ni son
+    guidage n'ont change.
     """
-    maintenant = time.time()
-    if _cache["payload"] is not None and maintenant - _cache["at"] < CACHE_TTL_S:
-        payload = _cache["payload"]
+    cache = _snapshot()
+    jeton = request.watch_token
+    bloc = _guidage_de(cache, (jeton or {}).get("_id"))
+    etag = _etag(cache["etag"], bloc)
+    if _etag_connu(request.headers.get("If-None-Match"), etag):
+        reponse = Response(status=304)
     else:
-        payload = watch_state.build_state(
-            _db(), datetime.now(), datetime.now(timezone.utc),
-            peaks=watch_peaks, pages=watch_pages)
-        _cache["payload"] = payload
-        _cache["at"] = maintenant
+        reponse = jsonify(_avec_guidage(cache["payload"], bloc))
+    reponse.headers["ETag"] = '"%s"' % etag
+    reponse.headers["Cache-Control"] = "no-cache"
+    return reponse
+
+
+def _snapshot():
+    """Le cache courant, reconstruit au besoin par UN seul appelant."""
+    cache = _cache
+    age = time.time() - cache["at"]
+    if cache["payload"] is not None and age < CACHE_TTL_S:
+        if age >= CACHE_TTL_S - PREWARM_S and _build_lock.acquire(blocking=False):
+            threading.Thread(target=_prechauffer, args=(_db(),),
+                             daemon=True).start()
+        return cache
+
+    attendre = cache["payload"] is None or age >= CACHE_STALE_MAX_S
+    while True:
+        if _build_lock.acquire(blocking=False):
+            try:
+                # Un autre vient peut-etre de finir : inutile de recommencer.
+                if _cache["payload"] is not None and time.time() - _cache["at"] < CACHE_TTL_S:
+                    return _cache
+                return _construire(_db())
+            finally:
+                _liberer()
+        if not attendre:
+            # Un autre constructeur travaille : copie precedente, encore recente.
+            return cache
+        with _construit:
+            while _build_lock.locked() and _cache is cache:
+                _construit.wait(CACHE_TTL_S)
+        if _cache is not cache:
+            return _cache
+        # Le constructeur a echoue : on retente nous-memes.
+
+
+def _liberer():
+    _build_lock.release()
+    with _construit:
+        _construit.notify_all()
+
+
+def _prechauffer(db):
+    """Reconstruction de fond. Appelee verrou pris, le relache toujours."""
+    try:
+        _construire(db)
+    except Exception:
+        # La copie en place reste servie ; la prochaine requete apres le TTL
+        # retentera, en premier plan cette fois.
+        logger.exception("Pre-chauffage du payload montre en echec")
+    finally:
+        _liberer()
+
+
+def _construire(db):
+    """Payload partage, son empreinte, et les guidages de toutes les montres
+    en une lecture. Verrou _build_lock tenu par l'appelant."""
+    global _cache
+    payload = watch_state.build_state(
+        db, datetime.now(), datetime.now(timezone.utc),
+        peaks=watch_peaks, pages=watch_pages)
+    generation = _guidage_gen
+    guidage = watch_guidage.read_points(db)
+    cache = {
+        "at": time.time(),
+        "payload": payload,
+        "etag": _empreinte(payload),
+        # Un envoi arrive pendant la lecture : table deja perimee.
+        "guidage": guidage if generation == _guidage_gen else None,
+    }
+    _cache = cache
+    return cache
+
+
+def _guidage_de(cache, token_id):
+    """Bloc `gd` de la montre, depuis la table lue a la reconstruction.
+
+    La table est invalidee par les routes d'envoi et d'effacement
+    (oublier_guidages) : un point envoye part a la requete suivante, sans
+    attendre l'expiration du payload.
+    """
+    if token_id is None:
+        return None
+    guidage = cache["guidage"]
+    if guidage is None:
+        with _guidage_lock:
+            guidage = cache["guidage"]
+            if guidage is None:
+                guidage = watch_guidage.read_points(_db())
+                # Illisible : rien en cache, la requete suivante retentera.
+                cache["guidage"] = guidage
+    return (guidage or {}).get(token_id)
 
-    return jsonify(_avec_guidage(payload, request.watch_token))
 
+def oublier_guidages():
+    global _guidage_gen
+    _guidage_gen += 1
+    _cache["guidage"] = None
 
-def _avec_guidage(payload, jeton):
+
+def _empreinte(valeur):
+    brut = json.dumps(valeur, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(brut.encode("utf-8")).hexdigest()[:20]
+
+
+def _etag(empreinte_partagee, bloc):
+    if bloc is None:
+        return empreinte_partagee
+    return empreinte_partagee + "-" + _empreinte(bloc)[:8]
+
+
+def _etag_connu(entete, etag):
+    if not entete:
+        return False
+    if entete.strip() == "*":
+        return True
+    candidats = [c.strip() for c in entete.split(",")]
+    return any(c.removeprefix("W/").strip('"') == etag for c in candidats)
+
+
+def _avec_guidage(payload, bloc):
     """Copie du payload, enrichie du guidage de CETTE montre.
 
     Deux champs, volontairement separes :
@@ -415,15 +560,10 @@ def _avec_guidage(payload, jeton):
         de fond ne lit que le noyau -- sans ce scalaire, un point envoye
         pendant que l'app est fermee n'aurait fait vibrer personne.
 
-    Ne leve jamais : un guidage illisible laisse le reste du payload intact,
+    Un guidage illisible (bloc None) laisse le reste du payload intact,
     meme regle que les quatre blocs de watch_pages.
     """
     sortie = dict(payload or {})
-    bloc = None
-    try:
-        bloc = watch_guidage.read_point(_db(), (jeton or {}).get("_id"))
-    except Exception:
-        logger.exception("Guidage illisible, payload servi sans")
     sortie["gd"] = bloc
     sortie["gs"] = bloc["s"] if bloc else None
     return sortie
@@ -534,6 +674,7 @@ def admin_set_guidage():
     except ValueError as erreur:
         return jsonify({"ok": False, "error": str(erreur)}), 400
 
+    oublier_guidages()
     logger.info("Guidage envoye vers la montre %s par %s : %s",
                 token_id, _admin_identity(), point.get("label"))
     return jsonify({"ok": True, "seq": point.get("seq"),
@@ -550,6 +691,7 @@ def admin_clear_guidage(token_id):
     except (InvalidId, TypeError):
         return jsonify({"ok": False, "error": "montre_inconnue"}), 400
     efface = watch_guidage.clear_point(_db(), cible)
+    oublier_guidages()
     return jsonify({"ok": True, "efface": efface})
 
 
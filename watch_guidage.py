@@ -147,6 +147,33 @@ def read_point(db, token_id):
         return None
     if not doc:
         return None
+    return _bloc(doc)
+
+
+def read_points(db):
+    """Blocs `gd` de TOUTES les montres guidees, indexes par token_id.
+
+    Une seule lecture pour l'ensemble des montres : watch_api la fait une
+    fois par reconstruction du payload partage, au lieu d'un read_point par
+    requete /state. Les points malformes sont omis (la montre recoit null,
+    comme avec read_point). Rend None si la collection est illisible, pour
+    que l'appelant ne prenne pas une panne pour << personne n'est guide >>.
+    """
+    try:
+        _ensure_indexes(db)
+        docs = list(db[COLLECTION].find())
+    except Exception:
+        logger.exception("Lecture des points de guidage impossible")
+        return None
+    sortie = {}
+    for doc in docs:
+        bloc = _bloc(doc)
+        if bloc is not None:
+            sortie[doc.get("token_id")] = bloc
+    return sortie
+
+
+def _bloc(doc):
     try:
         return {
             "lat": float(doc["lat"]),
@@ -156,7 +183,7 @@ def read_point(db, token_id):
             "t": _epoch(doc.get("sent_at")),
         }
     except (KeyError, TypeError, ValueError):
-        logger.warning("Point de guidage malforme pour %s", token_id)
+        logger.warning("Point de guidage malforme pour %s", doc.get("token_id"))
         return None
 
 
@@ -29,6 +29,7 @@ import logging
 from datetime import datetime, timedelta, timezone
 
 import pcorg_summary as _ps
+import peak_rollup as _pr
 import watch_state as _ws
 
 logger = logging.getLogger(__name__)
@@ -221,22 +222,45 @@ def _scan_peak(db, nom_collection, debut, fin, location_id):
     return maxi, _as_utc(maxi_ts)
 
 
-def peak_for_edition(db, event, year, location_id=DEFAULT_LOCATION_ID):
-    """Pic de presents d'une edition. (pic_int, instant_utc) ou (None, None).
+def _scan_all(db, debut, fin, location_id):
+    """Max sur les releves bruts de toutes les sources, dans [debut, fin)."""
+    maxi = None
+    maxi_ts = None
+    for nom in snapshot_collections(db):
+        valeur, instant = _scan_peak(db, nom, debut, fin, location_id)
+        if valeur is None:
+            continue
+        if maxi is None or valeur > maxi:
+            maxi = valeur
+            maxi_ts = instant
+    return maxi, maxi_ts
 
-    Balaye data_access et toutes les archives sur la fenetre de dates, sans
-    lire ni le nom de collection ni `requested_event`.
-    """
-    debut, fin = edition_window(db, event, year)
-    if debut is None:
-        return None, None
 
-    ensure_indexes(db)
+def _peak_from_rollup(db, debut, fin, location_id):
+    """Pic via les tranches de 15 min de peak_rollup.
+
+    Les tranches entieres de la fenetre sont une seule requete indexee. Une
+    borne qui ne tombe pas sur une frontiere de tranche laisse un bout de
+    moins de 15 minutes : celui-la est balaye sur les releves bruts, pour ne
+    jamais compter un releve hors fenetre. Avec une course a l'heure pile,
+    les deux bouts sont vides et rien n'est balaye.
+    """
+    interieur_debut = _pr.tranche_suivante(debut).replace(tzinfo=timezone.utc)
+    interieur_fin = _pr.tranche(fin).replace(tzinfo=timezone.utc)
+    morceaux = []
+    if interieur_debut < interieur_fin:
+        valeur, instant = _pr.pic(db, location_id, interieur_debut, interieur_fin)
+        morceaux.append((valeur, _as_utc(instant)))
+        bouts = [(debut, interieur_debut), (interieur_fin, fin)]
+    else:
+        bouts = [(debut, fin)]
+    for bout_debut, bout_fin in bouts:
+        if bout_debut < bout_fin:
+            morceaux.append(_scan_all(db, bout_debut, bout_fin, location_id))
 
     maxi = None
     maxi_ts = None
-    for nom in snapshot_collections(db):
-        valeur, instant = _scan_peak(db, nom, debut, fin, location_id)
+    for valeur, instant in morceaux:
         if valeur is None:
             continue
         if maxi is None or valeur > maxi:
@@ -245,6 +269,29 @@ def peak_for_edition(db, event, year, location_id=DEFAULT_LOCATION_ID):
     return maxi, maxi_ts
 
 
+def peak_for_edition(db, event, year, location_id=DEFAULT_LOCATION_ID):
+    """Pic de presents d'une edition. (pic_int, instant_utc) ou (None, None).
+
+    Lit les pics par tranche de peak_rollup des que l'historique y a ete
+    replie. Sinon balaye data_access et toutes les archives sur la fenetre
+    de dates. Dans les deux cas, sans lire ni le nom de collection ni
+    `requested_event`.
+    """
+    debut, fin = edition_window(db, event, year)
+    if debut is None:
+        return None, None
+
+    ensure_indexes(db)
+
+    if _pr.est_complet(db):
+        try:
+            return _peak_from_rollup(db, debut, fin, location_id)
+        except Exception as exc:
+            logger.warning("watch_peaks : lecture des pics par tranche echouee "
+                           "(%s), repli sur le balayage", exc)
+    return _scan_all(db, debut, fin, location_id)
+
+
 def list_editions(db, now_utc=None):
     """Editions consultables, de la plus recente a la plus ancienne.
 